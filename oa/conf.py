@@ -228,4 +228,22 @@ class PADConf(Conf):
         "training": ("bool", False),
         "user_config": ("bool", True),
         "ok_locales": ("str", ""),
+        "regex_match_timeout": ("float", 0.0),
+        "regex_message_timeout": ("float", 0.0),
+        "received_cache_size": ("int", 10000),
+        "sql_pool_size": ("int", 5),
+        "sql_pool_check_interval": ("int", 30),
+        "util_rb_tld": ("append_split", []),
+        "util_rb_2tld": ("append_split", []),
+        "util_rb_3tld": ("append_split", []),
     }
+    # These options are also passed on to the plugins that define them.
+    shared_options = frozenset(("util_rb_tld", "util_rb_2tld",
+                                "util_rb_3tld"))
+
+    def parse_config(self, key, value):
+        if key in self.shared_options:
+            set_func = getattr(self, "set_%s_option" % self.options[key][0])
+            set_func(key, value)
+            return
+        super(PADConf, self).parse_config(key, value)
@@ -30,6 +30,10 @@ SITE_RULES_PATHS = (
 )
 
 LAZY_MODE = True
+# In lazy mode, keep each regex after it's compiled on first use and
+# memoize the parsed headers of the messages. If disabled, the regexes
+# are compiled again every time they are used.
+LAZY_CACHE = True
 
 def setup_logging(log_name, debug=False, filepath=None, sentry_dsn=None,
                   file_lvl="INFO", sentry_lvl="WARN"):
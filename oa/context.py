@@ -43,6 +43,15 @@ DSN_SERVER_RE = oa.regex.Regex(r"""
 )?$
 """, re.I | re.S | re.M | re.X)
 
+# The global data that the plugins set up in their `finish_parsing_end`
+# hook, which runs again when a pickled ruleset is loaded. The "engine"
+# and "pool" are set up for every plugin by `BasePlugin`.
+_BASE_RESOURCES = ("engine", "pool")
+_PLUGIN_RESOURCES = {
+    "PyzorPlugin": ("client",),
+    "RelayCountryPlugin": ("ipv4", "ipv6"),
+}
+
 
 class _Context(object):
     """Base class for all context types."""
@@ -52,18 +61,27 @@ class _Context(object):
         self.log = logging.getLogger("oa-logger")
 
     def __getstate__(self):
-        odict = self.__dict__.copy()  # copy the dict since we change it
-        if "RelayCountryPlugin" in odict["plugin_data"]:
-            del odict["plugin_data"]["RelayCountryPlugin"]["ipv4"]
-            del odict["plugin_data"]["RelayCountryPlugin"]["ipv6"]
+        # Build new dicts instead of changing the ones of this context,
+        # it's still used after being pickled.
+        odict = self.__dict__.copy()
+        plugin_data = collections.defaultdict(dict)
+        for plugin_name, data in odict["plugin_data"].items():
+            data = dict(data)
+            for key in (_BASE_RESOURCES +
+                        _PLUGIN_RESOURCES.get(plugin_name, ())):
+                data.pop(key, None)
+            plugin_data[plugin_name] = data
+        odict["plugin_data"] = plugin_data
+        odict["plugins"] = odict["plugins"].copy()
+        odict["eval_rules"] = odict["eval_rules"].copy()
         odict["plugins_to_import"] = []
-        for plugin_name, plugin in odict["plugins"].copy().items():
+        for plugin_name, plugin in self.plugins.items():
             if plugin.path_to_plugin is None:
                 continue
             del odict["plugins"][plugin_name]
             odict["plugins_to_import"].append(plugin.path_to_plugin)
             for rule in plugin.eval_rules:
-                del odict["eval_rules"][rule]
+                odict["eval_rules"].pop(rule, None)
         return odict
 
     def __setstate__(self, d):
@@ -150,6 +168,12 @@ class GlobalContext(_Context):
         self.networks = oa.networks.NetworkList()
         self.conf = oa.conf.PADConf(self)
         self.username = getpass.getuser()
+        # The lazy message attributes parsed when the message is created,
+        # set by the ruleset.
+        self.message_requires = frozenset()
+        # The two and three level TLDs used to find the registered
+        # domains of the URIs, set by the ruleset.
+        self.tlds = frozenset()
 
     def err(self, *args, **kwargs):
         """Log a error according to the paranoid and
@@ -0,0 +1,18 @@
+"""Storage back-ends for the Bayes plug-in."""
+
+# Number of tokens looked up with a single query.
+DEFAULT_BATCH_SIZE = 500
+
+
+def batches(tokens, size=DEFAULT_BATCH_SIZE):
+    """Split the tokens in lists of at most `size` tokens, so that every
+    list can be looked up with a single query.
+    """
+    batch = []
+    for token in tokens:
+        batch.append(token)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,137 @@
+"""In-process cache in front of the Bayes stores."""
+
+from __future__ import absolute_import
+
+import time
+import collections
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 300
+DEFAULT_TOTALS_TTL = 10
+
+
+class CachedStore(object):
+    """Wrap a Bayes store with a bounded LRU cache of the token records
+    and a cache of the corpus totals.
+
+    The tokens that are not in the database are cached as well, most of
+    the tokens of a message are usually unknown. The records expire
+    after `ttl` seconds and the totals after `totals_ttl` seconds, so
+    the changes learned by other processes are eventually seen. The
+    tokens learned by this process are removed from the cache right
+    away.
+
+    All the other methods are passed on to the store.
+    """
+
+    def __init__(self, store, maxsize=DEFAULT_CACHE_SIZE,
+                 ttl=DEFAULT_CACHE_TTL, totals_ttl=DEFAULT_TOTALS_TTL):
+        self.store = store
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.totals_ttl = totals_ttl
+        # Maps the token to an (expiry time, record or None) pair.
+        self._records = collections.OrderedDict()
+        self._totals = None
+        self._totals_expire = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.totals_hits = 0
+        self.totals_misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _set(self, token, expire, record):
+        self._records.pop(token, None)
+        self._records[token] = (expire, record)
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def tok_get_all(self, tokens):
+        """Like the store's tok_get_all, only the tokens that are not
+        in the cache are looked up in the database.
+        """
+        now = time.time()
+        missing = []
+        for token in tokens:
+            try:
+                expire, record = self._records.pop(token)
+            except KeyError:
+                self.misses += 1
+                missing.append(token)
+                continue
+            if expire <= now:
+                self.expired += 1
+                self.misses += 1
+                missing.append(token)
+                continue
+            # Move the entry to the end, it was used most recently.
+            self._records[token] = (expire, record)
+            self.hits += 1
+            if record is not None:
+                yield record
+        if not missing:
+            return
+        found = {}
+        for record in self.store.tok_get_all(missing):
+            record = tuple(record)
+            found[record[0]] = record
+            yield record
+        expire = now + self.ttl
+        for token in missing:
+            self._set(token, expire, found.get(token))
+
+    def nspam_nham_get(self):
+        """Get the spam and ham counts for the database, cached for
+        `totals_ttl` seconds.
+        """
+        now = time.time()
+        if self._totals is not None and self._totals_expire > now:
+            self.totals_hits += 1
+            return self._totals
+        self.totals_misses += 1
+        self._totals = self.store.nspam_nham_get()
+        self._totals_expire = now + self.totals_ttl
+        return self._totals
+
+    def nspam_nham_change(self, spam, ham):
+        self._totals = None
+        return self.store.nspam_nham_change(spam, ham)
+
+    def multi_tok_count_change(self, spam, ham, tokens, msgatime):
+        tokens = list(tokens)
+        for token in tokens:
+            if self._records.pop(token, None) is not None:
+                self.invalidations += 1
+        return self.store.multi_tok_count_change(spam, ham, tokens, msgatime)
+
+    def clear(self):
+        """Remove all the entries and reset the counters."""
+        self._records.clear()
+        self._totals = None
+        self.hits = self.misses = self.expired = self.evictions = 0
+        self.invalidations = self.totals_hits = self.totals_misses = 0
+
+    def get_stats(self):
+        """The counters used to size the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / float(lookups) if lookups else 0.0,
+            "totals_hits": self.totals_hits,
+            "totals_misses": self.totals_misses,
+        }
@@ -1,4 +1,4 @@
-import pymysql
+from oa.db.bayes import batches
 
 
 class Store(object):
@@ -8,9 +8,10 @@ class Store(object):
         self.plugin = plugin
 
     def untie_db(self):
-        """Remove the connection to the database."""
+        """Return the connection to the pool of the DSN."""
         if self.conn:
-            self.conn.close()
+            self.plugin.release_connection(self.conn)
+            self.conn = None
 
     def tie_db_readonly(self):
         """Create a read-only connection to the database."""
@@ -21,11 +22,11 @@ class Store(object):
         return self.tie_db_writeable()
 
     def tie_db_writeable(self):
-        """Create a read/write connection to the database."""
-        self.conn = pymysql.connect(host=self.engine["hostname"], port=3306,
-                                    user=self.engine["user"],
-                                    passwd=self.engine["password"],
-                                    db=self.engine["db_name"])
+        """Get a read/write connection to the database from the pool
+        of the DSN.
+        """
+        if self.conn is None:
+            self.conn = self.plugin.get_connection()
         return True
 
     def tok_get(self, token):
@@ -42,14 +43,19 @@ class Store(object):
 
     def tok_get_all(self, tokens):
         """Like tok_get, but for all tokens specified.
-        Each returned tuple starts with the token."""
+        Each returned tuple starts with the token. The tokens are
+        looked up in batches of `bayes_sql_batch_size` with a single
+        query each, tokens that are not in the database are skipped.
+        """
         cursor = self.conn.cursor()
-        for token in tokens:
+        for batch in batches(tokens, self.plugin["bayes_sql_batch_size"]):
             cursor.execute(
                 "SELECT token, spam_count, ham_count, atime "
-                "FROM bayes_token WHERE token=%s", (token, )
+                "FROM bayes_token WHERE token IN (%s)" %
+                ", ".join(["%s"] * len(batch)), batch
             )
-            yield cursor.fetchone()
+            for row in cursor.fetchall():
+                yield row
         cursor.close()
 
     def seen_get(self, msgid):
@@ -57,9 +63,11 @@ class Store(object):
         cursor = self.conn.cursor()
         cursor.execute("SELECT flag FROM bayes_seen WHERE msgid=%s",
                        (msgid,))
-        result = cursor.fetchone()[0]
+        result = cursor.fetchone()
         cursor.close()
-        return result
+        if result is None:
+            return None
+        return result[0]
 
     def seen_delete(self, msgid):
         cursor = self.conn.cursor()
@@ -73,14 +81,17 @@ class Store(object):
         """Set the "seen" flag for the specified message."""
         cursor = self.conn.cursor()
         cursor.execute(
-            "UPDATE bayes_seen SET flag=%s WHERE msgid=%s", (flag, msgid)
+            "INSERT INTO bayes_seen (id, msgid, flag) VALUES (0, %s, %s) "
+            "ON DUPLICATE KEY UPDATE flag=VALUES(flag)", (msgid, flag)
         )
-        self.conn.commit()
         cursor.close()
 
     def cleanup(self):
-        """Do any necessary cleanup."""
-        pass
+        """Do any necessary cleanup. The changes made while learning or
+        forgetting a message are committed in a single transaction.
+        """
+        if self.conn is not None:
+            self.conn.commit()
 
     def nspam_nham_get(self):
         """Get the spam and ham counts for the database."""
@@ -93,30 +104,59 @@ class Store(object):
         return result
 
     def nspam_nham_change(self, spam, ham):
-        """Set the spam and ham counts for the database."""
+        """Add to the spam and ham counts for the database."""
         cursor = self.conn.cursor()
-        cursor.execute("UPDATE bayes_vars SET spam_count=%s, ham_count=%s",
-                       (spam, ham))
-        self.conn.commit()
+        cursor.execute(
+            "UPDATE bayes_vars SET spam_count=GREATEST(spam_count + %s, 0), "
+            "ham_count=GREATEST(ham_count + %s, 0)", (spam, ham)
+        )
         cursor.close()
 
     def multi_tok_count_change(self, spam, ham, tokens, msgatime):
-        """Update the spam and ham counts, and access time for the specified tokens."""
+        """Add to the spam and ham counts, and update the access time for
+        the specified tokens.
+
+        New tokens are inserted with a single multi-row statement, the
+        counts of the existing ones are incremented by the database.
+        When forgetting a message the counts are only decreased for the
+        tokens already in the database.
+        """
+        tokens = list(dict.fromkeys(tokens))
+        if not tokens:
+            return
         cursor = self.conn.cursor()
-        for token in tokens:
-            cursor.execute(
+        if spam >= 0 and ham >= 0:
+            cursor.executemany(
+                "INSERT INTO bayes_token "
+                "(id, token, spam_count, ham_count, atime) "
+                "VALUES (0, %s, %s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE "
+                "spam_count=GREATEST(spam_count + VALUES(spam_count), 0), "
+                "ham_count=GREATEST(ham_count + VALUES(ham_count), 0), "
+                "atime=GREATEST(atime, VALUES(atime))",
+                [(token, spam, ham, msgatime) for token in tokens]
+            )
+        else:
+            cursor.executemany(
                 "UPDATE bayes_token "
-                "SET spam_count=%s, ham_count=%s, atime=%s "
-                "WHERE token=%s", (spam, ham, msgatime, token))
-        self.conn.commit()
+                "SET spam_count=GREATEST(spam_count + %s, 0), "
+                "ham_count=GREATEST(ham_count + %s, 0) "
+                "WHERE token=%s",
+                [(spam, ham, token) for token in tokens]
+            )
         cursor.close()
 
     def tok_touch_all(self, touch_tokens, msgatime):
-        """Update the access time for all the specified tokens."""
+        """Update the access time for all the specified tokens, with a
+        single statement for every batch of tokens.
+        """
         cursor = self.conn.cursor()
-        for token in touch_tokens:
-            cursor.execute("UPDATE bayes_token SET atime=%s WHERE token=%s",
-                           (msgatime, token))
+        for batch in batches(touch_tokens, self.plugin["bayes_sql_batch_size"]):
+            cursor.execute(
+                "UPDATE bayes_token SET atime=%%s "
+                "WHERE atime < %%s AND token IN (%s)" %
+                ", ".join(["%s"] * len(batch)), [msgatime, msgatime] + batch
+            )
         self.conn.commit()
         cursor.close()
 
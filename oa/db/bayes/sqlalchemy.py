@@ -1,7 +1,12 @@
 from __future__ import absolute_import
-from sqlalchemy.orm.exc import NoResultFound
+
+import importlib
+
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, PrimaryKeyConstraint, String, LargeBinary
+from sqlalchemy import bindparam, case
+
+from oa.db.bayes import batches
 
 
 Base = declarative_base()
@@ -81,6 +86,35 @@ class BayesVars(Base):
     # Should also be a key on username, if we start using that.
 
 
+def not_negative(value):
+    """SQL expression for the value, or 0 if it's negative."""
+    return case([(value < 0, 0)], else_=value)
+
+
+def upsert(dialect, table, index_elements, set_):
+    """Return an INSERT statement for the table that updates the existing
+    row instead when it conflicts on the `index_elements` columns, or None
+    if the dialect doesn't support it.
+
+    `set_` is called with the columns of the inserted row and returns
+    the updated values.
+    """
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        return statement.on_duplicate_key_update(**set_(statement.inserted))
+    if dialect in ("postgresql", "sqlite"):
+        try:
+            insert = importlib.import_module(
+                "sqlalchemy.dialects." + dialect).insert
+        except (ImportError, AttributeError):
+            return None
+        statement = insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=index_elements, set_=set_(statement.excluded))
+    return None
+
+
 class Store(object):
     def __init__(self, plugin):
         self.engine = plugin.get_engine()
@@ -88,9 +122,12 @@ class Store(object):
         self.plugin = plugin
 
     def untie_db(self):
-        """Remove the connection to the database."""
+        """Close the session, the connection goes back to the pool of
+        the engine.
+        """
         if self.conn:
             self.conn.close()
+            self.conn = None
 
     def tie_db_readonly(self):
         """Create a read-only connection to the database."""
@@ -102,7 +139,8 @@ class Store(object):
 
     def tie_db_writeable(self):
         """Create a read/write connection to the database."""
-        self.conn = self.plugin.get_session()
+        if self.conn is None:
+            self.conn = self.plugin.get_session()
         return True
 
     def tok_get(self, token):
@@ -115,27 +153,34 @@ class Store(object):
 
     def tok_get_all(self, tokens):
         """Like tok_get, but for all tokens specified.
-        Each returned tuple starts with the token."""
-        for token in tokens:
-            try:
-                yield self.conn.query(
-                    BayesToken.token, BayesToken.spam_count,
-                    BayesToken.ham_count, BayesToken.atime,
-                ).filter(BayesToken.token==bytes(token)).one()
-            except NoResultFound:
-                yield None
-            # yield self.conn.execute(
-            #     "SELECT token, spam_count, ham_count, atime "
-            #     "FROM bayes_token WHERE token=:token", {'token': token}
-            # ).fetchone()
+        Each returned tuple starts with the token. The tokens are
+        looked up in batches of `bayes_sql_batch_size` with a single
+        query each, tokens that are not in the database are skipped.
+        """
+        query = self.conn.query(
+            BayesToken.token, BayesToken.spam_count,
+            BayesToken.ham_count, BayesToken.atime,
+        )
+        tokens = (bytes(token) for token in tokens)
+        for batch in batches(tokens, self.plugin["bayes_sql_batch_size"]):
+            for row in query.filter(BayesToken.token.in_(batch)):
+                yield row
+
+    @property
+    def dialect(self):
+        """The name of the SQLAlchemy dialect of the database."""
+        return self.conn.get_bind().dialect.name
 
     def seen_get(self, msgid):
         """Get the "seen" flag for the specified message."""
-        return self.conn.execute(
+        result = self.conn.execute(
             "SELECT flag FROM bayes_seen WHERE msgid=:msgid",
-            {'msgid': msgid}).fetchone()[0]
+            {'msgid': msgid}).fetchone()
+        if result is None:
+            return None
+        return result[0]
 
-    def seen_delete(self, id, msgid):
+    def seen_delete(self, msgid):
         self.conn.execute(
             "DELETE FROM bayes_seen WHERE msgid = :msgid",
             {"msgid": msgid}
@@ -143,14 +188,24 @@ class Store(object):
 
     def seen_put(self, msgid, flag):
         """Set the "seen" flag for the specified message."""
-        self.conn.execute(
-            "UPDATE bayes_seen SET flag=:flag WHERE msgid=:msgid",
-            {"flag": flag, "msgid": msgid})
-        self.conn.commit()
+        table = BayesSeen.__table__
+        statement = upsert(self.dialect, table, [table.c.id, table.c.msgid],
+                           lambda new: {"flag": new.flag})
+        if statement is None:
+            result = self.conn.execute(
+                table.update().where(table.c.msgid == msgid).values(
+                    flag=flag))
+            if result.rowcount:
+                return
+            statement = table.insert()
+        self.conn.execute(statement, {"id": 0, "msgid": msgid, "flag": flag})
 
     def cleanup(self):
-        """Do any necessary cleanup."""
-        pass
+        """Do any necessary cleanup. The changes made while learning or
+        forgetting a message are committed in a single transaction.
+        """
+        if self.conn is not None:
+            self.conn.commit()
 
     def nspam_nham_get(self):
         """Get the spam and ham counts for the database."""
@@ -159,34 +214,77 @@ class Store(object):
         ).fetchone()
 
     def nspam_nham_change(self, spam, ham):
-        """Set the spam and ham counts for the database."""
-        self.conn.execute(
-            "UPDATE bayes_vars "
-            "SET spam_count=:spam_count, ham_count=:ham_count",
-            {'spam_count': spam, 'ham_count': ham}
-        )
-        self.conn.commit()
+        """Add to the spam and ham counts for the database."""
+        table = BayesVars.__table__
+        self.conn.execute(table.update().values(
+            spam_count=not_negative(table.c.spam_count + spam),
+            ham_count=not_negative(table.c.ham_count + ham),
+        ))
 
     def multi_tok_count_change(self, spam, ham, tokens, msgatime):
-        """Update the spam and ham counts, and access time for the specified tokens."""
-        for token in tokens:
-            self.conn.execute(
-                "UPDATE bayes_token "
-                "SET spam_count=:spam_count, ham_count=:ham_count, "
-                "atime=:atime WHERE token=:token",
-                {
-                    'spam_count': spam, 'ham_count': ham,
-                    'atime': msgatime, 'token': token
-                }
-            )
-        self.conn.commit()
+        """Add to the spam and ham counts, and update the access time for
+        the specified tokens.
+
+        New tokens are inserted and the counts of the existing ones are
+        incremented by the database, with a single upsert statement run
+        for all the tokens where the dialect supports it. When forgetting
+        a message the counts are only decreased for the tokens already
+        in the database.
+        """
+        tokens = list(dict.fromkeys(bytes(token) for token in tokens))
+        if not tokens:
+            return
+        msgatime = int(msgatime)
+        table = BayesToken.__table__
+        update = table.update().where(
+            table.c.token == bindparam("b_token")
+        ).values(
+            spam_count=not_negative(table.c.spam_count + spam),
+            ham_count=not_negative(table.c.ham_count + ham),
+        )
+        if spam < 0 or ham < 0:
+            self.conn.execute(update, [{"b_token": token}
+                                       for token in tokens])
+            return
+
+        statement = upsert(
+            self.dialect, table, [table.c.id, table.c.token],
+            lambda new: {
+                "spam_count": not_negative(table.c.spam_count +
+                                           new.spam_count),
+                "ham_count": not_negative(table.c.ham_count + new.ham_count),
+                "atime": case([(table.c.atime < new.atime, new.atime)],
+                              else_=table.c.atime),
+            })
+        if statement is None:
+            # Update the tokens that are already in the database and
+            # insert the others.
+            existing = set(bytes(row[0]) for row in self.tok_get_all(tokens))
+            if existing:
+                self.conn.execute(update.values(atime=case(
+                    [(table.c.atime < msgatime, msgatime)],
+                    else_=table.c.atime
+                )), [{"b_token": token} for token in existing])
+            tokens = [token for token in tokens if token not in existing]
+            if not tokens:
+                return
+            statement = table.insert()
+        self.conn.execute(statement, [
+            {"id": 0, "token": token, "spam_count": spam, "ham_count": ham,
+             "atime": msgatime}
+            for token in tokens
+        ])
 
     def tok_touch_all(self, touch_tokens, msgatime):
-        """Update the access time for all the specified tokens."""
-        for token in touch_tokens:
-            self.conn.query(BayesToken).filter(
-                BayesToken.token==bytes(token)
-            ).update({'atime':msgatime})
+        """Update the access time for all the specified tokens, with a
+        single statement for every batch of tokens.
+        """
+        table = BayesToken.__table__
+        tokens = (bytes(token) for token in touch_tokens)
+        for batch in batches(tokens, self.plugin["bayes_sql_batch_size"]):
+            self.conn.execute(table.update().where(
+                table.c.token.in_(batch)
+            ).where(table.c.atime < msgatime).values(atime=msgatime))
         self.conn.commit()
 
     def get_running_expire_tok(self):
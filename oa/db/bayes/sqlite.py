@@ -0,0 +1,309 @@
+"""Embedded Bayes store in a local SQLite database.
+
+This doesn't need a database server, so it's meant for single node
+deployments. Enable it with::
+
+    bayes_store_module oa.db.bayes.sqlite
+    bayes_path ~/.spamassassin/bayes
+
+The database is kept in `bayes_path` with a ``.sqlite`` suffix and uses
+write-ahead logging, so any number of processes can read the database
+while one of them learns. The tokens are stored by the integer value of
+their 40-bit hash.
+
+Every process opens its own connection the first time it's needed and
+keeps it open between messages. A connection inherited from the parent
+process after a fork is never used or closed by the child.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import struct
+import sqlite3
+
+from oa.db.bayes import batches
+
+# Waits for the lock held by the writer before giving up.
+BUSY_TIMEOUT = 30.0
+# Time between two opportunistic expiries.
+EXPIRY_INTERVAL = 12 * 3600
+# An expiry that has been running for longer than this is assumed to
+# have failed.
+EXPIRY_TIMEOUT = 3600
+# The ratio of `bayes_expiry_max_db_size` tokens kept on expiry.
+EXPIRY_KEEP_RATIO = 0.75
+# INSERT ... ON CONFLICT DO UPDATE is only supported since SQLite 3.24.
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bayes_token ("
+    "token INTEGER PRIMARY KEY, "
+    "spam_count INTEGER NOT NULL DEFAULT 0, "
+    "ham_count INTEGER NOT NULL DEFAULT 0, "
+    "atime INTEGER NOT NULL DEFAULT 0)",
+    "CREATE INDEX IF NOT EXISTS bayes_token_atime ON bayes_token (atime)",
+    "CREATE TABLE IF NOT EXISTS bayes_seen ("
+    "msgid TEXT PRIMARY KEY, flag TEXT NOT NULL DEFAULT '')",
+    "CREATE TABLE IF NOT EXISTS bayes_vars ("
+    "id INTEGER PRIMARY KEY, "
+    "spam_count INTEGER NOT NULL DEFAULT 0, "
+    "ham_count INTEGER NOT NULL DEFAULT 0, "
+    "last_expire INTEGER NOT NULL DEFAULT 0, "
+    "running_expire INTEGER)",
+    "INSERT OR IGNORE INTO bayes_vars (id) VALUES (0)",
+)
+
+
+def token_to_int(token):
+    """The integer value of the 5 bytes token."""
+    return struct.unpack(">Q", b"\0\0\0" + bytes(token))[0]
+
+
+def int_to_token(value):
+    """The 5 bytes token of the integer value."""
+    return struct.pack(">Q", value)[3:]
+
+
+class Store(object):
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.path = os.path.expanduser(plugin["bayes_path"]) + ".sqlite"
+        self.conn = None
+        self.pid = None
+        # Connections inherited from the parent process, kept so they
+        # are never closed by this process.
+        self._inherited = []
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        return conn
+
+    def untie_db(self):
+        """End the current transaction, the connection is kept open for
+        the next message.
+        """
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.rollback()
+
+    def tie_db_readonly(self):
+        """Create a read-only connection to the database."""
+        # The scan also updates the access time of the tokens, so
+        # this is the same as the read/write connection.
+        return self.tie_db_writeable()
+
+    def tie_db_writeable(self):
+        """Open the connection of this process to the database."""
+        if self.conn is not None and self.pid != os.getpid():
+            self._inherited.append(self.conn)
+            self.conn = None
+        if self.conn is None:
+            self.conn = self._connect()
+            self.pid = os.getpid()
+        return True
+
+    def tok_get(self, token):
+        """Get the spam and ham counts, and access times for the
+        specified token.
+        """
+        return self.conn.execute(
+            "SELECT spam_count, ham_count, atime "
+            "FROM bayes_token WHERE token=?", (token_to_int(token),)
+        ).fetchone()
+
+    def tok_get_all(self, tokens):
+        """Like tok_get, but for all tokens specified.
+        Each returned tuple starts with the token. The tokens are
+        looked up in batches of `bayes_sql_batch_size` with a single
+        query each, tokens that are not in the database are skipped.
+        """
+        values = {}
+        for token in tokens:
+            values[token_to_int(token)] = token
+        for batch in batches(values, self.plugin["bayes_sql_batch_size"]):
+            rows = self.conn.execute(
+                "SELECT token, spam_count, ham_count, atime "
+                "FROM bayes_token WHERE token IN (%s)" %
+                ", ".join("?" * len(batch)), batch
+            )
+            for value, spam_count, ham_count, atime in rows:
+                yield values[value], spam_count, ham_count, atime
+
+    def seen_get(self, msgid):
+        """Get the "seen" flag for the specified message."""
+        result = self.conn.execute(
+            "SELECT flag FROM bayes_seen WHERE msgid=?", (msgid,)
+        ).fetchone()
+        if result is None:
+            return None
+        return result[0]
+
+    def seen_delete(self, msgid):
+        self.conn.execute("DELETE FROM bayes_seen WHERE msgid=?", (msgid,))
+
+    def seen_put(self, msgid, flag):
+        """Set the "seen" flag for the specified message."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO bayes_seen (msgid, flag) VALUES (?, ?)",
+            (msgid, flag)
+        )
+
+    def cleanup(self):
+        """Do any necessary cleanup. The changes made while learning or
+        forgetting a message are committed in a single transaction, and
+        the old tokens are expired if `bayes_auto_expire` is set and
+        the expiry is due.
+        """
+        if self.conn is None:
+            return
+        self.conn.commit()
+        if self.plugin["bayes_auto_expire"] and self.expiry_due():
+            self.expire_old_tokens()
+
+    def nspam_nham_get(self):
+        """Get the spam and ham counts for the database."""
+        return self.conn.execute(
+            "SELECT spam_count, ham_count FROM bayes_vars WHERE id=0"
+        ).fetchone()
+
+    def nspam_nham_change(self, spam, ham):
+        """Add to the spam and ham counts for the database."""
+        self.conn.execute(
+            "UPDATE bayes_vars SET spam_count=max(spam_count + ?, 0), "
+            "ham_count=max(ham_count + ?, 0) WHERE id=0", (spam, ham)
+        )
+
+    def multi_tok_count_change(self, spam, ham, tokens, msgatime):
+        """Add to the spam and ham counts, and update the access time for
+        the specified tokens. When forgetting a message the counts are
+        only decreased for the tokens already in the database.
+        """
+        values = set(token_to_int(token) for token in tokens)
+        msgatime = int(msgatime)
+        if spam < 0 or ham < 0:
+            self.conn.executemany(
+                "UPDATE bayes_token SET spam_count=max(spam_count + ?, 0), "
+                "ham_count=max(ham_count + ?, 0) WHERE token=?",
+                [(spam, ham, value) for value in values]
+            )
+            return
+        if not HAS_UPSERT:
+            # Update the existing tokens, then insert the new ones.
+            self.conn.executemany(
+                "UPDATE bayes_token SET spam_count=spam_count + ?, "
+                "ham_count=ham_count + ?, atime=max(atime, ?) WHERE token=?",
+                [(spam, ham, msgatime, value) for value in values]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO bayes_token "
+                "(token, spam_count, ham_count, atime) VALUES (?, ?, ?, ?)",
+                [(value, spam, ham, msgatime) for value in values]
+            )
+            return
+        self.conn.executemany(
+            "INSERT INTO bayes_token (token, spam_count, ham_count, atime) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (token) DO UPDATE SET "
+            "spam_count=max(spam_count + excluded.spam_count, 0), "
+            "ham_count=max(ham_count + excluded.ham_count, 0), "
+            "atime=max(atime, excluded.atime)",
+            [(value, spam, ham, msgatime) for value in values]
+        )
+
+    def tok_touch_all(self, touch_tokens, msgatime):
+        """Update the access time for all the specified tokens, with a
+        single statement for every batch of tokens.
+        """
+        msgatime = int(msgatime)
+        values = (token_to_int(token) for token in touch_tokens)
+        for batch in batches(values, self.plugin["bayes_sql_batch_size"]):
+            self.conn.execute(
+                "UPDATE bayes_token SET atime=? "
+                "WHERE atime < ? AND token IN (%s)" %
+                ", ".join("?" * len(batch)), [msgatime, msgatime] + batch
+            )
+        self.conn.commit()
+
+    def get_running_expire_tok(self):
+        """The start time of the expiry that is currently running, or
+        None.
+        """
+        return self.conn.execute(
+            "SELECT running_expire FROM bayes_vars WHERE id=0"
+        ).fetchone()[0]
+
+    def set_running_expire_tok(self):
+        """Mark the expiry as running. Returns False if another process
+        is already running it.
+        """
+        now = int(time.time())
+        cursor = self.conn.execute(
+            "UPDATE bayes_vars SET running_expire=? WHERE id=0 AND "
+            "(running_expire IS NULL OR running_expire < ?)",
+            (now, now - EXPIRY_TIMEOUT)
+        )
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def remove_running_expiry_tok(self):
+        self.conn.execute(
+            "UPDATE bayes_vars SET running_expire=NULL WHERE id=0"
+        )
+        self.conn.commit()
+
+    def expiry_due(self):
+        """Return True if the database has more than
+        `bayes_expiry_max_db_size` tokens and wasn't expired recently.
+        """
+        last_expire, running_expire = self.conn.execute(
+            "SELECT last_expire, running_expire FROM bayes_vars WHERE id=0"
+        ).fetchone()
+        now = time.time()
+        if now - last_expire < EXPIRY_INTERVAL:
+            return False
+        if (running_expire is not None and
+                now - running_expire < EXPIRY_TIMEOUT):
+            return False
+        count = self.conn.execute(
+            "SELECT count(*) FROM bayes_token"
+        ).fetchone()[0]
+        return count > self.plugin["bayes_expiry_max_db_size"]
+
+    def expire_old_tokens(self):
+        """Remove the least recently used tokens, keeping
+        `EXPIRY_KEEP_RATIO` of `bayes_expiry_max_db_size` tokens.
+        Returns the number of removed tokens.
+        """
+        if not self.set_running_expire_tok():
+            return 0
+        try:
+            keep = int(self.plugin["bayes_expiry_max_db_size"] *
+                       EXPIRY_KEEP_RATIO)
+            # Tokens accessed at the same time as the oldest kept token
+            # are kept as well.
+            cursor = self.conn.execute(
+                "DELETE FROM bayes_token WHERE atime < ("
+                "SELECT atime FROM bayes_token ORDER BY atime DESC "
+                "LIMIT 1 OFFSET ?)", (max(keep - 1, 0),)
+            )
+            self.conn.execute(
+                "UPDATE bayes_vars SET last_expire=? WHERE id=0",
+                (int(time.time()),)
+            )
+            self.conn.commit()
+            return cursor.rowcount
+        finally:
+            self.remove_running_expiry_tok()
+
+    def sync_due(self):
+        """Return True if a sync is required."""
+        return False
+
+    def get_magic_re(self):
+        """Not used in the SQLite implementation."""
+        pass
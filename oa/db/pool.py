@@ -0,0 +1,336 @@
+"""Persistent database connections for the plugins.
+
+Every worker process keeps its connections open between messages instead
+of connecting for each one. There is a single pool for every DSN in the
+process, shared by all the plugins and rulesets (e.g. Bayes and AWL, and
+the per user rulesets), and the pools are closed when the configuration
+is reloaded:
+
+ * `ConnectionPool` pools the pymysql connections used when SQLAlchemy
+   is not available.
+ * `EngineMonitor` adds the same health checks and fork safety to the
+   pool of a SQLAlchemy engine.
+
+A connection that was idle for more than `check_interval` seconds is
+pinged before it's used again and replaced if the server went away.
+Connections inherited from the parent process after a fork are dropped
+without being closed, since the parent still uses them.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import threading
+import functools
+import contextlib
+import collections
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_CHECK_INTERVAL = 30
+
+# All the pools and monitored engines of the process, by DSN.
+_POOLS = {}
+_LOCK = threading.Lock()
+
+
+def connect_mysql(engine):
+    """Open a pymysql connection with the settings from
+    `oa.plugins.base.dbi_to_mysql`.
+    """
+    import pymysql
+    return pymysql.connect(host=engine["hostname"], port=3306,
+                           user=engine["user"],
+                           passwd=engine["password"],
+                           db=engine["db_name"])
+
+
+def get_pool(engine, size=DEFAULT_POOL_SIZE,
+             check_interval=DEFAULT_CHECK_INTERVAL):
+    """Get the pool of pymysql connections for the settings from
+    `oa.plugins.base.dbi_to_mysql`, it's created on first use.
+    """
+    key = tuple(sorted(engine.items()))
+    with _LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            name = "mysql://%(user)s@%(hostname)s/%(db_name)s" % engine
+            pool = ConnectionPool(name, functools.partial(connect_mysql,
+                                                          engine),
+                                  size, check_interval)
+            _POOLS[key] = pool
+        return pool
+
+
+def get_engine(connect_string, create_engine,
+               check_interval=DEFAULT_CHECK_INTERVAL):
+    """Get the SQLAlchemy engine for the connect string, it's created
+    with `create_engine` on first use.
+    """
+    with _LOCK:
+        monitor = _POOLS.get(connect_string)
+        if monitor is None:
+            engine = create_engine(connect_string)
+            # The password is hidden in the representation of the URL.
+            name = repr(getattr(engine, "url", connect_string))
+            monitor = EngineMonitor(name, engine, check_interval)
+            _POOLS[connect_string] = monitor
+        return monitor.engine
+
+
+def close_all():
+    """Close the connections of all the pools, the pools are created
+    again when the new ruleset needs them.
+    """
+    with _LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def get_stats():
+    """The statistics of all the pools of the process, by name."""
+    with _LOCK:
+        pools = list(_POOLS.values())
+    return {pool.name: pool.get_stats() for pool in pools}
+
+
+def _after_fork():
+    """Reset the locks in the child process, they might have been held
+    by another thread of the parent.
+    """
+    global _LOCK
+    _LOCK = threading.Lock()
+    for pool in _POOLS.values():
+        pool.reset_after_fork()
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool(object):
+    """A pool of persistent DB-API connections created with `connect`.
+
+    At most `size` idle connections are kept, the most recently used
+    one is handed out first. The pool can be used by several threads.
+    """
+
+    def __init__(self, name, connect, size=DEFAULT_POOL_SIZE,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.name = name
+        self.connect = connect
+        self.size = size
+        self.check_interval = check_interval
+        self.pid = os.getpid()
+        self.closed = False
+        self._lock = threading.Lock()
+        # (connection, last used) pairs.
+        self._idle = collections.deque()
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.checks = 0
+        self.reconnects = 0
+        self.discarded = 0
+        self.forks = 0
+
+    def _check_fork(self):
+        """Drop the connections inherited from the parent process."""
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self._idle.clear()
+        self.in_use = 0
+        self.forks += 1
+
+    def reset_after_fork(self):
+        """Reset the lock and drop the inherited connections."""
+        self._lock = threading.Lock()
+        self._check_fork()
+
+    def _is_alive(self, conn):
+        with self._lock:
+            self.checks += 1
+        try:
+            conn.ping(False)
+        except Exception:
+            return False
+        return True
+
+    def _pop_idle(self):
+        """The most recently used idle connection and the time it was
+        last used, or None.
+        """
+        with self._lock:
+            self._check_fork()
+            if not self._idle:
+                return None
+            return self._idle.pop()
+
+    def acquire(self):
+        """Get a connection from the pool, or open a new one."""
+        idle = self._pop_idle()
+        while idle is not None:
+            conn, last_used = idle
+            if (time.time() - last_used < self.check_interval or
+                    self._is_alive(conn)):
+                with self._lock:
+                    self.reused += 1
+                    self.in_use += 1
+                return conn
+            with self._lock:
+                self.reconnects += 1
+            _close(conn)
+            idle = self._pop_idle()
+        conn = self.connect()
+        with self._lock:
+            self.created += 1
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        """Return the connection to the pool. Anything that wasn't
+        committed is rolled back.
+        """
+        if self.pid != os.getpid():
+            # Acquired by the parent process.
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            self.discard(conn)
+            return
+        with self._lock:
+            self.in_use -= 1
+            if not self.closed and len(self._idle) < self.size:
+                self._idle.append((conn, time.time()))
+                return
+        _close(conn)
+
+    def discard(self, conn):
+        """Close a connection that failed instead of returning it to
+        the pool.
+        """
+        with self._lock:
+            self.in_use -= 1
+            self.discarded += 1
+        _close(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager that acquires a connection and releases it
+        at the end, or discards it if there was an error.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.discard(conn)
+            raise
+        self.release(conn)
+
+    def close(self):
+        """Close all the idle connections, the connections still in use
+        are closed when they are released.
+        """
+        with self._lock:
+            self._check_fork()
+            self.closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, dummy in idle:
+            _close(conn)
+
+    def get_stats(self):
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "created": self.created,
+            "reused": self.reused,
+            "checks": self.checks,
+            "reconnects": self.reconnects,
+            "discarded": self.discarded,
+            "forks": self.forks,
+        }
+
+
+class EngineMonitor(object):
+    """Health checks, fork safety and statistics for the connection
+    pool of a SQLAlchemy engine.
+    """
+
+    def __init__(self, name, engine, check_interval=DEFAULT_CHECK_INTERVAL):
+        import sqlalchemy.event
+        self.name = name
+        self.engine = engine
+        self.check_interval = check_interval
+        self.created = 0
+        self.checkouts = 0
+        self.checks = 0
+        self.reconnects = 0
+        self.forks = 0
+        sqlalchemy.event.listen(engine, "connect", self.on_connect)
+        sqlalchemy.event.listen(engine, "checkout", self.on_checkout)
+        sqlalchemy.event.listen(engine, "checkin", self.on_checkin)
+
+    def reset_after_fork(self):
+        """Nothing to do, the inherited connections are dropped when
+        they are checked out.
+        """
+
+    def close(self):
+        """Close the connections of the engine."""
+        self.engine.dispose()
+
+    def on_connect(self, dbapi_connection, connection_record):
+        self.created += 1
+        connection_record.info["pid"] = os.getpid()
+        connection_record.info["last_used"] = time.time()
+
+    def on_checkout(self, dbapi_connection, connection_record,
+                    connection_proxy):
+        from sqlalchemy.exc import DisconnectionError
+        self.checkouts += 1
+        pid = connection_record.info.get("pid", os.getpid())
+        if pid != os.getpid():
+            # Don't close the connection, the parent still uses it.
+            self.forks += 1
+            connection_record.dbapi_connection = None
+            connection_proxy.dbapi_connection = None
+            raise DisconnectionError("Connection inherited from pid %s" %
+                                     pid)
+        idle = time.time() - connection_record.info.get("last_used", 0)
+        if idle < self.check_interval:
+            return
+        self.checks += 1
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        except Exception:
+            # The pool replaces the connection and tries again.
+            self.reconnects += 1
+            raise DisconnectionError()
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        connection_record.info["last_used"] = time.time()
+
+    def get_stats(self):
+        return {
+            "status": self.engine.pool.status(),
+            "created": self.created,
+            "checkouts": self.checkouts,
+            "checks": self.checks,
+            "reconnects": self.reconnects,
+            "forks": self.forks,
+        }
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -1,87 +1,139 @@
-"""Parser for fetching all links in a message"""
+"""Parser for fetching all links in a message, together with the text
+and the tags of the HTML parts.
+"""
+
+import collections
 
 from html.parser import HTMLParser
 
 try:
-    from urllib.parse import unquote
-    from urllib.parse import urlparse
+    from html.parser import HTMLParseError
 except ImportError:
-    from urllib import unquote
-    from urlparse import urlparse
+    # Removed in Python 3.5, the parser asserts instead.
+    HTMLParseError = AssertionError
+
+import oa.uri_parser
+
+# The text inside these elements is not shown to the reader.
+INVISIBLE_TAGS = frozenset(("head", "title", "script", "style", "noscript",
+                            "template"))
+# These elements have no content and no end tag.
+VOID_TAGS = frozenset(("area", "base", "br", "col", "embed", "hr", "img",
+                       "input", "keygen", "link", "meta", "param", "source",
+                       "track", "wbr"))
+
+
+def _is_hidden(tag, attrs):
+    """Check if the element hides its content."""
+    if tag in INVISIBLE_TAGS:
+        return True
+    for prop, value in attrs:
+        if prop == "hidden":
+            return True
+        if prop == "style" and value:
+            style = value.lower().replace(" ", "")
+            if "display:none" in style or "visibility:hidden" in style:
+                return True
+    return False
 
 
 class HTML(HTMLParser):
     """HTML parser to fetch all links in the message with the
-    corresponding value of the anchor"""
+    corresponding value of the anchor.
 
-    def __init__(self, logger):
+    The same pass also keeps:
+
+    * `data` - all the text in the part, stripped
+    * `visible` - the text shown to the reader
+    * `invisible` - the text in the head, scripts, styles and the
+      hidden elements
+    * `tags` - the number of times each tag is used
+    """
+
+    def __init__(self, logger, links=None, data=None):
         try:
             HTMLParser.__init__(self, convert_charrefs=False)
         except TypeError:
             # Python 2 does not have the convert_charrefs argument
             HTMLParser.__init__(self)
-        self.links = {}
+        self.links = {} if links is None else links
+        self.data = [] if data is None else data
+        self.visible = []
+        self.invisible = []
+        self.tags = collections.Counter()
         self.last_start_tag = None
         self.last_link_details = {}
         self.current_link = None
         self.logger = logger
-
+        # The open elements and whether they hide their content.
+        self._open_tags = []
+        self._hidden = 0
 
     def handle_starttag(self, tag, attrs):
         '''
         Handle the start of a tag.
         '''
+        self.tags[tag] += 1
+        if tag not in VOID_TAGS:
+            hidden = _is_hidden(tag, attrs)
+            self._open_tags.append((tag, hidden))
+            self._hidden += hidden
         if tag in ('a', 'link'):
             self.last_start_tag = tag
             for item in attrs:
                 prop, value = item
                 if prop not in ("href", "src"):
                     continue
-                link = parse_link(value, tag)
-                if value in self.links:
-                    if tag in self.links[value]:
-                        self.links[value][tag].update(link[tag])
-                        self.current_link = value
-                        continue
-                else:
-                    self.links[value] = {}
-                link[tag]['text'] = []
-                self.links[value][tag] = link[tag]
+                # The rest of the details come from `oa.uri_parser`.
+                self.links.setdefault(value, {}).setdefault(tag,
+                                                            {"text": []})
                 self.current_link = value
 
     def handle_endtag(self, tag):
         self.last_start_tag = None
         self.current_link = None
+        # Close this element and any unclosed elements inside it.
+        for index in range(len(self._open_tags) - 1, -1, -1):
+            if self._open_tags[index][0] == tag:
+                for dummy, hidden in self._open_tags[index:]:
+                    self._hidden -= hidden
+                del self._open_tags[index:]
+                break
 
     def handle_data(self, data):
-        """Handle the text in anchors"""
-        if not all([data, self.last_start_tag, self.current_link]):
+        """Handle the text in anchors and the text of the part"""
+        if all([data, self.last_start_tag, self.current_link]):
+            if self.last_start_tag in ("a", "link"):
+                self.links[self.current_link][self.last_start_tag]["text"].\
+                    append(data)
+        data = data.replace("\n", " ").strip()
+        if not data:
             return
-        if self.last_start_tag in ("a", "link"):
-            self.links[self.current_link][self.last_start_tag]["text"].\
-                append(data)
+        self.data.append(data)
+        if self._hidden:
+            self.invisible.append(data)
+        else:
+            self.visible.append(data)
+
 
 def parse_link(value, linktype):
     """ Returns a dictionary with information for the link"""
-    link = {}
-    link[linktype] = {}
-    link[linktype]["raw"] = value
-    urlp = urlparse(value)
-    link[linktype]["scheme"] = urlp.scheme
-    link[linktype]["cleaned"] = unquote(value)
-    link[linktype]["domain"] = urlp.netloc
-    return link
+    return {linktype: oa.uri_parser.URI(value, redirects=False).get_details()}
 
 
 def parsed_metadata(msg, ctxt):
     """Goes through the URIs, parse them and store them locally in the
             message"""
-    parser = HTML(ctxt.log)
-    parser.feed(msg.raw_text)
+    # The links in the HTML parts are found when the body is parsed,
+    # and the URIs are only parsed once in `msg.uris`.
+    links = {}
+    for value, tags in msg.html_links.items():
+        details = msg.uris[value].get_details()
+        links[value] = dict((tag, dict(details, text=link["text"]))
+                            for tag, link in tags.items())
     for uri in msg.uri_list:
-        if uri in parser.links:
+        if uri in links:
             continue
-        link = parse_link(uri, "parsed")
-        parser.links[uri] = link
-    msg.uri_detail_links = parser.links
-    ctxt.set_plugin_data("URIDetailPlugin", "links", parser.links)
\ No newline at end of file
+        links[uri] = {"parsed": msg.uris[uri].get_details()}
+    msg.uri_detail_links = links
+    ctxt.set_plugin_data("URIDetailPlugin", "links", links)
@@ -14,7 +14,6 @@ import calendar
 import functools
 import ipaddress
 import email.utils
-import html.parser
 import collections
 import email.header
 import email.errors
@@ -27,6 +26,8 @@ from future.utils import PY3
 
 import oa
 import oa.context
+import oa.uri_parser
+import oa.html_parser
 
 from oa.received_parser import ReceivedParser
 from oa.rules.ruleset import RuleSet
@@ -51,28 +52,25 @@ URL_RE = Regex(r"""
 
 IPFRE = Regex(r"[\[ \(]{1}[a-fA-F\d\.\:]{7,}?[\] \n;\)]{1}")
 
+# A blank line in any of the line break styles, the end of the headers.
+BLANK_LINE_RE = re.compile(br"(?:\r\n|\r(?!\n)|\n)(?:\r\n|\r(?!\n)|\n)")
+# The surrogates the bytes parser uses for the non-ASCII bytes.
+SURROGATES_RE = re.compile(u"[\udc80-\udcff]")
+
+# Text parts with these tags also have their links parsed.
+LINK_TAG_RE = re.compile(r"<(?:a|link)\b", re.I)
+
 STRICT_CHARSETS = frozenset(("quopri-codec", "quopri", "quoted-printable",
                              "quotedprintable"))
 
 
-class _ParseHTML(html.parser.HTMLParser):
+class _ParseHTML(oa.html_parser.HTML):
     """Extract data from HTML parts."""
 
-    def __init__(self, collector):
-        try:
-            html.parser.HTMLParser.__init__(self, convert_charrefs=False)
-        except TypeError:
-            # Python 2 does not have the convert_charrefs argument.
-            html.parser.HTMLParser.__init__(self)
-        self.reset()
+    def __init__(self, collector, links=None):
+        oa.html_parser.HTML.__init__(self, None, links, collector)
         self.collector = collector
 
-    def handle_data(self, data):
-        """Keep track of the data."""
-        data = data.strip()
-        if data:
-            self.collector.append(data)
-
 
 class _Headers(collections.defaultdict):
     """Like a defaultdict that returns an empty list by default, but the
@@ -109,8 +107,8 @@ class _memoize(object):
         """
         @functools.wraps(func)
         def wrapped_func(fself, name):
-            from oa.config import LAZY_MODE
-            if LAZY_MODE:
+            from oa.config import LAZY_MODE, LAZY_CACHE
+            if LAZY_MODE and not LAZY_CACHE:
                 return func(fself, name)
             cache = getattr(fself, self._cache_name)
             result = cache.get(name)
@@ -126,58 +124,124 @@ DEFAULT_SENDERH = (
     "X-Sender", "X-Envelope-From", "Envelope-Sender", "Return-Path"
 )
 
+# The attributes of the message that are only parsed when first
+# accessed, mapped to the method that sets them.
+LAZY_ATTRIBUTES = {
+    "raw_msg": "_decode_raw_msg",
+    "raw_bytes": "_encode_raw_msg",
+    "msg": "_parse_msg",
+    "text": "_parse_body",
+    "raw_text": "_parse_body",
+    "uri_list": "_parse_body",
+    "raw_mime_headers": "_parse_body",
+    "missing_boundary_header": "_parse_body",
+    "html_links": "_parse_body",
+    "html_visible_text": "_parse_body",
+    "html_invisible_text": "_parse_body",
+    "html_tags": "_parse_body",
+    "uris": "_parse_uris",
+    "received_headers": "_parse_received",
+    "sender_address": "_parse_received",
+    "hostname_with_ip": "_parse_received",
+    "internal_relays": "_parse_received",
+    "external_relays": "_parse_received",
+    "trusted_relays": "_parse_received",
+    "untrusted_relays": "_parse_received",
+    "last_internal_relay_index": "_parse_received",
+    "last_trusted_relay_index": "_parse_received",
+}
+
 
 class Message(oa.context.MessageContext):
-    """Internal representation of an email message. Used for rule matching."""
+    """Internal representation of an email message. Used for rule matching.
+
+    Only the headers are parsed when the message is created, the rest of
+    the attributes in `LAZY_ATTRIBUTES` are parsed when first accessed,
+    or before the `parsed_metadata` plugin hooks if the ruleset declares
+    they are required (see `oa.rules.ruleset.RuleSet.message_requires`).
+    """
 
     def __init__(self, global_context, raw_msg):
-        """Parse the message, extracts and decode all headers and all
-        text parts.
+        """Parse the message headers. The raw message can be either bytes,
+        as read from a file or socket, or text.
         """
-        self.missing_boundary_header = False
         self.missing_header_body_separator = False
         super(Message, self).__init__(global_context)
-        self.raw_msg = self.translate_line_breaks(raw_msg)
-        self.msg = email.message_from_string(self.raw_msg)
+        if PY3 and isinstance(raw_msg, bytes):
+            # Keep the bytes, the text is only decoded if needed.
+            self._raw_input = raw_msg
+        else:
+            self._raw_input = None
+            self.raw_msg = self.translate_line_breaks(raw_msg)
         self.headers = _Headers()
         self.raw_headers = _Headers()
         self.addr_headers = _Headers()
         self.name_headers = _Headers()
         self.mime_headers = _Headers()
-        self.received_headers = list()
-        self.raw_mime_headers = _Headers()
         self.header_ips = _Headers()
-        self.text = ""
-        self.raw_text = ""
-        self.uri_list = set()
         self.score = 0
         self.rules_checked = dict()
+        # The results of all the evaluated rules, including the ones
+        # only used in meta rules.
+        self.rule_results = dict()
+        # Number of rule evaluations avoided by reusing a stored result.
+        self.saved_evaluations = 0
+        self.prefilter_skipped = set()
+        # Number of checked rules left out because they could not
+        # change the verdict.
+        self.truncated_scan = 0
         self.interpolate_data = dict()
         self.rules_descriptions = dict()
         self.plugin_tags = dict()
-        # Data
-        self.sender_address = ""
-        self.hostname_with_ip = list()
-        self.internal_relays = []
-        self.external_relays = []
-        self.last_internal_relay_index = 0
-        self.last_trusted_relay_index = 0
-        self.trusted_relays = []
-        self.untrusted_relays = []
+        # The networks of the relay IPs, see `_classify_ip`.
+        self._ip_networks = dict()
+        self._untrusted_ips = None
         self._parse_message()
         self._hook_parsed_metadata()
 
+    def __getattr__(self, name):
+        """Parse the lazy attributes on first access."""
+        try:
+            parse = LAZY_ATTRIBUTES[name]
+        except KeyError:
+            raise AttributeError("%r object has no attribute %r" %
+                                 (type(self).__name__, name))
+        getattr(self, parse)()
+        return self.__dict__[name]
+
+    def prepare(self, *names):
+        """Parse these lazy attributes now, if they weren't already."""
+        for name in names:
+            getattr(self, name)
+
     def clear_matches(self):
         """Clear any already checked rules."""
         self.rules_checked = dict()
+        self.rule_results = dict()
+        self.saved_evaluations = 0
+        self.prefilter_skipped = set()
+        self.truncated_scan = 0
         self.score = 0
 
     @staticmethod
     def translate_line_breaks(text):
         """Convert any EOL style to Linux EOL."""
+        if isinstance(text, bytes):
+            text = text.replace(b"\r\n", b"\n")
+            return text.replace(b"\r", b"\n")
         text = text.replace("\r\n", "\n")
         return text.replace("\r", "\n")
 
+    @staticmethod
+    def _decode_surrogates(value):
+        """Decode the non-ASCII bytes kept as surrogates by the bytes
+        parser as UTF-8, the same as for text messages.
+        """
+        if SURROGATES_RE.search(value):
+            return value.encode("ascii", "surrogateescape").decode("utf-8",
+                                                                   "ignore")
+        return value
+
     @staticmethod
     def normalize_html_part(payload):
         """Strip all HTML tags."""
@@ -185,7 +249,7 @@ class Message(oa.context.MessageContext):
         stripper = _ParseHTML(data)
         try:
             stripper.feed(payload)
-        except (UnicodeDecodeError, html.parser.HTMLParseError):
+        except (UnicodeDecodeError, oa.html_parser.HTMLParseError):
             # We can't parse the HTML, so just strip it.  This is still
             # better than including generic HTML/CSS text.
             pass
@@ -242,9 +306,31 @@ class Message(oa.context.MessageContext):
 
         :return: A list of `ipaddress.ip_address`.
         """
-        ips = [ip for ip in self.get_header_ips()
-               if ip not in self.ctxt.networks.trusted]
-        return ips
+        if self._untrusted_ips is None:
+            self._untrusted_ips = []
+            for header in self.received_headers:
+                address, dummy, trusted, dummy = self._classify_ip(
+                    header["ip"])
+                if not trusted:
+                    self._untrusted_ips.append(address)
+        return list(self._untrusted_ips)
+
+    def _classify_ip(self, ip):
+        """Check if the IP address is in the internal, trusted and MSA
+        networks. The results are cached for the message.
+
+        :return: The `ipaddress.ip_address` and the three checks.
+        """
+        try:
+            return self._ip_networks[ip]
+        except KeyError:
+            pass
+        address = ipaddress.ip_address(str(ip))
+        networks = self.ctxt.networks
+        result = (address, address in networks.internal,
+                  address in networks.trusted, address in networks.msa)
+        self._ip_networks[ip] = result
+        return result
 
     def get_header_ips(self):
         values = list()
@@ -368,10 +454,8 @@ class Message(oa.context.MessageContext):
         for position, relay in enumerate(relays):
             relay['msa'] = 0
             if relay['ip']:
-                ip = ipaddress.ip_address(str(relay['ip']))
-                in_internal = ip in self.ctxt.networks.internal
-                in_trusted = ip in self.ctxt.networks.trusted
-                in_msa = ip in self.ctxt.networks.msa
+                ip, in_internal, in_trusted, in_msa = self._classify_ip(
+                    relay['ip'])
                 has_auth = relay.get("auth", None)
                 if is_trusted and not found_msa:
                     if self.ctxt.networks.configured:
@@ -427,11 +511,19 @@ class Message(oa.context.MessageContext):
         self._create_plugin_tags(relays_tags)
 
     def _parse_message(self):
-        """Parse the message."""
+        """Parse the message headers. The attributes required by the
+        ruleset are parsed as well, the rest when they are first accessed.
+        """
         self._hook_check_start()
-        # Dump the message raw headers
-
-        for line in self.raw_msg.splitlines():
+        # Only the headers are needed, don't split or decode the whole
+        # message.
+        if self._raw_input is not None:
+            end = BLANK_LINE_RE.search(self._raw_input)
+            head = self._raw_input[:end.start()] if end else self._raw_input
+            head = self.translate_line_breaks(head).decode("utf-8", "ignore")
+        else:
+            head = self.raw_msg.split("\n\n", 1)[0]
+        for line in head.splitlines():
             if not email.feedparser.headerRE.match(line):
                 # If we saw the RFC defined header/body separator
                 # (i.e. newline), just throw it away. Otherwise the line is
@@ -440,9 +532,47 @@ class Message(oa.context.MessageContext):
                     self.missing_header_body_separator = True
                 break
 
-        for name, raw_value in self.msg._headers:
+        # Dump the message raw headers
+        for name, raw_value in email.message_from_string(head)._headers:
             self.raw_headers[name].append(raw_value)
+        self.prepare(*self.ctxt.message_requires)
+
+    def _decode_raw_msg(self):
+        """Decode the raw message bytes."""
+        self.raw_msg = self.raw_bytes.decode("utf-8", "ignore")
 
+    def _encode_raw_msg(self):
+        """Get the raw message as bytes with Linux EOL. This is the same
+        buffer the message was created from if it was already using them.
+        """
+        if self._raw_input is not None:
+            self.raw_bytes = self.translate_line_breaks(self._raw_input)
+            # Only keep one copy of the message.
+            self._raw_input = self.raw_bytes
+        else:
+            self.raw_bytes = self.raw_msg.encode("utf-8")
+
+    def _parse_msg(self):
+        """Parse the whole message."""
+        if self._raw_input is not None:
+            self.msg = email.message_from_bytes(self.raw_bytes)
+        else:
+            self.msg = email.message_from_string(self.raw_msg)
+
+    def _parse_body(self):
+        """Decode the text parts and extract the MIME headers and the
+        URIs. The `extract_metadata` plugin hooks are called for every
+        part.
+
+        Every HTML part is parsed once for its text, links and tags.
+        """
+        self.missing_boundary_header = False
+        self.raw_mime_headers = _Headers()
+        self.uri_list = set()
+        self.html_links = {}
+        self.html_visible_text = []
+        self.html_invisible_text = []
+        self.html_tags = collections.Counter()
         # XXX This is strange, but it's what SA does.
         # The body starts with the Subject header(s)
         body = list(self.get_decoded_header("Subject"))
@@ -453,17 +583,25 @@ class Message(oa.context.MessageContext):
 
             # Extract any MIME headers
             for name, raw_value in part._headers:
+                if self._raw_input is not None:
+                    raw_value = self._decode_surrogates(raw_value)
                 self.raw_mime_headers[name].append(raw_value)
             text = None
             if payload is not None:
                 # this must be a text part
                 self.uri_list.update(set(URL_RE.findall(payload)))
                 if part.get_content_subtype() == "html":
-                    text = self.normalize_html_part(payload.replace("\n", " "))
-                    text = " ".join(text)
+                    html_part = self._analyse_html_part(payload)
+                    self.html_visible_text.extend(html_part.visible)
+                    self.html_invisible_text.extend(html_part.invisible)
+                    self.html_tags.update(html_part.tags)
+                    text = " ".join(html_part.data)
                     body.append(text)
                     raw_body.append(payload)
                 else:
+                    if LINK_TAG_RE.search(payload):
+                        # Only the links are kept for text parts.
+                        self._analyse_html_part(payload)
                     text = payload.replace("\n", " ")
                     body.append(text)
                     raw_body.append(payload)
@@ -471,7 +609,38 @@ class Message(oa.context.MessageContext):
         self.text = " ".join(body)
         self.raw_text = "\n".join(raw_body)
 
-        received_headers = self.get_decoded_header("Received")
+    def _analyse_html_part(self, payload):
+        """Parse the HTML part and add its links to `html_links`."""
+        parser = _ParseHTML(list(), self.html_links)
+        try:
+            parser.feed(payload)
+        except (UnicodeDecodeError, oa.html_parser.HTMLParseError):
+            # We can't parse the rest of the HTML, keep what we have.
+            pass
+        return parser
+
+    def _parse_uris(self):
+        """Parse the URIs found in the text and in the HTML links."""
+        uris = set(self.uri_list)
+        uris.update(self.html_links)
+        self.uris = oa.uri_parser.parse_uris(uris, self.ctxt.tlds)
+
+    def _parse_received(self):
+        """Parse the Received headers and find the relays and the
+        envelope sender.
+        """
+        self.sender_address = ""
+        self.hostname_with_ip = list()
+        self.internal_relays = []
+        self.external_relays = []
+        self.last_internal_relay_index = 0
+        self.last_trusted_relay_index = 0
+        self.trusted_relays = []
+        self.untrusted_relays = []
+        self.received_headers = list()
+
+        # Copy the list, the decoded headers are cached.
+        received_headers = list(self.get_decoded_header("Received"))
         for header in self.ctxt.conf["originating_ip_headers"]:
             headers = ["X-ORIGINATING-IP: %s" % x
                        for x in self.get_decoded_header(header)]
@@ -576,7 +745,7 @@ class Message(oa.context.MessageContext):
 
         combined = "{date}\x00{body}".format(date=date, body=body)
         msgid = u"%s@sa_generated" % hashlib.sha1(
-            combined.encode('utf-8')
+            combined.encode('utf-8', 'surrogateescape')
         ).hexdigest()
         return msgid
 
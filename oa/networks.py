@@ -34,26 +34,142 @@ def _format_network_str(network, mask):
         return str("%s%s/%s" % (network, padding, mask))
     return str("%s%s" % (network, padding))
 
+class _RadixNode(object):
+    """A node of the radix tree, with the networks that start with the
+    first `length` bits of `prefix`.
+
+    `entry` is the position of the network in the list and if it's
+    accepted, `first` is the lowest position in this subtree.
+    """
+    __slots__ = ("prefix", "length", "entry", "first", "children")
+
+    def __init__(self, prefix, length, entry=None):
+        self.prefix = prefix
+        self.length = length
+        self.entry = entry
+        self.first = entry[0] if entry else float("inf")
+        self.children = [None, None]
+
+
+class RadixTree(object):
+    """A path compressed binary radix tree of networks.
+
+    The lookups return the first network added that contains the
+    address, like checking the networks in order would, but only the
+    networks on the path of the address are checked.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = _RadixNode(0, 0)
+
+    def _get_bit(self, value, position):
+        return (value >> (self.bits - position - 1)) & 1
+
+    def _common_length(self, first, second, length):
+        diff = (first ^ second) >> (self.bits - length)
+        return length - diff.bit_length()
+
+    def add(self, network, index, accepted):
+        """Add the network, found at this position in the list."""
+        prefix = int(network.network_address)
+        length = network.prefixlen
+        entry = (index, accepted)
+        node = self.root
+        while True:
+            node.first = min(node.first, index)
+            if node.length == length:
+                # Only the first of the duplicate networks is used.
+                if node.entry is None:
+                    node.entry = entry
+                return
+            bit = self._get_bit(prefix, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _RadixNode(prefix, length, entry)
+                return
+            common = self._common_length(prefix, child.prefix,
+                                         min(length, child.length))
+            if common == child.length:
+                node = child
+                continue
+            # Split the path where the networks differ.
+            middle = _RadixNode(prefix >> (self.bits - common)
+                                << (self.bits - common), common)
+            middle.first = min(child.first, index)
+            middle.children[self._get_bit(child.prefix, common)] = child
+            node.children[bit] = middle
+            if common == length:
+                middle.entry = entry
+            else:
+                middle.children[self._get_bit(prefix, common)] = _RadixNode(
+                    prefix, length, entry)
+            return
+
+    def lookup(self, address):
+        """Get the (position, accepted) of the first network that
+        contains the address, None if there isn't one.
+        """
+        value = int(address)
+        best = None
+        best_index = float("inf")
+        node = self.root
+        while node is not None and node.first < best_index:
+            shift = self.bits - node.length
+            if (value >> shift) != (node.prefix >> shift):
+                break
+            if node.entry is not None and node.entry[0] < best_index:
+                best = node.entry
+                best_index = best[0]
+            if node.length == self.bits:
+                break
+            node = node.children[self._get_bit(value, node.length)]
+        return best
+
+
 class NetworkListBase(object):
+    """An ordered list of networks, the first network that contains
+    an address decides if it's accepted. Excluded networks (`!net`) are
+    added as not accepted.
+
+    The networks are indexed in a radix tree for each IP version, so
+    the lookups don't check all the networks in the list.
+    """
     _always_accepted = ()
     configured = False
 
     def __init__(self):
         self._networks = []
-        self._networks.extend(self._always_accepted)
+        self._trees = {}
+        self.clear()
 
     def add(self, network, accepted):
+        index = len(self._networks)
         self._networks.append((network, accepted))
+        if network is None:
+            return
+        try:
+            tree = self._trees[network.version]
+        except KeyError:
+            tree = self._trees[network.version] = RadixTree(
+                network.max_prefixlen)
+        tree.add(network, index, accepted)
 
     def clear(self):
         self._networks = []
-        self._networks.extend(self._always_accepted)
+        self._trees = {}
+        for network, accepted in self._always_accepted:
+            self.add(network, accepted)
 
     def __contains__(self, query):
-        for network, accepted in self._networks:
-            if query in network:
-                return accepted
-        return False
+        try:
+            tree = self._trees[query.version]
+        except KeyError:
+            return False
+        entry = tree.lookup(query)
+        if entry is None:
+            return False
+        return entry[1]
 
 
 class TrustedNetworks(NetworkListBase):
@@ -161,12 +161,16 @@ class AutoWhiteListPlugin(oa.plugins.base.BasePlugin):
 
 
     def get_mysql_entry(self, address, ip, signed_by):
-        conn = pymysql.connect(host=self.engine["hostname"], port=3306,
-                               user=self.engine["user"],
-                               passwd=self.engine["password"],
-                               db=self.engine["db_name"],
-                               )
-        cursor = conn.cursor()
+        # The connection is discarded if any of the queries fail.
+        with self["pool"].connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return self._get_mysql_entry(conn, cursor, address, ip,
+                                             signed_by)
+            finally:
+                cursor.close()
+
+    def _get_mysql_entry(self, conn, cursor, address, ip, signed_by):
         cursor.execute("SELECT * FROM awl WHERE username=%s AND email=%s AND "
                        "signedby=%s AND ip=%s",
                        (self.ctxt.username, address, signed_by, ip))
@@ -189,9 +193,6 @@ class AutoWhiteListPlugin(oa.plugins.base.BasePlugin):
                 "INSERT INTO awl VALUES (%s, %s, %s, %s, %s, %s) ",
                 (self.ctxt.username, address, ip, 0, 0, signed_by))
             conn.commit()
-
-        cursor.close()
-        conn.close()
         return result
 
     def get_sqlalch_entry(self, address, ip, signed_by):
@@ -260,19 +261,17 @@ class AutoWhiteListPlugin(oa.plugins.base.BasePlugin):
         session.close()
 
     def plugin_tags_mysql(self, msg, origin_ip, addr, signed_by, score, factor):
+        conn = None
         try:
-            conn = pymysql.connect(host=self.engine["hostname"], port=3306,
-                                   user=self.engine["user"],
-                                   passwd=self.engine["password"],
-                                   db=self.engine["db_name"],
-                                   )
-
+            conn = self.get_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT totscore, count FROM awl")
             entry_totscore, entry_count = cursor.fetchall()[0]
 
         except pymysql.Error:
             self.ctxt.log.error("DB connection failed")
+            if conn is not None:
+                self.release_connection(conn)
             return
 
         try:
@@ -308,12 +307,13 @@ class AutoWhiteListPlugin(oa.plugins.base.BasePlugin):
             result = cursor.execute(
                 "UPDATE awl SET count=%s, totscore=%s",
                 (entry_count, entry_totscore))
+            conn.commit()
         except pymysql.Error:
+            self.release_connection(conn)
             return False
 
-        conn.commit()
         cursor.close()
-        conn.close()
+        self.release_connection(conn)
 
     def check_from_in_auto_whitelist(self, msg, target=None):
         """Adjust the message score according to the
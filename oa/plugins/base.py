@@ -15,6 +15,7 @@ except ImportError:
 from collections import defaultdict
 
 import oa.conf
+import oa.db.pool
 
 
 def dbi_to_mysql(dsn, user, password):
@@ -112,33 +113,64 @@ class BasePlugin(oa.conf.Conf, object):
         ruleset.
 
         By default this prepares the SQLAlchemy engine if the plugin has any
-        set.
+        set, or the pool of pymysql connections if SQLAlchemy is not
+        available. The engines and pools are shared by all the plugins
+        with the same DSN and keep the connections open between messages
+        (see `oa.db.pool`).
         """
         connect_string = None
         self["engine"] = None
+        self["pool"] = None
         if self.dsn:
             if self.dsn.upper().startswith("DBI"):
                 # Convert from SA format.
                 user = self.sql_username
                 password = self.sql_password
                 if not create_engine:
-                    self["engine"] = dbi_to_mysql(self.dsn, user, password)
+                    engine = dbi_to_mysql(self.dsn, user, password)
+                    self["engine"] = engine
+                    if engine:
+                        self["pool"] = oa.db.pool.get_pool(
+                            engine, ruleset.conf["sql_pool_size"],
+                            ruleset.conf["sql_pool_check_interval"])
                 else:
                     connect_string = dbi_to_alchemy(self.dsn, user, password)
             elif self.dsn:
                 # The connect string is already in the correct format
                 connect_string = self.dsn
         if connect_string is not None:
-            self["engine"] = create_engine(connect_string)
+            self["engine"] = oa.db.pool.get_engine(
+                connect_string, create_engine,
+                ruleset.conf["sql_pool_check_interval"])
 
     def get_engine(self):
         return self["engine"]
 
+    def get_connection(self):
+        """Get a pymysql connection from the pool of the DSN. It must
+        be returned with `release_connection`.
+        """
+        return self["pool"].acquire()
+
+    def release_connection(self, conn):
+        """Return the connection to the pool of the DSN."""
+        self["pool"].release(conn)
+
     def get_session(self):
         """Open a new SQLAlchemy session."""
         engine = self["engine"]
         return sessionmaker(bind=engine)()
 
+    @property
+    def message_requires(self):
+        """The lazy attributes of the message (see `oa.message.Message`)
+        that must be parsed before the `parsed_metadata` hook. By default
+        the body is parsed if the plugin implements `extract_metadata`.
+        """
+        if type(self).extract_metadata is not BasePlugin.extract_metadata:
+            return ("text",)
+        return ()
+
     def check_start(self, msg):
         """Called before the metadata is extracted from the message. The
         message object passed will only have raw_msg and msg available.
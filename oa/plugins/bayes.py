@@ -19,10 +19,13 @@ The results are incorporated into SpamAssassin as the BAYES_* rules.
 
 import re
 import time
+import importlib
 import math
 import hashlib
 
 import oa.plugins.base
+import oa.db.bayes
+import oa.db.bayes.cache
 from oa.regex import Regex
 
 try:
@@ -478,7 +481,16 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
         u'bayes_sql_dsn': ('str', ''),
         u'bayes_sql_username': ('str', ''),
         u'bayes_sql_password': ('str', ''),
+        u'bayes_sql_batch_size': ('int', oa.db.bayes.DEFAULT_BATCH_SIZE),
+        u'bayes_token_cache_size': (
+            'int', oa.db.bayes.cache.DEFAULT_CACHE_SIZE),
+        u'bayes_token_cache_ttl': ('int', oa.db.bayes.cache.DEFAULT_CACHE_TTL),
+        u'bayes_totals_cache_ttl': (
+            'int', oa.db.bayes.cache.DEFAULT_TOTALS_TTL),
         u'bayes_auto_expire': ('int', 0),
+        u'bayes_expiry_max_db_size': ('int', 150000),
+        u'bayes_store_module': ('str', ''),
+        u'bayes_path': ('str', '~/.spamassassin/bayes'),
         u'bayes_token_sources': ('split', 'header visible invisible uri'),
     }
 
@@ -512,11 +524,15 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
         if part.get_content_type() == 'text/plain':
             self['rendered'].append(text)
             self['visible_rendered'].append(text)
-        if part.get_content_type() == 'text/html':
-            # XXX SA parses these and checks for [in]visible content
-            pass
 
     def parsed_metadata(self, msg):
+        # The HTML parts were already split in visible and invisible
+        # text when the body was parsed.
+        if msg.html_visible_text:
+            visible = " ".join(msg.html_visible_text)
+            self['rendered'].append(visible)
+            self['visible_rendered'].append(visible)
+        self['invisible_rendered'].extend(msg.html_invisible_text)
         self.ctxt.log.debug("rendered body %s", self['rendered'])
         self.ctxt.log.debug("invisible body %s", self['invisible_rendered'])
         self['rendered'] = "\n".join(self['rendered'])
@@ -525,9 +541,24 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
         self[u'bayes_token_inviz'] = self.get_body_text_array_common(self["invisible_rendered"])
         self[u'bayes_token_uris'] = []  # self.get_uri_list()
 
+    def __getstate__(self):
+        # The store is set up again by `finish_parsing_end` when the
+        # pickled ruleset is loaded.
+        odict = self.__dict__.copy()
+        odict.pop("store", None)
+        return odict
+
     def finish_parsing_end(self, ruleset):
         super(BayesPlugin, self).finish_parsing_end(ruleset)
-        self.store = Store(self)
+        if self["bayes_store_module"]:
+            module = importlib.import_module(self["bayes_store_module"])
+            self.store = module.Store(self)
+        else:
+            self.store = Store(self)
+        if self["bayes_token_cache_size"] > 0:
+            self.store = oa.db.bayes.cache.CachedStore(
+                self.store, self["bayes_token_cache_size"],
+                self["bayes_token_cache_ttl"], self["bayes_totals_cache_ttl"])
 
     def check_end(self, ruleset, msg):
         learned = self.get_local(msg, "learned")
@@ -675,7 +706,7 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
         # a safety measure.
         if msgatime - time.time() > 86400:
             msgatime = time.time()
-        tokens = self.tokenise(msg)
+        tokens = dict(self.tokenise(msg))
         # XXX SA puts this in a timer.
         if isspam:
             self.store.nspam_nham_change(1, 0)
@@ -723,7 +754,7 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
             self.ctxt.log.debug("bayes: forget: msgid %s not learnt, ignored",
                                 msgid)
             return False
-        tokens = self.tokenise(msg)
+        tokens = dict(self.tokenise(msg))
         if isspam:
             self.store.nspam_nham_change(-1, 0)
             self.store.multi_tok_count_change(-1, 0, tokens, msg.receive_date)
@@ -1153,7 +1184,11 @@ class BayesPlugin(oa.plugins.base.BasePlugin):
         self.ctxt.log.debug("bayes: corpus size: nspam = %s, nham = %s", ns, nn)
         # XXX This has a timer in SA.
         msgtokens = dict(t for t in self.tokenise(msg))
-        tokensdata = list(d for d in self.store.tok_get_all(msgtokens) if d is not None)
+        # Only the tokens found in the database are returned.
+        tokensdata = list(self.store.tok_get_all(msgtokens))
+        if isinstance(self.store, oa.db.bayes.cache.CachedStore):
+            self.ctxt.log.debug("bayes: token cache: %s",
+                                self.store.get_stats())
         probabilities_ref = (ref for ref in self._compute_prob_for_all_tokens(tokensdata, ns, nn) if ref is not None)
         pw = {}
         for tokendata, prob in zip(tokensdata, probabilities_ref):
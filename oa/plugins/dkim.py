@@ -265,7 +265,7 @@ class DKIMPlugin(oa.plugins.base.BasePlugin):
         self.dkim_valid = 1
         self.dkim_signatures_dependable = 1
         self.dkim_has_valid_author_sig = 1
-        message = msg.raw_msg
+        message = msg.raw_bytes
 
         if not self.author_domains:
             self._get_authors(msg)
@@ -286,7 +286,7 @@ class DKIMPlugin(oa.plugins.base.BasePlugin):
             minimum_key_bits = self["dkim_minimum_key_bits"]
             if minimum_key_bits < 0:
                 minimum_key_bits = 0
-            result = dkim.verify(message.encode(), dnsfunc=self.get_txt,
+            result = dkim.verify(message, dnsfunc=self.get_txt,
                                  minkey=minimum_key_bits)
             if not result:
                 self.is_valid = 0
@@ -68,7 +68,7 @@ class Razor2Plugin(oa.plugins.base.BasePlugin):
                                    [proc, self.ctxt.log])
         try:
             my_timer.start()
-            proc.communicate(input=str.encode(msg.raw_msg))
+            proc.communicate(input=msg.raw_bytes)
         finally:
             my_timer.cancel()
 
@@ -96,7 +96,7 @@ class Razor2Plugin(oa.plugins.base.BasePlugin):
                                    [proc, self.ctxt.log])
         my_timer.start()
         try:
-            proc.communicate(input=str.encode(msg.raw_msg))
+            proc.communicate(input=msg.raw_bytes)
             return proc.returncode
         except (IOError, OSError):
             self.ctxt.log.warning("Unable to communicate to " + name)
@@ -101,5 +101,9 @@ class ShortCircuit(oa.plugins.base.BasePlugin):
                 continue
             self.ctxt.log.debug("Short-circuiting rule: %s (%s)",
                                 rule.name, stype)
+            if isinstance(rule.match, ShortCircuitRule):
+                # The ruleset was loaded from the cache or a compiled
+                # file and the rule is already short-circuited.
+                rule.match = rule.match.match_func
             new_method = self.get_wrapped_method(rule, stype)
             rule.match = new_method
@@ -2,15 +2,9 @@
 
 from __future__ import absolute_import
 
-try:
-    from urllib.parse import unquote
-    from urllib.parse import urlparse
-except ImportError:
-    from urllib import unquote
-    from urlparse import urlparse
-
 import oa.regex
 import oa.rules.uri
+import oa.rules.uri_index
 import oa.plugins.base
 import oa.html_parser
 
@@ -51,6 +45,22 @@ class URIDetailRule(oa.rules.uri.URIRule):
                     return True
         return False
 
+    def get_index_domains(self):
+        """Get the domains this rule is restricted to, if the rule
+        requires an exact domain (e.g. ``domain =~ /^example\\.com$/``).
+        """
+        for key, regex in self._pattern:
+            if key != "domain" or type(regex) is not oa.regex.MatchPattern:
+                continue
+            domain = oa.rules.uri_index.extract_exact_literal(regex._pattern)
+            if domain is not None:
+                return {domain}
+        return None
+
+    def add_to_index(self, index):
+        return index.add_detail_check(self.name, self.check_single_item,
+                                      self.get_index_domains())
+
     @staticmethod
     def get_rule_kwargs(data):
         rule_value = data["value"]
@@ -2,22 +2,9 @@
 
 from __future__ import absolute_import
 
-import ipaddress
-from builtins import str
-
-try:
-    from urllib.parse import unquote
-    from urllib.parse import urlparse
-except ImportError:
-    from urllib import unquote
-    from urlparse import urlparse
-
-
+import oa.uri_parser
 import oa.plugins.base
 import oa.html_parser
-from oa.regex import Regex
-
-HTTP_REDIR = Regex(r'(^https?:\/\/[^\/:\?]+.+?)(https?:\/{0,2}?[^\/:\?]+.*)')
 
 MAX_URI_LENGTH = 8192
 
@@ -32,19 +19,16 @@ class URIEvalPlugin(oa.plugins.base.BasePlugin):
 
     def check_for_http_redirector(self, msg, target=None):
         """Checks if the uri has been redirected.
-            -use HTTP_REDIR regex in order to extract the
-            destination domain and compare it with source
+            -use the redirect chain of the URI in order to
+            compare each destination domain with its source
             domain
         """
         for uri in msg.uri_list:
-            while HTTP_REDIR.match(uri):
-                h_redir = HTTP_REDIR.match(uri).groups()[0]
-                h_dest = HTTP_REDIR.match(uri).groups()[1]
-                uri = h_dest
-                h_redir = urlparse(h_redir).netloc
-                h_dest = urlparse(h_dest).netloc
-                if h_redir != h_dest:
+            source = msg.uris[uri]
+            for destination in source.redirects:
+                if source.netloc != destination.netloc:
                     return 1
+                source = destination
         return 0
 
     def check_https_ip_mismatch(self, msg, target=None):
@@ -56,18 +40,14 @@ class URIEvalPlugin(oa.plugins.base.BasePlugin):
         for key, uri_details in msg.uri_detail_links.items():
             a_tag = uri_details.get("a", None)
             if a_tag:
-                domain = a_tag.get("domain", None)
-                try:
-                    ipaddress.ip_address(str(domain))
-                except ValueError:
+                # The whole network location must be an IP address.
+                if not oa.uri_parser.is_ip_address(msg.uris[key].netloc):
                     return 0
                 value = a_tag.get("text", "")
                 uri_list = self.extract_url_from_text(value)
                 for uri in uri_list:
-                    domain = urlparse(uri).netloc
-                    try:
-                        ipaddress.ip_address(str(domain))
-                    except ValueError:
+                    domain = oa.uri_parser.URI(uri, redirects=False).netloc
+                    if not oa.uri_parser.is_ip_address(domain):
                         if uri.startswith("https://"):
                             return 1
         return 0
@@ -442,13 +442,12 @@ class WLBLEvalPlugin(oa.plugins.base.BasePlugin):
         """Check if the message has URIs that are listed
         in the specified hostname
         """
-        parsed_list = 'parsed_enlist_uri_host'
+        parsed_list = self['parsed_enlist_uri_host'][list_name]
+        in_list = tuple(parsed_list['in_list'])
+        not_in_list = parsed_list['not_in_list']
         for uri in msg.uri_list:
-            if uri in self[parsed_list][list_name]['not_in_list']:
-                continue
-            for _uri_list_name in self[parsed_list][list_name]['in_list']:
-                if uri.endswith(_uri_list_name):
-                    return True
+            if msg.uris[uri].is_listed(in_list, not_in_list):
+                return True
         return False
 
     def check_uri_host_in_whitelist(self, msg, target=None):
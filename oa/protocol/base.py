@@ -48,7 +48,8 @@ class BaseProtocol(object):
     def get_message(self, options):
         """Retrieve the message from the client.
 
-        The data is read in chunks and returned as a joined string.
+        The data is read in chunks and returned as joined bytes, the
+        message is only decoded if needed.
         """
         message_chunks = list()
         # If the Content-Length is available it's much easier to
@@ -67,12 +68,12 @@ class BaseProtocol(object):
                                         self.chunk_size))
             if not chunk:
                 break
-            message_chunks.append(chunk.decode("utf8"))
+            message_chunks.append(chunk)
             if content_length is not None:
                 content_length -= len(chunk)
         if options.get('compress') == "zlib":
-            return zlib.decompress("".join(message_chunks))
-        return "".join(message_chunks)
+            return zlib.decompress(b"".join(message_chunks))
+        return b"".join(message_chunks)
 
     def get_and_handle(self):
         """Get data from the client and call the handle method."""
@@ -11,6 +11,8 @@ It extracts the following metadata:
 """
 
 import re
+import collections
+
 from oa.regex import Regex
 
 LOCALHOST = Regex(r"""
@@ -357,11 +359,105 @@ ORIGINATING_IP_HEADER_RE = r"^X-ORIGINATING-IP: ({}).*"
 
 # ========================================================
 
+# ================ tokenizer regex =======================
+HOST_TOKEN_RE = Regex(r"^[^\s()\[\]=]+$")
+PORT_RE = Regex(r"^:\d+$")
+MAYBE_IP_RE = Regex(r"\d\.\d|:")
+IP_ADDRESS_ONLY_RE = Regex(r"(?:{IP_ADDRESS})\Z".format(
+    IP_ADDRESS=IP_ADDRESS.pattern), re.X | re.I)
+ENVFROM_MARKER_RE = Regex(r"return-path:?\s|envelope-(?:sender|from)[\s=]")
+ENVFROM_VALUE_RE = Regex(r"^\S*\w")
+AUTH_PROTOCOLS = frozenset((
+    "ESMTPA", "ESMTPSA", "LMTPA", "LMTPSA", "UTF8SMTPA", "UTF8SMTPSA",
+    "UTF8LMTPA", "UTF8LMTPSA", "ASMTP", "HTTP", "HTTPU",
+))
+
+# ========================================================
+
+# The relay ids that can be replaced in the cache keys, without
+# changing how the rest of the header is parsed.
+SAFE_ID_RE = Regex(r"^[\w.\-@<>]+$")
+ID_PLACEHOLDER = "OA-RECEIVED-ID"
+DEFAULT_CACHE_SIZE = 10000
+
+
+class ReceivedCache(object):
+    """A bounded LRU cache of parsed Received headers, shared by all the
+    messages checked in the same process.
+
+    The headers are keyed by their normalised text: the date is already
+    stripped by the parser and the relay id is replaced with a
+    placeholder, so the headers added by the same relay share one entry.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._records = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, key):
+        """Get the cached record, None if the header is not cached."""
+        try:
+            record = self._records.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # Move the entry to the end, it was used most recently.
+        self._records[key] = record
+        self.hits += 1
+        return record
+
+    def set(self, key, record):
+        """Add the record to the cache, evicting the least recently
+        used ones if the cache is full.
+        """
+        if self.maxsize <= 0:
+            return
+        self._records.pop(key, None)
+        self._records[key] = record
+        while len(self._records) > self.maxsize:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        """Change the size of the cache, 0 disables it."""
+        self.maxsize = maxsize
+        while len(self._records) > max(maxsize, 0):
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all the entries and reset the counters."""
+        self._records.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_stats(self):
+        """The counters used to size the cache."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / float(lookups) if lookups else 0.0,
+        }
+
+
+# Shared by all the messages parsed in this process.
+CACHE = ReceivedCache()
+
 
 class ReceivedParser(object):
-    def __init__(self, received_headers):
+    def __init__(self, received_headers, cache=CACHE):
         self.received_headers = list()
         self.received = list()
+        self.cache = cache
         for header in received_headers:
             if header.startswith('from'):
                 header = re.sub(r'\s+', ' ', header)  # removing '\n\t' chars
@@ -539,19 +635,23 @@ class ReceivedParser(object):
         private_ips = list()
         count = 0
         for item in ips:
-            clean_ip = item.strip("[ ]();\n")
-            clean_ip = clean_ip.lower().replace('ipv6:','')
-            clean_ip = clean_ip.lower().replace('::ffff:','')
+            clean_ip = ReceivedParser._clean_ip(item)
             if IP_PRIVATE.search(clean_ip):
                 count += 1
                 private_ips.append(clean_ip)
-            if not IP_PRIVATE.search(clean_ip):
+            else:
                 ip = clean_ip
                 # break
         if no_ips != 0 and count == no_ips:
             ip = private_ips[0]
         return ip
 
+    @staticmethod
+    def _clean_ip(ip):
+        """Remove the brackets and the IPv6 prefixes from the address."""
+        ip = ip.strip("[ ]();\n").lower()
+        return ip.replace('ipv6:', '').replace('::ffff:', '')
+
     @staticmethod
     def get_by(header):
         """Parsing the relay server from Received header
@@ -652,7 +752,15 @@ class ReceivedParser(object):
                 auth = AUTH_RE.match(header).groups()[0]
             except IndexError:
                 pass
-        elif AUTH_RE3.search(header):
+        else:
+            auth = ReceivedParser._get_other_auth(header)
+        return auth
+
+    @staticmethod
+    def _get_other_auth(header):
+        """The authentication methods that are not in the "with" clause."""
+        auth = ""
+        if 'Authenticated' in header and AUTH_RE3.search(header):
             auth = 'Postfix'
         elif ' by mx.google.com with ESMTPS id ' in header:
             try:
@@ -667,31 +775,237 @@ class ReceivedParser(object):
             auth = "CriticalPath"
         elif 'authenticated' in header:
             auth = "Sendmail"
-        elif AUTH_RE4.search(header):
+        elif 'mail.gmx.' in header and AUTH_RE4.search(header):
             re_auth = AUTH_RE4.search(header).groups()
             auth = "GMX (%s / %s)" % (re_auth[3], re_auth[0])
-        elif AUTH_RE5.search(header):
+        elif 'CommuniGate Pro' in header and AUTH_RE5.search(header):
             auth = "Communigate"
         return auth
 
+    @staticmethod
+    def tokenize(header):
+        """Split the header once into its clauses.
+
+        :param header: The received header without the 'from ' at the begin
+        :return: a dictionary with the tokens of the header, the "from"
+          tokens before the first "by", the "by", "id" and "for" values and
+          the "with" protocols
+        """
+        tokens = header.split(" ")
+        clauses = {"tokens": tokens, "from": tokens, "by": "", "with": [],
+                   "id": "", "for": ""}
+        by_found = False
+        for i in range(1, len(tokens) - 1):
+            token = tokens[i]
+            if token == "by":
+                if clauses["from"] is tokens:
+                    clauses["from"] = tokens[:i]
+                # The relay must be followed by something else.
+                if not by_found and tokens[i + 1] and i + 2 < len(tokens):
+                    clauses["by"] = tokens[i + 1]
+                    by_found = True
+            elif token.lower() == "with":
+                clauses["with"].append(tokens[i + 1])
+            elif token == "for" and not clauses["for"]:
+                clauses["for"] = tokens[i + 1]
+        # The id is the last "id " in the header, even inside another word.
+        position = header.rfind("id ")
+        while position != -1:
+            relay_id = header[position + 3:].split(" ", 1)[0]
+            if relay_id:
+                clauses["id"] = relay_id
+                break
+            position = header.rfind("id ", 0, position)
+        return clauses
+
+    @staticmethod
+    def _get_relay(tokens, header):
+        """Get the rdns, the helo and the ip from the "from" clause of the
+        common Postfix, Sendmail and Exim headers:
+
+        * "helo (rdns [ip]) by ..."
+        * "rdns ([ip] helo=helo) by ..."
+        * "rdns ([ip]:port helo=helo) by ..."
+
+        The ip is None if the host names might contain other addresses.
+        Returns None for any other header, these are parsed with the
+        regular expressions.
+        """
+        if len(tokens) < 4 or tokens[3] != "by":
+            return None
+        host, first, second = tokens[:3]
+        if not HOST_TOKEN_RE.match(host):
+            return None
+        lower = header.lower()
+        if (first.startswith("(") and second.startswith("[") and
+                second.endswith("])")):
+            rdns = first[1:]
+            if ("helo" in lower or "ehlo" in lower or
+                    not HOST_TOKEN_RE.match(rdns) or
+                    not IP_ADDRESS_ONLY_RE.match(second[1:-2])):
+                return None
+            address = second[1:-2]
+            if MAYBE_IP_RE.search(host + " " + rdns):
+                address = None
+            if rdns == "softdnserr":
+                rdns = ""
+            return rdns, host, address
+        if (first.startswith("([") and second.startswith("helo=") and
+                second.endswith(")")):
+            address, sep, port = first[2:].partition("]")
+            helo = second[5:-1]
+            if (not sep or (port and not PORT_RE.match(port)) or
+                    lower.count("helo") != 1 or "ehlo" in lower or
+                    not helo or "(" in helo or ")" in helo or
+                    not IP_ADDRESS_ONLY_RE.match(address)):
+                return None
+            if MAYBE_IP_RE.search(host + " " + helo):
+                address = None
+            return host, helo.strip("[ ]();\n"), address
+        return None
+
+    @staticmethod
+    def _skip_relay(header):
+        """Check for the headers to skip that can also be in the form
+        accepted by `_get_relay`.
+        """
+        if ("with local" in header.lower() or "fetchmail" in header or
+                " with BSMTP" in header or "Novell_GroupWise" in header or
+                header.startswith("Unknown/Local")):
+            return ReceivedParser.check_for_skip(header)
+        return False
+
+    @staticmethod
+    def _get_envfrom_tokens(header):
+        """Like `get_envfrom`, without the full regex scan of the header."""
+        for marker in ENVFROM_MARKER_RE.finditer(header):
+            value = header[marker.end():].split(" ", 1)[0]
+            match = ENVFROM_VALUE_RE.match(value)
+            if not match:
+                continue
+            envfrom = match.group().strip("><[]")
+            if "=" in envfrom:
+                envfrom = envfrom.rsplit("=", 1)[1]
+            return envfrom
+        return ""
+
+    @staticmethod
+    def _get_ident_tokens(tokens, header):
+        """Like `get_ident`, without the full regex scan of the header."""
+        if "ident=" in header:
+            return ReceivedParser.get_ident(header)
+        for token in reversed(tokens):
+            at = token.rfind("@")
+            if at < 2:
+                continue
+            start = token.rfind("(", 0, at - 1)
+            if start != -1:
+                return token[start + 1:at]
+        return ""
+
+    @classmethod
+    def parse_header(cls, header):
+        """Parse a single normalised header. Returns the parsed record or
+        None if the header should be skipped.
+
+        The header is tokenized once and the fields are taken from its
+        clauses. Only the relays in an uncommon form fall back to the
+        regular expressions of `parse_header_regex`.
+        """
+        if header.startswith("X-ORIGINATING-IP"):
+            return cls.parse_header_regex(header)
+        clauses = cls.tokenize(header)
+        tokens = clauses["tokens"]
+        relay = cls._get_relay(tokens, header)
+        if relay is None:
+            if cls.check_for_skip(header):
+                return None
+            rdns, helo, ip = cls.get_rdns(header), cls.get_helo(header), None
+        else:
+            if cls._skip_relay(header):
+                return None
+            rdns, helo, ip = relay
+            if "@" in rdns or "unknown" in rdns or rdns == "UnknownHost":
+                rdns = ""
+        if ip is None:
+            ip = cls.get_ip(header)
+        else:
+            # The only address in the "from" clause.
+            ip = cls._clean_ip(ip)
+        by = clauses["by"]
+        if len(tokens) > 1 and tokens[1].startswith("["):
+            by = cls.get_by(header)
+        auth = ""
+        if " by " in header:
+            for protocol in clauses["with"]:
+                if protocol.upper() in AUTH_PROTOCOLS:
+                    auth = protocol
+                    break
+        if not auth:
+            auth = cls._get_other_auth(header)
+        return {"rdns": rdns, "ip": ip, "by": by,
+                "helo": helo, "ident": cls._get_ident_tokens(tokens, header),
+                "id": clauses["id"].strip("<>"),
+                "envfrom": cls._get_envfrom_tokens(header), "auth": auth}
+
+    @classmethod
+    def parse_header_regex(cls, header):
+        """Parse a single normalised header with a regular expression
+        for every field. Returns the parsed record or None if the header
+        should be skipped.
+        """
+        if cls.check_for_skip(header):
+            return None
+        ip = cls.get_ip(header)
+        if header.startswith("X-ORIGINATING-IP"):
+            return {"rdns": "", "ip": ip, "by": "", "helo": "", "ident": "",
+                    "id": "", "envfrom": "", "auth": ""}
+        return {"rdns": cls.get_rdns(header), "ip": ip,
+                "by": cls.get_by(header), "helo": cls.get_helo(header),
+                "ident": cls.get_ident(header), "id": cls.get_id(header),
+                "envfrom": cls.get_envfrom(header),
+                "auth": cls.get_auth(header)}
+
+    @staticmethod
+    def get_cache_key(header):
+        """Replace the relay id in the header with a placeholder. Returns
+        the key and the id, or None if the header cannot be cached.
+        """
+        match = ID_RE.match(header)
+        if not match:
+            return header, None
+        relay_id = match.group(1)
+        if not SAFE_ID_RE.match(relay_id):
+            return None, None
+        key = "%s%s%s" % (header[:match.start(1)], ID_PLACEHOLDER,
+                          header[match.end(1):])
+        return key, relay_id
+
+    def _parse_cached(self, header):
+        """Parse the header, using the cache if possible."""
+        if self.cache is None or self.cache.maxsize <= 0:
+            return self.parse_header(header)
+        key, relay_id = self.get_cache_key(header)
+        if key is None:
+            return self.parse_header(header)
+        record = self.cache.get(key)
+        if record is None:
+            record = self.parse_header(key)
+            if record and any(ID_PLACEHOLDER in value
+                              for name, value in record.items()
+                              if name != "id"):
+                # The id is used for some other field as well.
+                return self.parse_header(header)
+            self.cache.set(key, record or False)
+        if not record:
+            return None
+        record = dict(record)
+        if relay_id is not None and record["id"]:
+            record["id"] = relay_id.strip("<>")
+        return record
+
     def _parse_message(self):
         for header in self.received_headers:
-            if not self.check_for_skip(header):
-                rdns = self.get_rdns(header)
-                ip = self.get_ip(header)
-                by = self.get_by(header)
-                helo = self.get_helo(header)
-                ident = self.get_ident(header)
-                id = self.get_id(header)
-                envfrom = self.get_envfrom(header)
-                auth = self.get_auth(header)
-                if header.startswith("X-ORIGINATING-IP"):
-                    self.received.append({
-                        "rdns": "", "ip": ip, "by": "",
-                        "helo": "", "ident": "", "id": "", "envfrom": "",
-                        "auth": ""})
-                else:
-                    self.received.append({
-                        "rdns": rdns, "ip": ip, "by": by, "helo": helo,
-                        "ident": ident, "id": id, "envfrom": envfrom, "auth":
-                        auth})
+            record = self._parse_cached(header)
+            if record is not None:
+                self.received.append(record)
@@ -3,10 +3,14 @@
 from builtins import object
 
 import re
+import weakref
+import threading
 import operator
+import functools
 from functools import reduce
 
 import oa.errors
+import oa.regex_backend
 
 # Map of perl flags and the corresponding re ones.
 FLAGS = {
@@ -58,10 +62,38 @@ _CONVERTS = (
 
 
 class Pattern(object):
-    """Abstract class for rule regex matching."""
+    """Abstract class for rule regex matching.
 
-    def __init__(self, pattern):
+    `_pattern` is the compiled Python regex, `_matcher` the object of the
+    regex backend that searches the text (see `oa.regex_backend`).
+    """
+
+    def __init__(self, pattern, matcher=None):
         self._pattern = pattern
+        self._matcher = pattern if matcher is None else matcher
+        # The arguments of `get_pattern` if the pattern is interned.
+        self._key = None
+
+    def __reduce_ex__(self, protocol):
+        # Interned patterns are interned again when unpickled (e.g. from
+        # the ruleset cache), so they are still shared by all the
+        # rulesets of the process.
+        if self._key is not None:
+            return get_pattern, self._key
+        return super(Pattern, self).__reduce_ex__(protocol)
+
+    def __setstate__(self, state):
+        # Patterns pickled by older versions have no matcher.
+        state.setdefault("_matcher", state["_pattern"])
+        state.setdefault("_key", None)
+        self.__dict__.update(state)
+
+    def search(self, text):
+        """Search the text, within the match-time budget if any."""
+        budget = oa.regex_backend.get_budget()
+        if budget is None:
+            return self._matcher.search(text)
+        return budget.search(self._matcher, text)
 
     def match(self, text):
         raise NotImplementedError()
@@ -71,18 +103,100 @@ class MatchPattern(Pattern):
     """This pattern does a search on the text and returns either 1 or 0."""
 
     def match(self, text):
-        return 1 if self._pattern.search(text) else 0
+        return 1 if self.search(text) else 0
 
 
 class NotMatchPattern(Pattern):
-    """This pattern does a search on the text and returns either 1 or 0."""
+    """This pattern does a search on the text and returns either 1 or 0.
+
+    If the search exceeds the match-time budget the result is 0 as well.
+    """
 
     def match(self, text):
-        return 0 if self._pattern.search(text) else 1
+        budget = oa.regex_backend.get_budget()
+        if budget is None:
+            return 0 if self._matcher.search(text) else 1
+        exceeded = len(budget.exceeded)
+        if budget.search(self._matcher, text):
+            return 0
+        # The search might have been stopped by the budget.
+        return 0 if len(budget.exceeded) > exceeded else 1
+
+
+# Interning pool of the rule patterns, keyed by the converted pattern, the
+# flags, the match operator and the regex backend. Every ruleset in the
+# process (e.g. the user rulesets in the server) shares the same compiled
+# object for the same pattern. The patterns are dropped when no ruleset
+# uses them anymore.
+_POOL = weakref.WeakValueDictionary()
+# The same patterns keyed by the Perl regex, the match operator and the
+# regex backend, so the rules can be created again (e.g. when reloading
+# the configuration) without converting the regexes.
+_PERL_POOL = weakref.WeakValueDictionary()
+
+
+def get_pattern(pattern, flags=0, match_op="=~"):
+    """Get the interned Pattern for the Python regex and match operator.
+
+    Raises re.error if the regex is invalid.
+    """
+    backend = oa.regex_backend.get_backend()
+    key = (pattern, flags, match_op, backend)
+    try:
+        return _POOL[key]
+    except KeyError:
+        pass
+    if match_op == "=~":
+        pattern_class = MatchPattern
+    elif match_op == "!~":
+        pattern_class = NotMatchPattern
+    else:
+        return None
+    compiled = re.compile(pattern, flags)
+    result = pattern_class(compiled,
+                           oa.regex_backend.get_matcher(compiled, backend))
+    result._key = (pattern, flags, match_op)
+    # Another thread might have added it in the meantime.
+    return _POOL.setdefault(key, result)
+
+
+def pattern_cache(func):
+    """Cache the result of analysing a compiled regex (e.g. extracting its
+    literals). Since the patterns are interned, the result is computed once
+    for all the rulesets in the process.
+    """
+    cache = weakref.WeakKeyDictionary()
+
+    @functools.wraps(func)
+    def wrapped_func(pattern):
+        try:
+            return cache[pattern]
+        except (KeyError, TypeError):
+            pass
+        result = func(pattern)
+        try:
+            cache[pattern] = result
+        except TypeError:
+            # Not hashable or weak referenceable
+            pass
+        return result
+    return wrapped_func
 
 
 def perl2re(pattern, match_op="=~"):
     """Convert a Perl type regex to a Python one."""
+    key = (pattern, match_op, oa.regex_backend.get_backend())
+    try:
+        return _PERL_POOL[key]
+    except KeyError:
+        pass
+    result = _perl2re(pattern, match_op)
+    if result is None:
+        return None
+    return _PERL_POOL.setdefault(key, result)
+
+
+def _perl2re(pattern, match_op="=~"):
     # We don't need to consider the pre-flags
     pattern = pattern.strip().lstrip("mgs")
     delim = pattern[0]
@@ -104,13 +218,16 @@ def perl2re(pattern, match_op="=~"):
     flags = reduce(operator.or_, (FLAGS.get(flag, 0) for flag in flags_str), 0)
 
     try:
-        if match_op == "=~":
-            return MatchPattern(re.compile(pattern, flags))
-        elif match_op == "!~": return NotMatchPattern(re.compile(pattern, flags))
+        return get_pattern(pattern, flags, match_op)
     except re.error as e:
         raise oa.errors.InvalidRegex("Invalid regex %r: %s" % (pattern, e))
 
 
+# All the Regex objects, so they can be compiled before they are used.
+_REGEXES = weakref.WeakSet()
+_COMPILE_LOCK = threading.Lock()
+
+
 class Regex(object):
     """Customised regex class to work in lazy mode"""
     compiled = None
@@ -118,13 +235,25 @@ class Regex(object):
     def __init__(self, pattern, flags=0):
         self.pattern = pattern
         self.flags = flags
+        _REGEXES.add(self)
 
     def compile(self):
-        from oa.config import LAZY_MODE
-        if LAZY_MODE:
+        compiled = self.compiled
+        if compiled is not None:
+            return compiled
+        from oa.config import LAZY_MODE, LAZY_CACHE
+        if LAZY_MODE and not LAZY_CACHE:
             return re.compile(self.pattern, self.flags)
-        elif not self.compiled:
-            self.compiled = re.compile(self.pattern, self.flags)
+        return self.compile_once()
+
+    def compile_once(self):
+        """Compile the regex if it isn't already and keep it. This is
+        safe to call from multiple threads, the regex is only compiled
+        once.
+        """
+        with _COMPILE_LOCK:
+            if self.compiled is None:
+                self.compiled = re.compile(self.pattern, self.flags)
         return self.compiled
 
     def search(self, string):
@@ -133,9 +262,6 @@ class Regex(object):
     def match(self, string):
         return self.compile().match(string)
 
-    def fullmatch(self, string):
-        return self.compile().fullmatch(string)
-
     def sub(self, repl, string, count=0):
         return self.compile().sub(repl, string, count)
 
@@ -150,3 +276,41 @@ class Regex(object):
 
     def finditer(self, string):
         return self.compile().finditer(string)
+
+
+def _get_regexes():
+    """Get a list of all the Regex objects. The set can change while
+    it's copied if other threads are creating new objects.
+    """
+    while True:
+        try:
+            return list(_REGEXES)
+        except RuntimeError:
+            continue
+
+
+def warm_up():
+    """Compile all the Regex objects that haven't been used yet, so
+    that the scans don't have to. Invalid regexes are skipped, they
+    will fail when they are used. Returns the number of compiled regexes.
+    """
+    count = 0
+    for regex in _get_regexes():
+        if regex.compiled is not None:
+            continue
+        try:
+            regex.compile_once()
+        except re.error:
+            continue
+        count += 1
+    return count
+
+
+def start_warm_up():
+    """Start compiling the Regex objects in a background thread. Returns
+    the thread.
+    """
+    thread = threading.Thread(target=warm_up, name="regex-warm-up")
+    thread.daemon = True
+    thread.start()
+    return thread
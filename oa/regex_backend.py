@@ -0,0 +1,318 @@
+"""Regex engines used to match the rule patterns and the match-time budget.
+
+The rule patterns are always compiled with Python's `re`, which is used to
+analyse them (see `oa.rules.prefilter`) and is the default engine. Other
+engines can be selected with `set_backend`. Each pattern falls back to
+`re` if the engine cannot give the same results for it.
+
+Python's `re` is a backtracking engine, so a bad pattern can take a very
+long time on some texts. `match_budget` limits the time spent on each
+search and on all the searches for a message; searches that exceed it
+count as not matched.
+"""
+
+from builtins import object
+
+import re
+import time
+import signal
+import logging
+import threading
+import contextlib
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+_clock = getattr(time, "monotonic", time.time)
+_TEXT_TYPE = type(u"")
+_NON_ASCII_RE = re.compile(u"[^\x00-\x7f]")
+
+# The categories that differ between the engines even for ASCII text
+# (e.g. Python's `\s` also matches `\x0b` and `\x1c`-`\x1f`).
+_UNSUPPORTED_CATEGORIES = frozenset((
+    sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_SPACE,
+))
+_UNSUPPORTED_FLAGS = re.VERBOSE | getattr(re, "LOCALE", 0)
+
+
+def _has_same_semantics(items, flags):
+    """Check that the parsed pattern gives the same results with RE2 as
+    with Python's `re` on ASCII text.
+    """
+    for op, av in items:
+        if op == sre_constants.CATEGORY:
+            if av in _UNSUPPORTED_CATEGORIES:
+                return False
+        elif op == sre_constants.AT:
+            # Python's `$` also matches before a trailing newline.
+            if av == sre_constants.AT_END and not flags & re.MULTILINE:
+                return False
+        elif op == sre_constants.IN:
+            if not _has_same_semantics(av, flags):
+                return False
+        elif op == sre_constants.SUBPATTERN:
+            if not _has_same_semantics(av[-1], flags):
+                return False
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                if not _has_same_semantics(branch, flags):
+                    return False
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if not _has_same_semantics(av[2], flags):
+                return False
+    return True
+
+
+def compile_re2(pattern, flags=0):
+    """Compile the Python regex with RE2. Returns None if it's not
+    supported or would give different results.
+    """
+    if re2 is None or flags & _UNSUPPORTED_FLAGS:
+        return None
+    # Python reads `{,n}` as `{0,n}` and `[[:alpha:]]` as a set of
+    # characters, RE2 as a literal and a character class.
+    if u"{," in pattern or u"[:" in pattern:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except (sre_constants.error, TypeError, ValueError, RuntimeError):
+        return None
+    if not _has_same_semantics(list(parsed), flags):
+        return None
+    inline = u"".join(
+        char for flag, char in ((re.IGNORECASE, u"i"), (re.MULTILINE, u"m"),
+                                (re.DOTALL, u"s"))
+        if flags & flag
+    )
+    if inline:
+        pattern = u"(?%s)%s" % (inline, pattern)
+    options = re2.Options()
+    options.log_errors = False
+    try:
+        return re2.compile(pattern, options)
+    except re2.error:
+        return None
+
+
+class RE2Matcher(object):
+    """Search with RE2 in ASCII texts and with Python's `re` otherwise,
+    since some classes (e.g. `\\w`) only match ASCII characters in RE2.
+    """
+
+    def __init__(self, pattern, compiled):
+        self.pattern = pattern
+        self.compiled = compiled
+
+    def __reduce__(self):
+        # The RE2 objects cannot be pickled.
+        return get_matcher, (self.pattern, "re2")
+
+    def search(self, text):
+        if type(text) is _TEXT_TYPE and not _NON_ASCII_RE.search(text):
+            return self.compiled.search(text)
+        return self.pattern.search(text)
+
+
+def _get_re2_matcher(pattern):
+    compiled = compile_re2(pattern.pattern, pattern.flags)
+    if compiled is None:
+        return pattern
+    return RE2Matcher(pattern, compiled)
+
+
+# Maps the backend names to a function that gets the matcher for a
+# compiled Python regex. The matcher must have a `search` method.
+BACKENDS = {
+    "re": lambda pattern: pattern,
+    "re2": _get_re2_matcher,
+}
+_BACKEND = "re"
+
+
+def get_backend():
+    """Get the name of the regex backend used for the rule patterns."""
+    return _BACKEND
+
+
+def set_backend(name):
+    """Set the regex backend used for the rule patterns compiled from
+    now on. Raises ValueError if the backend is unknown or unavailable.
+    """
+    global _BACKEND
+    if name not in BACKENDS:
+        raise ValueError("Unknown regex backend %r" % name)
+    if name == "re2" and re2 is None:
+        raise ValueError("The re2 regex backend requires google-re2")
+    _BACKEND = name
+
+
+def get_matcher(pattern, backend=None):
+    """Get the matcher for the compiled Python regex with the backend,
+    or the current one if not specified.
+    """
+    return BACKENDS[backend or _BACKEND](pattern)
+
+
+class _MatchTimeout(Exception):
+    """Raised from the alarm handler to interrupt a search."""
+
+
+class MatchBudget(object):
+    """Limit the time spent searching: `pattern_timeout` for a single
+    search, `message_timeout` for all the searches of a message. A value
+    of 0 means no limit.
+    """
+
+    def __init__(self, pattern_timeout=0.0, message_timeout=0.0):
+        self.pattern_timeout = pattern_timeout
+        self.message_timeout = message_timeout
+        self.deadline = None
+        if message_timeout:
+            self.deadline = _clock() + message_timeout
+        # The patterns of the searches that exceeded the budget
+        self.exceeded = []
+        self.message_exceeded = False
+        self.log = logging.getLogger("oa-logger")
+        # Set if the searches are interrupted with a SIGALRM timer, see
+        # `match_budget`.
+        self.timer = False
+        self.previous_handler = None
+        self._start = 0.0
+        self._active = False
+
+    def _is_exceeded(self, now):
+        if self.pattern_timeout and now - self._start > self.pattern_timeout:
+            return True
+        return self.deadline is not None and now > self.deadline
+
+    def _get_timeout(self, now):
+        """The time left for a search starting now."""
+        timeouts = []
+        if self.pattern_timeout:
+            timeouts.append(self.pattern_timeout)
+        if self.deadline is not None:
+            timeouts.append(self.deadline - now)
+        return max(min(timeouts), 0.001)
+
+    def interrupt(self):
+        """Interrupt the current search, called when its timer expires."""
+        if self._active:
+            self._active = False
+            raise _MatchTimeout()
+
+    def search(self, matcher, text):
+        """Search the text with the matcher. Returns None if the search
+        exceeded the budget.
+
+        With the timer, a one-shot SIGALRM is armed for the time left and
+        cleared right after the search, so nothing else (e.g. the eval
+        rules, DNS or SQL queries) is ever interrupted by it.
+        """
+        self._start = _clock()
+        if self.deadline is not None and self._start > self.deadline:
+            return self._exceeded(matcher, "message")
+        try:
+            self._active = True
+            if self.timer:
+                signal.setitimer(signal.ITIMER_REAL,
+                                 self._get_timeout(self._start))
+            try:
+                result = matcher.search(text)
+            finally:
+                if self.timer:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                self._active = False
+        except _MatchTimeout:
+            return self._exceeded(matcher, "pattern")
+        # Searches without the timer cannot be interrupted.
+        if self._is_exceeded(_clock()):
+            return self._exceeded(matcher, "pattern")
+        return result
+
+    def _exceeded(self, matcher, kind):
+        pattern = getattr(matcher, "pattern", matcher)
+        pattern = getattr(pattern, "pattern", pattern)
+        self.exceeded.append(pattern)
+        if kind == "message":
+            if self.message_exceeded:
+                self.log.debug("Skipped regex %r", pattern)
+            else:
+                self.log.warning("Message match time budget exceeded, "
+                                 "the remaining regexes are treated as "
+                                 "not matched")
+            self.message_exceeded = True
+        else:
+            self.log.warning("Regex %r exceeded the match time budget, "
+                             "treating it as not matched", pattern)
+        return None
+
+
+_LOCAL = threading.local()
+
+
+def get_budget():
+    """Get the match-time budget for the current thread, or None."""
+    return getattr(_LOCAL, "budget", None)
+
+
+def _on_alarm(signum, frame):
+    budget = get_budget()
+    if budget is not None:
+        budget.interrupt()
+
+
+def _start_timer(budget):
+    """Interrupt the searches of the budget with SIGALRM, which is only
+    possible in the main thread. The timer is not used if another timer
+    is already set (e.g. by the application that embeds OrangeAssassin),
+    the budget is then only checked after each search. Returns True if
+    the timer is used.
+    """
+    if (not hasattr(signal, "setitimer") or
+            threading.current_thread().name != "MainThread"):
+        return False
+    if signal.getitimer(signal.ITIMER_REAL)[0]:
+        return False
+    budget.previous_handler = signal.signal(signal.SIGALRM, _on_alarm)
+    budget.timer = True
+    return True
+
+
+def _stop_timer(budget):
+    """Restore the SIGALRM handler set before the budget."""
+    budget.timer = False
+    previous_handler = budget.previous_handler
+    if previous_handler is None:
+        # Set from outside Python.
+        previous_handler = signal.SIG_DFL
+    signal.signal(signal.SIGALRM, previous_handler)
+
+
+@contextlib.contextmanager
+def match_budget(pattern_timeout=0.0, message_timeout=0.0):
+    """Limit the time spent in the rule pattern searches in this block.
+    Yields the `MatchBudget` or None if there are no limits.
+    """
+    if not pattern_timeout and not message_timeout:
+        yield None
+        return
+    budget = MatchBudget(pattern_timeout, message_timeout)
+    previous_budget = get_budget()
+    _LOCAL.budget = budget
+    timer = _start_timer(budget)
+    try:
+        yield budget
+    finally:
+        if timer:
+            _stop_timer(budget)
+        _LOCAL.budget = previous_budget
@@ -23,6 +23,12 @@ _ADVANCED_SCORING = {
 class BaseRule(object):
     """Abstract class for rules."""
     _rule_type = ""
+    # Rough estimate of the time in seconds it takes to check the rule, used
+    # to decide the evaluation order of the meta rule operands.
+    cost = 1e-5
+    # The rule always returns True or False, so the operands of the meta
+    # rules using it can be reordered.
+    bool_result = False
 
     def __init__(self, name, score=None, desc=None, priority=0, tflags=None):
         self.name = name
@@ -55,6 +61,14 @@ class BaseRule(object):
         # rule is added to a ruleset.
         self.score = self._scores[0]
 
+    def copy(self):
+        """Get a copy of the rule that can be added to a ruleset. The
+        patterns and the other settings are shared with this rule.
+        """
+        rule = object.__new__(type(self))
+        rule.__dict__.update(self.__dict__)
+        return rule
+
     def preprocess(self, ruleset):
         """Adjust the score for this rule taking into consideration
         the advanced scoring, if there are 4 scores provided.
@@ -15,6 +15,8 @@ class BodyRule(oa.rules.base.BaseRule):
     """
     _rule_type = "BODY: "
     rule_type = "body"
+    cost = 2e-5
+    bool_result = True
 
     def __init__(self, name, pattern, score=None, desc=None, priority=0,
                  tflags=None):
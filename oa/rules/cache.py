@@ -0,0 +1,174 @@
+"""Cache of the parsed rulesets, to speed up the startup.
+
+The entries are keyed by a hash of the content of the configuration files
+and of the parsing options. Each entry also stores a manifest with the
+hashes of all the files it depends on: the included configuration files,
+the loaded plugins and the OrangeAssassin modules. The entry is only used
+if all of them are unchanged.
+
+The entry is a snapshot of the parser after the ruleset was post-parsed,
+so loading it skips parsing the files, creating the rules and the post
+parsing (e.g. compiling the meta rules and building the indexes). The
+`finish_parsing_end` plugin hooks still run every time the ruleset is
+loaded, since the plugins set up their resources (e.g. database
+connections) there, like for the rulesets serialized by ``compile.py``.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import glob
+import hashlib
+import logging
+import tempfile
+
+import dill as pickle
+
+import oa
+import oa.common
+import oa.regex_backend
+
+# Increase when the format of the entries changes.
+CACHE_FORMAT = 4
+# Maximum number of entries kept in the cache directory.
+MAX_ENTRIES = 10
+SUFFIX = ".ruleset"
+
+
+def hash_file(path):
+    """Get the SHA-256 of the file content, or None if it cannot be
+    read.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as hashf:
+            for chunk in iter(lambda: hashf.read(65536), b""):
+                digest.update(chunk)
+    except (OSError, IOError):
+        return None
+    return digest.hexdigest()
+
+
+def get_cache_path(cache_dir, files, **options):
+    """Get the path of the cache entry for the configuration files and
+    the parsing options.
+    """
+    digest = hashlib.sha256()
+    key = [CACHE_FORMAT, oa.__version__, sys.version,
+           oa.regex_backend.get_backend(), sorted(options.items())]
+    for path in files:
+        key.append((path, hash_file(path)))
+    digest.update(repr(key).encode("utf-8"))
+    return os.path.join(os.path.expanduser(cache_dir),
+                        digest.hexdigest() + SUFFIX)
+
+
+def _get_module_files(modules):
+    files = set()
+    for module in modules:
+        path = getattr(module, "__file__", None)
+        if not path:
+            continue
+        if path.endswith((".pyc", ".pyo")):
+            path = path[:-1]
+        files.add(path)
+    return files
+
+
+def get_manifest(parser):
+    """Get the hashes of all the files the parsed ruleset depends on."""
+    manifest = dict(parser.file_hashes)
+    modules = [module for name, module in list(sys.modules.items())
+               if name == "oa" or name.startswith("oa.")]
+    modules.extend(sys.modules.get(type(plugin).__module__)
+                   for plugin in parser.ctxt.plugins.values())
+    for path in _get_module_files(modules):
+        manifest[path] = hash_file(path)
+    return manifest
+
+
+def is_valid(manifest):
+    """Check that none of the files in the manifest changed."""
+    for path, expected in manifest.items():
+        if hash_file(path) != expected:
+            return False
+    return True
+
+
+def load(path):
+    """Load the parser snapshot from the cache entry. Returns None if there
+    is no entry or it's outdated.
+    """
+    log = logging.getLogger("oa-logger")
+    try:
+        with open(path, "rb") as cachef:
+            manifest = pickle.load(cachef)
+            if not is_valid(manifest):
+                log.debug("Ruleset cache %s is outdated", path)
+                return None
+            snapshot = pickle.load(cachef)
+    except (OSError, IOError):
+        return None
+    except Exception as e:
+        log.warning("Cannot load the ruleset cache %s: %s", path, e)
+        return None
+    try:
+        # Mark the entry as recently used, so it's not pruned.
+        os.utime(path, None)
+    except OSError:
+        pass
+    return snapshot
+
+
+def store(path, parser):
+    """Store a snapshot of the parser in the cache entry. The entry is
+    written to a temporary file first and then renamed, so other processes
+    never see a partial entry.
+    """
+    log = logging.getLogger("oa-logger")
+    cache_dir = os.path.dirname(path)
+    tmp_path = None
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        manifest = get_manifest(parser)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp",
+                                         delete=False) as tmpf:
+            tmp_path = tmpf.name
+            pickle.dump(manifest, tmpf, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(parser.get_snapshot(), tmpf,
+                        pickle.HIGHEST_PROTOCOL)
+        getattr(os, "replace", os.rename)(tmp_path, path)
+    except Exception as e:
+        log.warning("Cannot store the ruleset cache %s: %s", path, e)
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return False
+    log.debug("Stored the ruleset cache %s", path)
+    prune(cache_dir)
+    return True
+
+
+def prune(cache_dir, max_entries=MAX_ENTRIES):
+    """Remove the oldest entries from the cache directory."""
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, "*" + SUFFIX)):
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    entries.sort(reverse=True)
+    for dummy, path in entries[max_entries:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def is_available():
+    """Check if the rulesets can be pickled in this environment."""
+    return oa.common.can_compile()
@@ -24,6 +24,12 @@ class EvalMethod(object):
         return self.method(*((msg,) + self.eval_args), target=self.target)
 
 
+# Eval rules can do anything so they are considered more expensive, and
+# network tests (e.g. DNS lookups) even more so.
+EVAL_COST = 1e-4
+NET_EVAL_COST = 1e-2
+
+
 class EvalRule(oa.rules.base.BaseRule):
     """Evaluates a registered eval function."""
 
@@ -49,6 +55,10 @@ class EvalRule(oa.rules.base.BaseRule):
 
         self.target = target
         self.eval_rule = None
+        if tflags and "net" in tflags:
+            self.cost = NET_EVAL_COST
+        else:
+            self.cost = EVAL_COST
 
     def preprocess(self, ruleset):
         """Get the eval rule from the global context and create a partial method
@@ -7,6 +7,8 @@ import oa.rules.base
 class FullRule(oa.rules.base.BaseRule):
     """Match a regular expression against the full raw message."""
     rule_type = 'full'
+    cost = 5e-5
+    bool_result = True
 
     def __init__(self, name, pattern, score=None, desc=None, priority=0,
                  tflags=None):
@@ -9,6 +9,8 @@ class MimeHeaderRule(oa.rules.base.BaseRule):
     """Abstract class for all MIME header rules."""
     _rule_type = "BODY: "
     rule_type = 'header'
+    cost = 5e-6
+    bool_result = True
 
     def match(self, msg):
         raise NotImplementedError()
@@ -73,6 +75,8 @@ class HeaderRule(oa.rules.base.BaseRule):
     """Abstract base class for all header rules."""
 
     rule_type = 'header'
+    cost = 5e-6
+    bool_result = True
 
     def match(self, msg):
         raise NotImplementedError()
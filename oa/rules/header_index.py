@@ -0,0 +1,74 @@
+"""Index the header rules by the header they check.
+
+Many rules check the same headers (e.g. Subject, From, Received). The rules
+are grouped by header name and modifier, so that the values of the header
+are fetched once per message and all the patterns for it are checked
+together.
+"""
+
+from builtins import dict
+from builtins import object
+
+import oa.rules.header
+
+# Maps the header rule classes to the Message method that gets
+# the values they check.
+GETTERS = {
+    oa.rules.header._PatternHeaderRule: "get_decoded_header",
+    oa.rules.header._PatternRawHeaderRule: "get_raw_header",
+    oa.rules.header._PatternAddrHeaderRule: "get_addr_header",
+    oa.rules.header._PatternNameHeaderRule: "get_name_header",
+    oa.rules.header._PatternMimeHeaderRule: "get_decoded_mime_header",
+    oa.rules.header._PatternMimeRawHeaderRule: "get_raw_mime_header",
+}
+
+
+class HeaderIndex(object):
+    """Groups the header rules by (getter, header name)."""
+
+    def __init__(self):
+        # Maps the (getter, header name) to a list of (rule name, pattern)
+        self.groups = dict()
+        # Maps the rule names to their group
+        self.rules = dict()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __contains__(self, name):
+        return name in self.rules
+
+    def add_rule(self, rule):
+        """Add the rule to the index if it's supported. Returns True if
+        the rule was added.
+
+        Only the exact classes are handled and only if the match method
+        hasn't been replaced (e.g. by the ShortCircuit plugin), otherwise
+        the results might differ.
+        """
+        try:
+            getter = GETTERS[type(rule)]
+        except KeyError:
+            return False
+        if "match" in vars(rule):
+            return False
+        key = (getter, rule._header_name)
+        self.groups.setdefault(key, []).append((rule.name, rule._pattern))
+        self.rules[rule.name] = key
+        return True
+
+    def match_group(self, name, msg):
+        """Check all the rules from the same group as the rule with this
+        name. Returns a dictionary mapping the rule names to their results.
+        """
+        getter, header_name = key = self.rules[name]
+        values = getattr(msg, getter)(header_name)
+        results = dict()
+        for rule_name, pattern in self.groups[key]:
+            result = False
+            for value in values:
+                if pattern.match(value):
+                    result = True
+                    break
+            results[rule_name] = result
+        return results
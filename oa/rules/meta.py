@@ -1,8 +1,15 @@
 """Rules that are boolean or arithmetic combinations of other rules."""
 
 from builtins import dict
+from builtins import list
+from builtins import range
+from builtins import object
 
 import re
+import ast
+import timeit
+import weakref
+import functools
 
 import oa.errors
 import oa.rules.base
@@ -20,6 +27,263 @@ MAX_RECURSION = 10
 
 _SUBRULE_P = Regex(r"([_a-zA-Z]\w*)(?=\W|$)")
 
+# Reorder the operands of `&&` and `||` according to the recorded
+# statistics after this many evaluations.
+REORDER_INTERVAL = 64
+
+
+class _BoolOperation(object):
+    """A `&&` or `||` operation of a meta rule.
+
+    The operands are evaluated in order of their expected cost, so that the
+    result is decided with the cheapest operands and the expensive ones
+    (e.g. eval and DNS rules) are skipped when possible. Operands whose rules
+    have already been evaluated for the message are free and are always
+    checked first.
+
+    The value is always the same as with the original order: the first
+    operand that decides the result or the last one. If the operand that
+    decided the result is True or False, and so are all the operands before
+    it that were not evaluated (see `BaseRule.bool_result`), it's the value
+    of the operation. Otherwise the skipped operands before it are evaluated
+    in the original order, since e.g. `||` gives the first true operand,
+    which might be a count or the description of an eval rule.
+    """
+
+    def __init__(self, is_and, operands, names, costs, bool_operands=None):
+        self.is_and = is_and
+        self.operands = operands
+        # Whether the value of each operand is always True or False
+        if bool_operands is None:
+            bool_operands = [True] * len(operands)
+        self.bool_operands = list(bool_operands)
+        self.all_bool = all(self.bool_operands)
+        # The rule names referenced by each operand
+        self.names = names
+        # The expected cost of evaluating each operand, this starts with the
+        # static estimate and is adjusted with the recorded durations.
+        self.costs = list(costs)
+        self.calls = [0] * len(operands)
+        self.hits = [0] * len(operands)
+        self.order = list(range(len(operands)))
+        self._evaluations = 0
+
+    def _is_decided(self, value):
+        if self.is_and:
+            return not value
+        return bool(value)
+
+    def _is_available(self, index, msg):
+        """Check if the result of this operand is already known."""
+        results = msg.rule_results
+        skipped = msg.prefilter_skipped
+        for name in self.names[index]:
+            if name not in results and name not in skipped:
+                return False
+        return True
+
+    def _record(self, index, value, elapsed=None):
+        self.hits[index] += bool(value)
+        if elapsed is not None:
+            if self.calls[index]:
+                self.costs[index] = 0.8 * self.costs[index] + 0.2 * elapsed
+            else:
+                self.costs[index] = elapsed
+        self.calls[index] += 1
+
+    def _expected_cost(self, index):
+        """The expected cost of evaluating this operand until the result
+        is decided.
+        """
+        hit_ratio = (self.hits[index] + 1.0) / (self.calls[index] + 2.0)
+        if self.is_and:
+            return self.costs[index] / (1.0 - hit_ratio)
+        return self.costs[index] / hit_ratio
+
+    def reorder(self):
+        """Sort the operands by their expected cost."""
+        self.order = sorted(range(len(self.operands)),
+                            key=self._expected_cost)
+
+    def _resolve(self, msg, values, index, value):
+        """Get the value of the operation with the original order, the
+        operand at this index decided the result with this value. `values`
+        has the values of the other operands evaluated so far, which
+        didn't decide the result.
+        """
+        if self.all_bool:
+            return value
+        skipped = [i for i in range(index) if i not in values]
+        if isinstance(value, bool) and all(self.bool_operands[i]
+                                           for i in skipped):
+            return value
+        for i in skipped:
+            skipped_value = self.operands[i](msg)
+            self._record(i, skipped_value)
+            if self._is_decided(skipped_value):
+                return skipped_value
+        return value
+
+    def __call__(self, msg):
+        self._evaluations += 1
+        if self._evaluations % REORDER_INTERVAL == 0:
+            self.reorder()
+        values = dict()
+        pending = list()
+        for index in self.order:
+            if not self._is_available(index, msg):
+                pending.append(index)
+                continue
+            value = self.operands[index](msg)
+            self._record(index, value)
+            if self._is_decided(value):
+                return self._resolve(msg, values, index, value)
+            values[index] = value
+        for index in pending:
+            start = timeit.default_timer()
+            value = self.operands[index](msg)
+            self._record(index, value, timeit.default_timer() - start)
+            if self._is_decided(value):
+                return self._resolve(msg, values, index, value)
+            values[index] = value
+        return values[len(self.operands) - 1]
+
+
+class _MetaCompiler(ast.NodeTransformer):
+    """Replace all the `and`/`or` operations in the meta rule expression with
+    calls to _BoolOperation objects.
+
+    The operations are only described in `operations`, with the name of the
+    object, the type of operation, the compiled operands, the rule names
+    referenced by each operand and what the value of each operand is (see
+    `_get_kind`). The objects are created for each rule, see
+    `_CompiledMeta.bind`.
+    """
+
+    def __init__(self, subrules):
+        self.subrules = subrules
+        self.operations = []
+        self.operation_names = set()
+        # What the value of the whole expression is.
+        self.result_kind = None
+
+    def _get_names(self, node):
+        names = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id in self.subrules:
+                names.add(child.id)
+        return tuple(sorted(names))
+
+    def _get_kind(self, node):
+        """Describe the value of this operand: "bool" if it's always True
+        or False, ("rule", name) for the result of a rule, ("operation",
+        name) for the value of another `and`/`or` operation and None if
+        it's unknown.
+        """
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return "bool"
+        if isinstance(node, ast.Compare):
+            return "bool"
+        if (isinstance(node, ast.Call) and
+                isinstance(node.func, ast.Name)):
+            if node.func.id in self.operation_names:
+                return "operation", node.func.id
+            if node.func.id in self.subrules:
+                return "rule", node.func.id
+        return None
+
+    def _compile_operand(self, node):
+        template = ast.parse("lambda msg: None", mode="eval")
+        template.body.body = node
+        ast.fix_missing_locations(template)
+        return compile(template, "<meta>", "eval")
+
+    def visit_Lambda(self, node):
+        self.generic_visit(node)
+        self.result_kind = self._get_kind(node.body)
+        return node
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        operation_name = "_operation_%d" % len(self.operations)
+        self.operations.append((
+            operation_name,
+            isinstance(node.op, ast.And),
+            [self._compile_operand(value) for value in node.values],
+            [self._get_names(value) for value in node.values],
+            [self._get_kind(value) for value in node.values],
+        ))
+        self.operation_names.add(operation_name)
+        call = ast.Call(func=ast.Name(id=operation_name, ctx=ast.Load()),
+                        args=[ast.Name(id="msg", ctx=ast.Load())],
+                        keywords=[])
+        return ast.copy_location(call, node)
+
+
+class _CompiledMeta(object):
+    """The compiled expression of a meta rule, shared by all the meta rules
+    with the same expression (e.g. in the rulesets of the different users,
+    or after reloading the configuration).
+    """
+
+    def __init__(self, rule_match, subrules):
+        tree = ast.parse(rule_match, "<meta>")
+        compiler = _MetaCompiler(subrules)
+        tree = compiler.visit(tree)
+        ast.fix_missing_locations(tree)
+        self.code = compile(tree, "<meta>", "exec")
+        self.operations = compiler.operations
+        self.result_kind = compiler.result_kind
+
+    @staticmethod
+    def _is_bool(kind, ruleset, bool_operations):
+        if kind == "bool":
+            return True
+        if kind is None:
+            return False
+        kind, name = kind
+        if kind == "operation":
+            return bool_operations[name]
+        return bool(ruleset.get_rule(name).bool_result)
+
+    def bind(self, location, ruleset):
+        """Create the match function in the location, with the costs of
+        the subrules from the ruleset.
+
+        Returns True if the result of the expression is always True or
+        False.
+        """
+        bool_operations = dict()
+        # The nested operations come first.
+        for name, is_and, operands, names, kinds in self.operations:
+            costs = [sum(ruleset.get_rule(subrule_name).cost
+                         for subrule_name in operand_names)
+                     for operand_names in names]
+            bool_operands = [self._is_bool(kind, ruleset, bool_operations)
+                             for kind in kinds]
+            bool_operations[name] = all(bool_operands)
+            location[name] = _BoolOperation(
+                is_and, [eval(operand, location) for operand in operands],
+                names, costs, bool_operands
+            )
+        exec(self.code, location)
+        return self._is_bool(self.result_kind, ruleset, bool_operations)
+
+
+# Interning pool of the compiled meta expressions, keyed by the converted
+# expression.
+_POOL = weakref.WeakValueDictionary()
+
+
+def get_compiled(rule_match, subrules):
+    """Get the compiled meta expression from the pool, or compile it."""
+    try:
+        return _POOL[rule_match]
+    except KeyError:
+        pass
+    compiled = _CompiledMeta(rule_match, subrules)
+    return _POOL.setdefault(rule_match, compiled)
+
 
 class MetaRule(oa.rules.base.BaseRule):
     """These rules are boolean or arithmetic combinations of other rules."""
@@ -31,7 +295,15 @@ class MetaRule(oa.rules.base.BaseRule):
         super(MetaRule, self).__init__(name, score=score, desc=desc,
                                        priority=priority, tflags=tflags)
         self.rule = rule
+        self.subrules = frozenset()
         self._location = {}
+        self._compiled = None
+
+    def copy(self):
+        """Get a copy of the rule that is bound to its own ruleset."""
+        rule = super(MetaRule, self).copy()
+        rule._location = {}
+        return rule
 
     def postparsing(self, ruleset, _depth=0):
         """Get the referenced sub-rules of this meta-rule and add execute the
@@ -52,7 +324,11 @@ class MetaRule(oa.rules.base.BaseRule):
         rule_match = "match = lambda msg: %s" % rule
         # XXX we should check for potentially unsafe code or run it in
         # XXX RestrictedPython.
-        _code_obj = compile(rule_match, "<meta>", "exec")
+        try:
+            compiled = get_compiled(rule_match, subrules)
+        except SyntaxError as e:
+            raise oa.errors.InvalidRule(self.name, "Invalid expression: %s" %
+                                        e)
 
         oa.rules.base.BaseRule.postparsing(self, ruleset)
         for subrule_name in subrules:
@@ -66,8 +342,16 @@ class MetaRule(oa.rules.base.BaseRule):
                 raise oa.errors.InvalidRule(self.name, "Undefined subrule "
                                                         "referenced %r" %
                                             subrule_name)
-            self._location[subrule_name] = subrule.match
-        exec(_code_obj, self._location)
+            # Get the result through the ruleset so it's only
+            # evaluated once per message.
+            self._location[subrule_name] = functools.partial(
+                ruleset.match_rule, subrule_name)
+        self.subrules = frozenset(subrules)
+        self.cost = sum(ruleset.get_rule(subrule_name).cost
+                        for subrule_name in subrules)
+        # Keep the compiled expression in the pool while it's used.
+        self._compiled = compiled
+        self.bool_result = compiled.bind(self._location, ruleset)
         assert "match" in self._location
 
     def match(self, msg):
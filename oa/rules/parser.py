@@ -19,6 +19,7 @@ import warnings
 import contextlib
 import collections
 import locale
+import hashlib
 
 import oa.config
 import oa.errors
@@ -29,6 +30,7 @@ import oa.rules.body
 import oa.rules.meta
 import oa.rules.full
 import oa.rules.eval_
+import oa.rules.cache
 import oa.rules.header
 import oa.rules.ruleset
 
@@ -105,7 +107,32 @@ class PADParser(object):
         # XXX This could be a default OrderedDict
         self.results = collections.OrderedDict()
         self.ruleset = oa.rules.ruleset.RuleSet(self.ctxt)
+        # The configuration files passed to `parse_file`, in order
+        self.files = []
+        # Maps the paths of the parsed files to the SHA-256 of their
+        # content (None if the file doesn't exist), their modification
+        # time and the entries read from them. These are used to
+        # reload the configuration incrementally, see `reload`.
+        self.file_hashes = collections.OrderedDict()
+        self.file_mtimes = dict()
+        self.file_entries = dict()
+        # Maps the rule names to their rule class, their parsed results
+        # and the rule created from them before it's added to the
+        # ruleset. A reloaded parser copies these rules if their results
+        # didn't change instead of creating them again.
+        self.rule_templates = dict()
+        # Store a snapshot in this ruleset cache entry once the ruleset
+        # is post-parsed, see `oa.rules.cache`.
+        self.cache_path = None
+        self._rules_added = False
+        # The ruleset loaded from the cache is already post-parsed.
+        self._post_parsed = False
         self._ignore = False
+        # The entries read from the file currently parsed
+        self._entries = None
+        # Only record the entries, without loading plugins, setting
+        # options or following includes.
+        self._record_only = False
 
     @contextlib.contextmanager
     def _paranoid(self, *exceptions):
@@ -121,18 +148,61 @@ class PADParser(object):
         """Parses a single PAD ruleset file."""
         if _depth > MAX_RECURSION:
             raise oa.errors.MaxRecursionDepthExceeded()
+        if not _depth:
+            self.files.append(filename)
         self.ctxt.log.debug("Parsing file: %s", filename)
         if not os.path.isfile(filename):
             self.ctxt.log.warn("Ignoring %s, not a file", filename)
+            self.file_hashes[filename] = None
+            self.file_mtimes[filename] = None
+            self.file_entries[filename] = []
             return
-        with open(filename, "rb") as rulef:
-            for line_no, line in enumerate(rulef):
-                try:
-                    with self._paranoid(oa.errors.InvalidSyntax):
-                        self._handle_line(filename, line, line_no + 1, _depth)
-                except oa.errors.PluginLoadError as e:
-                    warnings.warn(str(e))
-                    self.ctxt.log.warn("%s", e)
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            mtime = None
+        digest = hashlib.sha256()
+        entries = []
+        previous_entries, self._entries = self._entries, entries
+        try:
+            with open(filename, "rb") as rulef:
+                for line_no, line in enumerate(rulef):
+                    digest.update(line)
+                    try:
+                        with self._paranoid(oa.errors.InvalidSyntax):
+                            self._handle_line(filename, line, line_no + 1,
+                                              _depth)
+                    except oa.errors.PluginLoadError as e:
+                        warnings.warn(str(e))
+                        self.ctxt.log.warn("%s", e)
+        finally:
+            self._entries = previous_entries
+        self.file_hashes[filename] = digest.hexdigest()
+        self.file_mtimes[filename] = mtime
+        self.file_entries[filename] = entries
+
+    def _record(self, *entry):
+        """Record an entry read from the current file."""
+        if self._entries is not None:
+            self._entries.append(entry)
+
+    def _set_result(self, name, key, value):
+        """Set an option for the rule in the parsed results."""
+        self._record("rule", name, key, value)
+        if self._record_only:
+            return
+        if name not in self.results:
+            self.results[name] = dict()
+        self.results[name][key] = value
+
+    def _parse_config(self, rtype, value):
+        """Pass the configuration line to the plugins. Returns False if
+        it's unknown.
+        """
+        self._record("config", rtype, value)
+        if self._record_only:
+            return True
+        return self.ctxt.hook_parse_config(rtype, value)
 
     def _handle_line(self, filename, line, line_no, _depth=0):
         """Handles a single line."""
@@ -148,10 +218,12 @@ class PADParser(object):
         #     return
 
         if line.startswith("endif"):
+            self._record("condition", line)
             self._ignore = False
             return
 
         if line.startswith("else"):
+            self._record("condition", line)
             if self._ignore:
                 self._ignore = False
             else:
@@ -182,9 +254,12 @@ class PADParser(object):
             self._handle_include(value, line, line_no, _depth,
                                  dirname=dirname)
         elif rtype == "ifplugin":
+            self._record("condition", line)
             self._handle_ifplugin(value)
         elif rtype == "loadplugin":
-            self._handle_loadplugin(value)
+            self._record("loadplugin", value)
+            if not self._record_only:
+                self._handle_loadplugin(value)
         elif rtype in KNOWN_2_RTYPE or rtype in self.ctxt.cmds:
             try:
                 rtype, name, value = line.split(None, 2)
@@ -209,7 +284,7 @@ class PADParser(object):
                         raise oa.errors.InvalidSyntax(filename, line_no, line,
                                                       "Missing argument")
 
-                    if not self.ctxt.hook_parse_config(rtype, value):
+                    if not self._parse_config(rtype, value):
                         self.ctxt.err("%s:%s Ignoring unknown"
                                       "configuration line: %s",
                                       filename, line_no, line)
@@ -221,16 +296,13 @@ class PADParser(object):
                     raise oa.errors.InvalidSyntax(filename, line_no, line,
                                                   "Missing argument")
 
-            if name not in self.results:
-                self.results[name] = dict()
-
             if rtype in RULES or rtype in self.ctxt.cmds:
                 if value.startswith("eval:"):
                     # This is for compatibility with SA ruleset
-                    self.results[name]["target"] = rtype
+                    self._set_result(name, "target", rtype)
                     rtype = "eval"
-                self.results[name]["type"] = rtype
-                self.results[name]["value"] = value
+                self._set_result(name, "type", rtype)
+                self._set_result(name, "value", value)
             else:
                 if rtype == 'priority':
                     try:
@@ -240,10 +312,10 @@ class PADParser(object):
                                       "in configuration line: %s, setting it "
                                       "by"
                                       " default to 0", filename, line_no, line)
-                self.results[name][rtype] = value
+                self._set_result(name, rtype, value)
 
         else:
-            if not self.ctxt.hook_parse_config(rtype, value):
+            if not self._parse_config(rtype, value):
                 self.ctxt.err("%s:%s Ignoring unknown configuration line: %s",
                               filename, line_no, line)
 
@@ -253,6 +325,9 @@ class PADParser(object):
         filename = value.strip()
         if not os.path.isabs(filename) and dirname is not None:
             filename = os.path.join(dirname, filename)
+        self._record("include", filename)
+        if self._record_only:
+            return
         try:
             self.parse_file(filename, _depth=_depth + 1)
         except oa.errors.MaxRecursionDepthExceeded as e:
@@ -285,7 +360,29 @@ class PADParser(object):
 
     def get_ruleset(self):
         """Create and return the corresponding ruleset for the parsed files."""
+        store = False
+        if not self._rules_added:
+            self._add_rules()
+            store = self.cache_path is not None
+        # The plugins set up their resources (e.g. database connections)
+        # here, so this also runs for the ruleset loaded from the cache.
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.ctxt.log.info("%s rules loaded", len(self.ruleset.checked))
+        if not self._post_parsed:
+            self.ruleset.post_parsing()
+        if store:
+            oa.rules.cache.store(self.cache_path, self)
+        return self.ruleset
+
+    def _add_rules(self):
+        """Create the rules from the parsed results. Every rule added to
+        the ruleset is a copy of the rule in `rule_templates`, so that
+        the rules that didn't change can be reused by `reload`.
+        """
+        self._rules_added = True
         self.ctxt.hook_parsing_start(self.results)
+        previous_templates, self.rule_templates = self.rule_templates, dict()
+        reused = 0
         for name, data in self.results.items():
             try:
                 rule_type = data["type"]
@@ -303,19 +400,143 @@ class PADParser(object):
                         # A plugin might have been loaded that
                         # can handle this.
                         rule_class = self.ctxt.cmds[rule_type]
-                    self.ctxt.log.debug("Adding rule %s with: %s", name, data)
-                    rule = rule_class.get_rule(name, data)
-                    self.ruleset.add_rule(rule)
-        self.ctxt.hook_parsing_end(self.ruleset)
-        self.ctxt.log.info("%s rules loaded", len(self.ruleset.checked))
-        self.ruleset.post_parsing()
-        return self.ruleset
+                    template = previous_templates.get(name)
+                    if template is not None and template[:2] == (rule_class,
+                                                                 data):
+                        rule = template[2]
+                        reused += 1
+                    else:
+                        self.ctxt.log.debug("Adding rule %s with: %s", name,
+                                            data)
+                        rule = rule_class.get_rule(name, data)
+                    self.rule_templates[name] = (rule_class, data, rule)
+                    self.ruleset.add_rule(rule.copy())
+        if reused:
+            self.ctxt.log.debug("Reused %s unchanged rules", reused)
+
+    def get_snapshot(self):
+        """Get the snapshot of the parser stored in the ruleset cache."""
+        return (self.results, self.ruleset, self.files, self.file_hashes,
+                self.file_entries)
+
+    def load_snapshot(self, snapshot):
+        """Use the snapshot from the ruleset cache instead of parsing the
+        files, creating the rules and post-parsing the ruleset.
+        """
+        (self.results, self.ruleset, self.files, self.file_hashes,
+         self.file_entries) = snapshot
+        self.ctxt = self.ruleset.ctxt
+        # The modification times are not known, so the files are
+        # hashed again on the first reload.
+        self.file_mtimes = dict()
+        self.rule_templates = dict()
+        self._rules_added = True
+        self._post_parsed = True
+
+    def get_changed_files(self):
+        """Get the parsed files that changed since they were parsed.
+        Files are only hashed again if their modification time changed.
+        """
+        changed = []
+        for filename, digest in self.file_hashes.items():
+            try:
+                mtime = os.path.getmtime(filename)
+            except OSError:
+                mtime = None
+            if (filename in self.file_mtimes and
+                    mtime == self.file_mtimes[filename]):
+                continue
+            if oa.rules.cache.hash_file(filename) != digest:
+                changed.append(filename)
+            else:
+                self.file_mtimes[filename] = mtime
+        return changed
+
+    def reload(self, files):
+        """Get a new parser for the configuration files, reading only the
+        files that changed since they were parsed. The entries of the
+        other files are replayed from what was recorded when parsing
+        them, so the new parser creates a new ruleset without affecting
+        this one.
+
+        The rules are only created again if their definition changed,
+        the others are copied from this parser. The meta rules are
+        always bound again to the new ruleset, so they use the new
+        definitions of their subrules.
+
+        Returns this parser if nothing changed, or None if the changes
+        require parsing everything again: a different list of files or
+        changes to anything else than the rule definitions (e.g. options,
+        plugins or includes) in the changed files.
+        """
+        if list(files) != self.files:
+            return None
+        changed = self.get_changed_files()
+        if not changed:
+            return self
+
+        # Read the changed files with this context, so that the
+        # conditions and plugin rule types are evaluated the same way.
+        reader = PADParser(paranoid=self.ctxt.paranoid,
+                           ignore_unknown=self.ctxt.ignore_unknown,
+                           lazy_mode=self.ctxt.lazy_mode)
+        reader.ctxt = self.ctxt
+        reader._record_only = True
+        for filename in changed:
+            reader.parse_file(filename, _depth=1)
+            old_options = [entry for entry in self.file_entries[filename]
+                           if entry[0] != "rule"]
+            new_options = [entry for entry in reader.file_entries[filename]
+                           if entry[0] != "rule"]
+            if old_options != new_options:
+                self.ctxt.log.info("Configuration options changed in %s",
+                                   filename)
+                return None
+
+        parser = PADParser(paranoid=self.ctxt.paranoid,
+                           ignore_unknown=self.ctxt.ignore_unknown,
+                           lazy_mode=self.ctxt.lazy_mode)
+        parser.files = list(self.files)
+        for name in ("file_hashes", "file_mtimes", "file_entries"):
+            values = getattr(self, name).copy()
+            values.update(getattr(reader, name))
+            setattr(parser, name, values)
+        for filename in parser.files:
+            parser._replay(filename)
+        parser.rule_templates = self.rule_templates
+        self.ctxt.log.info("Reloaded %s changed files: %s", len(changed),
+                           ", ".join(changed))
+        return parser
+
+    def _replay(self, filename, _depth=0):
+        """Replay the entries recorded for the file, as if the file
+        was parsed again.
+        """
+        if _depth > MAX_RECURSION:
+            raise oa.errors.MaxRecursionDepthExceeded()
+        for entry in self.file_entries.get(filename, ()):
+            kind = entry[0]
+            if kind == "rule":
+                self._set_result(*entry[1:])
+            elif kind == "include":
+                self._replay(entry[1], _depth + 1)
+            elif kind == "config":
+                self.ctxt.hook_parse_config(*entry[1:])
+            elif kind == "loadplugin":
+                try:
+                    self._handle_loadplugin(entry[1])
+                except oa.errors.PluginLoadError as e:
+                    self.ctxt.log.warn("%s", e)
 
 
-def parse_pad_rules(files, paranoid=False, ignore_unknown=True):
+def parse_pad_rules(files, paranoid=False, ignore_unknown=True,
+                    cache_dir=None):
     """Parse a list of PAD rules and returns the corresponding ruleset.
 
     'files' - a list of file paths.
+    'cache_dir' - if set, load the ruleset from the cache in this
+    directory if the files didn't change, otherwise store it there when
+    `get_ruleset` is called. See `oa.rules.cache`.
 
     Returns a dictionary that maps rule names to a dictionary of rule options.
     Every rule will contain "type" and "value" which corresponds to the
@@ -326,6 +547,16 @@ def parse_pad_rules(files, paranoid=False, ignore_unknown=True):
     Other options may be included such as "score", "describe".
     """
     parser = PADParser(paranoid=paranoid, ignore_unknown=ignore_unknown)
+    if cache_dir is not None and oa.rules.cache.is_available():
+        cache_path = oa.rules.cache.get_cache_path(
+            cache_dir, files, paranoid=paranoid, ignore_unknown=ignore_unknown
+        )
+        snapshot = oa.rules.cache.load(cache_path)
+        if snapshot is not None:
+            parser.ctxt.log.info("Loaded the ruleset from %s", cache_path)
+            parser.load_snapshot(snapshot)
+            return parser
+        parser.cache_path = cache_path
     for filename in files:
         parser.parse_file(filename)
 
@@ -0,0 +1,294 @@
+"""Literal prefilter for rules that search the message text.
+
+For every converted regex we extract a set of literal substrings where at
+least one *must* be present in the text for the regex to match. Each text
+is then scanned once for all the literals of all the rules, and the real
+regex is only run for the rules that had one of their literals found.
+
+Rules that have no usable literal are not handled by the prefilter and are
+always matched normally.
+"""
+
+from builtins import chr
+from builtins import dict
+from builtins import object
+
+import re
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+import oa.regex
+import oa.rules.body
+import oa.rules.full
+
+# Literals shorter than this will match nearly every message, so they
+# don't help in filtering out rules.
+MIN_LITERAL_LENGTH = 3
+
+# Maps the rules that can be prefiltered to the message attribute they
+# search in.
+TARGETS = {
+    oa.rules.body.BodyRule: "text",
+    oa.rules.body.RawBodyRule: "raw_text",
+    oa.rules.full.FullRule: "raw_msg",
+}
+
+# Non ASCII characters that are matched by ASCII letters with the
+# IGNORECASE flag (e.g. the KELVIN SIGN matches "k"). These are folded
+# before lowering the text so case-insensitive literals are still found.
+_FOLD_TABLE = {
+    0x130: u"i",
+    0x131: u"i",
+    0x17f: u"s",
+    0x212a: u"k",
+}
+
+_REPEATS = frozenset(
+    getattr(sre_constants, name) for name in
+    ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_constants, name)
+)
+# Zero-width items, they don't break a run of literals.
+_ZERO_WIDTH = frozenset((sre_constants.AT, sre_constants.ASSERT,
+                         sre_constants.ASSERT_NOT))
+
+
+def _is_ascii(text):
+    try:
+        text.encode("ascii")
+    except UnicodeError:
+        return False
+    return True
+
+
+def _best(candidates):
+    """Choose the most selective alternative set: the one with the
+    longest shortest literal, and the fewest alternatives.
+    """
+    best = None
+    best_key = None
+    for candidate in candidates:
+        key = (min(len(literal) for literal, nocase in candidate),
+               -len(candidate))
+        if best_key is None or key > best_key:
+            best, best_key = candidate, key
+    return best
+
+
+def get_flags(parsed):
+    """The global flags of the parsed pattern. Before Python 3.8 they
+    are in `parsed.pattern` instead of `parsed.state`.
+    """
+    state = getattr(parsed, "state", None) or parsed.pattern
+    return state.flags
+
+
+def _subpattern(av):
+    """The flags added and removed by the group and its items. Before
+    Python 3.6 groups can't change the flags and are (group, items).
+    """
+    if len(av) == 4:
+        return av[1], av[2], av[3]
+    if len(av) == 2:
+        return 0, 0, av[1]
+    raise ValueError("Unknown group: %r" % (av,))
+
+
+def _flatten(items, nocase):
+    """Inline any groups that don't change the IGNORECASE flag, since
+    they are simply part of the concatenation.
+    """
+    for op, av in items:
+        if op == sre_constants.SUBPATTERN:
+            add_flags, del_flags, sub_items = _subpattern(av)
+            if not (add_flags | del_flags) & re.IGNORECASE:
+                for item in _flatten(sub_items, nocase):
+                    yield item
+                continue
+        yield op, av
+
+
+def _required(items, nocase):
+    """Get a set of (literal, nocase) alternatives where at least one
+    must be present in the text for the parsed sequence to match. Returns
+    None if no such set can be determined.
+    """
+    candidates = []
+    run = []
+
+    def flush():
+        if run:
+            candidates.append(frozenset(((u"".join(run), nocase),)))
+            del run[:]
+
+    for op, av in _flatten(items, nocase):
+        if op == sre_constants.LITERAL:
+            char = chr(av)
+            if nocase:
+                if not _is_ascii(char):
+                    flush()
+                    continue
+                char = char.lower()
+            run.append(char)
+        elif op in _ZERO_WIDTH:
+            continue
+        elif op == sre_constants.SUBPATTERN:
+            flush()
+            add_flags, del_flags, sub_items = _subpattern(av)
+            required = _required(sub_items, bool(add_flags & re.IGNORECASE))
+            if required:
+                candidates.append(required)
+        elif op == sre_constants.BRANCH:
+            flush()
+            alternatives = set()
+            for branch in av[1]:
+                required = _required(branch, nocase)
+                if not required:
+                    alternatives = None
+                    break
+                alternatives.update(required)
+            if alternatives:
+                candidates.append(frozenset(alternatives))
+        elif op in _REPEATS:
+            flush()
+            min_repeat, dummy, sub_items = av
+            if min_repeat >= 1:
+                required = _required(sub_items, nocase)
+                if required:
+                    candidates.append(required)
+        else:
+            flush()
+    flush()
+    return _best(candidates)
+
+
+@oa.regex.pattern_cache
+def extract_literals(pattern):
+    """Get the required literals for the compiled regular expression.
+
+    Returns a frozenset of (literal, nocase) where at least one of
+    the literals must be present in the text for the regex to match.
+    For nocase literals the text should be checked case-insensitive.
+
+    Returns None if there are no usable literals.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        nocase = bool(get_flags(parsed) & re.IGNORECASE)
+        required = _required(list(parsed), nocase)
+    except (sre_constants.error, TypeError, ValueError, RuntimeError,
+            AttributeError, IndexError):
+        # Unsupported pattern or parser version.
+        return None
+    if not required:
+        return None
+    if min(len(literal) for literal, dummy in required) < MIN_LITERAL_LENGTH:
+        return None
+    return required
+
+
+def fold_text(text):
+    """Fold the text so that it can be searched for nocase literals."""
+    if not _is_ascii(text):
+        text = text.translate(_FOLD_TABLE)
+    return text.lower()
+
+
+class _LiteralScanner(object):
+    """Finds which of a fixed set of literals are present in a text."""
+
+    def __init__(self, literals):
+        self.literals = sorted(literals)
+        self._automaton = None
+        if ahocorasick is not None and self.literals:
+            automaton = ahocorasick.Automaton()
+            for literal in self.literals:
+                automaton.add_word(literal, literal)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+    def scan(self, text):
+        """Return the set of literals present in the text."""
+        if self._automaton is not None:
+            return set(literal for dummy, literal in
+                       self._automaton.iter(text))
+        return set(literal for literal in self.literals if literal in text)
+
+
+class LiteralPrefilter(object):
+    """Scan each message text once to find which rules can't possibly
+    match it.
+    """
+
+    def __init__(self):
+        # Maps the message attribute to the literal -> rule names index
+        self._index = dict()
+        # Maps the message attribute to the prefiltered rule names
+        self._rules = dict()
+        self._scanners = dict()
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._rules.values())
+
+    def __contains__(self, name):
+        return any(name in rules for rules in self._rules.values())
+
+    def add_rule(self, rule):
+        """Add the rule to the prefilter if it is possible. Returns
+        True if the rule was added.
+        """
+        try:
+            target = TARGETS[type(rule)]
+        except KeyError:
+            return False
+        pattern = getattr(rule, "_pattern", None)
+        if type(pattern) is not oa.regex.MatchPattern:
+            return False
+        literals = extract_literals(pattern._pattern)
+        if not literals:
+            return False
+        index = self._index.setdefault(target, dict())
+        for literal in literals:
+            index.setdefault(literal, set()).add(rule.name)
+        self._rules.setdefault(target, set()).add(rule.name)
+        self._scanners.clear()
+        return True
+
+    def _get_scanners(self, target):
+        try:
+            return self._scanners[target]
+        except KeyError:
+            pass
+        literals = self._index[target]
+        scanners = (
+            _LiteralScanner(lit for lit, nocase in literals if not nocase),
+            _LiteralScanner(lit for lit, nocase in literals if nocase),
+        )
+        self._scanners[target] = scanners
+        return scanners
+
+    def get_skipped(self, msg):
+        """Get the names of the rules that cannot match this message."""
+        skipped = set()
+        for target, rules in self._rules.items():
+            text = getattr(msg, target)
+            index = self._index[target]
+            case_scanner, nocase_scanner = self._get_scanners(target)
+            possible = set()
+            for literal in case_scanner.scan(text):
+                possible.update(index[(literal, False)])
+            if nocase_scanner.literals:
+                for literal in nocase_scanner.scan(fold_text(text)):
+                    possible.update(index[(literal, True)])
+            skipped.update(rules - possible)
+        return skipped
@@ -0,0 +1,158 @@
+"""Collect timing and hit statistics for the rules of a ruleset.
+
+The profiler is opt-in, set `RuleSet.profiler` to a `RuleProfiler` instance
+to enable it. The times recorded for each rule exclude the time spent
+evaluating its subrules, so that the time of a meta rule doesn't include the
+time of the rules it references.
+"""
+
+from __future__ import division
+
+from builtins import dict
+from builtins import object
+
+import json
+import time
+import timeit
+
+import oa.rules.eval_
+
+try:
+    _cpu_time = time.process_time
+except AttributeError:
+    # Python 2
+    _cpu_time = time.clock
+
+# The keys that the statistics can be sorted by.
+SORT_KEYS = ("wall", "cpu", "calls", "hits")
+
+
+def get_rule_class(rule):
+    """Get the class used to aggregate the statistics for this rule, e.g.
+    body, header, uri, eval, meta.
+    """
+    if isinstance(rule, oa.rules.eval_.EvalRule):
+        return "eval"
+    return getattr(rule, "rule_type", None) or rule.__class__.__name__
+
+
+class RuleStats(object):
+    """Statistics for a single rule or class of rules."""
+
+    __slots__ = ("calls", "hits", "wall", "cpu")
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def add(self, wall, cpu, result):
+        self.calls += 1
+        if result:
+            self.hits += 1
+        self.wall += wall
+        self.cpu += cpu
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.calls if self.calls else 0.0,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "wall_per_call": self.wall / self.calls if self.calls else 0.0,
+        }
+
+
+class RuleProfiler(object):
+    """Records the wall and CPU time, calls and hits per rule name and
+    per rule class.
+    """
+
+    def __init__(self):
+        self.rules = dict()
+        self.classes = dict()
+        self.messages = 0
+        # The wall and CPU time of the subrules that are evaluated
+        # while checking the rules currently running.
+        self._stack = []
+
+    def reset(self):
+        """Clear all the recorded statistics."""
+        self.rules.clear()
+        self.classes.clear()
+        self.messages = 0
+
+    def profile(self, rule, msg):
+        """Match the rule against the message and record the statistics."""
+        self._stack.append([0.0, 0.0])
+        wall_start = timeit.default_timer()
+        cpu_start = _cpu_time()
+        result = False
+        try:
+            result = rule.match(msg)
+            return result
+        finally:
+            wall = timeit.default_timer() - wall_start
+            cpu = _cpu_time() - cpu_start
+            child_wall, child_cpu = self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            self._record(rule, wall - child_wall, cpu - child_cpu, result)
+
+    def _record(self, rule, wall, cpu, result):
+        try:
+            stats = self.rules[rule.name]
+        except KeyError:
+            stats = self.rules[rule.name] = RuleStats()
+        stats.add(wall, cpu, result)
+        rule_class = get_rule_class(rule)
+        try:
+            stats = self.classes[rule_class]
+        except KeyError:
+            stats = self.classes[rule_class] = RuleStats()
+        stats.add(wall, cpu, result)
+
+    def top(self, count=None, key="wall", classes=False):
+        """Get the (name, stats) with the highest value for the key."""
+        if key not in SORT_KEYS:
+            raise ValueError("Invalid sort key: %s" % key)
+        stats = self.classes if classes else self.rules
+        result = sorted(stats.items(),
+                        key=lambda item: getattr(item[1], key), reverse=True)
+        if count is not None:
+            result = result[:count]
+        return result
+
+    def as_dict(self):
+        return {
+            "messages": self.messages,
+            "rules": dict((name, stats.as_dict())
+                          for name, stats in self.rules.items()),
+            "classes": dict((name, stats.as_dict())
+                            for name, stats in self.classes.items()),
+        }
+
+    def to_json(self, **kwargs):
+        """Export all the statistics as JSON."""
+        return json.dumps(self.as_dict(), sort_keys=True, **kwargs)
+
+    def format_table(self, count=20, key="wall"):
+        """Format a table with the top rules and all the rule classes."""
+        lines = []
+        row = "%-40s %8s %8s %8s %12s %12s %12s"
+        for title, classes, limit in (("Rule", False, count),
+                                      ("Class", True, None)):
+            lines.append(row % (title, "calls", "hits", "hit%", "wall (s)",
+                                "cpu (s)", "wall/call"))
+            for name, stats in self.top(limit, key, classes):
+                data = stats.as_dict()
+                lines.append(
+                    "%-40s %8d %8d %7.1f%% %12.6f %12.6f %12.9f" %
+                    (name, stats.calls, stats.hits, data["hit_rate"] * 100,
+                     stats.wall, stats.cpu, data["wall_per_call"]))
+            lines.append("")
+        lines.append("%d message(s) profiled" % self.messages)
+        return "\n".join(lines)
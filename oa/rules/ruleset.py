@@ -17,6 +17,15 @@ from operator import itemgetter
 import oa
 import oa.errors
 import oa.regex
+import oa.regex_backend
+import oa.received_parser
+import oa.rules.meta
+import oa.rules.prefilter
+import oa.rules.header_index
+import oa.rules.uri_index
+
+# Pseudo test reported when the scan stopped before checking all the rules.
+TRUNCATED_SCAN = "TRUNCATED_SCAN"
 
 _TAG_RE = oa.regex.Regex(r"(_([A-Z_]*?)_)")
 
@@ -52,10 +61,38 @@ class RuleSet(object):
         }
         self.checked = collections.OrderedDict()
         self.not_checked = dict()
+        # Maps the meta rules to the names of their subrules
+        self.dependencies = dict()
+        # The names of all the rules that are needed to check the
+        # message, directly or as subrules.
+        self.required = set()
         # XXX Hardcoded at the moment, should be loaded from configuration.
         self.autolearn = False
         self.use_bayes = True
         self.use_network = True
+        # Scan the message texts once for the literals required by the
+        # body/rawbody/full rules and skip the rules that can't match.
+        self.use_prefilter = True
+        self.prefilter = oa.rules.prefilter.LiteralPrefilter()
+        # Check all the header rules for the same header together.
+        self.use_header_index = True
+        self.header_index = oa.rules.header_index.HeaderIndex()
+        # Check all the URI rules in one pass over the URIs.
+        self.use_uri_index = True
+        self.uri_index = oa.rules.uri_index.URIIndex()
+        # Set to a oa.rules.profiler.RuleProfiler to record per rule
+        # statistics.
+        self.profiler = None
+        # Stop checking the rules once the remaining ones can no longer
+        # change the verdict for the message. The scores added by plugins
+        # outside of the rules (e.g. AWL) are not taken into account.
+        self.decisive_verdict = False
+        # The maximum positive and negative score that can still be added
+        # by the checked rules, starting from each position.
+        self.score_bounds = []
+        # The lazy message attributes that are parsed when the message is
+        # created, so the plugin hooks run in order.
+        self.message_requires = frozenset()
 
     def _interpolate(self, text, msg):
         if msg.interpolate_data:
@@ -83,6 +120,8 @@ class RuleSet(object):
         if "TESTS" in self.tags:
             matched_rules = [name for name, result in msg.rules_checked.items()
                              if result]
+            if msg.truncated_scan:
+                matched_rules.append(TRUNCATED_SCAN)
             if not matched_rules:
                 data["TESTS"] = "none"
             else:
@@ -92,6 +131,8 @@ class RuleSet(object):
             matched_rules = ["%s=%s" % (name, int(result))
                              for name, result in msg.rules_checked.items()
                              if result]
+            if msg.truncated_scan:
+                matched_rules.append("%s=0" % TRUNCATED_SCAN)
             if not matched_rules:
                 data["TESTSSCORES"] = "none"
             else:
@@ -105,7 +146,9 @@ class RuleSet(object):
 
         # Plugin can store custom tags in the the message
         # after they perform check. Add them to the data
-        # as well.
+        # as well. The relays tags are only set once the
+        # relays are parsed.
+        msg.prepare("received_headers")
         data.update(msg.plugin_tags)
         return text % msg.interpolate_data
 
@@ -252,6 +295,9 @@ class RuleSet(object):
                 "* %s %s %s%s" %
                 (rule.score, rule.name, rule._rule_type, msg.rules_descriptions[name])
             )
+        if msg.truncated_scan:
+            report.append("* 0 %s %s" % (TRUNCATED_SCAN,
+                                         self._get_truncated_description(msg)))
 
         report = "\r\n".join(report)
         return "\r\n%s" % report
@@ -271,8 +317,17 @@ class RuleSet(object):
                     "%s %s %s" %
                     (score, rule.name.ljust(22), rule.description)
             )
+        if msg.truncated_scan:
+            summary.append("%s %s %s" %
+                           ("0".rjust(4), TRUNCATED_SCAN.ljust(22),
+                            self._get_truncated_description(msg)))
         return "\r\n".join(summary)
 
+    @staticmethod
+    def _get_truncated_description(msg):
+        return ("Scan stopped, the remaining %s rules cannot change the "
+                "verdict" % msg.truncated_scan)
+
     def get_rule(self, name, checked_only=False):
         """Gets the rule with the given name. If checked_only is set to True
         then only returns the rule if it is going to be checked.
@@ -291,6 +346,14 @@ class RuleSet(object):
         self.checked = collections.OrderedDict(
             sorted(self.checked.items(), key=itemgetter(1), reverse=False))
         self.call_postparsing()
+        self.build_dependencies()
+        self.build_prefilter()
+        self.build_header_index()
+        self.build_uri_index()
+        self.build_score_bounds()
+        self.build_message_requires()
+        self.build_tlds()
+        oa.received_parser.CACHE.resize(self.conf["received_cache_size"])
         # Convert some of the parsed information
         self.conf["report"] = "\n".join(
             self._convert_tags(value)
@@ -338,29 +401,217 @@ class RuleSet(object):
                         raise
                     del rule_list[name]
 
+    def build_dependencies(self):
+        """Build the dependency graph of the rules from the subrules
+        referenced by the meta rules.
+
+        The order of the checked rules is kept, the subrules are matched
+        when a meta rule first needs them. Rules that are not checked and
+        not used by any checked meta rule are excluded from the required
+        rules.
+        """
+        self.dependencies = dict()
+        for rule_list in (self.checked, self.not_checked):
+            for name, rule in rule_list.items():
+                if isinstance(rule, oa.rules.meta.MetaRule):
+                    self.dependencies[name] = rule.subrules
+
+        self.required = set()
+        pending = list(self.checked)
+        while pending:
+            name = pending.pop()
+            if name in self.required:
+                continue
+            self.required.add(name)
+            pending.extend(self.dependencies.get(name, ()))
+        self.ctxt.log.debug(
+            "%s rules are not used by any checked rule",
+            len(self.checked) + len(self.not_checked) - len(self.required))
+
+    def build_prefilter(self):
+        """Extract the required literals for all the rules that support
+        it and index them in the prefilter.
+        """
+        self.prefilter = oa.rules.prefilter.LiteralPrefilter()
+        if not self.use_prefilter:
+            return
+        for rule in self.checked.values():
+            self.prefilter.add_rule(rule)
+        for name, rule in self.not_checked.items():
+            # Only index the subrules that are actually needed.
+            if name in self.required:
+                self.prefilter.add_rule(rule)
+        self.ctxt.log.debug("%s rules handled by the literal prefilter",
+                            len(self.prefilter))
+
+    def build_header_index(self):
+        """Group the header rules by the header they check."""
+        self.header_index = oa.rules.header_index.HeaderIndex()
+        if not self.use_header_index:
+            return
+        for rule in self.checked.values():
+            self.header_index.add_rule(rule)
+        for name, rule in self.not_checked.items():
+            if name in self.required:
+                self.header_index.add_rule(rule)
+        self.ctxt.log.debug("%s header rules grouped in %s headers",
+                            len(self.header_index),
+                            len(self.header_index.groups))
+
+    def build_uri_index(self):
+        """Index the URI rules so they are checked in one pass over
+        the URIs of the message.
+        """
+        self.uri_index = oa.rules.uri_index.URIIndex()
+        if not self.use_uri_index:
+            return
+        for rule in self.checked.values():
+            self.uri_index.add_rule(rule)
+        for name, rule in self.not_checked.items():
+            if name in self.required:
+                self.uri_index.add_rule(rule)
+        self.ctxt.log.debug("%s URI rules indexed", len(self.uri_index))
+
+    def build_score_bounds(self):
+        """Compute the maximum positive and negative score that the checked
+        rules can still add to the message from each position.
+
+        In the decisive verdict mode the cheaper rules are moved first
+        within the same priority, so that the expensive ones (e.g. DNS
+        and network evals) are the ones left out when the scan is
+        stopped early.
+        """
+        if self.decisive_verdict:
+            self.checked = collections.OrderedDict(
+                sorted(self.checked.items(),
+                       key=lambda item: (item[1].priority, item[1].cost)))
+        positive = negative = 0.0
+        self.score_bounds = []
+        for rule in reversed(list(self.checked.values())):
+            if rule.score > 0:
+                positive += rule.score
+            else:
+                negative += rule.score
+            self.score_bounds.append((positive, negative))
+        self.score_bounds.reverse()
+
+    def build_tlds(self):
+        """Collect the TLDs from the `util_rb_tld`, `util_rb_2tld` and
+        `util_rb_3tld` options for `oa.uri_parser`.
+        """
+        tlds = set()
+        for key in ("util_rb_tld", "util_rb_2tld", "util_rb_3tld"):
+            tlds.update(tld.lower() for tld in self.conf[key] if tld)
+        self.ctxt.tlds = frozenset(tlds)
+
+    def build_message_requires(self):
+        """Collect the lazy message attributes that the plugins need
+        before their `parsed_metadata` hook, e.g. the body for the
+        `extract_metadata` hook. All the other attributes are only parsed
+        if a rule or plugin uses them.
+        """
+        requires = set()
+        for plugin in self.ctxt.plugins.values():
+            requires.update(plugin.message_requires)
+        self.message_requires = frozenset(requires)
+        self.ctxt.message_requires = self.message_requires
+        self.ctxt.log.debug("Message attributes parsed eagerly: %s",
+                            ", ".join(sorted(requires)) or "none")
+
+    def is_verdict_decided(self, msg, index):
+        """Check if the rules starting from this position can still
+        change the verdict for the message.
+        """
+        positive, negative = self.score_bounds[index]
+        required_score = self.conf["required_score"]
+        if msg.score >= required_score:
+            return msg.score + negative >= required_score
+        return msg.score + positive < required_score
+
+    def match_rule(self, name, msg):
+        """Get the result of the rule with this name for the message.
+
+        Every rule is evaluated at most once per message, any further
+        request (e.g. from meta rules sharing a subrule) reuses the
+        stored result.
+
+        The header rules are checked together with all the other rules
+        for the same header, and the URI rules all together, unless the
+        rules are being profiled.
+        """
+        try:
+            result = msg.rule_results[name]
+        except KeyError:
+            pass
+        else:
+            msg.saved_evaluations += 1
+            return result
+
+        if name in msg.prefilter_skipped:
+            # None of the required literals are present
+            # in the text, the rule cannot match.
+            result = False
+        else:
+            rule = self.get_rule(name)
+            try:
+                if self.profiler is not None:
+                    result = self.profiler.profile(rule, msg)
+                else:
+                    for index in (self.header_index, self.uri_index):
+                        if name in index:
+                            results = index.match_group(name, msg)
+                            msg.rule_results.update(results)
+                            result = results[name]
+                            break
+                    else:
+                        result = rule.match(msg)
+            except oa.errors.StopProcessing:
+                raise
+            except Exception as e:
+                self.ctxt.log.critical("Unable to run rule %r: %s",
+                                       name, e, exc_info=True)
+                result = False
+        msg.rule_results[name] = result
+        return result
+
+    def _match_rules(self, msg):
+        """Check the rules in order and update the score of the message."""
+        for index, (name, rule) in enumerate(self.checked.items()):
+            if self.decisive_verdict and self.is_verdict_decided(msg, index):
+                msg.truncated_scan = len(self.checked) - index
+                self.ctxt.log.debug("Verdict decided, skipping the "
+                                    "remaining %s rules", msg.truncated_scan)
+                break
+            result = self.match_rule(name, msg)
+            if isinstance(result, str):
+                msg.rules_descriptions[name] = result
+                result = True
+            elif result:
+                msg.rules_descriptions[name] = rule.description
+            self.ctxt.log.debug("Checked rule %s: %s", rule, result)
+            msg.rules_checked[name] = result
+            if result:
+                msg.score += rule.score
+
     def match(self, msg):
         """Match the message against all the rules in this ruleset."""
+        msg.rule_results = dict()
+        msg.saved_evaluations = 0
+        msg.prefilter_skipped = self.prefilter.get_skipped(msg)
+        msg.truncated_scan = 0
+        if self.profiler is not None:
+            self.profiler.messages += 1
+        budget = oa.regex_backend.match_budget(
+            self.conf["regex_match_timeout"],
+            self.conf["regex_message_timeout"]
+        )
         try:
-            for name, rule in self.checked.items():
-                try:
-                    result = rule.match(msg)
-                except oa.errors.StopProcessing as e:
-                    raise
-                except Exception as e:
-                    self.ctxt.log.critical("Unable to run rule %r: %s",
-                                           name, e, exc_info=True)
-                    result = False
-                if isinstance(result, str):
-                    msg.rules_descriptions[name] = result
-                    result = True
-                elif result:
-                    msg.rules_descriptions[name] = rule.description
-                self.ctxt.log.debug("Checked rule %s: %s", rule, result)
-                msg.rules_checked[name] = result
-                if result:
-                    msg.score += rule.score
+            with budget:
+                self._match_rules(msg)
         except oa.errors.StopProcessing as e:
             self.ctxt.log.debug("Stop processing the messages as "
                                 "requested: %s", e)
+        self.ctxt.log.debug("Reused %s stored rule results",
+                            msg.saved_evaluations)
         self.ctxt.hook_check_end(self, msg)
         self.ctxt.hook_auto_learn(self, msg)
@@ -12,6 +12,8 @@ class URIRule(oa.rules.base.BaseRule):
     """
     _rule_type = "URI: "
     rule_type = 'uri'
+    cost = 2e-5
+    bool_result = True
 
     def __init__(self, name, pattern, score=None, desc=None, priority=0,
                  tflags=None):
@@ -25,6 +27,15 @@ class URIRule(oa.rules.base.BaseRule):
                 return True
         return False
 
+    def add_to_index(self, index):
+        """Add this rule to the `oa.rules.uri_index.URIIndex`. Subclasses
+        that override `match` must also override this method, otherwise
+        they are not indexed.
+
+        Returns True if the rule was added.
+        """
+        return index.add_pattern(self.name, self._pattern)
+
     @staticmethod
     def get_rule_kwargs(data):
         kwargs = oa.rules.base.BaseRule.get_rule_kwargs(data)
@@ -0,0 +1,357 @@
+"""Check all the URI rules in one pass over the URIs of the message.
+
+Instead of looping over all the URIs for every rule, each URI is checked
+once and only the rules that could possibly match it are run:
+
+ * rules that are anchored on a domain (e.g. ``/^https?:\\/\\/(?:www\\.)?
+   example\\.com/``) are looked up in a hash by the labels of the URI host;
+ * rules with required literals are found with the literal prefilter;
+ * the rest are checked against every URI.
+
+The real pattern is always run for the candidate rules, so the results are
+the same as checking the rules one by one.
+
+Rule classes plug into the index by implementing ``add_to_index``, see
+`oa.rules.uri.URIRule`.
+"""
+
+from builtins import chr
+from builtins import dict
+from builtins import object
+
+import re
+
+import oa.regex
+import oa.rules.uri
+import oa.rules.prefilter
+from oa.rules.prefilter import sre_parse
+from oa.rules.prefilter import sre_constants
+
+# The part of the URI after `://` that is checked for the domain ends at
+# the first slash. This can include more than the host (e.g. the query if
+# there is no path), which only adds more candidates.
+_HOST_END = u"/"
+# The characters that can be part of a domain name literal.
+_DOMAIN_CHARS = frozenset(u"abcdefghijklmnopqrstuvwxyz0123456789-.")
+
+_NOT_CATEGORIES = frozenset(
+    getattr(sre_constants, name) for name in dir(sre_constants)
+    if name.startswith("CATEGORY_") and "_NOT_" in name
+)
+
+
+def _in_matches(items, char):
+    """Check if the parsed character set can match the character, returns
+    True if unsure.
+    """
+    code = ord(char)
+    negate = False
+    matched = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            matched = matched or av == code
+        elif op == sre_constants.RANGE:
+            matched = matched or av[0] <= code <= av[1]
+        elif op == sre_constants.CATEGORY:
+            # The host end is not a digit, space or word character.
+            matched = matched or av in _NOT_CATEGORIES
+        else:
+            return True
+    return matched != negate
+
+
+def _may_match(items, chars):
+    """Check if the parsed items can match any of the characters,
+    returns True if unsure.
+    """
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            if chr(av) in chars:
+                return True
+        elif op == sre_constants.NOT_LITERAL:
+            if any(char != chr(av) for char in chars):
+                return True
+        elif op == sre_constants.IN:
+            if any(_in_matches(av, char) for char in chars):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _may_match(av[-1], chars):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(_may_match(branch, chars) for branch in av[1]):
+                return True
+        elif op in oa.rules.prefilter._REPEATS:
+            if _may_match(av[2], chars):
+                return True
+        elif op not in oa.rules.prefilter._ZERO_WIDTH:
+            return True
+    return False
+
+
+def _ends_with_dot(items):
+    """Check if everything matched by the parsed items ends with a dot."""
+    items = list(items)
+    if not items:
+        return False
+    op, av = items[-1]
+    if op == sre_constants.LITERAL:
+        return av == ord(u".")
+    if op == sre_constants.SUBPATTERN:
+        return _ends_with_dot(av[-1])
+    if op == sre_constants.BRANCH:
+        return all(_ends_with_dot(branch) for branch in av[1])
+    return False
+
+
+def _is_optional_subdomain(op, av):
+    """Check if the item is something like ``(?:www\\.)?`` that can only
+    match a part of the host ending with a dot.
+    """
+    if op not in oa.rules.prefilter._REPEATS:
+        return False
+    sub_items = av[2]
+    return _ends_with_dot(sub_items) and not _may_match(sub_items, _HOST_END)
+
+
+def _find_domain_label(items):
+    """Get the first label of the domain literal after ``://`` in the
+    flattened items, or None.
+    """
+    separator = [(sre_constants.LITERAL, ord(char)) for char in u"://"]
+    for start in range(len(items) - len(separator) + 1):
+        if items[start:start + len(separator)] != separator:
+            continue
+        position = start + len(separator)
+        while (position < len(items) and
+               _is_optional_subdomain(*items[position])):
+            position += 1
+        domain = []
+        for op, av in items[position:]:
+            if op != sre_constants.LITERAL:
+                break
+            char = chr(av).lower()
+            if char not in _DOMAIN_CHARS:
+                break
+            domain.append(char)
+        label, dot, dummy = u"".join(domain).partition(u".")
+        if label and dot:
+            return label
+    return None
+
+
+@oa.regex.pattern_cache
+def extract_domain_label(pattern):
+    """Get the first label of the domain the compiled URI regex is
+    anchored on, or None if the regex isn't anchored on a domain.
+
+    The regex is anchored on a domain if it contains ``://`` followed
+    by an optional subdomain and a domain literal (with at least one dot).
+    In that case the returned label must be one of the labels of the
+    URI host for the regex to match.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        nocase = bool(oa.rules.prefilter.get_flags(parsed) & re.IGNORECASE)
+        items = list(oa.rules.prefilter._flatten(list(parsed), nocase))
+        return _find_domain_label(items)
+    except (sre_constants.error, TypeError, ValueError, RuntimeError,
+            AttributeError, IndexError):
+        # Unsupported pattern or parser version, the rule isn't indexed.
+        return None
+
+
+@oa.regex.pattern_cache
+def extract_exact_literal(pattern):
+    """Get the literal if the compiled regex only matches exactly that
+    text (e.g. ``/^example\\.com$/``), otherwise return None.
+    """
+    if pattern.flags & re.MULTILINE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (sre_constants.error, TypeError, ValueError, RuntimeError):
+        return None
+    items = list(parsed)
+    if (len(items) < 3 or
+            items[0] != (sre_constants.AT, sre_constants.AT_BEGINNING) or
+            items[-1][0] != sre_constants.AT or
+            items[-1][1] not in (sre_constants.AT_END,
+                                 sre_constants.AT_END_STRING)):
+        return None
+    literal = []
+    for op, av in items[1:-1]:
+        if op != sre_constants.LITERAL:
+            return None
+        literal.append(chr(av))
+    return oa.rules.prefilter.fold_text(u"".join(literal))
+
+
+def get_host_labels(uri):
+    """Get the labels of all the hosts in the folded URI. All the
+    occurrences of ``://`` are considered, not only the first one.
+    """
+    labels = set()
+    start = uri.find(u"://")
+    while start != -1:
+        end = uri.find(_HOST_END, start + 3)
+        if end == -1:
+            end = len(uri)
+        labels.update(uri[start + 3:end].split(u"."))
+        start = uri.find(u"://", start + 1)
+    return labels
+
+
+def _defined_in(cls, attribute):
+    """Get the class in the MRO that defines this attribute."""
+    for klass in cls.__mro__:
+        if attribute in vars(klass):
+            return klass
+    return None
+
+
+class URIIndex(object):
+    """Index of the URI rules."""
+
+    def __init__(self):
+        # Maps the rule names to the rules
+        self.rules = dict()
+        # The rules matched against msg.uri_list
+        self._patterns = dict()
+        self._domains = dict()
+        self._literals = dict()
+        self._unfiltered = set()
+        self._scanners = None
+        # The rules that check the items of msg.uri_detail_links
+        self._detail_checks = dict()
+        self._detail_domains = dict()
+        self._detail_unfiltered = set()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __contains__(self, name):
+        return name in self.rules
+
+    def add_rule(self, rule):
+        """Add the rule to the index if it's supported. Returns True if
+        the rule was added.
+
+        The rule is only added if the class that defines its match method
+        also defines how it's added to the index, and the match method
+        hasn't been replaced (e.g. by the ShortCircuit plugin).
+        """
+        if not isinstance(rule, oa.rules.uri.URIRule):
+            return False
+        if "match" in vars(rule):
+            return False
+        cls = type(rule)
+        if _defined_in(cls, "match") is not _defined_in(cls, "add_to_index"):
+            return False
+        if not rule.add_to_index(self):
+            return False
+        self.rules[rule.name] = rule
+        return True
+
+    def add_pattern(self, name, pattern):
+        """Index a rule that matches the pattern against msg.uri_list.
+        Returns True if the rule was added.
+        """
+        if type(pattern) is not oa.regex.MatchPattern:
+            return False
+        self._patterns[name] = pattern
+        self._scanners = None
+        label = extract_domain_label(pattern._pattern)
+        if label is not None:
+            self._domains.setdefault(label, set()).add(name)
+            return True
+        literals = oa.rules.prefilter.extract_literals(pattern._pattern)
+        if literals:
+            for literal in literals:
+                self._literals.setdefault(literal, set()).add(name)
+            return True
+        self._unfiltered.add(name)
+        return True
+
+    def add_detail_check(self, name, check, domains=None):
+        """Index a rule that calls `check` for each of the items in
+        msg.uri_detail_links. If `domains` is given the rule can only
+        match items that have one of these (folded) domains.
+        """
+        self._detail_checks[name] = check
+        if domains:
+            for domain in domains:
+                self._detail_domains.setdefault(domain, set()).add(name)
+        else:
+            self._detail_unfiltered.add(name)
+        return True
+
+    def _get_scanners(self):
+        if self._scanners is None:
+            literals = self._literals
+            self._scanners = (
+                oa.rules.prefilter._LiteralScanner(
+                    lit for lit, nocase in literals if not nocase),
+                oa.rules.prefilter._LiteralScanner(
+                    lit for lit, nocase in literals if nocase),
+            )
+        return self._scanners
+
+    def get_candidates(self, uri):
+        """Get the names of the rules that can match the URI."""
+        folded = oa.rules.prefilter.fold_text(uri)
+        candidates = set(self._unfiltered)
+        if self._domains:
+            for label in get_host_labels(folded):
+                candidates.update(self._domains.get(label, ()))
+        if self._literals:
+            case_scanner, nocase_scanner = self._get_scanners()
+            for literal in case_scanner.scan(uri):
+                candidates.update(self._literals[(literal, False)])
+            if nocase_scanner.literals:
+                for literal in nocase_scanner.scan(folded):
+                    candidates.update(self._literals[(literal, True)])
+        return candidates
+
+    def _get_detail_candidates(self, value):
+        candidates = set(self._detail_unfiltered)
+        if self._detail_domains:
+            domain = oa.rules.prefilter.fold_text(value.get("domain") or u"")
+            candidates.update(self._detail_domains.get(domain, ()))
+            if domain.endswith(u"\n"):
+                # `$` also matches before a trailing newline
+                candidates.update(self._detail_domains.get(domain[:-1], ()))
+        return candidates
+
+    def match(self, msg):
+        """Check all the indexed rules against the message. Returns
+        a dictionary mapping the rule names to their results.
+        """
+        results = dict.fromkeys(self.rules, False)
+        pending = set(self._patterns)
+        for uri in msg.uri_list:
+            if not pending:
+                break
+            for name in self.get_candidates(uri) & pending:
+                if self._patterns[name].match(uri):
+                    results[name] = True
+                    pending.discard(name)
+
+        pending = set(self._detail_checks)
+        if pending:
+            links = getattr(msg, "uri_detail_links", None) or {}
+            for link in links.values():
+                for value in link.values():
+                    if not pending:
+                        break
+                    candidates = self._get_detail_candidates(value)
+                    for name in candidates & pending:
+                        if self._detail_checks[name](value):
+                            results[name] = True
+                            pending.discard(name)
+        return results
+
+    def match_group(self, name, msg):
+        """All the URI rules are checked together."""
+        return self.match(msg)
@@ -9,8 +9,11 @@ import copy
 import spoon.server
 
 import oa
+import oa.regex
 import oa.config
+import oa.db.pool
 import oa.protocol
+import oa.received_parser
 import oa.rules.parser
 
 import oa.protocol.noop
@@ -57,11 +60,14 @@ class Server(spoon.server.TCPSpoon):
     handler_klass = RequestHandler
 
     def __init__(self, address, sitepath, configpath, paranoid=False,
-                 ignore_unknown=True):
+                 ignore_unknown=True, warm_up=False, cache_dir=None):
         self.paranoid = paranoid
         self.ignore_unknown = ignore_unknown
+        self.warm_up = warm_up
+        self.cache_dir = cache_dir
         self._ruleset = None
         self._user_rulesets = {}
+        self._parser = None
         self._parser_results = None
         self.sitepath = sitepath
         self.configpath = configpath
@@ -69,16 +75,45 @@ class Server(spoon.server.TCPSpoon):
         super(Server, self).__init__(address)
 
     def load_config(self):
-        """Reads the configuration files and reloads the ruleset."""
-        self._user_rulesets.clear()
-        parser = oa.rules.parser.parse_pad_rules(
-            oa.config.get_config_files(self.configpath, self.sitepath),
-            paranoid=self.paranoid, ignore_unknown=self.ignore_unknown
-        )
-        self._ruleset = parser.get_ruleset()
-        # Store a copy of the parser results to generate user
-        # settings later
-        self._parser_results = parser.results
+        """Reads the configuration files and reloads the ruleset.
+
+        On reload only the files that changed are read again if possible,
+        see `oa.rules.parser.PADParser.reload`. The current ruleset keeps
+        handling requests until the new one is ready.
+        """
+        self.log.info("Received cache: %s",
+                      oa.received_parser.CACHE.get_stats())
+        self.log.info("Database pools: %s", oa.db.pool.get_stats())
+        files = oa.config.get_config_files(self.configpath, self.sitepath)
+        parser = None
+        if self._parser is not None:
+            parser = self._parser.reload(files)
+        if parser is None:
+            parser = oa.rules.parser.parse_pad_rules(
+                files, paranoid=self.paranoid,
+                ignore_unknown=self.ignore_unknown, cache_dir=self.cache_dir
+            )
+        if parser is not self._parser:
+            # The new ruleset opens new database connections.
+            oa.db.pool.close_all()
+            ruleset = parser.get_ruleset()
+            self._parser = parser
+            # Store a copy of the parser results to generate user
+            # settings later
+            self._parser_results = parser.results
+            self._ruleset = ruleset
+        else:
+            self.log.info("The configuration files didn't change")
+        # The user preferences might have changed as well.
+        self._user_rulesets = {}
+        if self.warm_up:
+            self.start_warm_up()
+
+    def start_warm_up(self):
+        """Compile the regexes in a background thread, so that the
+        server can start handling requests right away.
+        """
+        oa.regex.start_warm_up()
 
     def get_user_ruleset(self, user=None):
         """Get the corresponding ruleset for this user. If the
@@ -119,3 +154,9 @@ class PreForkServer(Server, spoon.server.TCPSpork):
 
     The parent process will then wait for all his child process to complete.
     """
+
+    def start_warm_up(self):
+        """Compile the regexes before forking, so that the children
+        share them instead of each compiling its own.
+        """
+        oa.regex.warm_up()
@@ -0,0 +1,185 @@
+"""Parse the URIs found in a message once, for all the rules and plugins
+that check them.
+"""
+
+import ipaddress
+
+try:
+    from urllib.parse import unquote
+    from urllib.parse import urlsplit
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from builtins import str
+from builtins import object
+
+from oa.regex import Regex
+
+HTTP_REDIR = Regex(r'(^https?:\/\/[^\/:\?]+.+?)(https?:\/{0,2}?[^\/:\?]+.*)')
+
+
+def _urlsplit(value):
+    """Like urlsplit, but ignores invalid URIs (e.g. with an unclosed
+    IPv6 literal). This is enough for the scheme and the network location
+    and faster than urlparse.
+    """
+    try:
+        return urlsplit(value)
+    except ValueError:
+        return urlsplit("")
+
+
+def is_ip_address(host):
+    """Check if the host is an IPv4 or IPv6 address."""
+    if not host or not (host[0].isdigit() or ":" in host):
+        # Avoid the exception for the common case.
+        return False
+    try:
+        ipaddress.ip_address(str(host))
+    except ValueError:
+        return False
+    return True
+
+
+def get_registered_domain(host, tlds=frozenset()):
+    """Get the domain the host is registered under, using the two and
+    three level TLDs from `util_rb_2tld` and `util_rb_3tld`.
+    """
+    parts = host.split(".")
+    if len(parts) < 3:
+        return host
+    if ".".join(parts[-3:]) in tlds:
+        return ".".join(parts[-4:])
+    if ".".join(parts[-2:]) in tlds:
+        return ".".join(parts[-3:])
+    return ".".join(parts[-2:])
+
+
+class URI(object):
+    """A URI found in the message:
+
+    * `raw` - the URI as found in the message
+    * `cleaned` - the URI with the escapes decoded
+    * `scheme` and `netloc` - as returned by `urlsplit`
+    * `host` - the lowercase host name, without the port and the
+      user information (the scheme may be missing, e.g. "www.example.com")
+    * `is_ip` - True if the host is an IP address
+    * `domain` - the registered domain of the host
+    * `redirects` - the URIs this URI redirects to, in order (e.g. for
+      "http://redirect.example.com/?u=http://example.com")
+
+    Only the scheme and the network location are parsed right away, the
+    rest is parsed when first needed.
+    """
+    __slots__ = ("raw", "scheme", "netloc", "_cleaned", "_host", "_is_ip",
+                 "_domain", "_tlds", "_redirects")
+
+    def __init__(self, raw, tlds=frozenset(), redirects=True):
+        self.raw = raw
+        parsed = _urlsplit(raw)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self._cleaned = None
+        self._host = None
+        self._is_ip = None
+        self._domain = None
+        self._tlds = tlds
+        self._redirects = None if redirects else []
+
+    @property
+    def cleaned(self):
+        if self._cleaned is None:
+            self._cleaned = unquote(self.raw)
+        return self._cleaned
+
+    @property
+    def host(self):
+        if self._host is None:
+            self._parse_host()
+        return self._host
+
+    @property
+    def is_ip(self):
+        if self._host is None:
+            self._parse_host()
+        return self._is_ip
+
+    @property
+    def domain(self):
+        if self._host is None:
+            self._parse_host()
+        return self._domain
+
+    def _parse_host(self):
+        """Find the host, check if it's an IP address and get its
+        registered domain.
+        """
+        if is_ip_address(self.netloc):
+            # An IPv6 address without the brackets.
+            host = self.netloc
+        else:
+            if self.netloc or "://" in self.raw:
+                parsed = _urlsplit(self.raw)
+            else:
+                parsed = _urlsplit("http://" + self.raw)
+            try:
+                host = parsed.hostname or ""
+            except ValueError:
+                host = ""
+        self._is_ip = is_ip_address(host)
+        if self._is_ip:
+            self._domain = host
+        else:
+            self._domain = get_registered_domain(host, self._tlds)
+        self._host = host
+
+    @property
+    def redirects(self):
+        """The redirect chain, only parsed when first needed."""
+        if self._redirects is None:
+            self._redirects = []
+            # Most URIs don't redirect, skip the regex for them.
+            if self.raw.find("http", 1) != -1:
+                match = HTTP_REDIR.match(self.raw)
+                while match:
+                    target = match.groups()[1]
+                    self._redirects.append(URI(target, self._tlds, False))
+                    match = HTTP_REDIR.match(target)
+        return self._redirects
+
+    def get_details(self):
+        """The details of the link used by the `uri_detail` rules."""
+        return {
+            "raw": self.raw,
+            "scheme": self.scheme,
+            "cleaned": self.cleaned,
+            "domain": self.netloc,
+        }
+
+    def get_hosts(self):
+        """The host and all its parent domains, starting with the host
+        (e.g. "www.example.com", "example.com", "com").
+        """
+        if self.is_ip:
+            return [self.host]
+        parts = self.host.split(".")
+        return [".".join(parts[i:]) for i in range(len(parts))]
+
+    def is_listed(self, listed, excluded=()):
+        """Check if the URI ends with one of the `listed` hosts, unless
+        it's exactly one of the `excluded` ones.
+        """
+        if self.raw in excluded:
+            return False
+        return self.raw.endswith(tuple(listed))
+
+    def __repr__(self):
+        return "URI(%r)" % self.raw
+
+
+def parse_uris(uris, tlds=frozenset()):
+    """Parse the URIs, returns a dictionary that maps the raw URIs
+    to `URI` objects.
+    """
+    return dict((uri, URI(uri, tlds)) for uri in uris)
@@ -18,10 +18,12 @@ import oa.common
 import oa.config
 import oa.errors
 import oa.message
+import oa.regex_backend
+import oa.received_parser
 import oa.rules.meta
 import oa.rules.parser
+import oa.rules.profiler
 
-from future.utils import PY3
 
 class MessageList(argparse.FileType):
     def __call__(self, string):
@@ -97,6 +99,27 @@ def parse_arguments(args):
     parser.add_argument("-R", "--report-only", action="store_true",
                         default=False, help="Only print the report instead of "
                                             "the adjusted message.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Store the parsed ruleset in this directory "
+                             "and reuse it while the configuration files "
+                             "are unchanged")
+    parser.add_argument("--regex-backend", default="re",
+                        choices=sorted(oa.regex_backend.BACKENDS),
+                        help="Regex engine used for the rule patterns, "
+                             "falls back to re for unsupported patterns")
+    parser.add_argument("--decisive-verdict", action="store_true",
+                        default=False,
+                        help="Stop checking the rules once the remaining "
+                             "ones cannot change the verdict")
+    parser.add_argument("--profile-rules", type=int, metavar="N", default=0,
+                        help="Record the time and hits of each rule and "
+                             "print the N slowest rules to stderr")
+    parser.add_argument("--profile-sort", default="wall",
+                        choices=oa.rules.profiler.SORT_KEYS,
+                        help="Sort the rule profile by this value")
+    parser.add_argument("--profile-json", metavar="PATH", default=None,
+                        help="Record the time and hits of each rule and "
+                             "export them as JSON to this file")
     parser.add_argument("messages", type=MessageList(), nargs="*",
                         metavar="path", help="Paths to messages or "
                                              "directories containing messages",
@@ -116,6 +139,11 @@ def main():
     options = parse_arguments(sys.argv[1:])
     oa.config.LAZY_MODE = not options.lazy_mode
     logger = oa.config.setup_logging("oa-logger", debug=options.debug)
+    try:
+        oa.regex_backend.set_backend(options.regex_backend)
+    except ValueError as e:
+        logger.critical(e)
+        sys.exit(1)
     config_files = oa.config.get_config_files(options.configpath,
                                               options.sitepath,
                                               options.prefspath)
@@ -133,7 +161,8 @@ def main():
     if not serialize:
         try:
             ruleset = oa.rules.parser.parse_pad_rules(
-                config_files, options.paranoid, not options.show_unknown
+                config_files, options.paranoid, not options.show_unknown,
+                cache_dir=options.cache_dir
             ).get_ruleset()
         except oa.errors.MaxRecursionDepthExceeded as e:
             logger.critical(e.recursion_list)
@@ -150,12 +179,16 @@ def main():
             sys.exit(1)
         call_post_parsing(ruleset)
 
+    if options.decisive_verdict:
+        ruleset.decisive_verdict = True
+        ruleset.build_score_bounds()
+    if options.profile_rules or options.profile_json:
+        ruleset.profiler = oa.rules.profiler.RuleProfiler()
+
     count = 0
     for message_list in options.messages:
         for msgf in message_list:
             raw_msg = msgf.read()
-            if type(raw_msg) is bytes and PY3:
-                raw_msg = raw_msg.decode("utf-8", "ignore")
             msgf.close()
             msg = oa.message.Message(ruleset.ctxt, raw_msg)
 
@@ -174,6 +207,15 @@ def main():
         count += 1
     if options.revoke or options.report:
         print("%s message(s) examined" % count)
+    ruleset.ctxt.log.debug("Received cache: %s",
+                           oa.received_parser.CACHE.get_stats())
+    if options.profile_rules:
+        print(ruleset.profiler.format_table(options.profile_rules,
+                                            options.profile_sort),
+              file=sys.stderr)
+    if options.profile_json:
+        with open(options.profile_json, "w") as jsonf:
+            jsonf.write(ruleset.profiler.to_json(indent=2))
 
 
 if __name__ == "__main__":
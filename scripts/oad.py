@@ -14,6 +14,7 @@ import spoon.daemon
 import oa
 import oa.config
 import oa.server
+import oa.regex_backend
 
 
 def run_daemon(args):
@@ -24,13 +25,15 @@ def run_daemon(args):
     if args.prefork is not None:
         server = oa.server.PreForkServer(
             address, args.sitepath, args.configpath, paranoid=args.paranoid,
-            ignore_unknown=not args.show_unknown
+            ignore_unknown=not args.show_unknown, warm_up=args.warm_up,
+            cache_dir=args.cache_dir
         )
         server.prefork = args.prefork
     else:
         server = oa.server.Server(
             address, args.sitepath, args.configpath, paranoid=args.paranoid,
-            ignore_unknown=not args.show_unknown
+            ignore_unknown=not args.show_unknown, warm_up=args.warm_up,
+            cache_dir=args.cache_dir
         )
     try:
         server.serve_forever()
@@ -79,6 +82,17 @@ def main():
     parser.add_argument("-dl", "--deactivate-lazy", dest="lazy_mode",
                         action="store_true", default=False,
                         help="Deactivate lazy loading of rules/regex")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Store the parsed ruleset in this directory "
+                             "and reuse it while the configuration files "
+                             "are unchanged")
+    parser.add_argument("--regex-backend", default="re",
+                        choices=sorted(oa.regex_backend.BACKENDS),
+                        help="Regex engine used for the rule patterns, "
+                             "falls back to re for unsupported patterns")
+    parser.add_argument("--warm-up", action="store_true", default=False,
+                        help="Compile the regexes in the background "
+                             "after startup")
     # parser.add_argument("-4", "--ipv4-only", "--ipv4", default=False,
     #                     action="store_true", help="Use IPv4 where
     # applicable, "
@@ -91,6 +105,10 @@ def main():
                         version=oa.__version__)
     args = parser.parse_args()
     oa.config.LAZY_MODE = not args.lazy_mode
+    try:
+        oa.regex_backend.set_backend(args.regex_backend)
+    except ValueError as e:
+        parser.error(str(e))
     logger = oa.config.setup_logging("oa-logger", debug=args.debug,
                                      filepath=args.log_file)
     if args.action:
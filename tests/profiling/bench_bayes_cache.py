@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+
+"""Compare the cost of looking up the Bayes tokens of messages that share
+many tokens (headers, signatures, boilerplate) with the MySQL store
+alone and with the in-process token cache in front of it, and check that
+both give the same results.
+
+The store runs against a local SQLite stand-in for the server. Every
+statement waits for `--latency` milliseconds.
+
+Usage:
+
+    python -m tests.profiling.bench_bayes_cache [--count 500] [--size 300]
+        [--common 0.5] [--latency 0.2]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+import oa.db.bayes
+import oa.db.bayes.cache
+import oa.db.bayes.mysql
+
+import tests.util.benchmark
+
+
+class Store(oa.db.bayes.mysql.Store):
+    """Count the tokens looked up in the database."""
+
+    looked_up = 0
+
+    def tok_get_all(self, tokens):
+        tokens = list(tokens)
+        self.looked_up += len(tokens)
+        return super(Store, self).tok_get_all(tokens)
+
+
+def scan(store, messages):
+    results = []
+    for tokens in messages:
+        totals = store.nspam_nham_get()
+        results.append((tuple(totals), sorted(store.tok_get_all(tokens))))
+    return results
+
+
+def run(name, store, messages):
+    """Scan the messages and report the time, the number of round trips
+    and of tokens looked up in the database per message.
+    """
+    sql_store = getattr(store, "store", store)
+    sql_store.conn.round_trips = 0
+    sql_store.looked_up = 0
+    start = time.time()
+    results = scan(store, messages)
+    tests.util.benchmark.report(name, time.time() - start, len(messages))
+    print("%-40s %10.1f round trips/msg %10.1f tokens queried/msg" %
+          ("", float(sql_store.conn.round_trips) / len(messages),
+           float(sql_store.looked_up) / len(messages)))
+    return results
+
+
+def generate_messages(rnd, count, size, common, vocabulary):
+    """Every message has this ratio of tokens from a small set of
+    frequent tokens, the rest come from the whole vocabulary.
+    """
+    frequent = vocabulary[:size * 2]
+    messages = []
+    for dummy in range(count):
+        tokens = set(rnd.sample(frequent, int(size * common)))
+        while len(tokens) < size:
+            tokens.add(rnd.choice(vocabulary))
+        messages.append(list(tokens))
+    return messages
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=500,
+                        help="Number of messages.")
+    parser.add_argument("--size", type=int, default=300,
+                        help="Number of tokens in each message.")
+    parser.add_argument("--common", type=float, default=0.5,
+                        help="Ratio of frequent tokens in the messages.")
+    parser.add_argument("--vocabulary", type=int, default=100000,
+                        help="Number of distinct tokens.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Latency of a round trip in milliseconds.")
+    parser.add_argument("--cache-size", type=int,
+                        default=oa.db.bayes.cache.DEFAULT_CACHE_SIZE,
+                        help="Size of the token cache.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    vocabulary = tests.util.benchmark.generate_tokens(rnd, options.vocabulary)
+    messages = generate_messages(rnd, options.count, options.size,
+                                 options.common, vocabulary)
+
+    conn = tests.util.benchmark.SQLiteConnection(
+        latency=options.latency / 1000.0)
+    cursor = conn.cursor()
+    # Half of the tokens were learned.
+    cursor.executemany(
+        "INSERT INTO bayes_token (token, spam_count, ham_count, atime) "
+        "VALUES (%s, %s, %s, %s)",
+        [(token, rnd.randint(0, 100), rnd.randint(0, 100), 0)
+         for token in vocabulary[::2]])
+    cursor.execute("INSERT INTO bayes_vars (spam_count, ham_count) "
+                   "VALUES (1000, 1000)")
+    conn.commit()
+    store = Store(tests.util.benchmark.BayesPlugin(
+        bayes_sql_batch_size=oa.db.bayes.DEFAULT_BATCH_SIZE))
+    store.conn = conn
+
+    expected = run("No cache", store, messages)
+    cache = oa.db.bayes.cache.CachedStore(store, options.cache_size)
+    results = run("Token cache", cache, messages)
+    print("Cache: %s" % cache.get_stats())
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#! /usr/bin/env python
+
+"""Compare the cost of learning messages in the Bayes database with an
+UPDATE (and an INSERT for new tokens) per token, and with the bulk
+upsert of the SQLAlchemy store, with and without the upsert support of
+the dialect, and check that all give the same token counts.
+
+The stores run against SQLite engines. Every statement waits for
+`--latency` milliseconds to simulate the round trip to a remote server.
+
+Usage:
+
+    python -m tests.profiling.bench_bayes_learn [--count 200]
+        [--size 300] [--vocabulary 20000] [--latency 0.2]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+try:
+    from unittest.mock import patch, PropertyMock
+except ImportError:
+    from mock import patch, PropertyMock
+
+import sqlalchemy
+
+import oa.db.bayes
+import oa.db.bayes.sqlalchemy
+
+import tests.util.benchmark
+
+
+def per_token(store, spam, ham, tokens, msgatime):
+    """Update every token with its own statement, and insert it when
+    it's not in the database yet.
+    """
+    for token in tokens:
+        result = store.conn.execute(sqlalchemy.text(
+            "UPDATE bayes_token SET spam_count=spam_count + :spam, "
+            "ham_count=ham_count + :ham, atime=:atime WHERE token=:token"),
+            {"spam": spam, "ham": ham, "atime": msgatime, "token": token})
+        if not result.rowcount:
+            store.conn.execute(sqlalchemy.text(
+                "INSERT INTO bayes_token "
+                "(id, token, spam_count, ham_count, atime) "
+                "VALUES (0, :token, :spam, :ham, :atime)"),
+                {"spam": spam, "ham": ham, "atime": msgatime,
+                 "token": token})
+
+
+def bulk(store, spam, ham, tokens, msgatime):
+    store.multi_tok_count_change(spam, ham, tokens, msgatime)
+
+
+def get_store(latency):
+    engine = sqlalchemy.create_engine("sqlite://")
+    oa.db.bayes.sqlalchemy.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in tests.util.benchmark.BAYES_SQLITE_SCHEMA:
+            if statement.startswith("CREATE INDEX"):
+                conn.execute(sqlalchemy.text(statement))
+        conn.execute(oa.db.bayes.sqlalchemy.BayesVars.__table__.insert(),
+                     {"id": 1, "spam_count": 0, "ham_count": 0})
+    plugin = tests.util.benchmark.BayesPlugin(
+        engine, bayes_sql_batch_size=oa.db.bayes.DEFAULT_BATCH_SIZE)
+    store = oa.db.bayes.sqlalchemy.Store(plugin)
+    store.tie_db_writeable()
+    return store, tests.util.benchmark.count_round_trips(engine, latency)
+
+
+def learn(name, func, messages, latency):
+    """Learn all the messages, with a transaction per message, and
+    report the time and the number of round trips per message.
+    """
+    store, counter = get_store(latency)
+    start = time.time()
+    for i, (isspam, tokens) in enumerate(messages):
+        spam, ham = (1, 0) if isspam else (0, 1)
+        store.nspam_nham_change(spam, ham)
+        func(store, spam, ham, tokens, 1000 + i)
+        store.seen_put("<%d@example.com>" % i, "s" if isspam else "h")
+        store.cleanup()
+    elapsed = time.time() - start
+    tests.util.benchmark.report(name, elapsed, len(messages))
+    print("%-40s %10.1f msgs/min %10.1f round trips/msg" %
+          ("", len(messages) * 60 / elapsed,
+           float(counter[0]) / len(messages)))
+    table = oa.db.bayes.sqlalchemy.BayesToken.__table__
+    return sorted(tuple(row) for row in store.conn.execute(table.select()))
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=200,
+                        help="Number of learned messages.")
+    parser.add_argument("--size", type=int, default=300,
+                        help="Number of tokens in each message.")
+    parser.add_argument("--vocabulary", type=int, default=20000,
+                        help="Number of distinct tokens.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Latency of a round trip in milliseconds.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    latency = options.latency / 1000.0
+    vocabulary = tests.util.benchmark.generate_tokens(rnd, options.vocabulary)
+    messages = [(rnd.random() < 0.5, rnd.sample(vocabulary, options.size))
+                for dummy in range(options.count)]
+
+    expected = learn("Statement per token", per_token, messages, latency)
+    results = [learn("Bulk upsert", bulk, messages, latency)]
+    with patch("oa.db.bayes.sqlalchemy.Store.dialect",
+               new_callable=PropertyMock, return_value="other"):
+        results.append(learn("Bulk update and insert, no upsert", bulk,
+                             messages, latency))
+
+    if any(expected != result for result in results):
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+
+"""Compare the cost of looking up the tokens of a message in the Bayes
+database with a query per token, like the stores used to, and in
+batches with a single query each, and check that both give the same
+results.
+
+The MySQL store runs against a local SQLite stand-in for the server and
+the SQLAlchemy store (if available) against an SQLite engine. Every
+statement waits for `--latency` milliseconds to simulate the round trip
+to a remote server.
+
+Usage:
+
+    python -m tests.profiling.bench_bayes_lookup [--vocabulary 100000]
+        [--sizes 100,1000,5000] [--latency 0.2] [--batch-size 500]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+import oa.db.bayes
+import oa.db.bayes.mysql
+
+import tests.util.benchmark
+
+
+def per_token(conn, tokens):
+    """Look up every token with its own query."""
+    cursor = conn.cursor()
+    results = []
+    for token in tokens:
+        cursor.execute(
+            "SELECT token, spam_count, ham_count, atime "
+            "FROM bayes_token WHERE token=%s", (token, )
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            results.append(tuple(row))
+    cursor.close()
+    return results
+
+
+def batched(store, tokens):
+    return [tuple(row) for row in store.tok_get_all(tokens)]
+
+
+def run(name, func, counter, messages, *args):
+    """Look up the tokens of all the messages and report the time and
+    the number of round trips per message.
+    """
+    before = counter()
+    start = time.time()
+    results = [sorted(func(*(args + (tokens,)))) for tokens in messages]
+    elapsed = time.time() - start
+    tests.util.benchmark.report(name, elapsed, len(messages))
+    print("%-40s %10.1f round trips/msg" %
+          ("", float(counter() - before) / len(messages)))
+    return results
+
+
+def populate(rnd, vocabulary):
+    """Generate the rows of the tokens in the database."""
+    return [(token, rnd.randint(0, 100), rnd.randint(0, 100),
+             rnd.randint(0, 2 ** 30))
+            for token in tests.util.benchmark.generate_tokens(rnd, vocabulary)]
+
+
+def generate_messages(rnd, rows, size, count):
+    """Generate the tokens of the messages, half of them are in the
+    database.
+    """
+    known = [row[0] for row in rows]
+    messages = []
+    for dummy in range(count):
+        tokens = rnd.sample(known, min(size // 2, len(known)))
+        tokens.extend(tests.util.benchmark.generate_tokens(
+            rnd, size - len(tokens)))
+        messages.append(tokens)
+    return messages
+
+
+def get_sqlalchemy_store(rows, plugin, latency):
+    try:
+        import sqlalchemy
+        import oa.db.bayes.sqlalchemy
+    except ImportError:
+        return None, None
+    engine = sqlalchemy.create_engine("sqlite://")
+    oa.db.bayes.sqlalchemy.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in tests.util.benchmark.BAYES_SQLITE_SCHEMA:
+            if statement.startswith("CREATE INDEX"):
+                conn.execute(sqlalchemy.text(statement))
+    with engine.begin() as conn:
+        conn.execute(oa.db.bayes.sqlalchemy.BayesToken.__table__.insert(), [
+            {"id": 0, "token": token, "spam_count": spam_count,
+             "ham_count": ham_count, "atime": atime}
+            for token, spam_count, ham_count, atime in rows
+        ])
+    plugin.engine = engine
+    store = oa.db.bayes.sqlalchemy.Store(plugin)
+    store.tie_db_writeable()
+    return store, count_round_trips(engine, latency)
+
+
+def count_round_trips(engine, latency):
+    counter = tests.util.benchmark.count_round_trips(engine, latency)
+    return lambda: counter[0]
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--vocabulary", type=int, default=100000,
+                        help="Number of tokens in the database.")
+    parser.add_argument("--sizes", default="100,1000,5000",
+                        help="Comma separated number of tokens in the "
+                             "messages.")
+    parser.add_argument("--count", type=int, default=5,
+                        help="Number of messages of each size.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Latency of a round trip in milliseconds.")
+    parser.add_argument("--batch-size", type=int,
+                        default=oa.db.bayes.DEFAULT_BATCH_SIZE,
+                        help="Number of tokens looked up in a query.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    latency = options.latency / 1000.0
+    rows = populate(rnd, options.vocabulary)
+
+    conn = tests.util.benchmark.SQLiteConnection(latency=latency)
+    conn.cursor().executemany(
+        "INSERT INTO bayes_token (token, spam_count, ham_count, atime) "
+        "VALUES (%s, %s, %s, %s)", rows)
+    conn.commit()
+    plugin = tests.util.benchmark.BayesPlugin(
+        bayes_sql_batch_size=options.batch_size)
+    mysql_store = oa.db.bayes.mysql.Store(plugin)
+    mysql_store.conn = conn
+    sqlalchemy_store, sqlalchemy_counter = get_sqlalchemy_store(
+        rows, plugin, latency)
+
+    same = True
+    for size in (int(size) for size in options.sizes.split(",")):
+        print("%d tokens per message" % size)
+        messages = generate_messages(rnd, rows, size, options.count)
+        counter = lambda: conn.round_trips
+        expected = run("Query per token", per_token, counter, messages, conn)
+        results = run("MySQL store, batched", batched, counter, messages,
+                      mysql_store)
+        same = same and expected == results
+        if sqlalchemy_store is not None:
+            results = run("SQLAlchemy store, batched", batched,
+                          sqlalchemy_counter, messages, sqlalchemy_store)
+            same = same and expected == results
+
+    if not same:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
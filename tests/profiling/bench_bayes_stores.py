@@ -0,0 +1,186 @@
+#! /usr/bin/env python
+
+"""Compare the cost of learning and scanning messages with the SQLAlchemy
+store and with the embedded SQLite store, and check that both give the
+same results.
+
+The SQLAlchemy store runs against a SQLite engine, every statement waits
+for `--latency` milliseconds to simulate the round trip to a remote
+server. The embedded store uses a database file in a temporary
+directory.
+
+With `--readers`, the messages are also scanned by this many forked
+processes with the embedded store while the main process learns, to
+check that the readers are never locked out by the writer.
+
+Usage:
+
+    python -m tests.profiling.bench_bayes_stores [--count 200]
+        [--size 300] [--vocabulary 20000] [--latency 0.2] [--readers 4]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import sqlalchemy
+
+import oa.db.bayes
+import oa.db.bayes.sqlite
+import oa.db.bayes.sqlalchemy
+
+import tests.util.benchmark
+
+
+def get_sqlalchemy_store(latency):
+    engine = sqlalchemy.create_engine("sqlite://")
+    oa.db.bayes.sqlalchemy.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in tests.util.benchmark.BAYES_SQLITE_SCHEMA:
+            if statement.startswith("CREATE INDEX"):
+                conn.execute(sqlalchemy.text(statement))
+        conn.execute(oa.db.bayes.sqlalchemy.BayesVars.__table__.insert(),
+                     {"id": 1, "spam_count": 0, "ham_count": 0})
+    plugin = tests.util.benchmark.BayesPlugin(
+        engine, bayes_sql_batch_size=oa.db.bayes.DEFAULT_BATCH_SIZE)
+    store = oa.db.bayes.sqlalchemy.Store(plugin)
+    store.tie_db_writeable()
+    tests.util.benchmark.count_round_trips(engine, latency)
+    return store
+
+
+def get_sqlite_store(path):
+    plugin = tests.util.benchmark.BayesPlugin(
+        bayes_sql_batch_size=oa.db.bayes.DEFAULT_BATCH_SIZE,
+        bayes_path=path, bayes_auto_expire=0)
+    store = oa.db.bayes.sqlite.Store(plugin)
+    store.tie_db_writeable()
+    return store
+
+
+def learn(store, messages):
+    for i, (isspam, tokens) in enumerate(messages):
+        spam, ham = (1, 0) if isspam else (0, 1)
+        store.nspam_nham_change(spam, ham)
+        store.multi_tok_count_change(spam, ham, tokens, 1000 + i)
+        store.seen_put("<%d@example.com>" % i, "s" if isspam else "h")
+        store.cleanup()
+
+
+def scan(store, messages):
+    results = []
+    for dummy, tokens in messages:
+        totals = tuple(store.nspam_nham_get())
+        tokens = sorted((bytes(row[0]),) + tuple(row[1:])
+                        for row in store.tok_get_all(tokens))
+        results.append((totals, tokens))
+    return results
+
+
+def run(name, store, learned, scanned):
+    """Learn and scan the messages, and report the time of each."""
+    start = time.time()
+    learn(store, learned)
+    elapsed = time.time() - start
+    tests.util.benchmark.report("%s (learn)" % name, elapsed, len(learned))
+    start = time.time()
+    results = scan(store, scanned)
+    elapsed = time.time() - start
+    tests.util.benchmark.report("%s (scan)" % name, elapsed, len(scanned))
+    return results
+
+
+def reader(path, messages):
+    """Scan the messages in a forked process, the exit status is 1 if
+    any scan failed.
+    """
+    status = 0
+    try:
+        store = get_sqlite_store(path)
+        for message in messages:
+            store.tie_db_readonly()
+            scan(store, [message])
+            store.untie_db()
+    except Exception as e:
+        print("Reader %s failed: %s" % (os.getpid(), e))
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def run_concurrent(path, learned, scanned, readers):
+    """Learn the messages in this process while the readers scan."""
+    writer = get_sqlite_store(path)
+    pids = []
+    for dummy in range(readers):
+        pid = os.fork()
+        if pid == 0:
+            reader(path, scanned)
+        pids.append(pid)
+    start = time.time()
+    learn(writer, learned)
+    tests.util.benchmark.report("Embedded store (learn, %d readers)" %
+                                readers, time.time() - start, len(learned))
+    failed = 0
+    for pid in pids:
+        dummy, status = os.waitpid(pid, 0)
+        failed += status != 0
+    elapsed = time.time() - start
+    tests.util.benchmark.report("Embedded store (scan, %d readers)" %
+                                readers, elapsed, len(scanned) * readers)
+    return failed
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=200,
+                        help="Number of learned and scanned messages.")
+    parser.add_argument("--size", type=int, default=300,
+                        help="Number of tokens in each message.")
+    parser.add_argument("--vocabulary", type=int, default=20000,
+                        help="Number of distinct tokens.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Latency of a round trip in milliseconds.")
+    parser.add_argument("--readers", type=int, default=4,
+                        help="Number of concurrent reader processes.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    vocabulary = tests.util.benchmark.generate_tokens(rnd, options.vocabulary)
+    learned = [(rnd.random() < 0.5, rnd.sample(vocabulary, options.size))
+               for dummy in range(options.count)]
+    scanned = [(None, rnd.sample(vocabulary, options.size))
+               for dummy in range(options.count)]
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        expected = run("SQLAlchemy store",
+                       get_sqlalchemy_store(options.latency / 1000.0),
+                       learned, scanned)
+        results = run("Embedded store",
+                      get_sqlite_store(os.path.join(tmpdir, "bayes")),
+                      learned, scanned)
+        failed = 0
+        if options.readers and hasattr(os, "fork"):
+            failed = run_concurrent(os.path.join(tmpdir, "concurrent"),
+                                    learned, scanned, options.readers)
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+    if failed:
+        print("%d readers failed!" % failed)
+        sys.exit(1)
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
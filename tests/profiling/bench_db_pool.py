@@ -0,0 +1,122 @@
+#! /usr/bin/env python
+
+"""Compare the cost of looking up the Bayes tokens of messages with the
+MySQL store when a new connection is opened for every message, like the
+store used to, and with the pool of persistent connections, and check
+that both give the same results.
+
+The store runs against a local SQLite stand-in for the server. Opening
+a connection waits for `--connect-latency` milliseconds and every
+statement for `--latency` milliseconds.
+
+Usage:
+
+    python -m tests.profiling.bench_db_pool [--count 500] [--size 300]
+        [--connect-latency 3] [--latency 0.2]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import oa.db.pool
+import oa.db.bayes
+import oa.db.bayes.mysql
+
+import tests.util.benchmark
+
+
+class Plugin(tests.util.benchmark.BayesPlugin):
+    """Bayes plug-in stand-in that gets the connections from a pool."""
+
+    def __init__(self, pool, **options):
+        super(Plugin, self).__init__(**options)
+        self.pool = pool
+
+    def get_connection(self):
+        return self.pool.acquire()
+
+    def release_connection(self, conn):
+        self.pool.release(conn)
+
+
+def scan(store, messages):
+    results = []
+    for tokens in messages:
+        store.tie_db_readonly()
+        store.nspam_nham_get()
+        results.append(sorted(store.tok_get_all(tokens)))
+        store.untie_db()
+    return results
+
+
+def run(name, messages, connect, size):
+    pool = oa.db.pool.ConnectionPool(name, connect, size)
+    store = oa.db.bayes.mysql.Store(
+        Plugin(pool, bayes_sql_batch_size=oa.db.bayes.DEFAULT_BATCH_SIZE))
+    start = time.time()
+    results = scan(store, messages)
+    tests.util.benchmark.report(name, time.time() - start, len(messages))
+    print("Pool: %s" % pool.get_stats())
+    return results
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=500,
+                        help="Number of messages.")
+    parser.add_argument("--size", type=int, default=300,
+                        help="Number of tokens in each message.")
+    parser.add_argument("--vocabulary", type=int, default=20000,
+                        help="Number of tokens in the database.")
+    parser.add_argument("--connect-latency", type=float, default=3,
+                        help="Time to open a connection in milliseconds.")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Latency of a round trip in milliseconds.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    latency = options.latency / 1000.0
+    connect_latency = options.connect_latency / 1000.0
+    vocabulary = tests.util.benchmark.generate_tokens(rnd, options.vocabulary)
+    messages = [rnd.sample(vocabulary, options.size)
+                for dummy in range(options.count)]
+
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "bayes.db")
+    conn = tests.util.benchmark.SQLiteConnection(path)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO bayes_token (token, spam_count, ham_count, atime) "
+        "VALUES (%s, %s, %s, %s)",
+        [(token, rnd.randint(0, 100), rnd.randint(0, 100), 0)
+         for token in vocabulary[::2]])
+    cursor.execute("INSERT INTO bayes_vars (spam_count, ham_count) "
+                   "VALUES (1000, 1000)")
+    conn.commit()
+
+    def connect():
+        time.sleep(connect_latency)
+        return tests.util.benchmark.SQLiteConnection(path, latency)
+
+    try:
+        expected = run("Connection per message", messages, connect, 0)
+        results = run("Pooled connections", messages, connect,
+                      oa.db.pool.DEFAULT_POOL_SIZE)
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
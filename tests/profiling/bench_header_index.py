@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+
+"""Compare checking the header rules grouped by header against checking
+each header rule separately.
+
+Usage:
+
+    python -m tests.profiling.bench_header_index [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+
+import tests.util.benchmark
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs to average over.")
+    options = parser.parse_args()
+
+    ruleset = tests.util.benchmark.get_ruleset(options)
+    messages = tests.util.benchmark.parse_messages(
+        ruleset, tests.util.benchmark.get_raw_messages(options))
+    print("%s rules checked, %s header rules in %s groups, %s messages" %
+          (len(ruleset.checked), len(ruleset.header_index),
+           len(ruleset.header_index.groups), len(messages)))
+
+    ruleset.use_header_index = False
+    ruleset.build_header_index()
+    base_time, base_hits = tests.util.benchmark.run(ruleset, messages,
+                                                    options.repeat)
+    tests.util.benchmark.report("Per rule", base_time, len(messages))
+
+    ruleset.use_header_index = True
+    ruleset.build_header_index()
+    index_time, index_hits = tests.util.benchmark.run(ruleset, messages,
+                                                      options.repeat)
+    tests.util.benchmark.report("Header index", index_time, len(messages))
+
+    if not tests.util.benchmark.compare_hits(base_hits, index_hits,
+                                             ("per rule", "index")):
+        print("Hit sets differ!")
+        sys.exit(1)
+    print("Hit sets are identical.")
+
+
+if __name__ == "__main__":
+    main()
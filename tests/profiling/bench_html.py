@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+"""Compare parsing the HTML parts of the messages once for the text,
+the links and the visible text, and parsing them again for the links
+like the URI plugins used to, and check that both find the same text
+and links.
+
+Usage:
+
+    python -m tests.profiling.bench_html [--count 200]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+import oa.message
+import oa.html_parser
+
+import tests.util.benchmark
+
+
+def generate_html_message(rnd, paragraphs=50):
+    """Generate a message with a large HTML part."""
+    body = []
+    for dummy in range(paragraphs):
+        text = " ".join(rnd.choice(tests.util.benchmark.WORDS)
+                        for dummy in range(30))
+        link = "http://%s%d.example.com/" % (
+            rnd.choice(tests.util.benchmark.WORDS), rnd.randint(0, 99))
+        body.append("<div class=\"p\"><p>%s <a href=\"%s\">%s</a></p>"
+                    "<span style=\"display:none\">%s</span></div>" %
+                    (text, link, link, text[:50]))
+    return (
+        "From: Sender <sender@example.com>\n"
+        "To: rcpt@example.net\n"
+        "Subject: test\n"
+        "MIME-Version: 1.0\n"
+        "Content-Type: text/html\n"
+        "\n"
+        "<html><head><style>p {color: red}</style></head><body>\n"
+        "%s\n</body></html>\n" % "\n".join(body)
+    )
+
+
+def separate(ruleset, raw_messages):
+    """Parse the HTML for the text and then again for the links."""
+    results = []
+    for raw in raw_messages:
+        msg = oa.message.Message(ruleset.ctxt, raw)
+        text = []
+        for payload, part in msg._iter_parts(msg.msg):
+            if payload is not None and part.get_content_subtype() == "html":
+                text.extend(msg.normalize_html_part(payload))
+        parser = oa.html_parser.HTML(ruleset.ctxt.log)
+        parser.feed("\n".join(payload for payload, part in
+                              msg._iter_parts(msg.msg)
+                              if payload is not None))
+        results.append((text, sorted(parser.links)))
+    return results
+
+
+def single(ruleset, raw_messages):
+    """Parse the HTML once and reuse the results."""
+    results = []
+    for raw in raw_messages:
+        msg = oa.message.Message(ruleset.ctxt, raw)
+        text = msg.html_visible_text + msg.html_invisible_text
+        results.append((sorted(text), sorted(msg.html_links)))
+    return results
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=200,
+                        help="Number of messages.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    raw_messages = [generate_html_message(rnd) for dummy in
+                    range(options.count)]
+    ruleset = tests.util.benchmark.get_ruleset(options, "")
+
+    start = time.time()
+    expected = separate(ruleset, raw_messages)
+    tests.util.benchmark.report("Separate passes", time.time() - start,
+                                len(raw_messages))
+    start = time.time()
+    result = single(ruleset, raw_messages)
+    tests.util.benchmark.report("Single pass", time.time() - start,
+                                len(raw_messages))
+
+    for (text, links), (new_text, new_links) in zip(expected, result):
+        if sorted(text) != new_text or links != new_links:
+            print("Results differ!")
+            sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
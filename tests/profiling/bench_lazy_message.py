@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+
+"""Compare checking a large message against header only rules when the
+message is parsed on demand and when all of it is parsed upfront, and
+check that both give the same results.
+
+Usage:
+
+    python -m tests.profiling.bench_lazy_message [--size 10]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+
+import oa.message
+
+import tests.util.benchmark
+
+
+def check(ruleset, raw, eager, repeat):
+    """Parse and match the message, returns the elapsed time and the
+    hits.
+    """
+    hits = None
+    start = time.time()
+    for dummy in range(repeat):
+        msg = oa.message.Message(ruleset.ctxt, raw)
+        if eager:
+            msg.prepare(*oa.message.LAZY_ATTRIBUTES)
+        ruleset.match(msg)
+        hits = tests.util.benchmark.get_hits(msg)
+    return (time.time() - start) / repeat, hits
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--size", type=int, default=10,
+                        help="Approximate size of the message in MB.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of checks.")
+    options = parser.parse_args()
+
+    config = tests.util.benchmark.generate_header_rules(options.rules,
+                                                        options.seed)
+    ruleset = tests.util.benchmark.get_ruleset(options, config)
+    raw = tests.util.benchmark.generate_large_message(options.size,
+                                                      options.seed)
+    print("Message size: %.1f MB" % (len(raw) / 1024.0 / 1024.0))
+
+    elapsed, expected = check(ruleset, raw, True, options.repeat)
+    tests.util.benchmark.report("Parsed upfront", elapsed, 1)
+    elapsed, hits = check(ruleset, raw, False, options.repeat)
+    tests.util.benchmark.report("Parsed on demand", elapsed, 1)
+
+    if not tests.util.benchmark.compare_hits([expected], [hits],
+                                             ("upfront", "on demand")):
+        print("Hit sets differ!")
+        sys.exit(1)
+    print("Hit sets are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+"""Compare the memory used to check large messages with attachments
+when they are decoded to text first and when they are passed to the
+message as bytes, and check that both give the same results.
+
+Usage:
+
+    python -m tests.profiling.bench_message_memory [--size 10]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import tracemalloc
+
+import oa.message
+
+import tests.util.benchmark
+
+
+def check(ruleset, raw, decode):
+    """Parse and match the message. Returns the elapsed time, the peak
+    memory, the memory still used by the message and the hits.
+    """
+    tracemalloc.start()
+    start = time.time()
+    if decode:
+        raw = raw.decode("utf-8", "ignore")
+    msg = oa.message.Message(ruleset.ctxt, raw)
+    ruleset.match(msg)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, current, tests.util.benchmark.get_hits(msg)
+
+
+def report(name, elapsed, peak, current):
+    print("%-32s %8.4fs %8.1f MB peak %8.1f MB kept" %
+          (name, elapsed, peak / 1024.0 / 1024.0, current / 1024.0 / 1024.0))
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--size", type=int, default=10,
+                        help="Approximate size of the messages in MB.")
+    options = parser.parse_args()
+
+    raw = tests.util.benchmark.generate_large_message(options.size,
+                                                      options.seed)
+    raw = raw.replace("\n", "\r\n").encode("utf-8")
+    print("Message size: %.1f MB" % (len(raw) / 1024.0 / 1024.0))
+
+    same = True
+    for name, config in (
+            ("all rules", None),
+            ("header rules", tests.util.benchmark.generate_header_rules(
+                options.rules, options.seed))):
+        ruleset = tests.util.benchmark.get_ruleset(options, config)
+        elapsed, peak, current, expected = check(ruleset, raw, True)
+        report("Decoded to text, %s" % name, elapsed, peak, current)
+        elapsed, peak, current, hits = check(ruleset, raw, False)
+        report("Bytes, %s" % name, elapsed, peak, current)
+        same &= tests.util.benchmark.compare_hits([expected], [hits],
+                                                  ("text", "bytes"))
+    if not same:
+        print("Hit sets differ!")
+        sys.exit(1)
+    print("Hit sets are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+
+"""Compare the cost of checking relay IPs against a long list of
+`trusted_networks` by checking every network in order, like the network
+lists used to, and with the radix tree, and check that both give the
+same results.
+
+Usage:
+
+    python -m tests.profiling.bench_networks [--networks 500]
+        [--lookups 20000] [--excluded 0.1]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+import ipaddress
+
+import oa.networks
+
+import tests.util.benchmark
+
+
+def generate_networks(rnd, count, excluded):
+    """Generate network strings as they are written in the configuration,
+    with this ratio of excluded networks.
+    """
+    networks = []
+    for dummy in range(count):
+        address = ipaddress.ip_address(rnd.getrandbits(16) << 16 |
+                                       rnd.getrandbits(16))
+        prefix = rnd.choice((16, 20, 24, 24, 24, 28, 32))
+        network = ipaddress.ip_network((int(address), 32)).supernet(
+            new_prefix=prefix) if prefix < 32 else address
+        networks.append("%s%s" % ("!" if rnd.random() < excluded else "",
+                                  network))
+    return networks
+
+
+def linear(networks, ips):
+    """Check every network in order."""
+    results = []
+    for ip in ips:
+        result = False
+        for network, accepted in networks:
+            if ip in network:
+                result = accepted
+                break
+        results.append(result)
+    return results
+
+
+def indexed(trusted, ips):
+    return [ip in trusted for ip in ips]
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--networks", type=int, default=500,
+                        help="Number of trusted networks.")
+    parser.add_argument("--lookups", type=int, default=20000,
+                        help="Number of IPs checked.")
+    parser.add_argument("--excluded", type=float, default=0.1,
+                        help="Ratio of excluded networks.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    networks = oa.networks.NetworkList()
+    networks.trusted.clear()
+    for network in generate_networks(rnd, options.networks,
+                                     options.excluded):
+        networks.add_trusted_network(network)
+    # Half of the IPs are in the configured networks.
+    ips = []
+    for dummy in range(options.lookups):
+        if rnd.random() < 0.5:
+            network = rnd.choice(networks.trusted._networks)[0]
+            ips.append(network.network_address +
+                       rnd.randint(0, network.num_addresses - 1))
+        else:
+            ips.append(ipaddress.ip_address(rnd.getrandbits(32)))
+
+    start = time.time()
+    expected = linear(networks.trusted._networks, ips)
+    tests.util.benchmark.report("Every network in order",
+                                time.time() - start, len(ips))
+    start = time.time()
+    results = indexed(networks.trusted, ips)
+    tests.util.benchmark.report("Radix tree", time.time() - start, len(ips))
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+
+"""Compare the literal prefilter against matching every body, rawbody and
+full rule regex.
+
+Usage:
+
+    python -m tests.profiling.bench_prefilter [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+
+import tests.util.benchmark
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs to average over.")
+    options = parser.parse_args()
+
+    ruleset = tests.util.benchmark.get_ruleset(options)
+    messages = tests.util.benchmark.parse_messages(
+        ruleset, tests.util.benchmark.get_raw_messages(options))
+    print("%s rules checked, %s handled by the prefilter, %s messages" %
+          (len(ruleset.checked), len(ruleset.prefilter), len(messages)))
+
+    ruleset.use_prefilter = False
+    ruleset.build_prefilter()
+    base_time, base_hits = tests.util.benchmark.run(ruleset, messages,
+                                                    options.repeat)
+    tests.util.benchmark.report("Without prefilter", base_time, len(messages))
+
+    ruleset.use_prefilter = True
+    ruleset.build_prefilter()
+    pre_time, pre_hits = tests.util.benchmark.run(ruleset, messages,
+                                                  options.repeat)
+    tests.util.benchmark.report("With prefilter", pre_time, len(messages))
+
+    if not tests.util.benchmark.compare_hits(base_hits, pre_hits,
+                                             ("regex", "prefilter")):
+        print("Hit sets differ!")
+        sys.exit(1)
+    print("Hit sets are identical.")
+
+
+if __name__ == "__main__":
+    main()
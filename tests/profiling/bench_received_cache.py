@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+
+"""Compare the cost of parsing the Received headers of messages that
+passed through the same relays with and without the shared cache of
+parsed headers, and check that both give the same results.
+
+Usage:
+
+    python -m tests.profiling.bench_received_cache [--count 2000]
+        [--relays 50] [--cache-size 10000]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+import oa.received_parser
+
+import tests.util.benchmark
+
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def generate_relays(rnd, relays):
+    """Generate the templates of the headers added by the relays, with
+    the id and the date left out.
+    """
+    templates = []
+    for i in range(relays):
+        word = rnd.choice(tests.util.benchmark.WORDS)
+        templates.append(
+            "from mail%d.%s.example.com (mail%d.%s.example.com "
+            "[192.0.2.%d]) by mx%d.example.org with ESMTPS id %%s "
+            "for <user@example.org>; %%s" %
+            (i, word, i, word, i % 255, i % 3))
+    return templates
+
+
+def generate_headers(rnd, templates, count):
+    """Generate the Received headers of the messages, every message
+    passed through two of the relays.
+    """
+    messages = []
+    for dummy in range(count):
+        headers = []
+        for template in rnd.sample(templates, 2):
+            relay_id = "%08X%04d" % (rnd.getrandbits(32), rnd.randint(0, 9999))
+            date = "%s, %d Jan 2017 %02d:%02d:%02d +0000" % (
+                rnd.choice(DAYS), rnd.randint(1, 28), rnd.randint(0, 23),
+                rnd.randint(0, 59), rnd.randint(0, 59))
+            headers.append(template % (relay_id, date))
+        messages.append(headers)
+    return messages
+
+
+def run(messages, cache):
+    start = time.time()
+    results = [oa.received_parser.ReceivedParser(headers, cache).received
+               for headers in messages]
+    return time.time() - start, results
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=2000,
+                        help="Number of messages.")
+    parser.add_argument("--relays", type=int, default=50,
+                        help="Number of distinct relays.")
+    parser.add_argument("--cache-size", type=int,
+                        default=oa.received_parser.DEFAULT_CACHE_SIZE,
+                        help="Size of the cache.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    templates = generate_relays(rnd, options.relays)
+    messages = generate_headers(rnd, templates, options.count)
+
+    elapsed, expected = run(messages, None)
+    tests.util.benchmark.report("No cache", elapsed, len(messages))
+    cache = oa.received_parser.ReceivedCache(options.cache_size)
+    elapsed, results = run(messages, cache)
+    tests.util.benchmark.report("Shared cache", elapsed, len(messages))
+    print("Cache: %s" % cache.get_stats())
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
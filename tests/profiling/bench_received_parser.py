@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+"""Compare the cost of parsing Received headers with a regular expression
+for every field and with the tokenizer, and check that both give the
+same results. The shared cache is not used.
+
+Usage:
+
+    python -m tests.profiling.bench_received_parser [--count 20000]
+        [--common 0.8]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+import oa.received_parser
+
+import tests.util.benchmark
+
+
+def run(func, headers):
+    start = time.time()
+    results = [func(header) for header in headers]
+    return time.time() - start, results
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=20000,
+                        help="Number of headers.")
+    parser.add_argument("--common", type=float, default=0.8,
+                        help="Ratio of headers added by Postfix, Sendmail "
+                             "or Exim.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    generate = tests.util.benchmark.generate_received_header
+    raw_headers = [generate(rnd, options.common)
+                   for dummy in range(options.count)]
+    headers = oa.received_parser.ReceivedParser(
+        raw_headers, None).received_headers
+
+    received = oa.received_parser.ReceivedParser
+    elapsed, expected = run(received.parse_header_regex, headers)
+    tests.util.benchmark.report("Regex per field", elapsed, len(headers))
+    elapsed, results = run(received.parse_header, headers)
+    tests.util.benchmark.report("Tokenized", elapsed, len(headers))
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+
+"""Match adversarial messages (long runs of characters that make
+backtracking regexes slow) against the rules with the different regex
+backends, with and without a match-time budget.
+
+Usage:
+
+    python -m tests.profiling.bench_regex_backend [-C /usr/share/spamassassin]
+
+The RE2 backend requires google-re2.
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+
+import oa.regex_backend
+
+import tests.util.benchmark
+
+# Rules with nested quantifiers, added to the generated rules since those
+# are all well-behaved.
+BACKTRACKING_RULES = r"""
+body BENCH_NESTED_LETTERS /(?:a+)+!/
+score BENCH_NESTED_LETTERS 1.0
+body BENCH_NESTED_ALTERNATION /(?:a|aa)+!/
+score BENCH_NESTED_ALTERNATION 1.0
+rawbody BENCH_NESTED_DIGITS /(?:\d+)+x/
+score BENCH_NESTED_DIGITS 1.0
+"""
+
+
+def generate_adversarial(length):
+    """Generate messages with long runs of characters."""
+    texts = ("a" * length, "1" * length, ("a" * length + " ") * 3)
+    return [
+        "From: Sender <sender@example.com>\n"
+        "To: rcpt@example.net\n"
+        "Subject: %s\n"
+        "\n"
+        "%s\n" % (text[:900], text)
+        for text in texts
+    ]
+
+
+def run(ruleset, messages):
+    """Match the messages, returns the total and the slowest time."""
+    slowest = 0.0
+    hits = []
+    start = time.time()
+    for msg in messages:
+        msg.clear_matches()
+        msg_start = time.time()
+        ruleset.match(msg)
+        slowest = max(slowest, time.time() - msg_start)
+        hits.append(tests.util.benchmark.get_hits(msg))
+    return time.time() - start, slowest, hits
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--length", type=int, default=22,
+                        help="Length of the runs of characters in the "
+                             "adversarial messages.")
+    parser.add_argument("--timeout", type=float, default=0.05,
+                        help="Match-time budget for a single regex search.")
+    parser.add_argument("--message-timeout", type=float, default=1.0,
+                        help="Match-time budget for all the regex searches "
+                             "of a message.")
+    options = parser.parse_args()
+
+    config = None
+    if not options.configpath:
+        config = (tests.util.benchmark.generate_rules(options.rules,
+                                                      options.seed) +
+                  BACKTRACKING_RULES)
+    raw_normal = tests.util.benchmark.get_raw_messages(options)
+    raw_adversarial = generate_adversarial(options.length)
+
+    backends = ["re"]
+    if oa.regex_backend.re2 is not None:
+        backends.append("re2")
+    else:
+        print("google-re2 is not installed, only checking re.")
+
+    normal_hits = {}
+    for backend in backends:
+        oa.regex_backend.set_backend(backend)
+        ruleset = tests.util.benchmark.get_ruleset(options, config)
+        normal = tests.util.benchmark.parse_messages(ruleset, raw_normal)
+        adversarial = tests.util.benchmark.parse_messages(ruleset,
+                                                          raw_adversarial)
+        matchers = [getattr(rule, "_pattern", None)
+                    for rule in ruleset.checked.values()]
+        native = sum(1 for pattern in matchers
+                     if isinstance(pattern, oa.regex.Pattern) and
+                     pattern._matcher is not pattern._pattern)
+        print("Backend %s: %s rules, %s patterns not using re" %
+              (backend, len(ruleset.checked), native))
+
+        elapsed, slowest, normal_hits[backend] = run(ruleset, normal)
+        tests.util.benchmark.report("%s normal messages" % backend,
+                                    elapsed, len(normal))
+        for timeout, message_timeout in ((0.0, 0.0),
+                                         (options.timeout,
+                                          options.message_timeout)):
+            ruleset.conf["regex_match_timeout"] = timeout
+            ruleset.conf["regex_message_timeout"] = message_timeout
+            elapsed, slowest, dummy = run(ruleset, adversarial)
+            name = "%s adversarial, budget %ss/%ss" % (
+                backend, timeout, message_timeout)
+            tests.util.benchmark.report(name, elapsed, len(adversarial))
+            print("%-40s %10.4fs slowest message" % ("", slowest))
+        ruleset.conf["regex_match_timeout"] = 0.0
+        ruleset.conf["regex_message_timeout"] = 0.0
+
+    if "re2" in normal_hits:
+        if not tests.util.benchmark.compare_hits(
+                normal_hits["re"], normal_hits["re2"], ("re", "re2")):
+            print("Hit sets differ!")
+            sys.exit(1)
+        print("Hit sets on the normal messages are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+
+"""Compare reloading the configuration from scratch and incrementally
+after editing a small local configuration file, and check that both
+rulesets give the same results.
+
+Usage:
+
+    python -m tests.profiling.bench_reload [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+
+import oa.config
+import oa.rules.parser
+
+import tests.util.benchmark
+
+LOCAL_RULES = """
+body LOCAL_BENCH_RULE /%s/
+score LOCAL_BENCH_RULE 1.0
+meta LOCAL_BENCH_META LOCAL_BENCH_RULE && BENCH_BODY_1
+score LOCAL_BENCH_META 1.0
+"""
+
+
+def get_files(options, tmpdir):
+    local = os.path.join(tmpdir, "local.cf")
+    if options.configpath:
+        files = oa.config.get_config_files(
+            options.configpath, options.sitepath or options.configpath)
+    else:
+        path = os.path.join(tmpdir, "20_bench.cf")
+        with open(path, "w") as conf:
+            conf.write(tests.util.benchmark.generate_rules(options.rules,
+                                                           options.seed))
+        files = [path]
+    return files + [local], local
+
+
+def edit(local, word):
+    with open(local, "w") as conf:
+        conf.write(LOCAL_RULES % word)
+    # Make sure the modification time changes.
+    mtime = time.time() + 1
+    os.utime(local, (mtime, mtime))
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of reloads.")
+    options = parser.parse_args()
+    oa.config.LAZY_MODE = False
+    if options.debug:
+        oa.config.setup_logging("oa-logger", debug=True)
+    else:
+        logging.getLogger("oa-logger").setLevel(logging.CRITICAL)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files, local = get_files(options, tmpdir)
+        edit(local, "lorem")
+        start = time.time()
+        pad_parser = oa.rules.parser.parse_pad_rules(files)
+        pad_parser.get_ruleset()
+        print("%-40s %10.4fs" % ("Initial load", time.time() - start))
+
+        full = incremental = 0.0
+        for i in range(options.repeat):
+            edit(local, "ipsum%d" % i)
+            start = time.time()
+            reloaded = pad_parser.reload(files)
+            incremental_ruleset = reloaded.get_ruleset()
+            incremental += time.time() - start
+
+            start = time.time()
+            full_parser = oa.rules.parser.parse_pad_rules(files)
+            full_ruleset = full_parser.get_ruleset()
+            full += time.time() - start
+            pad_parser = reloaded
+        print("%-40s %10.4fs" % ("Full reload", full / options.repeat))
+        print("%-40s %10.4fs" % ("Incremental reload",
+                                 incremental / options.repeat))
+
+        raw_messages = tests.util.benchmark.get_raw_messages(options)
+        hits = []
+        for ruleset in (full_ruleset, incremental_ruleset):
+            messages = tests.util.benchmark.parse_messages(ruleset,
+                                                           raw_messages)
+            hits.append(tests.util.benchmark.run(ruleset, messages)[1])
+        if not tests.util.benchmark.compare_hits(hits[0], hits[1],
+                                                 ("full", "incremental")):
+            print("Hit sets differ!")
+            sys.exit(1)
+        print("Hit sets are identical.")
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+
+if __name__ == "__main__":
+    main()
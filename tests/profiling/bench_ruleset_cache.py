@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+"""Compare the startup time (parsing the configuration and creating the
+ruleset) without the ruleset cache, with an empty cache and with a warm
+cache, and check that the cached ruleset gives the same results.
+
+Every load runs in a new process, so the caches of this process (e.g. of
+the analysed patterns) don't hide the cost of the post parsing.
+
+Usage:
+
+    python -m tests.profiling.bench_ruleset_cache [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import oa.config
+import oa.rules.parser
+
+import tests.util.benchmark
+
+
+def get_files(options, tmpdir):
+    if options.configpath:
+        return oa.config.get_config_files(
+            options.configpath, options.sitepath or options.configpath)
+    path = os.path.join(tmpdir, "20_bench.cf")
+    with open(path, "w") as conf:
+        conf.write(tests.util.benchmark.generate_rules(options.rules,
+                                                       options.seed))
+    return [path]
+
+
+def load(files, cache_dir=None):
+    """Parse the rules, returns the elapsed time and the ruleset."""
+    start = time.time()
+    parser = oa.rules.parser.parse_pad_rules(files, cache_dir=cache_dir)
+    ruleset = parser.get_ruleset()
+    return time.time() - start, ruleset
+
+
+def load_in_process(files, cache_dir=None):
+    """Load the ruleset in a new process, returns the elapsed time."""
+    command = [sys.executable, "-m", "tests.profiling.bench_ruleset_cache",
+               "--load"] + files
+    if cache_dir is not None:
+        command += ["--cache-dir", cache_dir]
+    return float(subprocess.check_output(command))
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of warm cache loads.")
+    parser.add_argument("--load", nargs="+", default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--cache-dir", default=None,
+                        help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    oa.config.LAZY_MODE = False
+    if options.debug:
+        oa.config.setup_logging("oa-logger", debug=True)
+    else:
+        logging.getLogger("oa-logger").setLevel(logging.CRITICAL)
+    if options.load:
+        elapsed, dummy = load(options.load, options.cache_dir)
+        print(elapsed)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        files = get_files(options, tmpdir)
+        cache_dir = os.path.join(tmpdir, "cache")
+        raw_messages = tests.util.benchmark.get_raw_messages(options)
+
+        elapsed = load_in_process(files)
+        print("%-40s %10.4fs" % ("No cache", elapsed))
+        elapsed = load_in_process(files, cache_dir)
+        print("%-40s %10.4fs" % ("Empty cache (parse and store)", elapsed))
+        total = 0.0
+        for dummy in range(options.repeat):
+            total += load_in_process(files, cache_dir)
+        print("%-40s %10.4fs" % ("Warm cache", total / options.repeat))
+
+        dummy, ruleset = load(files)
+        messages = tests.util.benchmark.parse_messages(ruleset, raw_messages)
+        dummy, expected = tests.util.benchmark.run(ruleset, messages)
+        dummy, ruleset = load(files, cache_dir)
+        messages = tests.util.benchmark.parse_messages(ruleset, raw_messages)
+        dummy, hits = tests.util.benchmark.run(ruleset, messages)
+        if not tests.util.benchmark.compare_hits(expected, hits,
+                                                 ("parsed", "cached")):
+            print("Hit sets differ!")
+            sys.exit(1)
+        print("Hit sets are identical.")
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+"""Compare the cost of processing the URIs of link-heavy newsletters
+when every consumer parses the URIs again, like the URI plugins used to,
+and when they are parsed once in `msg.uris`, and check that both give
+the same results.
+
+Usage:
+
+    python -m tests.profiling.bench_uri [--count 200] [--links 100]
+        [--redirects 0.3]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+import time
+import random
+
+try:
+    from urllib.parse import unquote
+    from urllib.parse import urlparse
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlparse
+
+import oa.uri_parser
+
+import tests.util.benchmark
+
+HTTP_REDIR = oa.uri_parser.HTTP_REDIR
+
+
+def generate_newsletter(rnd, links, redirects):
+    """Generate the URIs of a newsletter, with this ratio of tracking
+    redirects.
+    """
+    uris = set()
+    for i in range(links):
+        word = rnd.choice(tests.util.benchmark.WORDS)
+        uri = "https://www.%s%d.example.com/%s?id=%d" % (
+            word, rnd.randint(0, 20), word, i)
+        if rnd.random() < redirects:
+            uri = "http://tracking.example.net/c/%d/%s" % (i, uri)
+        uris.add(uri)
+    return uris
+
+
+def separate(uris):
+    """Every consumer parses the URIs again."""
+    redirected = 0
+    for uri in uris:
+        while HTTP_REDIR.match(uri):
+            h_redir = HTTP_REDIR.match(uri).groups()[0]
+            h_dest = HTTP_REDIR.match(uri).groups()[1]
+            uri = h_dest
+            if urlparse(h_redir).netloc != urlparse(h_dest).netloc:
+                redirected = 1
+                break
+        if redirected:
+            break
+    details = {}
+    for uri in uris:
+        urlp = urlparse(uri)
+        details[uri] = {"raw": uri, "scheme": urlp.scheme,
+                        "cleaned": unquote(uri), "domain": urlp.netloc}
+    return redirected, details
+
+
+def single(uris):
+    """The URIs are parsed once and the consumers use the results."""
+    parsed = oa.uri_parser.parse_uris(uris)
+    redirected = 0
+    for uri in uris:
+        source = parsed[uri]
+        for destination in source.redirects:
+            if source.netloc != destination.netloc:
+                redirected = 1
+                break
+            source = destination
+        if redirected:
+            break
+    details = dict((uri, parsed[uri].get_details()) for uri in uris)
+    return redirected, details
+
+
+def run(func, newsletters, repeat):
+    results = []
+    start = time.time()
+    for dummy in range(repeat):
+        results = [func(uris) for uris in newsletters]
+    return (time.time() - start) / repeat, results
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--count", type=int, default=200,
+                        help="Number of messages.")
+    parser.add_argument("--links", type=int, default=100,
+                        help="Number of links in every message.")
+    parser.add_argument("--redirects", type=float, default=0.0,
+                        help="Ratio of links with tracking redirects.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs.")
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    newsletters = [generate_newsletter(rnd, options.links, options.redirects)
+                   for dummy in range(options.count)]
+
+    elapsed, expected = run(separate, newsletters, options.repeat)
+    tests.util.benchmark.report("Parsed by every consumer", elapsed,
+                                len(newsletters))
+    elapsed, results = run(single, newsletters, options.repeat)
+    tests.util.benchmark.report("Parsed once", elapsed, len(newsletters))
+
+    if expected != results:
+        print("Results differ!")
+        sys.exit(1)
+    print("Results are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+"""Compare checking all the URI rules in one pass over the URIs against
+looping over the URIs for each rule.
+
+Usage:
+
+    python -m tests.profiling.bench_uri_index [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import sys
+
+import tests.util.benchmark
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs to average over.")
+    options = parser.parse_args()
+
+    config = None
+    if not options.configpath:
+        # Only keep the generated URI rules, so the URI rules are
+        # not drowned out by the others.
+        config = "".join(
+            line + "\n" for line in
+            tests.util.benchmark.generate_rules(options.rules,
+                                                options.seed).splitlines()
+            if line.startswith(("uri ", "score BENCH_URI_"))
+        )
+    ruleset = tests.util.benchmark.get_ruleset(options, config)
+    messages = tests.util.benchmark.parse_messages(
+        ruleset, tests.util.benchmark.get_raw_messages(options))
+    print("%s rules checked, %s URI rules indexed, %s messages" %
+          (len(ruleset.checked), len(ruleset.uri_index), len(messages)))
+
+    ruleset.use_uri_index = False
+    ruleset.build_uri_index()
+    base_time, base_hits = tests.util.benchmark.run(ruleset, messages,
+                                                    options.repeat)
+    tests.util.benchmark.report("Per rule", base_time, len(messages))
+
+    ruleset.use_uri_index = True
+    ruleset.build_uri_index()
+    index_time, index_hits = tests.util.benchmark.run(ruleset, messages,
+                                                      options.repeat)
+    tests.util.benchmark.report("URI index", index_time, len(messages))
+
+    if not tests.util.benchmark.compare_hits(base_hits, index_hits,
+                                             ("per rule", "index")):
+        print("Hit sets differ!")
+        sys.exit(1)
+    print("Hit sets are identical.")
+
+
+if __name__ == "__main__":
+    main()
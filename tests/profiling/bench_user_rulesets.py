@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+"""Measure the time and memory of building additional rulesets from the
+same parsed rules, like the server does for every user when
+`allow_user_rules` is enabled.
+
+Usage:
+
+    python -m tests.profiling.bench_user_rulesets [-C /usr/share/spamassassin]
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+import re
+import copy
+import time
+import tracemalloc
+
+import oa.regex
+import oa.rules.parser
+
+import tests.util.benchmark
+
+
+def build_ruleset(results):
+    parser = oa.rules.parser.PADParser()
+    parser.results = copy.deepcopy(results)
+    return parser.get_ruleset()
+
+
+def count_compiled(rulesets):
+    """Count the distinct compiled regex objects used by the rules."""
+    compiled = set()
+    for ruleset in rulesets:
+        for rules in (ruleset.checked, ruleset.not_checked):
+            for rule in rules.values():
+                pattern = getattr(rule, "_pattern", None)
+                if isinstance(pattern, oa.regex.Pattern):
+                    compiled.add(id(pattern._pattern))
+    return len(compiled)
+
+
+def build_users(results, users, shared):
+    """Build the rulesets for the users. Returns the rulesets and the
+    average time per ruleset.
+    """
+    rulesets = []
+    start = time.time()
+    for dummy in range(users):
+        if not shared:
+            oa.regex._POOL.clear()
+            re.purge()
+        rulesets.append(build_ruleset(results))
+    return rulesets, (time.time() - start) / users
+
+
+def measure_memory(results, users, shared):
+    """Get the average memory used by each additional ruleset."""
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    rulesets, dummy = build_users(results, users, shared)
+    memory = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del rulesets
+    return memory / users
+
+
+def main():
+    parser = tests.util.benchmark.get_argument_parser(__doc__)
+    parser.add_argument("-U", "--users", type=int, default=10,
+                        help="Number of user rulesets to build.")
+    options = parser.parse_args()
+
+    results = tests.util.benchmark.get_parser(options).results
+    oa.regex._POOL.clear()
+    re.purge()
+
+    # The first ruleset is the one loaded from the site configuration.
+    start = time.time()
+    main_ruleset = build_ruleset(results)
+    print("First ruleset: %0.4fs, %s compiled patterns" %
+          (time.time() - start, count_compiled([main_ruleset])))
+
+    for name, shared in (("With interning", True),
+                         ("Without interning", False)):
+        rulesets, elapsed = build_users(results, options.users, shared)
+        compiled = count_compiled(rulesets + [main_ruleset])
+        del rulesets
+        memory = measure_memory(results, options.users, shared)
+        print("%-20s %8.4fs %10.1f KiB per user ruleset, "
+              "%s compiled patterns" %
+              (name, elapsed, memory / 1024.0, compiled))
+
+
+if __name__ == "__main__":
+    main()
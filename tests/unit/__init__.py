@@ -9,6 +9,7 @@ def suite():
     """Gather all the tests from this package in a test suite."""
 
     import tests.unit.test_regex as test_regex
+    import tests.unit.test_regex_backend as test_regex_backend
     import tests.unit.test_rules as test_rules
     import tests.unit.test_match as test_match
     import tests.unit.test_daemon as test_daemon
@@ -19,6 +20,7 @@ def suite():
 
     test_suite = unittest.TestSuite()
     test_suite.addTest(test_regex.suite())
+    test_suite.addTest(test_regex_backend.suite())
     test_suite.addTest(test_rules.suite())
     test_suite.addTest(test_match.suite())
     test_suite.addTest(test_server.suite())
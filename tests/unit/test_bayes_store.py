@@ -0,0 +1,488 @@
+"""Tests for the storage back-ends of the Bayes plug-in."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch, Mock, MagicMock, PropertyMock
+except ImportError:
+    from mock import patch, Mock, MagicMock, PropertyMock
+
+import oa.db.bayes
+import oa.db.bayes.cache
+import oa.db.bayes.mysql
+import oa.db.bayes.sqlite
+
+
+class TestBatches(unittest.TestCase):
+    """Tests for splitting the tokens in batches."""
+
+    def test_batches(self):
+        result = list(oa.db.bayes.batches(range(7), 3))
+        self.assertEqual(result, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_batches_exact(self):
+        result = list(oa.db.bayes.batches(range(6), 3))
+        self.assertEqual(result, [[0, 1, 2], [3, 4, 5]])
+
+    def test_batches_empty(self):
+        self.assertEqual(list(oa.db.bayes.batches([], 3)), [])
+
+    def test_batches_generator(self):
+        tokens = (token for token in (b"a", b"b", b"c"))
+        result = list(oa.db.bayes.batches(tokens, 2))
+        self.assertEqual(result, [[b"a", b"b"], [b"c"]])
+
+
+class TestMySQLStore(unittest.TestCase):
+    """Tests for the MySQL store."""
+
+    def setUp(self):
+        self.plugin = MagicMock(**{
+            "__getitem__.side_effect": {"bayes_sql_batch_size": 2}.get})
+        self.cursor = Mock()
+        self.store = oa.db.bayes.mysql.Store(self.plugin)
+        self.store.conn = Mock(**{"cursor.return_value": self.cursor})
+
+    def test_tok_get_all_batches(self):
+        self.cursor.fetchall.side_effect = [
+            [(b"aaaaa", 1, 2, 3)], [(b"ccccc", 4, 5, 6)]]
+        result = list(self.store.tok_get_all(
+            [b"aaaaa", b"bbbbb", b"ccccc"]))
+        self.assertEqual(result, [(b"aaaaa", 1, 2, 3), (b"ccccc", 4, 5, 6)])
+        calls = self.cursor.execute.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(calls[0][0][0].endswith("IN (%s, %s)"))
+        self.assertEqual(calls[0][0][1], [b"aaaaa", b"bbbbb"])
+        self.assertTrue(calls[1][0][0].endswith("IN (%s)"))
+        self.assertEqual(calls[1][0][1], [b"ccccc"])
+
+    def test_tok_get_all_no_tokens(self):
+        self.assertEqual(list(self.store.tok_get_all([])), [])
+        self.cursor.execute.assert_not_called()
+
+    def test_multi_tok_count_change_learn(self):
+        self.store.multi_tok_count_change(1, 0, [b"aaaaa", b"bbbbb"], 100)
+        query, rows = self.cursor.executemany.call_args[0]
+        self.assertTrue(query.startswith("INSERT INTO bayes_token"))
+        self.assertIn("ON DUPLICATE KEY UPDATE", query)
+        self.assertIn("spam_count + VALUES(spam_count)", query)
+        self.assertEqual(rows, [(b"aaaaa", 1, 0, 100), (b"bbbbb", 1, 0, 100)])
+        self.cursor.execute.assert_not_called()
+        self.store.conn.commit.assert_not_called()
+
+    def test_multi_tok_count_change_forget(self):
+        self.store.multi_tok_count_change(0, -1, [b"aaaaa"], 100)
+        query, rows = self.cursor.executemany.call_args[0]
+        self.assertTrue(query.startswith("UPDATE bayes_token"))
+        self.assertEqual(rows, [(0, -1, b"aaaaa")])
+
+    def test_multi_tok_count_change_no_tokens(self):
+        self.store.multi_tok_count_change(1, 0, [], 100)
+        self.cursor.executemany.assert_not_called()
+
+    def test_tok_touch_all_batches(self):
+        self.store.tok_touch_all([b"aaaaa", b"bbbbb", b"ccccc"], 100)
+        calls = self.cursor.execute.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][0][1], [100, 100, b"aaaaa", b"bbbbb"])
+        self.assertEqual(calls[1][0][1], [100, 100, b"ccccc"])
+        self.store.conn.commit.assert_called_once_with()
+
+    def test_seen_get_missing(self):
+        self.cursor.fetchone.return_value = None
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+
+    def test_cleanup_commits(self):
+        self.store.cleanup()
+        self.store.conn.commit.assert_called_once_with()
+
+    def test_cleanup_untied(self):
+        self.store.conn = None
+        self.store.cleanup()
+
+    def test_tie_untie_pool(self):
+        conn = self.store.conn
+        self.store.conn = None
+        self.plugin.get_connection.return_value = conn
+        self.assertTrue(self.store.tie_db_writeable())
+        self.assertTrue(self.store.tie_db_readonly())
+        self.assertIs(self.store.conn, conn)
+        self.plugin.get_connection.assert_called_once_with()
+        self.store.untie_db()
+        self.plugin.release_connection.assert_called_once_with(conn)
+        self.assertIsNone(self.store.conn)
+
+
+class TestSQLAlchemyStore(unittest.TestCase):
+    """Tests for the SQLAlchemy store, against an in-memory SQLite
+    database.
+    """
+
+    def setUp(self):
+        try:
+            import sqlalchemy
+            import sqlalchemy.orm
+            import oa.db.bayes.sqlalchemy
+        except ImportError:
+            self.skipTest("SQLAlchemy is not installed")
+        engine = sqlalchemy.create_engine("sqlite://")
+        oa.db.bayes.sqlalchemy.Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(
+                oa.db.bayes.sqlalchemy.BayesToken.__table__.insert(),
+                [{"id": 0, "token": b"%05d" % i, "spam_count": i,
+                  "ham_count": 10 - i, "atime": 100 + i}
+                 for i in range(10)])
+        self.statements = []
+        sqlalchemy.event.listen(
+            engine, "before_cursor_execute",
+            lambda conn, cursor, statement, *args:
+            self.statements.append(statement))
+        self.plugin = MagicMock(**{
+            "__getitem__.side_effect": {"bayes_sql_batch_size": 4}.get,
+            "get_session.return_value": sqlalchemy.orm.sessionmaker(
+                bind=engine)()})
+        self.store = oa.db.bayes.sqlalchemy.Store(self.plugin)
+        self.store.tie_db_writeable()
+
+    def test_tok_get_all(self):
+        tokens = [b"%05d" % i for i in range(0, 20, 2)]
+        result = sorted(tuple(row) for row in self.store.tok_get_all(tokens))
+        self.assertEqual(result, [(b"%05d" % i, i, 10 - i, 100 + i)
+                                  for i in range(0, 10, 2)])
+        self.assertEqual(len(self.statements), 3)
+
+    def test_tok_get_all_bytearray(self):
+        result = list(self.store.tok_get_all([bytearray(b"00003")]))
+        self.assertEqual([tuple(row) for row in result],
+                         [(b"00003", 3, 7, 103)])
+
+    def test_tok_get_all_missing(self):
+        result = list(self.store.tok_get_all([b"abcde"]))
+        self.assertEqual(result, [])
+
+    def get_token(self, token):
+        result = list(self.store.tok_get_all([token]))
+        if not result:
+            return None
+        return tuple(result[0])[1:]
+
+    def check_learn(self):
+        del self.statements[:]
+        self.store.multi_tok_count_change(
+            1, 0, [b"00001", b"00002", b"abcde"], 200)
+        self.store.cleanup()
+        statements = len(self.statements)
+        self.assertEqual(self.get_token(b"00001"), (2, 9, 200))
+        self.assertEqual(self.get_token(b"00002"), (3, 8, 200))
+        self.assertEqual(self.get_token(b"abcde"), (1, 0, 200))
+        self.assertEqual(self.get_token(b"00003"), (3, 7, 103))
+        return statements
+
+    def test_multi_tok_count_change_learn(self):
+        # A single statement for all the tokens.
+        self.assertEqual(self.check_learn(), 1)
+
+    def test_multi_tok_count_change_learn_no_upsert(self):
+        with patch("oa.db.bayes.sqlalchemy.Store.dialect",
+                   new_callable=PropertyMock, return_value="other"):
+            self.check_learn()
+
+    def test_multi_tok_count_change_older_atime(self):
+        self.store.multi_tok_count_change(0, 1, [b"00005"], 50)
+        self.assertEqual(self.get_token(b"00005"), (5, 6, 105))
+
+    def test_multi_tok_count_change_forget(self):
+        self.store.multi_tok_count_change(
+            -1, 0, [b"00000", b"00004", b"abcde"], 200)
+        self.store.cleanup()
+        self.assertEqual(self.get_token(b"00000"), (0, 10, 100))
+        self.assertEqual(self.get_token(b"00004"), (3, 6, 104))
+        self.assertIsNone(self.get_token(b"abcde"))
+
+    def test_tok_touch_all(self):
+        self.store.tok_touch_all([b"00001", b"00002"], 102)
+        self.assertEqual(self.get_token(b"00001"), (1, 9, 102))
+        self.assertEqual(self.get_token(b"00002"), (2, 8, 102))
+
+    def test_nspam_nham_change(self):
+        self.store.conn.execute(
+            oa.db.bayes.sqlalchemy.BayesVars.__table__.insert(),
+            {"id": 1, "spam_count": 5, "ham_count": 0})
+        self.store.nspam_nham_change(1, -1)
+        self.store.cleanup()
+        self.assertEqual(tuple(self.store.nspam_nham_get()), (6, 0))
+
+    def check_seen(self):
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+        self.store.seen_put("<msgid>", "s")
+        self.assertEqual(self.store.seen_get("<msgid>"), "s")
+        self.store.seen_put("<msgid>", "h")
+        self.assertEqual(self.store.seen_get("<msgid>"), "h")
+        self.store.seen_delete("<msgid>")
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+
+    def test_seen(self):
+        self.check_seen()
+
+    def test_seen_no_upsert(self):
+        with patch("oa.db.bayes.sqlalchemy.Store.dialect",
+                   new_callable=PropertyMock, return_value="other"):
+            self.check_seen()
+
+
+class TestSQLiteStore(unittest.TestCase):
+    """Tests for the embedded SQLite store, against a temporary file."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.options = {"bayes_sql_batch_size": 4,
+                        "bayes_path": os.path.join(self.tmpdir, "bayes"),
+                        "bayes_auto_expire": 0,
+                        "bayes_expiry_max_db_size": 8}
+        self.plugin = MagicMock(**{
+            "__getitem__.side_effect": lambda key: self.options[key]})
+        self.store = oa.db.bayes.sqlite.Store(self.plugin)
+        self.store.tie_db_writeable()
+        for i in range(10):
+            self.store.multi_tok_count_change(i, 10 - i, [b"%05d" % i],
+                                              100 + i)
+        self.store.cleanup()
+
+    def tearDown(self):
+        self.store.untie_db()
+        shutil.rmtree(self.tmpdir, True)
+
+    def get_token(self, token):
+        result = list(self.store.tok_get_all([token]))
+        if not result:
+            return None
+        return tuple(result[0])[1:]
+
+    def test_token_to_int(self):
+        value = oa.db.bayes.sqlite.token_to_int(b"\xff\x00\x01\x02\x03")
+        self.assertEqual(value, 0xff00010203)
+        self.assertEqual(oa.db.bayes.sqlite.int_to_token(value),
+                         b"\xff\x00\x01\x02\x03")
+
+    def test_wal(self):
+        mode = self.store.conn.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode[0], "wal")
+        self.assertTrue(os.path.exists(self.store.path))
+
+    def test_tok_get(self):
+        self.assertEqual(self.store.tok_get(b"00003"), (3, 7, 103))
+        self.assertIsNone(self.store.tok_get(b"abcde"))
+
+    def test_tok_get_all(self):
+        tokens = [b"%05d" % i for i in range(0, 20, 2)]
+        result = sorted(self.store.tok_get_all(tokens))
+        self.assertEqual(result, [(b"%05d" % i, i, 10 - i, 100 + i)
+                                  for i in range(0, 10, 2)])
+
+    def test_tok_get_all_bytearray(self):
+        result = list(self.store.tok_get_all([bytearray(b"00003")]))
+        self.assertEqual(result, [(b"00003", 3, 7, 103)])
+
+    def test_multi_tok_count_change_learn(self):
+        self.store.multi_tok_count_change(
+            1, 0, [b"00001", b"00002", b"abcde"], 200)
+        self.store.cleanup()
+        self.assertEqual(self.get_token(b"00001"), (2, 9, 200))
+        self.assertEqual(self.get_token(b"00002"), (3, 8, 200))
+        self.assertEqual(self.get_token(b"abcde"), (1, 0, 200))
+        self.assertEqual(self.get_token(b"00003"), (3, 7, 103))
+
+    def test_multi_tok_count_change_learn_no_upsert(self):
+        with patch("oa.db.bayes.sqlite.HAS_UPSERT", False):
+            self.test_multi_tok_count_change_learn()
+
+    def test_multi_tok_count_change_older_atime(self):
+        self.store.multi_tok_count_change(0, 1, [b"00005"], 50)
+        self.assertEqual(self.get_token(b"00005"), (5, 6, 105))
+
+    def test_multi_tok_count_change_older_atime_no_upsert(self):
+        with patch("oa.db.bayes.sqlite.HAS_UPSERT", False):
+            self.test_multi_tok_count_change_older_atime()
+
+    def test_multi_tok_count_change_forget(self):
+        self.store.multi_tok_count_change(
+            -1, 0, [b"00000", b"00004", b"abcde"], 200)
+        self.store.cleanup()
+        self.assertEqual(self.get_token(b"00000"), (0, 10, 100))
+        self.assertEqual(self.get_token(b"00004"), (3, 6, 104))
+        self.assertIsNone(self.get_token(b"abcde"))
+
+    def test_tok_touch_all(self):
+        self.store.tok_touch_all([b"00001", b"00002"], 102)
+        self.assertEqual(self.get_token(b"00001"), (1, 9, 102))
+        self.assertEqual(self.get_token(b"00002"), (2, 8, 102))
+
+    def test_nspam_nham_change(self):
+        self.assertEqual(self.store.nspam_nham_get(), (0, 0))
+        self.store.nspam_nham_change(5, 1)
+        self.store.nspam_nham_change(1, -2)
+        self.store.cleanup()
+        self.assertEqual(self.store.nspam_nham_get(), (6, 0))
+
+    def test_seen(self):
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+        self.store.seen_put("<msgid>", "s")
+        self.assertEqual(self.store.seen_get("<msgid>"), "s")
+        self.store.seen_put("<msgid>", "h")
+        self.assertEqual(self.store.seen_get("<msgid>"), "h")
+        self.store.seen_delete("<msgid>")
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+
+    def test_untie_rollback(self):
+        self.store.seen_put("<msgid>", "s")
+        self.store.untie_db()
+        self.assertIsNone(self.store.seen_get("<msgid>"))
+
+    def test_reader(self):
+        """The changes committed by the writer are seen by the other
+        connections.
+        """
+        reader = oa.db.bayes.sqlite.Store(self.plugin)
+        reader.tie_db_readonly()
+        self.store.multi_tok_count_change(1, 0, [b"abcde"], 200)
+        self.assertIsNone(reader.tok_get(b"abcde"))
+        self.store.cleanup()
+        self.assertEqual(reader.tok_get(b"abcde"), (1, 0, 200))
+
+    def test_fork(self):
+        conn = self.store.conn
+        with patch("oa.db.bayes.sqlite.os.getpid",
+                   return_value=os.getpid() + 1):
+            self.store.tie_db_readonly()
+        self.assertIsNot(self.store.conn, conn)
+        self.assertEqual(self.store._inherited, [conn])
+        self.assertEqual(self.store.tok_get(b"00003"), (3, 7, 103))
+
+    def test_expire_old_tokens(self):
+        self.assertEqual(self.store.expire_old_tokens(), 4)
+        self.assertIsNone(self.get_token(b"00003"))
+        self.assertEqual(self.get_token(b"00004"), (4, 6, 104))
+        self.assertIsNone(self.store.get_running_expire_tok())
+        self.assertFalse(self.store.expiry_due())
+
+    def test_expire_running(self):
+        self.assertTrue(self.store.set_running_expire_tok())
+        self.assertFalse(self.store.expiry_due())
+        self.assertEqual(self.store.expire_old_tokens(), 0)
+        self.store.remove_running_expiry_tok()
+        self.assertTrue(self.store.expiry_due())
+
+    def test_expiry_due_size(self):
+        self.options["bayes_expiry_max_db_size"] = 10
+        self.assertFalse(self.store.expiry_due())
+
+    def test_cleanup_auto_expire(self):
+        self.options["bayes_auto_expire"] = 1
+        self.store.cleanup()
+        self.assertEqual(len(list(self.store.tok_get_all(
+            [b"%05d" % i for i in range(10)]))), 6)
+
+
+class TestCachedStore(unittest.TestCase):
+    """Tests for the cache in front of the stores."""
+
+    def setUp(self):
+        self.rows = {b"aaaaa": (b"aaaaa", 1, 2, 3),
+                     b"bbbbb": (b"bbbbb", 4, 5, 6)}
+        self.store = Mock(**{
+            "tok_get_all.side_effect": lambda tokens: [
+                self.rows[token] for token in tokens if token in self.rows],
+            "nspam_nham_get.return_value": (10, 20),
+        })
+        self.cache = oa.db.bayes.cache.CachedStore(self.store, 3, 60, 5)
+        self.time = patch("oa.db.bayes.cache.time.time",
+                          return_value=1000).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def get(self, tokens):
+        return sorted(self.cache.tok_get_all(tokens))
+
+    def test_tok_get_all(self):
+        expected = [(b"aaaaa", 1, 2, 3), (b"bbbbb", 4, 5, 6)]
+        tokens = [b"aaaaa", b"bbbbb", b"ccccc"]
+        self.assertEqual(self.get(tokens), expected)
+        self.assertEqual(self.get(tokens), expected)
+        # The unknown token is cached as well.
+        self.store.tok_get_all.assert_called_once_with(tokens)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 3)
+
+    def test_tok_get_all_partial(self):
+        self.get([b"aaaaa"])
+        self.assertEqual(self.get([b"aaaaa", b"bbbbb"]),
+                         [(b"aaaaa", 1, 2, 3), (b"bbbbb", 4, 5, 6)])
+        self.store.tok_get_all.assert_called_with([b"bbbbb"])
+
+    def test_tok_get_all_expired(self):
+        self.get([b"aaaaa"])
+        self.rows[b"aaaaa"] = (b"aaaaa", 7, 8, 9)
+        self.time.return_value = 1060
+        self.assertEqual(self.get([b"aaaaa"]), [(b"aaaaa", 7, 8, 9)])
+        self.assertEqual(self.cache.get_stats()["expired"], 1)
+
+    def test_tok_get_all_evict(self):
+        self.get([b"aaaaa", b"bbbbb", b"ccccc"])
+        self.get([b"aaaaa"])
+        self.get([b"ddddd"])
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.get_stats()["evictions"], 1)
+        # The least recently used one was evicted.
+        self.get([b"bbbbb"])
+        self.store.tok_get_all.assert_called_with([b"bbbbb"])
+
+    def test_learn_invalidates(self):
+        self.get([b"aaaaa", b"ccccc"])
+        self.cache.multi_tok_count_change(1, 0, {b"ccccc": "c"}, 100)
+        self.store.multi_tok_count_change.assert_called_once_with(
+            1, 0, [b"ccccc"], 100)
+        self.rows[b"ccccc"] = (b"ccccc", 1, 0, 100)
+        self.assertEqual(self.get([b"aaaaa", b"ccccc"]),
+                         [(b"aaaaa", 1, 2, 3), (b"ccccc", 1, 0, 100)])
+        self.store.tok_get_all.assert_called_with([b"ccccc"])
+        self.assertEqual(self.cache.get_stats()["invalidations"], 1)
+
+    def test_nspam_nham_get(self):
+        self.assertEqual(self.cache.nspam_nham_get(), (10, 20))
+        self.assertEqual(self.cache.nspam_nham_get(), (10, 20))
+        self.store.nspam_nham_get.assert_called_once_with()
+        self.time.return_value = 1005
+        self.cache.nspam_nham_get()
+        self.assertEqual(self.store.nspam_nham_get.call_count, 2)
+
+    def test_nspam_nham_change_invalidates(self):
+        self.cache.nspam_nham_get()
+        self.cache.nspam_nham_change(1, 0)
+        self.store.nspam_nham_change.assert_called_once_with(1, 0)
+        self.cache.nspam_nham_get()
+        self.assertEqual(self.store.nspam_nham_get.call_count, 2)
+
+    def test_passthrough(self):
+        self.cache.seen_get("<msgid>")
+        self.store.seen_get.assert_called_once_with("<msgid>")
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestBatches, "test"))
+    test_suite.addTest(unittest.makeSuite(TestMySQLStore, "test"))
+    test_suite.addTest(unittest.makeSuite(TestSQLAlchemyStore, "test"))
+    test_suite.addTest(unittest.makeSuite(TestSQLiteStore, "test"))
+    test_suite.addTest(unittest.makeSuite(TestCachedStore, "test"))
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
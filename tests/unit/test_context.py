@@ -274,6 +274,47 @@ class TestGlobalContextUnloadPlugin(unittest.TestCase):
         self.assertEqual(ctxt.plugin_data, {})
 
 
+class TestGlobalContextGetState(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("oa-logger").handlers = [logging.NullHandler()]
+        self.ctxt = oa.context.GlobalContext()
+        self.plugin = MagicMock(path_to_plugin=("TestPlugin", "/plugin.py"),
+                                eval_rules=["test_eval_rule"])
+        self.ctxt.plugins["TestPlugin"] = self.plugin
+        self.ctxt.eval_rules["test_eval_rule"] = MagicMock()
+        self.ctxt.plugin_data["RelayCountryPlugin"].update(
+            {"ipv4": "db4", "ipv6": "db6", "other": "value"})
+        self.ctxt.plugin_data["BayesPlugin"].update(
+            {"engine": "engine", "pool": "pool", "other": "value"})
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_state(self):
+        state = self.ctxt.__getstate__()
+        self.assertEqual(state["plugins"], {})
+        self.assertEqual(state["eval_rules"], {})
+        self.assertEqual(state["plugins_to_import"],
+                         [("TestPlugin", "/plugin.py")])
+        self.assertEqual(state["plugin_data"]["RelayCountryPlugin"],
+                         {"other": "value"})
+        self.assertEqual(state["plugin_data"]["BayesPlugin"],
+                         {"other": "value"})
+
+    def test_context_unchanged(self):
+        """The context is still used after it's pickled."""
+        self.ctxt.__getstate__()
+        self.assertEqual(self.ctxt.plugins, {"TestPlugin": self.plugin})
+        self.assertIn("test_eval_rule", self.ctxt.eval_rules)
+        self.assertEqual(self.ctxt.plugin_data["RelayCountryPlugin"],
+                         {"ipv4": "db4", "ipv6": "db6", "other": "value"})
+        self.assertEqual(self.ctxt.plugin_data["BayesPlugin"],
+                         {"engine": "engine", "pool": "pool",
+                          "other": "value"})
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
@@ -281,6 +322,7 @@ def suite():
     test_suite.addTest(unittest.makeSuite(TestGlobalContextLoadPlugin, "test"))
     test_suite.addTest(unittest.makeSuite(TestGlobalContextLoadModule, "test"))
     test_suite.addTest(unittest.makeSuite(TestGlobalContextUnloadPlugin, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGlobalContextGetState, "test"))
     return test_suite
 
 if __name__ == '__main__':
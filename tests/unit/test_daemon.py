@@ -34,17 +34,39 @@ class TestDaemon(unittest.TestCase):
         self.mock_s.assert_called_with(
             ("0.0.0.0", 783), '/etc/mail/spamassassin',
             '/etc/mail/spamassassin', paranoid=False,
-            ignore_unknown=True,
+            ignore_unknown=True, warm_up=False,
+            cache_dir=None
         )
         self.mock_s.return_value.serve_forever.assert_called_with()
 
+    def test_warm_up(self):
+        self.argv.append("--warm-up")
+        scripts.oad.main()
+        self.mock_s.assert_called_with(
+            ("0.0.0.0", 783), '/etc/mail/spamassassin',
+            '/etc/mail/spamassassin', paranoid=False,
+            ignore_unknown=True, warm_up=True,
+            cache_dir=None
+        )
+
+    def test_cache_dir(self):
+        self.argv.append("--cache-dir=/var/cache/oa")
+        scripts.oad.main()
+        self.mock_s.assert_called_with(
+            ("0.0.0.0", 783), '/etc/mail/spamassassin',
+            '/etc/mail/spamassassin', paranoid=False,
+            ignore_unknown=True, warm_up=False,
+            cache_dir="/var/cache/oa"
+        )
+
     def test_preforked(self):
         self.argv.append("--prefork=6")
         scripts.oad.main()
         self.mock_pfs.assert_called_with(
             ("0.0.0.0", 783), '/etc/mail/spamassassin',
             '/etc/mail/spamassassin', paranoid=False,
-            ignore_unknown=True
+            ignore_unknown=True, warm_up=False,
+            cache_dir=None
         )
         self.assertEqual(self.mock_pfs.return_value.prefork, 6)
         self.mock_pfs.return_value.serve_forever.assert_called_with()
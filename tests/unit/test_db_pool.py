@@ -0,0 +1,244 @@
+"""Tests for oa.db.pool."""
+
+import os
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.db.pool
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Tests for the pool of pymysql connections."""
+
+    def setUp(self):
+        self.connections = []
+        self.pool = oa.db.pool.ConnectionPool("test", self.connect, 2, 30)
+        self.time = patch("oa.db.pool.time.time", return_value=1000).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def connect(self):
+        conn = Mock()
+        self.connections.append(conn)
+        return conn
+
+    def test_reuse(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(), conn)
+        self.assertEqual(len(self.connections), 1)
+        conn.rollback.assert_called_once_with()
+        conn.ping.assert_not_called()
+
+    def test_concurrent(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(self.pool.get_stats()["in_use"], 2)
+
+    def test_size(self):
+        conns = [self.pool.acquire() for dummy in range(3)]
+        for conn in conns:
+            self.pool.release(conn)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["idle"], 2)
+        self.assertEqual(stats["in_use"], 0)
+        conns[2].close.assert_called_once_with()
+
+    def test_check_after_interval(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.time.return_value = 1031
+        self.assertIs(self.pool.acquire(), conn)
+        conn.ping.assert_called_once_with(False)
+        self.assertEqual(self.pool.get_stats()["checks"], 1)
+
+    def test_reconnect(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.ping.side_effect = Exception("gone away")
+        self.time.return_value = 1031
+        new_conn = self.pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        conn.close.assert_called_once_with()
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["reconnects"], 1)
+        self.assertEqual(stats["created"], 2)
+
+    def test_release_broken(self):
+        conn = self.pool.acquire()
+        conn.rollback.side_effect = Exception("gone away")
+        self.pool.release(conn)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["idle"], 0)
+        self.assertEqual(stats["discarded"], 1)
+        conn.close.assert_called_once_with()
+
+    def test_connection_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as conn:
+                raise ValueError()
+        conn.close.assert_called_once_with()
+        self.assertEqual(self.pool.get_stats()["idle"], 0)
+
+    def test_connection(self):
+        with self.pool.connection() as conn:
+            pass
+        self.assertEqual(self.pool.get_stats()["idle"], 1)
+
+    def test_fork(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        with patch("oa.db.pool.os.getpid", return_value=os.getpid() + 1):
+            new_conn = self.pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        # The parent still uses the connection.
+        conn.close.assert_not_called()
+        self.assertEqual(self.pool.get_stats()["forks"], 1)
+
+    def test_close(self):
+        conn = self.pool.acquire()
+        idle = self.pool.acquire()
+        self.pool.release(idle)
+        self.pool.close()
+        idle.close.assert_called_once_with()
+        # Connections in use are closed when they are released.
+        self.pool.release(conn)
+        conn.close.assert_called_once_with()
+        self.assertEqual(self.pool.get_stats()["idle"], 0)
+
+    def test_reset_after_fork(self):
+        self.pool._lock.acquire()
+        with patch("oa.db.pool.os.getpid", return_value=os.getpid() + 1):
+            self.pool.reset_after_fork()
+            conn = self.pool.acquire()
+        self.assertIs(conn, self.connections[-1])
+        self.assertEqual(self.pool.get_stats()["forks"], 1)
+
+
+class TestPools(unittest.TestCase):
+    """Tests for the pools shared by DSN."""
+
+    ENGINE = {"hostname": "localhost", "user": "test", "password": "pass",
+              "db_name": "spamassassin"}
+
+    def setUp(self):
+        patch.dict("oa.db.pool._POOLS", clear=True).start()
+        self.connect = patch("oa.db.pool.connect_mysql").start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def test_get_pool_shared(self):
+        pool = oa.db.pool.get_pool(dict(self.ENGINE), 2, 30)
+        self.assertIs(oa.db.pool.get_pool(dict(self.ENGINE), 2, 30), pool)
+        self.assertEqual(pool.size, 2)
+        pool.acquire()
+        self.connect.assert_called_once_with(self.ENGINE)
+
+    def test_get_pool_other_dsn(self):
+        pool = oa.db.pool.get_pool(dict(self.ENGINE))
+        other = oa.db.pool.get_pool(dict(self.ENGINE, db_name="awl"))
+        self.assertIsNot(other, pool)
+
+    def test_get_engine_shared(self):
+        create_engine = Mock()
+        monitor = patch("oa.db.pool.EngineMonitor").start()
+        engine = oa.db.pool.get_engine("sqlite://", create_engine, 30)
+        self.assertIs(engine, monitor.return_value.engine)
+        self.assertIs(oa.db.pool.get_engine("sqlite://", create_engine, 30),
+                      engine)
+        create_engine.assert_called_once_with("sqlite://")
+        monitor.assert_called_once_with(
+            repr(create_engine.return_value.url),
+            create_engine.return_value, 30)
+
+    def test_close_all(self):
+        pool = oa.db.pool.get_pool(dict(self.ENGINE))
+        conn = pool.acquire()
+        pool.release(conn)
+        oa.db.pool.close_all()
+        conn.close.assert_called_once_with()
+        self.assertIsNot(oa.db.pool.get_pool(dict(self.ENGINE)), pool)
+
+    def test_get_stats(self):
+        pool = oa.db.pool.get_pool(dict(self.ENGINE))
+        self.assertEqual(oa.db.pool.get_stats(),
+                         {"mysql://test@localhost/spamassassin":
+                          pool.get_stats()})
+
+    def test_after_fork(self):
+        pool = oa.db.pool.get_pool(dict(self.ENGINE))
+        pool.acquire()
+        oa.db.pool._LOCK.acquire()
+        with patch("oa.db.pool.os.getpid", return_value=os.getpid() + 1):
+            oa.db.pool._after_fork()
+            self.assertIs(oa.db.pool.get_pool(dict(self.ENGINE)), pool)
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+
+
+class TestEngineMonitor(unittest.TestCase):
+    """Tests for monitoring the pool of a SQLAlchemy engine."""
+
+    def setUp(self):
+        try:
+            import sqlalchemy
+        except ImportError:
+            self.skipTest("SQLAlchemy is not installed")
+        self.engine = sqlalchemy.create_engine("sqlite://")
+        self.monitor = oa.db.pool.EngineMonitor("test", self.engine, 30)
+        self.time = patch("oa.db.pool.time.time", return_value=1000).start()
+
+    def tearDown(self):
+        patch.stopall()
+
+    def query(self):
+        import sqlalchemy
+        with self.engine.connect() as conn:
+            return conn.execute(sqlalchemy.text("SELECT 1")).scalar()
+
+    def test_reuse(self):
+        self.query()
+        self.query()
+        stats = self.monitor.get_stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["checks"], 0)
+
+    def test_check_after_interval(self):
+        self.query()
+        self.time.return_value = 1031
+        self.assertEqual(self.query(), 1)
+        self.assertEqual(self.monitor.get_stats()["checks"], 1)
+
+    def test_fork(self):
+        self.query()
+        with patch("oa.db.pool.os.getpid", return_value=os.getpid() + 1):
+            self.assertEqual(self.query(), 1)
+        stats = self.monitor.get_stats()
+        self.assertEqual(stats["forks"], 1)
+        self.assertEqual(stats["created"], 2)
+
+    def test_close(self):
+        self.query()
+        self.monitor.close()
+        self.query()
+        self.assertEqual(self.monitor.get_stats()["created"], 2)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestConnectionPool, "test"))
+    test_suite.addTest(unittest.makeSuite(TestPools, "test"))
+    test_suite.addTest(unittest.makeSuite(TestEngineMonitor, "test"))
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -6,6 +6,8 @@ import unittest
 import collections
 import email.header
 import hashlib
+import ipaddress
+import html.parser
 
 try:
     from unittest.mock import patch, Mock, call, MagicMock
@@ -13,6 +15,7 @@ except ImportError:
     from mock import patch, Mock, call, MagicMock
 
 import oa.message
+import oa.html_parser
 import oa.config
 
 HTML_TEXT = """<html><head><title>Email spam</title></head><body>
@@ -43,6 +46,41 @@ class TestHTMLStrip(unittest.TestCase):
         res = " ".join(self.data)
         self.assertEqual(res, HTML_TEXT_STRIPED)
 
+    def test_HTMLStripper_visible(self):
+        stripper = oa.message._ParseHTML(self.data)
+        stripper.feed("<html><head><title>Title</title>"
+                      "<style>p {color: red}</style></head>"
+                      "<body><p>Shown</p>"
+                      "<div style='display: none'>Not <b>shown</b></div>"
+                      "<span hidden>Hidden</span><br>After"
+                      "<script>var x;</script></body></html>")
+        self.assertEqual(stripper.visible, ["Shown", "After"])
+        self.assertEqual(stripper.invisible,
+                         ["Title", "p {color: red}", "Not", "shown",
+                          "Hidden", "var x;"])
+        self.assertEqual(self.data, stripper.invisible[:2] + ["Shown"] +
+                         stripper.invisible[2:5] + ["After"] +
+                         stripper.invisible[5:])
+
+    def test_HTMLStripper_unclosed(self):
+        stripper = oa.message._ParseHTML(self.data)
+        stripper.feed("<div hidden><p>Hidden<p>Hidden too</div>Shown")
+        self.assertEqual(stripper.visible, ["Shown"])
+        self.assertEqual(stripper.invisible, ["Hidden", "Hidden too"])
+
+    def test_HTMLStripper_tags(self):
+        stripper = oa.message._ParseHTML(self.data)
+        stripper.feed("<p>One<br/>Two</p><p>Three<img src='x'></p>")
+        self.assertEqual(stripper.tags, {"p": 2, "br": 1, "img": 1})
+        self.assertEqual(stripper.visible, ["One", "Two", "Three"])
+
+    def test_HTMLStripper_links(self):
+        stripper = oa.message._ParseHTML(self.data)
+        stripper.feed("<a href='http://example.com'>Example\nlink</a>")
+        self.assertEqual(stripper.links["http://example.com"]["a"]["text"],
+                         ["Example\nlink"])
+        self.assertEqual(self.data, ["Example link"])
+
 
 class TestHeaders(unittest.TestCase):
     def setUp(self):
@@ -91,7 +129,7 @@ class TestParseMessage(unittest.TestCase):
             "envelope_sender_header": [],
             "always_trust_envelope_sender": "0"
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=())
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -271,7 +309,7 @@ class TestMessageVarious(unittest.TestCase):
             "originating_ip_headers": [],
             "always_trust_envelope_sender": "0"
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=())
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -330,7 +368,7 @@ class TestGetHeaders(unittest.TestCase):
             "always_trust_envelope_sender": "0",
             "envelope_sender_header": []
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=())
         self.msg = oa.message.Message(self.mock_ctxt, "Subject: test\n\n")
 
     def tearDown(self):
@@ -355,6 +393,25 @@ class TestGetHeaders(unittest.TestCase):
         self.msg.headers = {name: expected}
         self.assertEqual(self.msg.get_decoded_header(name), expected)
 
+    def test_get_cached_addr_headers_lazy(self):
+        patch("oa.config.LAZY_MODE", True).start()
+        patch("oa.config.LAZY_CACHE", True).start()
+        self.addCleanup(patch.stopall)
+        name = "test1"
+        self.msg.raw_headers = {name: ["<my@example.com>"]}
+        self.msg.addr_headers = {name: ["cached@example.com"]}
+        self.assertEqual(self.msg.get_addr_header(name),
+                         ["cached@example.com"])
+
+    def test_get_addr_headers_lazy_no_cache(self):
+        patch("oa.config.LAZY_MODE", True).start()
+        patch("oa.config.LAZY_CACHE", False).start()
+        self.addCleanup(patch.stopall)
+        name = "test1"
+        self.msg.raw_headers = {name: ["<my@example.com>"]}
+        self.msg.addr_headers = {name: ["cached@example.com"]}
+        self.assertEqual(self.msg.get_addr_header(name), ["my@example.com"])
+
     def test_get_addr_header(self):
         name = "test1"
         values = ["My Name <my@example.com>, <no@example.com>",
@@ -417,6 +474,228 @@ class TestGetHeaders(unittest.TestCase):
         self.assertEqual(results, expected)
 
 
+class TestLazyParsing(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.conf = {
+            "originating_ip_headers": [],
+            "always_trust_envelope_sender": "0",
+            "envelope_sender_header": []
+        }
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=(),
+                              networks=MagicMock(configured=False))
+        self.raw = ("Received: from mx.example.com (mx.example.com "
+                    "[1.2.3.4]) by mail.example.net; "
+                    "Mon, 1 Jan 2018 10:00:00 +0000\n"
+                    "Subject: test\n"
+                    "\n"
+                    "Visit http://example.com\n")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_headers_only(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertEqual(msg.raw_headers["Subject"], ["test"])
+        for name in oa.message.LAZY_ATTRIBUTES:
+            if name != "raw_msg":
+                self.assertNotIn(name, msg.__dict__)
+
+    def test_body_on_access(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertEqual(msg.text, "test Visit http://example.com ")
+        self.assertEqual(msg.uri_list, {"http://example.com"})
+        self.assertIn("raw_text", msg.__dict__)
+        self.assertNotIn("received_headers", msg.__dict__)
+
+    def test_html_parsed_once(self):
+        raw = ("Subject: test\n"
+               "Content-Type: text/html\n"
+               "\n"
+               "<html><head><title>Title</title></head><body>"
+               "<a href='http://example.com'>Example</a></body></html>\n")
+        msg = oa.message.Message(self.mock_ctxt, raw)
+        mock_feed = patch.object(oa.html_parser.HTML, "feed", autospec=True,
+                                 side_effect=html.parser.HTMLParser.feed
+                                 ).start()
+        msg.prepare("text")
+        oa.html_parser.parsed_metadata(msg, self.mock_ctxt)
+        self.assertEqual(mock_feed.call_count, 1)
+        self.assertIn("http://example.com", msg.uri_detail_links)
+
+    def test_html_results(self):
+        raw = ("Subject: test\n"
+               "Content-Type: text/html\n"
+               "\n"
+               "<html><head><title>Title</title></head><body>"
+               "<a href='http://example.com'>Example</a></body></html>\n")
+        msg = oa.message.Message(self.mock_ctxt, raw)
+        self.assertEqual(msg.text, "test Title Example")
+        self.assertEqual(msg.html_visible_text, ["Example"])
+        self.assertEqual(msg.html_invisible_text, ["Title"])
+        self.assertEqual(msg.html_tags["a"], 1)
+        self.assertEqual(
+            msg.html_links["http://example.com"]["a"]["text"], ["Example"])
+
+    def test_html_links_text_part(self):
+        raw = ("Subject: test\n"
+               "\n"
+               "<a href='http://example.com'>Example</a>\n")
+        msg = oa.message.Message(self.mock_ctxt, raw)
+        self.assertIn("http://example.com", msg.html_links)
+        self.assertEqual(msg.html_visible_text, [])
+        self.assertEqual(msg.html_tags, {})
+
+    def test_uris(self):
+        self.mock_ctxt.tlds = frozenset(("co.uk",))
+        raw = ("Subject: test\n"
+               "Content-Type: text/html\n"
+               "\n"
+               "Visit http://www.example.co.uk/page "
+               "<a href='http://1.2.3.4/'>here</a>\n")
+        msg = oa.message.Message(self.mock_ctxt, raw)
+        self.assertEqual(msg.uris["http://www.example.co.uk/page"].netloc,
+                         "www.example.co.uk")
+        self.assertEqual(msg.uris["http://1.2.3.4/"].scheme, "http")
+        self.assertEqual(msg.uris["http://www.example.co.uk/page"].domain,
+                         "example.co.uk")
+        self.assertTrue(msg.uris["http://1.2.3.4/"].is_ip)
+
+    def test_received_on_access(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertEqual(msg.hostname_with_ip,
+                         [("mx.example.com", "1.2.3.4")])
+        self.assertNotIn("text", msg.__dict__)
+
+    def test_parsed_once(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        with patch("oa.message.Message._parse_body",
+                   side_effect=oa.message.Message._parse_body,
+                   autospec=True) as mock_parse:
+            msg.text
+            msg.raw_text
+        self.assertEqual(mock_parse.call_count, 1)
+
+    def test_set_attribute(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        msg.text = "changed"
+        self.assertEqual(msg.text, "changed")
+        self.assertNotIn("raw_text", msg.__dict__)
+
+    def test_unknown_attribute(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertRaises(AttributeError, getattr, msg, "unknown")
+
+    def test_prepare(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        msg.prepare("text", "received_headers")
+        self.assertIn("text", msg.__dict__)
+        self.assertIn("trusted_relays", msg.__dict__)
+
+    def test_message_requires(self):
+        self.mock_ctxt.message_requires = ("text",)
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertIn("text", msg.__dict__)
+        self.assertNotIn("received_headers", msg.__dict__)
+
+    def test_message_requires_hooks_order(self):
+        calls = []
+        plugin = Mock(**{
+            "check_start.side_effect":
+                lambda msg: calls.append("check_start"),
+            "extract_metadata.side_effect":
+                lambda msg, payload, text, part: calls.append("extract"),
+            "parsed_metadata.side_effect":
+                lambda msg: calls.append("parsed"),
+        })
+        self.mock_ctxt.plugins = {"TestPlugin": plugin}
+        self.mock_ctxt.message_requires = ("text",)
+        oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertEqual(calls, ["check_start", "extract", "parsed"])
+
+    def test_missing_header_body_separator(self):
+        msg = oa.message.Message(self.mock_ctxt,
+                                 "Subject: test\nnot a header\n\nbody")
+        self.assertTrue(msg.missing_header_body_separator)
+        self.assertEqual(msg.raw_headers["Subject"], ["test"])
+
+    def test_header_body_separator(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertFalse(msg.missing_header_body_separator)
+
+
+class TestBytesMessage(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.conf = {
+            "originating_ip_headers": [],
+            "always_trust_envelope_sender": "0",
+            "envelope_sender_header": []
+        }
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=(),
+                              networks=MagicMock(configured=False))
+        self.raw = (u"Subject: test \u00e9\r\n"
+                    u"Content-Type: text/plain; charset=utf-8\r\n"
+                    u"Content-Transfer-Encoding: 8bit\r\n"
+                    u"\r\n"
+                    u"Visit http://example.com \u00e9\r\n")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_headers(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertEqual(msg.raw_headers["Subject"], [u"test \u00e9"])
+        self.assertNotIn("raw_msg", msg.__dict__)
+        self.assertNotIn("raw_bytes", msg.__dict__)
+
+    def test_raw_msg(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertEqual(msg.raw_msg, self.raw.replace(u"\r\n", u"\n"))
+
+    def test_raw_bytes(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertEqual(msg.raw_bytes,
+                         self.raw.replace(u"\r\n", u"\n").encode("utf-8"))
+
+    def test_raw_bytes_same_buffer(self):
+        raw = self.raw.replace(u"\r\n", u"\n").encode("utf-8")
+        msg = oa.message.Message(self.mock_ctxt, raw)
+        self.assertIs(msg.raw_bytes, raw)
+
+    def test_raw_bytes_text(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw)
+        self.assertEqual(msg.raw_bytes,
+                         self.raw.replace(u"\r\n", u"\n").encode("utf-8"))
+
+    def test_text(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertEqual(msg.text,
+                         u"test \u00e9 Visit http://example.com \u00e9 ")
+        self.assertEqual(msg.uri_list, {"http://example.com"})
+
+    def test_mime_headers(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertEqual(msg.get_raw_mime_header("Subject"),
+                         [u"test \u00e9"])
+
+    def test_no_body(self):
+        msg = oa.message.Message(self.mock_ctxt, b"Subject: test")
+        self.assertEqual(msg.raw_headers["Subject"], ["test"])
+        self.assertFalse(msg.missing_header_body_separator)
+
+    def test_missing_header_body_separator(self):
+        msg = oa.message.Message(self.mock_ctxt,
+                                 b"Subject: test\r\nnot a header\r\n\r\n")
+        self.assertTrue(msg.missing_header_body_separator)
+
+    def test_msgid(self):
+        msg = oa.message.Message(self.mock_ctxt, self.raw.encode("utf-8"))
+        self.assertTrue(msg.msgid.endswith("@sa_generated"))
+
+
 class TestParseRelays(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
@@ -425,7 +704,7 @@ class TestParseRelays(unittest.TestCase):
             "always_trust_envelope_sender": "0",
             "envelope_sender_header": []
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf, message_requires=())
         self.msg = oa.message.Message(self.mock_ctxt, "Subject: test\n\n")
 
     def tearDown(self):
@@ -439,6 +718,18 @@ class TestParseRelays(unittest.TestCase):
         self.msg._parse_relays(relays)
         self.assertEqual(self.msg.external_relays, [])
 
+    def test_get_untrusted_ips(self):
+        trusted = MagicMock()
+        trusted.__contains__.side_effect = \
+            lambda ip: ip == ipaddress.ip_address(u"10.0.0.1")
+        self.mock_ctxt.networks = MagicMock(trusted=trusted)
+        self.msg.received_headers = [{"ip": "1.2.3.4"}, {"ip": "10.0.0.1"},
+                                     {"ip": "1.2.3.4"}]
+        expected = [ipaddress.ip_address(u"1.2.3.4")] * 2
+        self.assertEqual(self.msg.get_untrusted_ips(), expected)
+        self.assertEqual(self.msg.get_untrusted_ips(), expected)
+        self.assertEqual(trusted.__contains__.call_count, 2)
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
@@ -449,6 +740,8 @@ def suite():
     test_suite.addTest(unittest.makeSuite(TestIterPartsMessage, "test"))
     test_suite.addTest(unittest.makeSuite(TestMessageVarious, "test"))
     test_suite.addTest(unittest.makeSuite(TestGetHeaders, "test"))
+    test_suite.addTest(unittest.makeSuite(TestLazyParsing, "test"))
+    test_suite.addTest(unittest.makeSuite(TestBytesMessage, "test"))
     test_suite.addTest(unittest.makeSuite(TestParseRelays, "test"))
     return test_suite
 
@@ -1,6 +1,7 @@
 
 from builtins import str
 
+import random
 import unittest
 import ipaddress
 import oa.networks
@@ -154,3 +155,85 @@ class NetworkListTest(unittest.TestCase):
         network = ipaddress.ip_network(str("192.168.0.0/24"))
         self.assertTrue((network, False) in self.networks.msa._networks)
 
+
+
+class RadixTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.network = oa.networks.MSANetworks()
+
+    def add(self, network, accepted=True):
+        self.network.add(ipaddress.ip_network(str(network)), accepted)
+
+    def check(self, ip):
+        return ipaddress.ip_address(str(ip)) in self.network
+
+    def test_first_match_exclusion(self):
+        self.add("192.168.1.0/24", False)
+        self.add("192.168.0.0/16")
+        self.assertFalse(self.check("192.168.1.1"))
+        self.assertTrue(self.check("192.168.2.1"))
+
+    def test_first_match_broader(self):
+        self.add("192.168.0.0/16")
+        self.add("192.168.1.0/24", False)
+        self.assertTrue(self.check("192.168.1.1"))
+
+    def test_duplicate(self):
+        self.add("10.0.0.0/8", False)
+        self.add("10.0.0.0/8")
+        self.assertFalse(self.check("10.1.2.3"))
+
+    def test_split(self):
+        self.add("10.1.0.0/16")
+        self.add("10.2.0.0/16")
+        self.add("10.0.0.0/8", False)
+        self.assertTrue(self.check("10.1.2.3"))
+        self.assertTrue(self.check("10.2.2.3"))
+        self.assertFalse(self.check("10.3.2.3"))
+        self.assertFalse(self.check("11.1.2.3"))
+
+    def test_host(self):
+        self.add("1.2.3.4/32")
+        self.assertTrue(self.check("1.2.3.4"))
+        self.assertFalse(self.check("1.2.3.5"))
+
+    def test_default_route(self):
+        self.add("1.2.3.0/24", False)
+        self.add("0.0.0.0/0")
+        self.assertFalse(self.check("1.2.3.4"))
+        self.assertTrue(self.check("5.6.7.8"))
+        self.assertFalse(self.check("::1"))
+
+    def test_ipv6(self):
+        self.add("2001:db8::/32")
+        self.assertTrue(self.check("2001:db8::1"))
+        self.assertFalse(self.check("2001:db9::1"))
+        self.assertFalse(self.check("32.1.13.184"))
+
+    def test_clear(self):
+        self.add("1.2.3.0/24")
+        self.network.clear()
+        self.assertFalse(self.check("1.2.3.4"))
+        self.assertEqual(self.network._networks, [])
+
+    def test_same_as_list(self):
+        rnd = random.Random(42)
+        networks = []
+        for dummy in range(200):
+            prefix = rnd.choice((8, 16, 20, 24, 28, 32))
+            network = ipaddress.ip_network((rnd.getrandbits(12) << 20, 32))
+            network = network.supernet(new_prefix=prefix) \
+                if prefix < 32 else network
+            accepted = rnd.random() < 0.7
+            networks.append((network, accepted))
+            self.network.add(network, accepted)
+        for dummy in range(2000):
+            ip = ipaddress.ip_address(rnd.getrandbits(12) << 20 |
+                                      rnd.getrandbits(20))
+            expected = False
+            for network, accepted in networks:
+                if ip in network:
+                    expected = accepted
+                    break
+            self.assertEqual(ip in self.network, expected, ip)
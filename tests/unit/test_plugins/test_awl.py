@@ -16,6 +16,7 @@ except:
 
     has_sqlalchemy = False
 
+import oa.db.pool
 import oa.plugins
 from oa.plugins import awl
 
@@ -320,6 +321,32 @@ class TestAWLBasePyMySQL(unittest.TestCase):
         result = self.plugin.get_entry(address, ip, signed_by)
         getEntryMySQL.assert_called_with(address, ip, signed_by)
 
+    def _pool(self):
+        self.conn = MagicMock()
+        pool = oa.db.pool.ConnectionPool("test", Mock(return_value=self.conn))
+        self.global_data["pool"] = pool
+        return pool
+
+    def test_get_mysql_entry_released(self):
+        pool = self._pool()
+        self.conn.cursor.return_value.fetchall.return_value = [("entry",)]
+        result = self.plugin.get_mysql_entry("address", "ip", "signed_by")
+        self.assertEqual(result, ("entry",))
+        self.conn.cursor.return_value.close.assert_called_once_with()
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+        self.assertEqual(pool.get_stats()["idle"], 1)
+
+    def test_get_mysql_entry_error_discarded(self):
+        pool = self._pool()
+        self.conn.cursor.return_value.execute.side_effect = ValueError
+        self.assertRaises(ValueError, self.plugin.get_mysql_entry,
+                          "address", "ip", "signed_by")
+        self.conn.cursor.return_value.close.assert_called_once_with()
+        self.conn.close.assert_called_once_with()
+        self.assertEqual(pool.get_stats()["in_use"], 0)
+        self.assertEqual(pool.get_stats()["idle"], 0)
+        self.assertEqual(pool.get_stats()["discarded"], 1)
+
     def test_check_from_in_auto_whitelist_with_mysql(self):
         self.mock_msg.score = 0
         self.global_data["auto_whitelist_factor"] = 0
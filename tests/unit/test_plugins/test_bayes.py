@@ -4,7 +4,10 @@ import unittest
 
 import mock
 from mock import MagicMock
+
+import oa.db.bayes.sqlite
 from oa.plugins.bayes import BayesPlugin, Store
+from oa.db.bayes.cache import CachedStore
 from oa.message import Message
 
 
@@ -42,6 +45,62 @@ class BayesTests(unittest.TestCase):
         self.assertEqual(ret, result)
         b._learn_trapped.assert_called_once_with(isspam, msg)
 
+    def test_learn_trapped_tokens(self):
+        """Test that the tokens are learned in a single transaction."""
+        b = BayesPlugin(self.mock_ctxt)
+        b.store = MagicMock(**{"seen_get.return_value": None})
+        b.tokenise = lambda msg: iter([(b"aaaaa", "a"), (b"bbbbb", "b")])
+        msg = MagicMock(msgid="<msgid>", receive_date=100)
+        self.assertTrue(b._learn_trapped(True, msg))
+        b.store.nspam_nham_change.assert_called_once_with(1, 0)
+        b.store.multi_tok_count_change.assert_called_once_with(
+            1, 0, {b"aaaaa": "a", b"bbbbb": "b"}, 100)
+        b.store.seen_put.assert_called_once_with("<msgid>", "s")
+        b.store.cleanup.assert_called_once_with()
+
+    def test_finish_parsing_end_cache(self):
+        """Test that the store is wrapped with the token cache."""
+        self.global_data.update({"bayes_store_module": "",
+                                 "bayes_token_cache_size": 100,
+                                 "bayes_token_cache_ttl": 60,
+                                 "bayes_totals_cache_ttl": 5})
+        mock.patch("oa.plugins.base.BasePlugin.finish_parsing_end").start()
+        b = BayesPlugin(self.mock_ctxt)
+        b.finish_parsing_end(MagicMock())
+        self.assertIsInstance(b.store, CachedStore)
+        self.assertIsInstance(b.store.store, Store)
+        self.assertEqual(b.store.maxsize, 100)
+
+    def test_finish_parsing_end_no_cache(self):
+        """Test that the token cache can be disabled."""
+        self.global_data.update({"bayes_store_module": "",
+                                 "bayes_token_cache_size": 0})
+        mock.patch("oa.plugins.base.BasePlugin.finish_parsing_end").start()
+        b = BayesPlugin(self.mock_ctxt)
+        b.finish_parsing_end(MagicMock())
+        self.assertIsInstance(b.store, Store)
+
+    def test_store_not_pickled(self):
+        """The store is set up again when the pickled ruleset is loaded."""
+        self.global_data.update({"bayes_store_module": "",
+                                 "bayes_token_cache_size": 0})
+        mock.patch("oa.plugins.base.BasePlugin.finish_parsing_end").start()
+        b = BayesPlugin(self.mock_ctxt)
+        b.finish_parsing_end(MagicMock())
+        self.assertNotIn("store", b.__getstate__())
+        self.assertIsInstance(b.store, Store)
+
+    def test_finish_parsing_end_store_module(self):
+        """Test that the store can be loaded from another module."""
+        self.global_data.update({"bayes_store_module": "oa.db.bayes.sqlite",
+                                 "bayes_path": "/tmp/bayes",
+                                 "bayes_token_cache_size": 0})
+        mock.patch("oa.plugins.base.BasePlugin.finish_parsing_end").start()
+        b = BayesPlugin(self.mock_ctxt)
+        b.finish_parsing_end(MagicMock())
+        self.assertIsInstance(b.store, oa.db.bayes.sqlite.Store)
+        self.assertEqual(b.store.path, "/tmp/bayes.sqlite")
+
     def test_learn_message_no_bayes(self):
         """Test the learn_message method when bayes is not enabled."""
         b = BayesPlugin(self.mock_ctxt)
@@ -50,6 +109,22 @@ class BayesTests(unittest.TestCase):
         result = b.learn_message(None, None)
         self.assertEqual(result, None)
 
+    def test_parsed_metadata_html(self):
+        """Test that the visible and invisible HTML text is rendered."""
+        self.mock_ctxt.set_plugin_data.side_effect = \
+            lambda p, k, v: self.global_data.update({k: v})
+        b = BayesPlugin(self.mock_ctxt)
+        b['rendered'] = ["subject"]
+        b['visible_rendered'] = ["subject"]
+        b['invisible_rendered'] = []
+        msg = MagicMock(html_visible_text=["visible", "text"],
+                        html_invisible_text=["hidden"])
+        b.parsed_metadata(msg)
+        self.assertEqual(b['rendered'], "subject\nvisible text")
+        self.assertEqual(b['visible_rendered'], ["subject", "visible text"])
+        self.assertEqual(b['invisible_rendered'], "hidden")
+        self.assertEqual(b['bayes_token_inviz'], ["hidden"])
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
@@ -171,6 +171,18 @@ class TestShortCircuit(unittest.TestCase):
         mock_wrap.assert_called_with(self.mock_rule, "ham")
         self.assertEqual(self.mock_rule.match, mock_wrap.return_value)
 
+    def test_finish_parsing_already_wrapped(self):
+        """The rules of a cached or compiled ruleset are only wrapped
+        once.
+        """
+        original = self.mock_rule.match
+        self.global_data["shortcircuit"] = [
+            "TEST spam"
+        ]
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertIs(self.mock_rule.match.match_func, original)
+
     def test_finish_parsing_off(self):
         mock_wrap = MagicMock()
         self.plugin.get_wrapped_method = mock_wrap
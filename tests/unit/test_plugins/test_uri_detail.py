@@ -13,6 +13,8 @@ except ImportError:
 
 import oa.context
 import oa.message
+import oa.regex
+import oa.rules.uri_index
 import oa.plugins.uri_detail
 
 def _get_basic_message(text=""):
@@ -190,6 +192,32 @@ class TestUriDetailRule(unittest.TestCase):
             pattern.match.assert_has_calls(calls)
         self.assertEqual(result, False)
 
+    def test_get_index_domains(self):
+        """An exact domain pattern restricts the rule to that domain"""
+        pattern = [("text", oa.regex.perl2re("/test/")),
+                   ("domain", oa.regex.perl2re(r"/^Example\.com$/"))]
+        rule = oa.plugins.uri_detail.URIDetailRule("TEST", pattern=pattern)
+        self.assertEqual(rule.get_index_domains(), {u"example.com"})
+
+    def test_get_index_domains_no_exact(self):
+        """A domain pattern that is not exact doesn't restrict the rule"""
+        pattern = [("domain", oa.regex.perl2re(r"/\bexample\.com\b/")),
+                   ("domain", oa.regex.perl2re(r"/^example\.com$/", "!~"))]
+        rule = oa.plugins.uri_detail.URIDetailRule("TEST", pattern=pattern)
+        self.assertIsNone(rule.get_index_domains())
+
+    def test_add_to_index(self):
+        """The rule plugs into the URI index and gets the same results"""
+        pattern = [("domain", oa.regex.perl2re(r"/^test\.com$/")),
+                   ("text", oa.regex.perl2re(r"/exampletest/"))]
+        rule = oa.plugins.uri_detail.URIDetailRule("TEST", pattern=pattern)
+        index = oa.rules.uri_index.URIIndex()
+        self.assertTrue(index.add_rule(rule))
+        self.mock_msg.uri_list = set()
+        self.assertEqual(index.match(self.mock_msg),
+                         {"TEST": rule.match(self.mock_msg)})
+        self.assertEqual(rule.match(self.mock_msg), True)
+
     def test_get_rule_kwargs(self):
         """Test getting the kwargs for the rule, the rule have keys (what to match in the
         link) and the value to be used in against the regex"""
@@ -9,6 +9,7 @@ except ImportError:
     from mock import patch, Mock, MagicMock, call
 
 import oa.plugins.wlbl_eval
+import oa.uri_parser
 
 
 class TestGetHeader(unittest.TestCase):
@@ -739,6 +740,7 @@ class TestUriHost(unittest.TestCase):
 
     def test_check_uri_host_listed(self):
         self.mock_msg.uri_list = ["ceva.example.com"]
+        self.mock_msg.uris = oa.uri_parser.parse_uris(self.mock_msg.uri_list)
         self.global_data["parsed_enlist_uri_host"] = {
             "WHITE": {
                 "in_list": ["example.com"],
@@ -754,6 +756,7 @@ class TestUriHost(unittest.TestCase):
 
     def test_check_uri_host_listed_match(self):
         self.mock_msg.uri_list = ["ceva.example.com"]
+        self.mock_msg.uris = oa.uri_parser.parse_uris(self.mock_msg.uri_list)
         self.global_data["parsed_enlist_uri_host"] = {
             "WHITE": {
                 "in_list": ["example.com"],
@@ -767,6 +770,18 @@ class TestUriHost(unittest.TestCase):
         result = self.plug.check_uri_host_listed(self.mock_msg, "WHITE")
         self.assertTrue(result)
 
+    def test_check_uri_host_listed_end_of_uri(self):
+        self.mock_msg.uri_list = ["http://ceva.example.com/page"]
+        self.mock_msg.uris = oa.uri_parser.parse_uris(self.mock_msg.uri_list)
+        self.global_data["parsed_enlist_uri_host"] = {
+            "WHITE": {
+                "in_list": ["example.com"],
+                "not_in_list": []
+            }
+        }
+        result = self.plug.check_uri_host_listed(self.mock_msg, "WHITE")
+        self.assertFalse(result)
+
 
 class TestCheckForged(unittest.TestCase):
     def setUp(self):
@@ -1,5 +1,6 @@
 """Tests for pad.protocol.base"""
 
+import zlib
 import unittest
 
 try:
@@ -53,8 +54,7 @@ class TestBaseCommand(unittest.TestCase):
         self.mockr.read.side_effect = [message, None]
         base = self.get_base()
         self.mock_h.assert_called_with(self.mock_m.return_value, {})
-        self.mock_m.assert_called_with(self.mockrules.ctxt,
-                                       message.decode("utf8"))
+        self.mock_m.assert_called_with(self.mockrules.ctxt, message)
 
     def test_init_message_chunked(self):
         """Test creating a new base protocol command."""
@@ -64,8 +64,17 @@ class TestBaseCommand(unittest.TestCase):
                                        None]
         base = self.get_base()
         self.mock_h.assert_called_with(self.mock_m.return_value, {})
-        self.mock_m.assert_called_with(self.mockrules.ctxt,
-                                       message.decode("utf8"))
+        self.mock_m.assert_called_with(self.mockrules.ctxt, message)
+
+    def test_init_message_compressed(self):
+        """Test receiving a compressed message."""
+        message = b"Subject: Test\n\nTest message"
+        oa.protocol.base.BaseProtocol.has_message = True
+        oa.protocol.base.BaseProtocol.has_options = True
+        self.mockr.readline.side_effect = [b"Compress: zlib", b""]
+        self.mockr.read.side_effect = [zlib.compress(message), None]
+        base = self.get_base()
+        self.mock_m.assert_called_with(self.mockrules.ctxt, message)
 
     def test_init_message_options(self):
         """Test creating a new base protocol command."""
@@ -78,8 +87,7 @@ class TestBaseCommand(unittest.TestCase):
         base = self.get_base()
         self.mock_h.assert_called_with(
             self.mock_m.return_value, {"content-length": "27", "user": "Alex"})
-        self.mock_m.assert_called_with(self.mockrules.ctxt,
-                                       message.decode("utf8"))
+        self.mock_m.assert_called_with(self.mockrules.ctxt, message)
 
     def test_init_response(self):
         """Test creating a new base protocol command."""
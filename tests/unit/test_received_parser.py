@@ -2,6 +2,7 @@
 Tests for pad.received_parser
 """
 
+import random
 import unittest
 import collections
 import email.header
@@ -13,6 +14,8 @@ except ImportError:
 
 import oa.received_parser
 
+import tests.util.benchmark
+
 
 class TestReceivedParser(unittest.TestCase):
     def setUp(self):
@@ -954,10 +957,180 @@ class TestReceivedParser(unittest.TestCase):
         self.assertEqual(parsed_data, expected)
 
 
+class TestReceivedCache(unittest.TestCase):
+    header = ("from server1.example.com ([216.219.119.8] "
+              "helo=relay.example.com) by server.example.org with esmtps "
+              "(Exim 4.85) (envelope-from <user@example.org>) "
+              "id %s for john@example.com; Mon, 25 Jan 2016 06:59:12 -0600")
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.cache = oa.received_parser.ReceivedCache(2)
+
+    def parse(self, *headers):
+        return oa.received_parser.ReceivedParser(headers,
+                                                 self.cache).received
+
+    def test_cache_hit(self):
+        first = self.parse(self.header % "1aNgjg-00006s-19")
+        second = self.parse(self.header % "1aNgjh-00007t-20")
+        self.assertEqual(first[0]["id"], "1aNgjg-00006s-19")
+        self.assertEqual(second[0]["id"], "1aNgjh-00007t-20")
+        self.assertEqual(first[0]["rdns"], "server1.example.com")
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_cache_date(self):
+        self.parse(self.header % "abc")
+        self.parse((self.header % "abc").replace("Mon, 25", "Tue, 26"))
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_cache_id_brackets(self):
+        result = self.parse(self.header % "<abc@example.com>")
+        self.assertEqual(result[0]["id"], "abc@example.com")
+
+    def test_cache_unsafe_id(self):
+        result = self.parse(self.header % "a(b)")
+        self.assertEqual(result[0]["id"], "a(b)")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_cache_id_in_other_field(self):
+        get_helo = lambda header: header.split()[-1]
+        with patch.object(oa.received_parser.ReceivedParser, "get_helo",
+                          side_effect=get_helo):
+            result = self.parse("from a ([1.2.3.4]) by mx.example.com id abc")
+        self.assertEqual(result[0]["helo"], "abc")
+        self.assertEqual(result[0]["id"], "abc")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_cache_skipped(self):
+        header = ("from root by server6.seinternal.com with "
+                  "local-spamexperts-generated (Exim 4.80) id "
+                  "1abp1W-0007Xm-KO for spam@example.com")
+        self.assertEqual(self.parse(header), [])
+        self.assertEqual(self.parse(header), [])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_cache_lru(self):
+        self.parse("from a.example.com ([1.2.3.4]) by mx.example.com")
+        self.parse("from b.example.com ([1.2.3.5]) by mx.example.com")
+        self.parse("from a.example.com ([1.2.3.4]) by mx.example.com")
+        self.parse("from c.example.com ([1.2.3.6]) by mx.example.com")
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+        self.parse("from a.example.com ([1.2.3.4]) by mx.example.com")
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_cache_disabled(self):
+        self.cache.resize(0)
+        result = self.parse(self.header % "abc")
+        self.assertEqual(result[0]["id"], "abc")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_resize(self):
+        self.parse("from a.example.com ([1.2.3.4]) by mx.example.com")
+        self.parse("from b.example.com ([1.2.3.5]) by mx.example.com")
+        self.cache.resize(1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_get_stats(self):
+        self.parse(self.header % "abc")
+        self.parse(self.header % "abd")
+        self.assertEqual(self.cache.get_stats(),
+                         {"size": 1, "maxsize": 2, "hits": 1, "misses": 1,
+                          "evictions": 0, "hit_rate": 0.5})
+        self.cache.clear()
+        self.assertEqual(self.cache.get_stats()["hit_rate"], 0.0)
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestTokenizer(unittest.TestCase):
+    postfix = ("mail.example.com (mail.example.com. [1.2.3.4]) by "
+               "mx.example.org (Postfix) with ESMTPSA id 48963245BF8 for "
+               "<user@example.org>")
+    exim = ("rdns.example.com ([217.70.183.195]:4521 helo=helo.example.com) "
+            "by by.example.org with esmtps (Exim 4.85) (envelope-from "
+            "<envfrom@example.com>) id 1aVFVG-0000me-LC for user@example.org")
+
+    def test_tokenize(self):
+        clauses = oa.received_parser.ReceivedParser.tokenize(self.postfix)
+        self.assertEqual(clauses["from"], ["mail.example.com",
+                                           "(mail.example.com.",
+                                           "[1.2.3.4])"])
+        self.assertEqual(clauses["by"], "mx.example.org")
+        self.assertEqual(clauses["with"], ["ESMTPSA"])
+        self.assertEqual(clauses["id"], "48963245BF8")
+        self.assertEqual(clauses["for"], "<user@example.org>")
+
+    def test_tokenize_last_id(self):
+        clauses = oa.received_parser.ReceivedParser.tokenize(
+            "a by b id 123 (uid 1000)")
+        self.assertEqual(clauses["id"], "1000)")
+
+    def test_tokenize_by_last_token(self):
+        clauses = oa.received_parser.ReceivedParser.tokenize("a by b")
+        self.assertEqual(clauses["by"], "")
+
+    def test_parse_header_postfix(self):
+        result = oa.received_parser.ReceivedParser.parse_header(self.postfix)
+        self.assertEqual(result, {
+            "rdns": "mail.example.com.", "ip": "1.2.3.4",
+            "by": "mx.example.org", "helo": "mail.example.com",
+            "ident": "", "id": "48963245BF8", "envfrom": "",
+            "auth": "ESMTPSA"})
+
+    def test_parse_header_exim(self):
+        result = oa.received_parser.ReceivedParser.parse_header(self.exim)
+        self.assertEqual(result, {
+            "rdns": "rdns.example.com", "ip": "217.70.183.195",
+            "by": "by.example.org", "helo": "helo.example.com",
+            "ident": "", "id": "1aVFVG-0000me-LC",
+            "envfrom": "envfrom@example.com", "auth": ""})
+
+    def test_parse_header_uncommon(self):
+        header = "mail.example.com (HELO helo.example.com) (1.2.3.4) by mx"
+        self.assertIsNone(oa.received_parser.ReceivedParser._get_relay(
+            header.split(" "), header))
+        self.assertEqual(
+            oa.received_parser.ReceivedParser.parse_header(header),
+            oa.received_parser.ReceivedParser.parse_header_regex(header))
+
+    def test_get_relay_partial_ip(self):
+        header = "rdns.example.com (rdns.example.com [1.2.3.4x]) by mx"
+        self.assertIsNone(oa.received_parser.ReceivedParser._get_relay(
+            header.split(" "), header))
+        header = "mx.example.com ([1.2.3.4x] helo=helo.example.com) by mx"
+        self.assertIsNone(oa.received_parser.ReceivedParser._get_relay(
+            header.split(" "), header))
+
+    def test_parse_header_skip(self):
+        header = ("mail.example.com (mail.example.com [1.2.3.4]) by "
+                  "mx.example.org with local id 123")
+        self.assertIsNone(
+            oa.received_parser.ReceivedParser.parse_header(header))
+
+    def test_differential(self):
+        rnd = random.Random(42)
+        for common in (0.0, 0.8):
+            headers = oa.received_parser.ReceivedParser(
+                [tests.util.benchmark.generate_received_header(rnd, common)
+                 for dummy in range(2500)], None).received_headers
+            for header in headers:
+                self.assertEqual(
+                    oa.received_parser.ReceivedParser.parse_header(header),
+                    oa.received_parser.ReceivedParser.parse_header_regex(
+                        header), header)
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestReceivedParser, "test"))
+    test_suite.addTest(unittest.makeSuite(TestReceivedCache, "test"))
+    test_suite.addTest(unittest.makeSuite(TestTokenizer, "test"))
     return test_suite
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 """Tests for pad.regex"""
 
 import re
+import gc
+import pickle
 import unittest
 
 try:
@@ -17,6 +19,9 @@ class TestPerl2Re(unittest.TestCase):
         self.mock_compile = patch("oa.regex.re.compile").start()
         self.mock_match_pattern = patch("oa.regex.MatchPattern").start()
         self.mock_notmatch_pattern = patch("oa.regex.NotMatchPattern").start()
+        patch("oa.regex._POOL", oa.regex.weakref.WeakValueDictionary()).start()
+        patch("oa.regex._PERL_POOL",
+              oa.regex.weakref.WeakValueDictionary()).start()
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -56,11 +61,224 @@ class TestPerl2Re(unittest.TestCase):
         self.assertEqual(result, self.mock_notmatch_pattern(pattern))
 
 
+class TestPatternPool(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("oa.regex._POOL", oa.regex.weakref.WeakValueDictionary()).start()
+        patch("oa.regex._PERL_POOL",
+              oa.regex.weakref.WeakValueDictionary()).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_same_pattern(self):
+        first = oa.regex.perl2re("/test/i")
+        second = oa.regex.perl2re("m{test}i")
+        self.assertIs(first, second)
+
+    def test_different_flags(self):
+        first = oa.regex.perl2re("/test/i")
+        second = oa.regex.perl2re("/test/")
+        self.assertIsNot(first, second)
+
+    def test_different_match_op(self):
+        first = oa.regex.perl2re("/test/", "=~")
+        second = oa.regex.perl2re("/test/", "!~")
+        self.assertIsNot(first, second)
+        self.assertIsInstance(second, oa.regex.NotMatchPattern)
+
+    def test_different_backend(self):
+        first = oa.regex.perl2re("/test/")
+        patch("oa.regex.oa.regex_backend.get_backend",
+              return_value="other").start()
+        patch.dict("oa.regex.oa.regex_backend.BACKENDS",
+                   {"other": lambda pattern: pattern}).start()
+        second = oa.regex.perl2re("/test/")
+        self.assertIsNot(first, second)
+
+    def test_matcher(self):
+        matcher = Mock()
+        patch("oa.regex.oa.regex_backend.get_matcher",
+              return_value=matcher).start()
+        result = oa.regex.perl2re("/test/")
+        self.assertIs(result._matcher, matcher)
+        self.assertEqual(result._pattern.pattern, "test")
+
+    def test_get_pattern(self):
+        result = oa.regex.get_pattern("test", re.I)
+        self.assertIs(result, oa.regex.perl2re("/test/i"))
+
+    def test_get_pattern_invalid_match_op(self):
+        self.assertIsNone(oa.regex.get_pattern("test", 0, "~~"))
+
+    def test_same_perl_pattern_not_converted(self):
+        first = oa.regex.perl2re("/test/i")
+        with patch("oa.regex._perl2re") as mock_convert:
+            second = oa.regex.perl2re("/test/i")
+        self.assertIs(first, second)
+        self.assertFalse(mock_convert.called)
+
+    def test_perl_pattern_different_backend(self):
+        first = oa.regex.perl2re("/test/")
+        patch("oa.regex.oa.regex_backend.get_backend",
+              return_value="other").start()
+        with patch("oa.regex._perl2re") as mock_convert:
+            second = oa.regex.perl2re("/test/")
+        self.assertIs(second, mock_convert.return_value)
+        self.assertIsNot(first, second)
+
+    def test_unpickled_interned(self):
+        pattern = oa.regex.perl2re("/test/i")
+        self.assertIs(pickle.loads(pickle.dumps(pattern)), pattern)
+
+    def test_unpickled_dill_interned(self):
+        try:
+            import dill
+        except ImportError:
+            self.skipTest("dill is not installed")
+        pattern = oa.regex.perl2re("/test/", "!~")
+        self.assertIs(dill.loads(dill.dumps(pattern)), pattern)
+
+    def test_unpickled_released(self):
+        data = pickle.dumps(oa.regex.perl2re("/test/i"))
+        gc.collect()
+        pattern = pickle.loads(data)
+        self.assertIs(pattern, oa.regex.get_pattern("test", re.I))
+        self.assertEqual(pattern.match("TEST"), 1)
+
+    def test_released(self):
+        oa.regex.perl2re("/test/")
+        gc.collect()
+        self.assertEqual(len(oa.regex._POOL), 0)
+        self.assertEqual(len(oa.regex._PERL_POOL), 0)
+
+
+class TestPatternCache(unittest.TestCase):
+    def test_cached(self):
+        analyse = Mock(return_value=42)
+        cached = oa.regex.pattern_cache(analyse)
+        pattern = re.compile("test")
+        self.assertEqual(cached(pattern), 42)
+        self.assertEqual(cached(pattern), 42)
+        analyse.assert_called_once_with(pattern)
+
+    def test_different_patterns(self):
+        analyse = Mock(return_value=42)
+        cached = oa.regex.pattern_cache(analyse)
+        cached(re.compile("test"))
+        cached(re.compile("test", re.I))
+        self.assertEqual(analyse.call_count, 2)
+
+    def test_not_hashable(self):
+        analyse = Mock(return_value=42)
+        cached = oa.regex.pattern_cache(analyse)
+        self.assertEqual(cached([]), 42)
+        self.assertEqual(cached([]), 42)
+        self.assertEqual(analyse.call_count, 2)
+
+
+class TestRegex(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("oa.config.LAZY_MODE", True).start()
+        patch("oa.config.LAZY_CACHE", True).start()
+        patch("oa.regex._REGEXES", oa.regex.weakref.WeakSet()).start()
+        self.mock_compile = patch("oa.regex.re.compile",
+                                  side_effect=lambda *args: Mock()).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_not_compiled_on_init(self):
+        oa.regex.Regex("test")
+        self.assertFalse(self.mock_compile.called)
+
+    def test_compiled_once(self):
+        regex = oa.regex.Regex("test", re.I)
+        compiled = regex.compile()
+        self.assertIs(regex.compile(), compiled)
+        self.mock_compile.assert_called_once_with("test", re.I)
+
+    def test_recompiled_without_cache(self):
+        patch("oa.config.LAZY_CACHE", False).start()
+        regex = oa.regex.Regex("test")
+        self.assertIsNot(regex.compile(), regex.compile())
+        self.assertEqual(self.mock_compile.call_count, 2)
+        self.assertIsNone(regex.compiled)
+
+    def test_compiled_once_not_lazy(self):
+        patch("oa.config.LAZY_MODE", False).start()
+        patch("oa.config.LAZY_CACHE", False).start()
+        regex = oa.regex.Regex("test")
+        self.assertIs(regex.compile(), regex.compile())
+        self.assertEqual(self.mock_compile.call_count, 1)
+
+    def test_compiled_once_threads(self):
+        regex = oa.regex.Regex("test")
+        results = []
+        threads = [oa.regex.threading.Thread(
+            target=lambda: results.append(regex.compile()))
+            for dummy in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.mock_compile.call_count, 1)
+        self.assertEqual(len(set(id(result) for result in results)), 1)
+
+    def test_warm_up(self):
+        regexes = [oa.regex.Regex("test%s" % i) for i in range(3)]
+        regexes[0].compile()
+        self.assertEqual(oa.regex.warm_up(), 2)
+        for regex in regexes:
+            self.assertIsNotNone(regex.compiled)
+        self.assertEqual(self.mock_compile.call_count, 3)
+
+    def test_warm_up_without_cache(self):
+        patch("oa.config.LAZY_CACHE", False).start()
+        regex = oa.regex.Regex("test")
+        oa.regex.warm_up()
+        self.assertIs(regex.compile(), regex.compiled)
+        self.assertEqual(self.mock_compile.call_count, 1)
+
+    def test_warm_up_invalid(self):
+        self.mock_compile.side_effect = re.error("invalid")
+        regex = oa.regex.Regex("(")
+        self.assertEqual(oa.regex.warm_up(), 0)
+        self.assertIsNone(regex.compiled)
+
+    def test_warm_up_released(self):
+        oa.regex.Regex("test")
+        gc.collect()
+        self.assertEqual(oa.regex.warm_up(), 0)
+
+    def test_start_warm_up(self):
+        regex = oa.regex.Regex("test")
+        thread = oa.regex.start_warm_up()
+        thread.join()
+        self.assertTrue(thread.daemon)
+        self.assertIsNotNone(regex.compiled)
+
+
 class TestPattern(unittest.TestCase):
     def test_pattern(self):
         p = oa.regex.Pattern(None)
         self.assertRaises(NotImplementedError, p.match, "test")
 
+    def test_pattern_unpickled(self):
+        p = oa.regex.Pattern.__new__(oa.regex.Pattern)
+        p.__setstate__({"_pattern": "compiled"})
+        self.assertEqual(p._matcher, "compiled")
+        self.assertIsNone(p._key)
+
+    def test_pattern_not_interned_pickled(self):
+        p = oa.regex.MatchPattern(re.compile("test"))
+        result = pickle.loads(pickle.dumps(p))
+        self.assertIsNot(result, p)
+        self.assertEqual(result.match("test"), 1)
+
     def test_matchpattern_matched(self):
         p = oa.regex.MatchPattern(Mock(**{"search.return_value": True}))
         result = p.match("test")
@@ -86,6 +304,9 @@ def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestPerl2Re, "test"))
+    test_suite.addTest(unittest.makeSuite(TestPatternPool, "test"))
+    test_suite.addTest(unittest.makeSuite(TestPatternCache, "test"))
+    test_suite.addTest(unittest.makeSuite(TestRegex, "test"))
     test_suite.addTest(unittest.makeSuite(TestPattern, "test"))
     return test_suite
 
@@ -0,0 +1,371 @@
+"""Tests for oa.regex_backend"""
+
+import re
+import signal
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.regex
+import oa.regex_backend
+
+
+class TestBackend(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("oa.regex_backend._BACKEND", "re").start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_default(self):
+        self.assertEqual(oa.regex_backend.get_backend(), "re")
+
+    def test_set_backend_unknown(self):
+        self.assertRaises(ValueError, oa.regex_backend.set_backend, "pcre")
+        self.assertEqual(oa.regex_backend.get_backend(), "re")
+
+    def test_set_backend_unavailable(self):
+        patch("oa.regex_backend.re2", None).start()
+        self.assertRaises(ValueError, oa.regex_backend.set_backend, "re2")
+
+    def test_set_backend(self):
+        patch("oa.regex_backend.re2").start()
+        oa.regex_backend.set_backend("re2")
+        self.assertEqual(oa.regex_backend.get_backend(), "re2")
+
+    def test_get_matcher_re(self):
+        pattern = re.compile("test")
+        self.assertIs(oa.regex_backend.get_matcher(pattern), pattern)
+
+    def test_get_matcher_fallback(self):
+        patch("oa.regex_backend.re2", None).start()
+        pattern = re.compile("test")
+        self.assertIs(oa.regex_backend.get_matcher(pattern, "re2"), pattern)
+
+    def test_get_matcher_re2(self):
+        mock_compile = patch("oa.regex_backend.compile_re2").start()
+        pattern = re.compile("test")
+        matcher = oa.regex_backend.get_matcher(pattern, "re2")
+        self.assertIsInstance(matcher, oa.regex_backend.RE2Matcher)
+        self.assertIs(matcher.pattern, pattern)
+        self.assertIs(matcher.compiled, mock_compile.return_value)
+
+
+class TestCompileRE2(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mock_re2 = patch("oa.regex_backend.re2").start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def check_supported(self, pattern, flags=0, expected=None):
+        result = oa.regex_backend.compile_re2(pattern, flags)
+        self.assertIs(result, self.mock_re2.compile.return_value)
+        if expected is not None:
+            self.assertEqual(self.mock_re2.compile.call_args[0][0], expected)
+
+    def check_unsupported(self, pattern, flags=0):
+        self.assertIsNone(oa.regex_backend.compile_re2(pattern, flags))
+        self.assertFalse(self.mock_re2.compile.called)
+
+    def test_unavailable(self):
+        patch("oa.regex_backend.re2", None).start()
+        self.assertIsNone(oa.regex_backend.compile_re2("test"))
+
+    def test_simple(self):
+        self.check_supported(r"\bviagra\d+\w*", expected=r"\bviagra\d+\w*")
+
+    def test_flags(self):
+        self.check_supported("test", re.I | re.M | re.S, "(?ims)test")
+
+    def test_end_multiline(self):
+        self.check_supported("test$", re.M)
+
+    def test_end(self):
+        self.check_unsupported("test$")
+
+    def test_space(self):
+        self.check_unsupported(r"a\sb")
+
+    def test_space_in_set(self):
+        self.check_unsupported(r"a[\S.]b")
+
+    def test_space_in_group(self):
+        self.check_unsupported(r"(?:a|(b\s)+)c")
+
+    def test_verbose(self):
+        self.check_unsupported("test", re.X)
+
+    def test_empty_min_repeat(self):
+        self.check_unsupported("a{,3}")
+
+    def test_posix_class(self):
+        self.check_unsupported("[[:alpha:]]")
+
+    def test_invalid(self):
+        self.check_unsupported("(test")
+
+    def test_re2_error(self):
+        self.mock_re2.error = ValueError
+        self.mock_re2.compile.side_effect = ValueError("backreference")
+        self.assertIsNone(oa.regex_backend.compile_re2(r"(a)\1"))
+
+
+class TestRE2Matcher(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.pattern = Mock()
+        self.compiled = Mock()
+        self.matcher = oa.regex_backend.RE2Matcher(self.pattern,
+                                                   self.compiled)
+
+    def test_ascii(self):
+        result = self.matcher.search(u"test")
+        self.assertIs(result, self.compiled.search.return_value)
+        self.assertFalse(self.pattern.search.called)
+
+    def test_not_ascii(self):
+        result = self.matcher.search(u"t\xe9st")
+        self.assertIs(result, self.pattern.search.return_value)
+        self.assertFalse(self.compiled.search.called)
+
+    def test_reduce(self):
+        self.assertEqual(self.matcher.__reduce__(),
+                         (oa.regex_backend.get_matcher,
+                          (self.pattern, "re2")))
+
+
+@unittest.skipIf(oa.regex_backend.re2 is None, "google-re2 not installed")
+class TestRE2(unittest.TestCase):
+    """Check the results with the real RE2 engine."""
+
+    def check_same(self, pattern, flags, texts):
+        compiled = re.compile(pattern, flags)
+        matcher = oa.regex_backend.get_matcher(compiled, "re2")
+        self.assertIsInstance(matcher, oa.regex_backend.RE2Matcher)
+        for text in texts:
+            self.assertEqual(bool(matcher.search(text)),
+                             bool(compiled.search(text)), text)
+
+    def test_same_results(self):
+        self.check_same(r"\bv[i1]agra\b", re.I,
+                        [u"buy VIAGRA now", u"viagras", u"v1agra", u""])
+
+    def test_same_results_unicode(self):
+        self.check_same(r"^\w+$", re.M, [u"t\xe9st", u"test", u"a b"])
+
+    def test_backtracking(self):
+        compiled = re.compile(r"(a+)+b")
+        matcher = oa.regex_backend.get_matcher(compiled, "re2")
+        self.assertIsNone(matcher.search(u"a" * 100))
+
+    def test_lookahead_fallback(self):
+        compiled = re.compile(r"a(?=b)")
+        self.assertIs(oa.regex_backend.get_matcher(compiled, "re2"),
+                      compiled)
+
+
+class TestMatchBudget(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.now = 100.0
+        patch("oa.regex_backend._clock", lambda: self.now).start()
+        patch("oa.regex_backend.logging").start()
+        self.matcher = Mock(pattern="test")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_search(self):
+        budget = oa.regex_backend.MatchBudget(1.0, 10.0)
+        result = budget.search(self.matcher, "text")
+        self.assertIs(result, self.matcher.search.return_value)
+        self.assertEqual(budget.exceeded, [])
+
+    def test_search_exceeded(self):
+        def slow_search(text):
+            self.now += 2
+            return True
+        self.matcher.search.side_effect = slow_search
+        budget = oa.regex_backend.MatchBudget(1.0)
+        self.assertIsNone(budget.search(self.matcher, "text"))
+        self.assertEqual(budget.exceeded, ["test"])
+
+    def test_search_interrupted(self):
+        budget = oa.regex_backend.MatchBudget(1.0)
+
+        def slow_search(text):
+            budget.interrupt()
+        self.matcher.search.side_effect = slow_search
+        self.assertIsNone(budget.search(self.matcher, "text"))
+        self.assertEqual(budget.exceeded, ["test"])
+        self.assertFalse(budget._active)
+
+    def test_interrupt_inactive(self):
+        budget = oa.regex_backend.MatchBudget(1.0)
+        budget.interrupt()
+
+    def test_get_timeout(self):
+        budget = oa.regex_backend.MatchBudget(1.0, 5.0)
+        self.assertEqual(budget._get_timeout(self.now), 1.0)
+        self.assertEqual(budget._get_timeout(self.now + 4.5), 0.5)
+        self.assertEqual(budget._get_timeout(self.now + 5), 0.001)
+
+    def test_message_exceeded(self):
+        budget = oa.regex_backend.MatchBudget(message_timeout=5.0)
+        self.now += 6
+        self.assertIsNone(budget.search(self.matcher, "text"))
+        self.assertIsNone(budget.search(self.matcher, "text"))
+        self.assertFalse(self.matcher.search.called)
+        self.assertTrue(budget.message_exceeded)
+        self.assertEqual(budget.exceeded, ["test", "test"])
+
+    def test_pattern_name(self):
+        budget = oa.regex_backend.MatchBudget(message_timeout=5.0)
+        self.now += 6
+        budget.search(re.compile("compiled"), "text")
+        self.assertEqual(budget.exceeded, ["compiled"])
+
+
+class TestMatchBudgetContext(unittest.TestCase):
+    def test_no_limit(self):
+        with oa.regex_backend.match_budget() as budget:
+            self.assertIsNone(budget)
+            self.assertIsNone(oa.regex_backend.get_budget())
+
+    def test_budget(self):
+        with oa.regex_backend.match_budget(1.0, 2.0) as budget:
+            self.assertIs(oa.regex_backend.get_budget(), budget)
+            self.assertEqual(budget.pattern_timeout, 1.0)
+            self.assertEqual(budget.message_timeout, 2.0)
+        self.assertIsNone(oa.regex_backend.get_budget())
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_timer_restored(self):
+        previous = signal.getsignal(signal.SIGALRM)
+        with oa.regex_backend.match_budget(1.0):
+            self.assertEqual(signal.getsignal(signal.SIGALRM),
+                             oa.regex_backend._on_alarm)
+        self.assertEqual(signal.getsignal(signal.SIGALRM), previous)
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_timer_only_during_search(self):
+        timers = []
+        matcher = Mock()
+        matcher.search.side_effect = lambda text: timers.append(
+            signal.getitimer(signal.ITIMER_REAL))
+        with oa.regex_backend.match_budget(1.0) as budget:
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+            budget.search(matcher, "text")
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+        delay, interval = timers[0]
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, 1.0)
+        self.assertEqual(interval, 0)
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_timer_cleared_on_error(self):
+        matcher = Mock()
+        matcher.search.side_effect = ValueError
+        with oa.regex_backend.match_budget(1.0) as budget:
+            self.assertRaises(ValueError, budget.search, matcher, "text")
+            self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+            self.assertFalse(budget._active)
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_application_handler_restored(self):
+        handler = Mock()
+        previous = signal.signal(signal.SIGALRM, handler)
+        self.addCleanup(signal.signal, signal.SIGALRM, previous)
+        with oa.regex_backend.match_budget(1.0):
+            self.assertEqual(signal.getsignal(signal.SIGALRM),
+                             oa.regex_backend._on_alarm)
+        self.assertIs(signal.getsignal(signal.SIGALRM), handler)
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_application_timer_kept(self):
+        handler = Mock()
+        previous = signal.signal(signal.SIGALRM, handler)
+        self.addCleanup(signal.signal, signal.SIGALRM, previous)
+        signal.setitimer(signal.ITIMER_REAL, 100, 50)
+        self.addCleanup(signal.setitimer, signal.ITIMER_REAL, 0)
+        with oa.regex_backend.match_budget(1.0):
+            self.assertIs(signal.getsignal(signal.SIGALRM), handler)
+        delay, interval = signal.getitimer(signal.ITIMER_REAL)
+        self.assertGreater(delay, 90)
+        self.assertEqual(interval, 50)
+        self.assertIs(signal.getsignal(signal.SIGALRM), handler)
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_no_timer_outside_main_thread(self):
+        previous = signal.getsignal(signal.SIGALRM)
+        thread = Mock()
+        thread.name = "Thread-1"
+        with patch("oa.regex_backend.threading.current_thread",
+                   return_value=thread):
+            with oa.regex_backend.match_budget(1.0):
+                self.assertEqual(signal.getsignal(signal.SIGALRM), previous)
+
+    @unittest.skipUnless(hasattr(signal, "setitimer"), "no setitimer")
+    def test_backtracking_interrupted(self):
+        patch("oa.regex_backend.logging").start()
+        self.addCleanup(patch.stopall)
+        pattern = oa.regex.MatchPattern(re.compile(r"(a+)+b"))
+        with oa.regex_backend.match_budget(0.01) as budget:
+            self.assertEqual(pattern.match(u"a" * 40), 0)
+        self.assertEqual(budget.exceeded, [r"(a+)+b"])
+
+
+class TestPatternBudget(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.budget = Mock(exceeded=[])
+        patch("oa.regex_backend.get_budget",
+              return_value=self.budget).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_match(self):
+        matcher = Mock()
+        pattern = oa.regex.MatchPattern(Mock(), matcher)
+        self.assertEqual(pattern.match("test"), 1)
+        self.budget.search.assert_called_with(matcher, "test")
+
+    def test_not_match(self):
+        self.budget.search.return_value = None
+        pattern = oa.regex.NotMatchPattern(Mock())
+        self.assertEqual(pattern.match("test"), 1)
+
+    def test_not_match_exceeded(self):
+        def exceeded(matcher, text):
+            self.budget.exceeded.append("test")
+        self.budget.search.side_effect = exceeded
+        pattern = oa.regex.NotMatchPattern(Mock())
+        self.assertEqual(pattern.match("test"), 0)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestBackend, "test"))
+    test_suite.addTest(unittest.makeSuite(TestCompileRE2, "test"))
+    test_suite.addTest(unittest.makeSuite(TestRE2Matcher, "test"))
+    test_suite.addTest(unittest.makeSuite(TestRE2, "test"))
+    test_suite.addTest(unittest.makeSuite(TestMatchBudget, "test"))
+    test_suite.addTest(unittest.makeSuite(TestMatchBudgetContext, "test"))
+    test_suite.addTest(unittest.makeSuite(TestPatternBudget, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
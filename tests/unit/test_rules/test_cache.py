@@ -0,0 +1,219 @@
+"""Tests for pad.rules.cache"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.rules.cache
+import oa.rules.parser
+
+
+class TestCacheBase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("oa-logger").handlers = [logging.NullHandler()]
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def write(self, name, content):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, "w") as testf:
+            testf.write(content)
+        return path
+
+
+class TestHash(TestCacheBase):
+    def test_hash_file(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        self.assertEqual(oa.rules.cache.hash_file(path),
+                         oa.rules.cache.hash_file(path))
+        self.assertEqual(len(oa.rules.cache.hash_file(path)), 64)
+
+    def test_hash_file_missing(self):
+        path = os.path.join(self.cache_dir, "missing.cf")
+        self.assertIsNone(oa.rules.cache.hash_file(path))
+
+    def test_cache_path(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        cache_path = oa.rules.cache.get_cache_path(self.cache_dir, [path])
+        self.assertEqual(os.path.dirname(cache_path), self.cache_dir)
+        self.assertTrue(cache_path.endswith(oa.rules.cache.SUFFIX))
+        self.assertEqual(
+            oa.rules.cache.get_cache_path(self.cache_dir, [path]), cache_path
+        )
+
+    def test_cache_path_content(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        cache_path = oa.rules.cache.get_cache_path(self.cache_dir, [path])
+        self.write("test.cf", "body TEST /changed/\n")
+        self.assertNotEqual(
+            oa.rules.cache.get_cache_path(self.cache_dir, [path]), cache_path
+        )
+
+    def test_cache_path_options(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        self.assertNotEqual(
+            oa.rules.cache.get_cache_path(self.cache_dir, [path],
+                                          paranoid=True),
+            oa.rules.cache.get_cache_path(self.cache_dir, [path],
+                                          paranoid=False),
+        )
+
+    def test_cache_path_backend(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        cache_path = oa.rules.cache.get_cache_path(self.cache_dir, [path])
+        patch("oa.rules.cache.oa.regex_backend.get_backend",
+              return_value="re2").start()
+        self.assertNotEqual(
+            oa.rules.cache.get_cache_path(self.cache_dir, [path]), cache_path
+        )
+
+
+class TestManifest(TestCacheBase):
+    def test_get_manifest(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        parser = Mock(file_hashes={path: "hash"})
+        parser.ctxt.plugins = {}
+        manifest = oa.rules.cache.get_manifest(parser)
+        self.assertEqual(manifest[path], "hash")
+        self.assertIn(oa.rules.cache.__file__.replace(".pyc", ".py"),
+                      manifest)
+
+    def test_valid(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        manifest = {path: oa.rules.cache.hash_file(path)}
+        self.assertTrue(oa.rules.cache.is_valid(manifest))
+
+    def test_invalid(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        manifest = {path: oa.rules.cache.hash_file(path)}
+        self.write("test.cf", "body TEST /changed/\n")
+        self.assertFalse(oa.rules.cache.is_valid(manifest))
+
+    def test_invalid_removed(self):
+        path = self.write("test.cf", "body TEST /test/\n")
+        manifest = {path: oa.rules.cache.hash_file(path)}
+        os.remove(path)
+        self.assertFalse(oa.rules.cache.is_valid(manifest))
+
+
+class TestStoreLoad(TestCacheBase):
+    def setUp(self):
+        TestCacheBase.setUp(self)
+        self.rules_path = self.write("test.cf", "body TEST /test/\n")
+        self.parser = Mock(
+            file_hashes={
+                self.rules_path: oa.rules.cache.hash_file(self.rules_path)
+            },
+        )
+        self.parser.get_snapshot.return_value = (
+            {"TEST": {"type": "body", "value": "/test/"}}, ["ruleset"]
+        )
+        self.parser.ctxt.plugins = {}
+        self.cache_path = os.path.join(self.cache_dir, "entries",
+                                       "test" + oa.rules.cache.SUFFIX)
+
+    def test_round_trip(self):
+        self.assertTrue(oa.rules.cache.store(self.cache_path, self.parser))
+        self.assertEqual(oa.rules.cache.load(self.cache_path),
+                         self.parser.get_snapshot.return_value)
+
+    def test_no_temporary_files(self):
+        oa.rules.cache.store(self.cache_path, self.parser)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)),
+                         [os.path.basename(self.cache_path)])
+
+    def test_load_missing(self):
+        self.assertIsNone(oa.rules.cache.load(self.cache_path))
+
+    def test_load_outdated(self):
+        oa.rules.cache.store(self.cache_path, self.parser)
+        self.write("test.cf", "body TEST /changed/\n")
+        self.assertIsNone(oa.rules.cache.load(self.cache_path))
+
+    def test_load_corrupted(self):
+        path = self.write("corrupted" + oa.rules.cache.SUFFIX, "corrupted")
+        self.assertIsNone(oa.rules.cache.load(path))
+
+    def test_store_error(self):
+        patch("oa.rules.cache.pickle.dump",
+              side_effect=[None, TypeError("cannot pickle")]).start()
+        self.assertFalse(oa.rules.cache.store(self.cache_path, self.parser))
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_path)), [])
+
+    def test_prune(self):
+        for i in range(5):
+            path = self.write("%s%s" % (i, oa.rules.cache.SUFFIX), "")
+            os.utime(path, (i, i))
+        oa.rules.cache.prune(self.cache_dir, 2)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ["3.ruleset", "4.ruleset", "test.cf"])
+
+
+class TestParserCache(TestCacheBase):
+    """Parse rules with a loaded plugin through the cache."""
+
+    def setUp(self):
+        TestCacheBase.setUp(self)
+        plugin_path = os.path.abspath(os.path.join(
+            os.path.dirname(__file__), "..", "..", "util", "sample_plugin.py"))
+        self.rules_path = self.write(
+            "test.cf", "loadplugin TestPluginReportRevoke %s\n"
+                       "body TEST /test/\n" % plugin_path)
+
+    def get_ruleset(self):
+        return oa.rules.parser.parse_pad_rules(
+            [self.rules_path], cache_dir=self.cache_dir).get_ruleset()
+
+    def test_plugins_kept_after_store(self):
+        """Storing the ruleset in the cache doesn't change the context
+        that's still used by this process.
+        """
+        ruleset = self.get_ruleset()
+        self.assertIn("TestPluginReportRevoke", ruleset.ctxt.plugins)
+
+    def test_plugins_loaded_from_cache(self):
+        self.get_ruleset()
+        ruleset = self.get_ruleset()
+        self.assertIn("TestPluginReportRevoke", ruleset.ctxt.plugins)
+        self.assertIn("TEST", ruleset.checked)
+
+    def test_post_parsed_once(self):
+        self.get_ruleset()
+        with patch("oa.rules.ruleset.RuleSet.post_parsing") as mock_post:
+            ruleset = self.get_ruleset()
+        self.assertFalse(mock_post.called)
+        self.assertIn("TEST", ruleset.checked)
+
+    def test_patterns_interned_from_cache(self):
+        """The patterns loaded from the cache are shared with the other
+        rulesets of the process.
+        """
+        first = self.get_ruleset()
+        second = self.get_ruleset()
+        self.assertIs(second.checked["TEST"]._pattern,
+                      first.checked["TEST"]._pattern)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestHash, "test"))
+    test_suite.addTest(unittest.makeSuite(TestManifest, "test"))
+    test_suite.addTest(unittest.makeSuite(TestStoreLoad, "test"))
+    test_suite.addTest(unittest.makeSuite(TestParserCache, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,110 @@
+"""Tests for oa.rules.header_index"""
+
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.regex
+import oa.rules.body
+import oa.rules.header
+import oa.rules.header_index
+
+
+class TestHeaderIndex(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.index = oa.rules.header_index.HeaderIndex()
+        self.mock_msg = Mock(**{
+            "get_decoded_header.return_value": ["Hello world", "Test"],
+            "get_raw_header.return_value": ["=?UTF-8?B?dGVzdA==?="],
+        })
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def get_rule(self, name, value):
+        return oa.rules.header.HeaderRule.get_rule(name, {"value": value})
+
+    def test_add_rule(self):
+        rule = self.get_rule("TEST", "Subject =~ /hello/i")
+        self.assertTrue(self.index.add_rule(rule))
+        self.assertIn("TEST", self.index)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.rules["TEST"],
+                         ("get_decoded_header", "Subject"))
+
+    def test_add_rule_grouped(self):
+        self.index.add_rule(self.get_rule("TEST1", "Subject =~ /hello/"))
+        self.index.add_rule(self.get_rule("TEST2", "Subject !~ /hello/"))
+        self.index.add_rule(self.get_rule("TEST3", "Subject:raw =~ /test/"))
+        self.assertEqual(len(self.index.groups), 2)
+        self.assertEqual(len(self.index), 3)
+
+    def test_add_rule_modifiers(self):
+        for mod, getter in (("raw", "get_raw_header"),
+                            ("addr", "get_addr_header"),
+                            ("name", "get_name_header")):
+            rule = self.get_rule("TEST_%s" % mod, "From:%s =~ /test/" % mod)
+            self.index.add_rule(rule)
+            self.assertEqual(self.index.rules["TEST_%s" % mod],
+                             (getter, "From"))
+
+    def test_add_rule_mime(self):
+        rule = oa.rules.header.MimeHeaderRule.get_rule(
+            "TEST", {"value": "Content-Type =~ /text/"})
+        self.index.add_rule(rule)
+        self.assertEqual(self.index.rules["TEST"],
+                         ("get_decoded_mime_header", "Content-Type"))
+
+    def test_add_rule_unsupported(self):
+        for value in ("exists:Subject", "ALL =~ /test/", "ToCc =~ /test/"):
+            self.assertFalse(self.index.add_rule(self.get_rule("TEST",
+                                                               value)))
+        rule = oa.rules.body.BodyRule("TEST", oa.regex.perl2re("/test/"))
+        self.assertFalse(self.index.add_rule(rule))
+        self.assertEqual(len(self.index), 0)
+
+    def test_add_rule_replaced_match(self):
+        rule = self.get_rule("TEST", "Subject =~ /hello/i")
+        rule.match = Mock()
+        self.assertFalse(self.index.add_rule(rule))
+
+    def test_match_group(self):
+        self.index.add_rule(self.get_rule("TEST1", "Subject =~ /Hello/"))
+        self.index.add_rule(self.get_rule("TEST2", "Subject =~ /^Test$/"))
+        self.index.add_rule(self.get_rule("TEST3", "Subject =~ /missing/"))
+        self.index.add_rule(self.get_rule("TEST4", "Subject !~ /missing/"))
+        self.index.add_rule(self.get_rule("TEST5", r"Subject:raw =~ /B\?/"))
+
+        result = self.index.match_group("TEST1", self.mock_msg)
+        self.mock_msg.get_decoded_header.assert_called_once_with("Subject")
+        self.mock_msg.get_raw_header.assert_not_called()
+        self.assertEqual(result, {"TEST1": True, "TEST2": True,
+                                  "TEST3": False, "TEST4": True})
+
+    def test_match_group_same_as_rules(self):
+        values = ("Subject =~ /hello/", "Subject =~ /^Test$/",
+                  "Subject !~ /world/", "Subject =~ /nothing/i")
+        rules = [self.get_rule("TEST%d" % i, value)
+                 for i, value in enumerate(values)]
+        for rule in rules:
+            self.index.add_rule(rule)
+
+        result = self.index.match_group("TEST0", self.mock_msg)
+        expected = dict((rule.name, rule.match(self.mock_msg))
+                        for rule in rules)
+        self.assertEqual(result, expected)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestHeaderIndex, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -32,6 +32,26 @@ class TestMetaRule(unittest.TestCase):
         result = rule.postparsing(mock_ruleset)
         self.assertEqual(result, None)
 
+    def test_postparsing_subrule_result(self):
+        perlrule = "TEST_1 && TEST_2"
+        rule = oa.rules.meta.MetaRule("TEST", perlrule)
+        mock_ruleset = MagicMock()
+        rule.postparsing(mock_ruleset)
+        mock_msg = MagicMock(rule_results={}, prefilter_skipped=set())
+
+        rule.match(mock_msg)
+        mock_ruleset.match_rule.assert_any_call("TEST_1", mock_msg)
+
+    def test_postparsing_subrules(self):
+        rule = oa.rules.meta.MetaRule("TEST", "TEST_1 && !TEST_2")
+        rule.postparsing(MagicMock())
+        self.assertEqual(rule.subrules, {"TEST_1", "TEST_2"})
+
+    def test_postparsing_invalid(self):
+        rule = oa.rules.meta.MetaRule("TEST", "TEST_1 &&")
+        self.assertRaises(oa.errors.InvalidRule, rule.postparsing,
+                          MagicMock())
+
     def test_postparsing_no_match(self):
         perlrule = "TEST_1"
         rule = oa.rules.meta.MetaRule("TEST", perlrule)
@@ -56,6 +76,21 @@ class TestMetaRule(unittest.TestCase):
         mock_match.assert_called_once_with(self.mock_msg)
         self.assertEqual(result, False)
 
+    def test_copy(self):
+        template = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        ruleset1 = MagicMock()
+        ruleset2 = MagicMock()
+        ruleset1.match_rule.return_value = True
+        ruleset2.match_rule.return_value = False
+        rule1 = template.copy()
+        rule2 = template.copy()
+        rule1.postparsing(ruleset1)
+        rule2.postparsing(ruleset2)
+        msg = MagicMock(rule_results={}, prefilter_skipped=set())
+        self.assertTrue(rule1.match(msg))
+        self.assertFalse(rule2.match(msg))
+        self.assertEqual(template._location, {})
+
     def test_get_rule_kwargs(self):
         data = {"value": "TEST_1 && TEST_2"}
         expected = {"rule": "TEST_1 && TEST_2"}
@@ -63,10 +98,240 @@ class TestMetaRule(unittest.TestCase):
         self.assertEqual(kwargs, expected)
 
 
+class TestCompiledMeta(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("oa.rules.meta._POOL", {}).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_shared(self):
+        rule1 = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        rule2 = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        rule1.postparsing(MagicMock())
+        rule2.postparsing(MagicMock())
+        self.assertIs(rule1._compiled, rule2._compiled)
+
+    def test_not_shared(self):
+        rule1 = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        rule2 = oa.rules.meta.MetaRule("TEST", "TEST_1 || TEST_2")
+        rule1.postparsing(MagicMock())
+        rule2.postparsing(MagicMock())
+        self.assertIsNot(rule1._compiled, rule2._compiled)
+
+    def test_bound_separately(self):
+        ruleset1 = MagicMock()
+        ruleset2 = MagicMock()
+        ruleset1.match_rule.return_value = True
+        ruleset2.match_rule.return_value = False
+        rule1 = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        rule2 = oa.rules.meta.MetaRule("TEST", "TEST_1 && TEST_2")
+        rule1.postparsing(ruleset1)
+        rule2.postparsing(ruleset2)
+        msg = MagicMock(rule_results={}, prefilter_skipped=set())
+        self.assertTrue(rule1.match(msg))
+        self.assertFalse(rule2.match(msg))
+        self.assertTrue(ruleset1.match_rule.called)
+
+
+class TestCompiledMetaOrder(unittest.TestCase):
+    """The operands are only reordered if it cannot change the result."""
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        patch("oa.rules.meta._POOL", {}).start()
+        self.rules = {}
+        self.values = {}
+        self.ruleset = Mock(**{
+            "get_rule.side_effect": lambda name: self.rules[name],
+            "match_rule.side_effect": self.match_rule})
+        self.mock_msg = MagicMock(rule_results={}, prefilter_skipped=set())
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def match_rule(self, name, msg):
+        self.rules[name].calls += 1
+        return self.values[name]
+
+    def add_rule(self, name, value, bool_result=True):
+        self.rules[name] = Mock(cost=1e-5, bool_result=bool_result,
+                                calls=0)
+        self.values[name] = value
+
+    def get_rule(self, expression):
+        rule = oa.rules.meta.MetaRule("TEST", expression)
+        rule.postparsing(self.ruleset)
+        return rule
+
+    def test_bool_operands(self):
+        self.add_rule("TEST_1", True)
+        self.add_rule("TEST_2", False)
+        rule = self.get_rule("TEST_1 || TEST_2")
+        self.assertTrue(rule._location["_operation_0"].all_bool)
+        self.assertTrue(rule.bool_result)
+
+    def test_value_operand(self):
+        self.add_rule("TEST_1", 2, bool_result=False)
+        self.add_rule("TEST_2", True)
+        self.add_rule("TEST_3", False)
+        rule = self.get_rule("(TEST_1 || TEST_2) + TEST_3 > 1")
+        operation = rule._location["_operation_0"]
+        self.assertEqual(operation.bool_operands, [False, True])
+        operation.order = [1, 0]
+        self.assertIs(rule.match(self.mock_msg), True)
+        # The comparison is always True or False
+        self.assertTrue(rule.bool_result)
+
+    def test_value_operand_short_circuit(self):
+        self.add_rule("TEST_1", 2, bool_result=False)
+        self.add_rule("TEST_2", True)
+        rule = self.get_rule("(TEST_1 || TEST_2) * 2")
+        self.assertEqual(rule.match(self.mock_msg), 4)
+        self.assertEqual(self.rules["TEST_2"].calls, 0)
+        self.assertFalse(rule.bool_result)
+
+    def test_value_result(self):
+        self.add_rule("TEST_1", False)
+        self.add_rule("TEST_2", "description", bool_result=False)
+        rule = self.get_rule("TEST_1 || TEST_2")
+        self.assertEqual(rule.match(self.mock_msg), "description")
+        self.assertFalse(rule.bool_result)
+
+    def test_nested_value(self):
+        self.add_rule("TEST_1", True)
+        self.add_rule("TEST_2", True)
+        self.add_rule("TEST_3", 2, bool_result=False)
+        rule = self.get_rule("TEST_1 && (TEST_2 || TEST_3)")
+        self.assertEqual(rule._location["_operation_0"].bool_operands,
+                         [True, False])
+        self.assertEqual(rule._location["_operation_1"].bool_operands,
+                         [True, False])
+
+    def test_nested_not(self):
+        self.add_rule("TEST_1", True)
+        self.add_rule("TEST_2", True)
+        self.add_rule("TEST_3", 2, bool_result=False)
+        rule = self.get_rule("TEST_1 && !(TEST_2 || TEST_3)")
+        self.assertFalse(rule._location["_operation_0"].all_bool)
+        self.assertTrue(rule._location["_operation_1"].all_bool)
+
+    def test_meta_subrule(self):
+        self.add_rule("TEST_1", True)
+        self.add_rule("TEST_2", 2, bool_result=False)
+        self.rules["TEST_META"] = self.get_rule("TEST_1 || TEST_2")
+        self.values["TEST_META"] = True
+        rule = self.get_rule("TEST_1 && TEST_META")
+        self.assertEqual(rule._location["_operation_0"].bool_operands,
+                         [True, False])
+
+
+class TestBoolOperation(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mock_msg = MagicMock(rule_results={}, prefilter_skipped=set())
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def get_operation(self, is_and, values, costs):
+        operands = [Mock(return_value=value) for value in values]
+        names = [("TEST_%d" % i,) for i in range(len(values))]
+        operation = oa.rules.meta._BoolOperation(is_and, operands, names,
+                                                 costs)
+        return operation, operands
+
+    def test_and_cheapest_first(self):
+        operation, operands = self.get_operation(True, [True, False],
+                                                 [1.0, 0.1])
+        operation.reorder()
+        self.assertEqual(operation(self.mock_msg), False)
+        operands[0].assert_not_called()
+        operands[1].assert_called_once_with(self.mock_msg)
+
+    def test_or_cheapest_first(self):
+        operation, operands = self.get_operation(False, [False, True],
+                                                 [1.0, 0.1])
+        operation.reorder()
+        self.assertEqual(operation(self.mock_msg), True)
+        operands[0].assert_not_called()
+
+    def test_available_first(self):
+        operation, operands = self.get_operation(True, [False, False],
+                                                 [0.1, 1.0])
+        operation.reorder()
+        self.mock_msg.rule_results["TEST_1"] = False
+        self.assertEqual(operation(self.mock_msg), False)
+        operands[0].assert_not_called()
+        operands[1].assert_called_once_with(self.mock_msg)
+
+    def test_and_all_evaluated(self):
+        operation, operands = self.get_operation(True, [True, True],
+                                                 [1.0, 0.1])
+        operation.reorder()
+        self.assertEqual(operation(self.mock_msg), True)
+
+    def test_or_all_evaluated(self):
+        operation, operands = self.get_operation(False, [False, False],
+                                                 [1.0, 0.1])
+        operation.reorder()
+        self.assertEqual(operation(self.mock_msg), False)
+
+    def test_value_reordered(self):
+        operation, operands = self.get_operation(False, [2, True],
+                                                 [1.0, 0.1])
+        operation.bool_operands = [False, True]
+        operation.all_bool = False
+        operation.reorder()
+        # Same value as the original expression
+        self.assertEqual(operation(self.mock_msg), 2)
+        operands[0].assert_called_once_with(self.mock_msg)
+
+    def test_bool_skipped(self):
+        operation, operands = self.get_operation(False, [False, True, "test"],
+                                                 [1.0, 0.1, 0.1])
+        operation.bool_operands = [True, True, False]
+        operation.all_bool = False
+        operation.reorder()
+        self.assertIs(operation(self.mock_msg), True)
+        operands[0].assert_not_called()
+
+    def test_value_all_evaluated(self):
+        operation, operands = self.get_operation(True, [True, 3], [1.0, 0.1])
+        operation.bool_operands = [True, False]
+        operation.all_bool = False
+        operation.reorder()
+        self.assertEqual(operation(self.mock_msg), 3)
+
+    def test_reorder_hit_ratio(self):
+        operation, operands = self.get_operation(True, [True, True],
+                                                 [0.1, 0.1])
+        operation.hits = [90, 10]
+        operation.calls = [100, 100]
+        operation.reorder()
+        # The operand that is usually False decides the result faster.
+        self.assertEqual(operation.order, [1, 0])
+
+    def test_record_cost(self):
+        operation, operands = self.get_operation(True, [True], [0.1])
+        operation._record(0, True, 0.5)
+        self.assertEqual(operation.costs, [0.5])
+        operation._record(0, True, 1.0)
+        self.assertAlmostEqual(operation.costs[0], 0.6)
+        self.assertEqual(operation.hits, [2])
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestMetaRule, "test"))
+    test_suite.addTest(unittest.makeSuite(TestCompiledMeta, "test"))
+    test_suite.addTest(unittest.makeSuite(TestCompiledMetaOrder, "test"))
+    test_suite.addTest(unittest.makeSuite(TestBoolOperation, "test"))
     return test_suite
 
 if __name__ == '__main__':
@@ -1,6 +1,9 @@
 """Tests for pad.rules.parser"""
 
+import os
+import shutil
 import logging
+import tempfile
 import unittest
 from builtins import UnicodeDecodeError
 
@@ -39,7 +42,49 @@ class TestParseGetRuleset(unittest.TestCase):
 
         mock_body_rule.get_rule.assert_called_with("TEST_RULE", data)
         ruleset.add_rule.assert_called_with(
-            mock_body_rule.get_rule("TEST_RULE", data))
+            mock_body_rule.get_rule("TEST_RULE", data).copy())
+
+    def test_parse_get_rules_store_cache(self):
+        mock_store = patch("oa.rules.parser.oa.rules.cache.store").start()
+        self.parser.cache_path = "/cache/test.ruleset"
+
+        self.parser.get_ruleset()
+
+        mock_store.assert_called_once_with("/cache/test.ruleset",
+                                           self.parser)
+
+    def test_parse_get_rules_store_post_parsed(self):
+        post_parsed = []
+        patch("oa.rules.parser.oa.rules.cache.store",
+              side_effect=lambda *args: post_parsed.append(
+                  self.parser.ruleset.post_parsing.called)).start()
+        self.parser.cache_path = "/cache/test.ruleset"
+
+        self.parser.get_ruleset()
+
+        self.assertEqual(post_parsed, [True])
+
+    def test_parse_get_rules_no_cache(self):
+        mock_store = patch("oa.rules.parser.oa.rules.cache.store").start()
+
+        self.parser.get_ruleset()
+
+        self.assertFalse(mock_store.called)
+
+    def test_parse_get_rules_snapshot(self):
+        mock_body_rule = Mock()
+        self.mock_rules["body"] = mock_body_rule
+        ruleset = Mock(checked={})
+        results = {"TEST_RULE": {"type": "body", "score": "1.0"}}
+        self.parser.load_snapshot((results, ruleset, [], {}, {}))
+
+        result = self.parser.get_ruleset()
+
+        self.assertIs(result, ruleset)
+        self.assertIs(self.parser.ctxt, ruleset.ctxt)
+        self.assertFalse(mock_body_rule.get_rule.called)
+        ruleset.ctxt.hook_parsing_end.assert_called_with(ruleset)
+        self.assertFalse(ruleset.post_parsing.called)
 
     def test_parse_get_rules_no_type_defined(self):
         mock_body_rule = Mock()
@@ -96,7 +141,7 @@ class TestParseGetRuleset(unittest.TestCase):
 
         mock_body_rule.get_rule.assert_called_with("TEST_RULE", data)
         ruleset.add_rule.assert_called_with(
-            mock_body_rule.get_rule("TEST_RULE", data))
+            mock_body_rule.get_rule("TEST_RULE", data).copy())
 
 
 class TestParsePADLine(unittest.TestCase):
@@ -428,6 +473,146 @@ class TestParsePADLine(unittest.TestCase):
         self.check_parse(rules, expected)
 
 
+class TestReload(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("oa-logger").handlers = [logging.NullHandler()]
+        patch("oa.rules.parser.oa.rules.ruleset.RuleSet").start()
+        patch("oa.rules.parser.oa.context.GlobalContext",
+              **{"return_value.plugins": {}, "return_value.cmds": {},
+                 "return_value.paranoid": False,
+                 "return_value.ignore_unknown": True,
+                 "return_value.lazy_mode": True}).start()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.rules = self.write("20_rules.cf",
+                                "body TEST_RULE /test/\n"
+                                "include 21_included.cf\n")
+        self.included = self.write("21_included.cf",
+                                   "header TEST_HEADER Subject =~ /test/\n")
+        self.local = self.write("local.cf", "required_score 5\n"
+                                            "body LOCAL_RULE /local/\n")
+        self.files = [self.rules, self.local]
+        self.parser = oa.rules.parser.parse_pad_rules(self.files)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as rulef:
+            rulef.write(content)
+        mtime = mtime or 1000
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_entries(self):
+        self.assertEqual(self.parser.files, self.files)
+        self.assertEqual(self.parser.file_entries[self.rules], [
+            ("rule", "TEST_RULE", "type", "body"),
+            ("rule", "TEST_RULE", "value", "/test/"),
+            ("include", self.included),
+        ])
+        self.assertEqual(self.parser.file_entries[self.local], [
+            ("config", "required_score", "5"),
+            ("rule", "LOCAL_RULE", "type", "body"),
+            ("rule", "LOCAL_RULE", "value", "/local/"),
+        ])
+        self.assertEqual(self.parser.file_mtimes[self.local], 1000)
+
+    def test_unchanged(self):
+        self.assertIs(self.parser.reload(self.files), self.parser)
+
+    def test_unchanged_not_hashed(self):
+        with patch("oa.rules.parser.oa.rules.cache.hash_file") as mock_hash:
+            self.parser.reload(self.files)
+        self.assertFalse(mock_hash.called)
+
+    def test_touched(self):
+        self.write("local.cf", "required_score 5\nbody LOCAL_RULE /local/\n",
+                   2000)
+        self.assertIs(self.parser.reload(self.files), self.parser)
+        self.assertEqual(self.parser.file_mtimes[self.local], 2000)
+
+    def test_changed_rules(self):
+        self.write("local.cf", "required_score 5\n"
+                               "body LOCAL_RULE /changed/\n"
+                               "score LOCAL_RULE 2\n", 2000)
+        parser = self.parser.reload(self.files)
+        self.assertIsNot(parser, self.parser)
+        self.assertEqual(parser.results, {
+            "TEST_RULE": {"type": "body", "value": "/test/"},
+            "TEST_HEADER": {"type": "header", "value": "Subject =~ /test/"},
+            "LOCAL_RULE": {"type": "body", "value": "/changed/",
+                           "score": "2"},
+        })
+        self.assertEqual(self.parser.results["LOCAL_RULE"],
+                         {"type": "body", "value": "/local/"})
+        parser.ctxt.hook_parse_config.assert_called_with("required_score",
+                                                         "5")
+
+    def test_changed_rules_only_changed_read(self):
+        self.write("local.cf", "required_score 5\n", 2000)
+        with patch("oa.rules.parser.open", create=True,
+                   side_effect=open) as mock_open:
+            self.parser.reload(self.files)
+        mock_open.assert_called_once_with(self.local, "rb")
+
+    def test_changed_included(self):
+        self.write("21_included.cf", "header TEST_HEADER From =~ /test/\n",
+                   2000)
+        parser = self.parser.reload(self.files)
+        self.assertEqual(parser.results["TEST_HEADER"]["value"],
+                         "From =~ /test/")
+
+    def test_changed_options(self):
+        self.write("local.cf", "required_score 6\n"
+                               "body LOCAL_RULE /local/\n", 2000)
+        self.assertIsNone(self.parser.reload(self.files))
+
+    def test_changed_include(self):
+        self.write("20_rules.cf", "body TEST_RULE /test/\n", 2000)
+        self.assertIsNone(self.parser.reload(self.files))
+
+    def test_changed_files(self):
+        self.assertIsNone(self.parser.reload([self.rules]))
+
+    def test_removed(self):
+        os.remove(self.included)
+        parser = self.parser.reload(self.files)
+        self.assertNotIn("TEST_HEADER", parser.results)
+
+    def test_changed_rules_reused(self):
+        self.parser.get_ruleset()
+        self.write("local.cf", "required_score 5\n"
+                               "body LOCAL_RULE /changed/\n", 2000)
+        parser = self.parser.reload(self.files)
+        with patch("oa.rules.parser.oa.rules.body.BodyRule.get_rule",
+                   wraps=oa.rules.body.BodyRule.get_rule) as mock_get_rule:
+            parser.get_ruleset()
+        mock_get_rule.assert_called_once_with(
+            "LOCAL_RULE", {"type": "body", "value": "/changed/"})
+        self.assertIs(parser.rule_templates["TEST_RULE"][2],
+                      self.parser.rule_templates["TEST_RULE"][2])
+        self.assertIs(parser.rule_templates["TEST_HEADER"][2],
+                      self.parser.rule_templates["TEST_HEADER"][2])
+        self.assertIsNot(parser.rule_templates["LOCAL_RULE"][2],
+                         self.parser.rule_templates["LOCAL_RULE"][2])
+
+    def test_added_rules_are_copies(self):
+        ruleset = self.parser.get_ruleset()
+        rule = ruleset.add_rule.call_args_list[0][0][0]
+        self.assertEqual(rule.name, "TEST_RULE")
+        self.assertIsNot(rule, self.parser.rule_templates["TEST_RULE"][2])
+
+    def test_snapshot(self):
+        parser = oa.rules.parser.PADParser()
+        parser.load_snapshot(self.parser.get_snapshot())
+        self.assertEqual(parser.file_mtimes, {})
+        self.assertIs(parser.reload(self.files), parser)
+
+
 class TestParsePADRules(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
@@ -452,12 +637,45 @@ class TestParsePADRules(unittest.TestCase):
         oa.rules.parser.parse_pad_rules(["testf1.cf"])
         self.mock_parser.return_value.parse_file.assert_called_with("testf1.cf")
 
+    def test_cache_hit(self):
+        mock_cache = patch("oa.rules.parser.oa.rules.cache").start()
+        parser = oa.rules.parser.parse_pad_rules(["testf1.cf"],
+                                                 cache_dir="/cache")
+        mock_cache.get_cache_path.assert_called_with(
+            "/cache", ["testf1.cf"], paranoid=False, ignore_unknown=True)
+        parser.load_snapshot.assert_called_with(mock_cache.load.return_value)
+        self.assertFalse(parser.parse_file.called)
+
+    def test_cache_miss(self):
+        mock_cache = patch("oa.rules.parser.oa.rules.cache").start()
+        mock_cache.load.return_value = None
+        parser = oa.rules.parser.parse_pad_rules(["testf1.cf"],
+                                                 cache_dir="/cache")
+        self.assertFalse(parser.load_snapshot.called)
+        self.assertEqual(parser.cache_path,
+                         mock_cache.get_cache_path.return_value)
+        parser.parse_file.assert_called_with("testf1.cf")
+
+    def test_cache_unavailable(self):
+        mock_cache = patch("oa.rules.parser.oa.rules.cache").start()
+        mock_cache.is_available.return_value = False
+        parser = oa.rules.parser.parse_pad_rules(["testf1.cf"],
+                                                 cache_dir="/cache")
+        self.assertFalse(mock_cache.load.called)
+        parser.parse_file.assert_called_with("testf1.cf")
+
+    def test_no_cache(self):
+        mock_cache = patch("oa.rules.parser.oa.rules.cache").start()
+        oa.rules.parser.parse_pad_rules(["testf1.cf"])
+        self.assertFalse(mock_cache.load.called)
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestParseGetRuleset, "test"))
     test_suite.addTest(unittest.makeSuite(TestParsePADLine, "test"))
+    test_suite.addTest(unittest.makeSuite(TestReload, "test"))
     test_suite.addTest(unittest.makeSuite(TestParsePADRules, "test"))
     return test_suite
 
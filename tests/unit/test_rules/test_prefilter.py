@@ -0,0 +1,187 @@
+"""Tests for oa.rules.prefilter"""
+
+import re
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.regex
+import oa.rules.body
+import oa.rules.full
+import oa.rules.header
+import oa.rules.prefilter
+
+
+class _OldParsed(list):
+    """A parsed pattern without the `state` attribute."""
+
+
+class TestExtractLiterals(unittest.TestCase):
+    def check(self, pattern, expected, flags=0):
+        result = oa.rules.prefilter.extract_literals(
+            re.compile(pattern, flags))
+        if expected is not None:
+            expected = frozenset(expected)
+        self.assertEqual(result, expected)
+
+    def test_simple(self):
+        self.check(r"viagra", [("viagra", False)])
+
+    def test_ignorecase(self):
+        self.check(r"ViAgRa", [("viagra", True)], re.I)
+
+    def test_inline_ignorecase(self):
+        self.check(r"(?i)ViAgRa", [("viagra", True)])
+
+    def test_longest_run(self):
+        self.check(r"\bfree\s+money\b", [("money", False)])
+
+    def test_zero_width(self):
+        self.check(r"free\bmoney", [("freemoney", False)])
+
+    def test_group_concatenation(self):
+        self.check(r"free(?:mo)ney", [("freemoney", False)])
+
+    def test_alternation(self):
+        self.check(r"(?:cheap|discount)\s+meds",
+                   [("cheap", False), ("discount", False)])
+
+    def test_alternation_without_literal(self):
+        self.check(r"(?:cheap|\d+)\s+pill", [("pill", False)])
+
+    def test_optional(self):
+        self.check(r"foo(?:bar)?baz", [("foo", False)])
+
+    def test_repeat(self):
+        self.check(r"\d+(?:pills)+", [("pills", False)])
+
+    def test_no_literal(self):
+        self.check(r"\d+\s+\w+", None)
+
+    def test_short_literal(self):
+        self.check(r"a.b", None)
+
+    def test_non_ascii_ignorecase(self):
+        self.check(u"caf\xe9 noir", [(" noir", True)], re.I)
+
+    def test_non_ascii(self):
+        self.check(u"caf\xe9 noir", [(u"caf\xe9 noir", False)])
+
+    def test_invalid(self):
+        self.assertIsNone(oa.rules.prefilter.extract_literals(Mock()))
+
+    def check_old(self, items, expected, flags=0):
+        """Check with the parsed pattern shape used before Python 3.6,
+        with the flags in `pattern` and groups as (group, items).
+        """
+        parsed = _OldParsed(items)
+        parsed.pattern = Mock(flags=flags)
+        pattern = Mock(pattern=u"", flags=flags)
+        with patch("oa.rules.prefilter.sre_parse.parse",
+                   return_value=parsed):
+            result = oa.rules.prefilter.extract_literals(pattern)
+        if expected is not None:
+            expected = frozenset(expected)
+        self.assertEqual(result, expected)
+
+    def literals(self, text):
+        return [(oa.rules.prefilter.sre_constants.LITERAL, ord(char))
+                for char in text]
+
+    def test_old_group_shape(self):
+        group = (oa.rules.prefilter.sre_constants.SUBPATTERN,
+                 (None, self.literals("mo")))
+        self.check_old(self.literals("free") + [group] +
+                       self.literals("ney"), [("freemoney", False)])
+
+    def test_old_flags(self):
+        self.check_old(self.literals("viagra"), [("viagra", True)], re.I)
+
+    def test_unknown_group_shape(self):
+        group = (oa.rules.prefilter.sre_constants.SUBPATTERN,
+                 (None, 0, self.literals("mo")))
+        self.check_old(self.literals("free") + [group], None)
+
+
+class TestFoldText(unittest.TestCase):
+    def test_lower(self):
+        self.assertEqual(oa.rules.prefilter.fold_text("ViAgRa"), "viagra")
+
+    def test_special_chars(self):
+        # These are matched by "i", "s" and "k" in case-insensitive
+        # regular expressions.
+        self.assertEqual(
+            oa.rules.prefilter.fold_text(u"\u0130\u0131\u017f\u212a"),
+            "iisk")
+
+
+class TestLiteralPrefilter(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.prefilter = oa.rules.prefilter.LiteralPrefilter()
+        self.mock_msg = Mock(text="Buy cheap VIAGRA now",
+                             raw_text="Buy cheap <b>VIAGRA</b> now",
+                             raw_msg="Subject: test\n\nBuy cheap VIAGRA now")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def add_rule(self, rule_class, name, pattern):
+        rule = rule_class(name, pattern=oa.regex.perl2re(pattern))
+        return self.prefilter.add_rule(rule)
+
+    def test_add_rule(self):
+        self.assertTrue(self.add_rule(oa.rules.body.BodyRule, "TEST",
+                                      "/viagra/i"))
+        self.assertIn("TEST", self.prefilter)
+        self.assertEqual(len(self.prefilter), 1)
+
+    def test_add_rule_no_literal(self):
+        self.assertFalse(self.add_rule(oa.rules.body.BodyRule, "TEST",
+                                       r"/\d+/"))
+        self.assertNotIn("TEST", self.prefilter)
+
+    def test_add_rule_not_supported(self):
+        rule = oa.rules.header.HeaderRule.get_rule(
+            "TEST", {"value": "Subject =~ /viagra/"})
+        self.assertFalse(self.prefilter.add_rule(rule))
+
+    def test_add_rule_not_match(self):
+        rule = oa.rules.body.BodyRule(
+            "TEST", pattern=oa.regex.perl2re("/viagra/", "!~"))
+        self.assertFalse(self.prefilter.add_rule(rule))
+
+    def test_skipped(self):
+        self.add_rule(oa.rules.body.BodyRule, "TEST_MATCH", "/viagra/i")
+        self.add_rule(oa.rules.body.BodyRule, "TEST_CASE", "/viagra/")
+        self.add_rule(oa.rules.body.BodyRule, "TEST_NO_MATCH", "/cialis/i")
+        result = self.prefilter.get_skipped(self.mock_msg)
+        self.assertEqual(result, {"TEST_CASE", "TEST_NO_MATCH"})
+
+    def test_skipped_target(self):
+        self.add_rule(oa.rules.body.BodyRule, "TEST_BODY", "/<b>/")
+        self.add_rule(oa.rules.body.RawBodyRule, "TEST_RAWBODY", "/<b>/")
+        self.add_rule(oa.rules.full.FullRule, "TEST_FULL", "/Subject:/")
+        result = self.prefilter.get_skipped(self.mock_msg)
+        self.assertEqual(result, {"TEST_BODY"})
+
+    def test_skipped_alternation(self):
+        self.add_rule(oa.rules.body.BodyRule, "TEST", "/(?:cialis|cheap)/")
+        result = self.prefilter.get_skipped(self.mock_msg)
+        self.assertEqual(result, set())
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestExtractLiterals, "test"))
+    test_suite.addTest(unittest.makeSuite(TestFoldText, "test"))
+    test_suite.addTest(unittest.makeSuite(TestLiteralPrefilter, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,144 @@
+"""Tests for oa.rules.profiler"""
+
+import json
+import unittest
+
+try:
+    from unittest.mock import patch, Mock, MagicMock
+except ImportError:
+    from mock import patch, Mock, MagicMock
+
+import oa.errors
+import oa.rules.eval_
+import oa.rules.profiler
+
+
+class TestRuleProfiler(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.timer = patch("oa.rules.profiler.timeit.default_timer",
+                           side_effect=self._tick).start()
+        self.cpu = patch("oa.rules.profiler._cpu_time",
+                         side_effect=self._tick).start()
+        self.now = 0.0
+        self.profiler = oa.rules.profiler.RuleProfiler()
+        self.mock_msg = Mock()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def _tick(self):
+        return self.now
+
+    def get_rule(self, name, rule_type="body", duration=1.0, result=True):
+        def match(msg):
+            self.now += duration
+            return result
+        rule = Mock(rule_type=rule_type, match=match)
+        rule.name = name
+        return rule
+
+    def test_profile(self):
+        rule = self.get_rule("TEST_RULE", duration=2.0)
+        result = self.profiler.profile(rule, self.mock_msg)
+        self.assertTrue(result)
+        stats = self.profiler.rules["TEST_RULE"]
+        self.assertEqual((stats.calls, stats.hits, stats.wall, stats.cpu),
+                         (1, 1, 2.0, 2.0))
+
+    def test_profile_no_hit(self):
+        rule = self.get_rule("TEST_RULE", result=False)
+        self.profiler.profile(rule, self.mock_msg)
+        self.profiler.profile(rule, self.mock_msg)
+        stats = self.profiler.rules["TEST_RULE"]
+        self.assertEqual((stats.calls, stats.hits), (2, 0))
+
+    def test_profile_classes(self):
+        self.profiler.profile(self.get_rule("TEST1"), self.mock_msg)
+        self.profiler.profile(self.get_rule("TEST2"), self.mock_msg)
+        self.profiler.profile(self.get_rule("TEST3", "header"), self.mock_msg)
+        self.assertEqual(self.profiler.classes["body"].calls, 2)
+        self.assertEqual(self.profiler.classes["header"].calls, 1)
+
+    def test_profile_subrules(self):
+        """The time of the subrules is not counted for the parent rule."""
+        subrule = self.get_rule("TEST_SUB", duration=3.0)
+
+        def match(msg):
+            self.now += 1.0
+            return self.profiler.profile(subrule, msg)
+        meta = Mock(rule_type="meta", match=match)
+        meta.name = "TEST_META"
+        self.profiler.profile(meta, self.mock_msg)
+        self.assertEqual(self.profiler.rules["TEST_META"].wall, 1.0)
+        self.assertEqual(self.profiler.rules["TEST_SUB"].wall, 3.0)
+
+    def test_profile_error(self):
+        def match(msg):
+            self.now += 1.0
+            raise oa.errors.StopProcessing()
+        rule = Mock(rule_type="body", match=match)
+        rule.name = "TEST"
+        self.assertRaises(oa.errors.StopProcessing, self.profiler.profile,
+                          rule, self.mock_msg)
+        stats = self.profiler.rules["TEST"]
+        self.assertEqual((stats.calls, stats.hits, stats.wall), (1, 0, 1.0))
+
+    def test_top(self):
+        self.profiler.profile(self.get_rule("TEST1", duration=1.0),
+                              self.mock_msg)
+        self.profiler.profile(self.get_rule("TEST2", duration=3.0),
+                              self.mock_msg)
+        self.profiler.profile(self.get_rule("TEST3", duration=2.0),
+                              self.mock_msg)
+        result = [name for name, stats in self.profiler.top(2)]
+        self.assertEqual(result, ["TEST2", "TEST3"])
+
+    def test_top_invalid_key(self):
+        self.assertRaises(ValueError, self.profiler.top, 2, "invalid")
+
+    def test_to_json(self):
+        self.profiler.messages = 1
+        self.profiler.profile(self.get_rule("TEST1", duration=2.0),
+                              self.mock_msg)
+        result = json.loads(self.profiler.to_json())
+        self.assertEqual(result["messages"], 1)
+        self.assertEqual(result["rules"]["TEST1"]["calls"], 1)
+        self.assertEqual(result["rules"]["TEST1"]["hit_rate"], 1.0)
+        self.assertEqual(result["classes"]["body"]["wall"], 2.0)
+
+    def test_format_table(self):
+        self.profiler.profile(self.get_rule("TEST1"), self.mock_msg)
+        result = self.profiler.format_table(10)
+        self.assertIn("TEST1", result)
+        self.assertIn("body", result)
+
+    def test_reset(self):
+        self.profiler.messages = 1
+        self.profiler.profile(self.get_rule("TEST1"), self.mock_msg)
+        self.profiler.reset()
+        self.assertEqual(self.profiler.rules, {})
+        self.assertEqual(self.profiler.classes, {})
+        self.assertEqual(self.profiler.messages, 0)
+
+
+class TestGetRuleClass(unittest.TestCase):
+    def test_rule_type(self):
+        rule = Mock(rule_type="uri")
+        self.assertEqual(oa.rules.profiler.get_rule_class(rule), "uri")
+
+    def test_eval(self):
+        rule = MagicMock(spec=oa.rules.eval_.EvalRule, rule_type="body")
+        self.assertEqual(oa.rules.profiler.get_rule_class(rule), "eval")
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestRuleProfiler, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGetRuleClass, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -2,6 +2,7 @@
 
 import email
 import unittest
+import collections
 
 try:
     from unittest.mock import patch, Mock, PropertyMock, MagicMock, call
@@ -9,7 +10,12 @@ except ImportError:
     from mock import patch, Mock, PropertyMock, MagicMock, call
 
 import oa.errors
+import oa.regex
+import oa.rules.body
+import oa.rules.header
+import oa.rules.meta
 import oa.rules.ruleset
+import oa.rules.uri
 
 
 class TestRuleSet(unittest.TestCase):
@@ -25,6 +31,12 @@ class TestRuleSet(unittest.TestCase):
             "report_safe": 1,
             "dns_query_restriction": [],
             "dns_options": "",
+            "regex_match_timeout": 0.0,
+            "regex_message_timeout": 0.0,
+            "util_rb_tld": [],
+            "util_rb_2tld": [],
+            "util_rb_3tld": [],
+            "received_cache_size": 10000,
         })
 
     def tearDown(self):
@@ -43,6 +55,23 @@ class TestRuleSet(unittest.TestCase):
         self.assertEqual(mock_msg.rules_checked["TEST_RULE"],
                          mock_rule.match(mock_msg))
 
+    def test_match_budget(self):
+        mock_budget = patch("oa.rules.ruleset.oa.regex_backend."
+                            "match_budget").start()
+        self.addCleanup(patch.stopall)
+        self.mock_ctxt.conf["regex_match_timeout"] = 0.5
+        self.mock_ctxt.conf["regex_message_timeout"] = 2.0
+        mock_msg = MagicMock(rules_checked={})
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+
+        ruleset.match(mock_msg)
+
+        mock_budget.assert_called_with(0.5, 2.0)
+        mock_budget.return_value.__enter__.assert_called_with()
+        mock_rule.match.assert_called_with(mock_msg)
+
     def test_match_check_score(self):
         mock_msg = MagicMock(rules_checked={}, score=0)
         mock_rule = MagicMock(score=42)
@@ -61,6 +90,245 @@ class TestRuleSet(unittest.TestCase):
         ruleset.match(mock_msg)
         self.assertEqual(mock_msg.score, 0)
 
+    def test_match_prefilter_skipped(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_rule = MagicMock(score=42)
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+        ruleset.prefilter = Mock(**{"get_skipped.return_value":
+                                    {"TEST_RULE"}})
+
+        ruleset.match(mock_msg)
+        mock_rule.match.assert_not_called()
+        self.assertEqual(mock_msg.rules_checked["TEST_RULE"], False)
+        self.assertEqual(mock_msg.score, 0)
+
+    def test_match_rule(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": mock_rule}
+
+        result = ruleset.match_rule("__TEST_RULE", mock_msg)
+        mock_rule.match.assert_called_once_with(mock_msg)
+        self.assertEqual(result, mock_rule.match(mock_msg))
+        self.assertEqual(mock_msg.rule_results,
+                         {"__TEST_RULE": mock_rule.match(mock_msg)})
+
+    def test_match_rule_profiler(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": mock_rule}
+        ruleset.profiler = Mock()
+
+        result = ruleset.match_rule("__TEST_RULE", mock_msg)
+        ruleset.profiler.profile.assert_called_once_with(mock_rule, mock_msg)
+        mock_rule.match.assert_not_called()
+        self.assertEqual(result, ruleset.profiler.profile.return_value)
+
+    def test_match_profiler_messages(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {}
+        ruleset.profiler = Mock(messages=0)
+
+        ruleset.match(mock_msg)
+        self.assertEqual(ruleset.profiler.messages, 1)
+
+    def test_match_rule_header_index(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+        ruleset.header_index = MagicMock(**{
+            "__contains__.return_value": True,
+            "match_group.return_value": {"TEST_RULE": True,
+                                         "TEST_OTHER": False},
+        })
+
+        result = ruleset.match_rule("TEST_RULE", mock_msg)
+        mock_rule.match.assert_not_called()
+        self.assertEqual(result, True)
+        self.assertEqual(mock_msg.rule_results,
+                         {"TEST_RULE": True, "TEST_OTHER": False})
+
+    def test_build_header_index(self):
+        header_rule = oa.rules.header.HeaderRule.get_rule(
+            "TEST_HEADER", {"value": "Subject =~ /test/"})
+        unused_rule = oa.rules.header.HeaderRule.get_rule(
+            "__TEST_UNUSED", {"value": "Subject =~ /test/"})
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_HEADER": header_rule,
+                           "TEST_BODY": Mock()}
+        ruleset.not_checked = {"__TEST_UNUSED": unused_rule}
+        ruleset.required = {"TEST_HEADER", "TEST_BODY"}
+
+        ruleset.build_header_index()
+        self.assertEqual(list(ruleset.header_index.rules), ["TEST_HEADER"])
+
+    def test_build_header_index_disabled(self):
+        header_rule = oa.rules.header.HeaderRule.get_rule(
+            "TEST_HEADER", {"value": "Subject =~ /test/"})
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.use_header_index = False
+        ruleset.checked = {"TEST_HEADER": header_rule}
+
+        ruleset.build_header_index()
+        self.assertEqual(len(ruleset.header_index), 0)
+
+    def test_match_rule_uri_index(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_URI": mock_rule}
+        ruleset.uri_index = MagicMock(**{
+            "__contains__.return_value": True,
+            "match_group.return_value": {"TEST_URI": False,
+                                         "TEST_OTHER": True},
+        })
+
+        result = ruleset.match_rule("TEST_URI", mock_msg)
+        mock_rule.match.assert_not_called()
+        self.assertEqual(result, False)
+        self.assertEqual(mock_msg.rule_results,
+                         {"TEST_URI": False, "TEST_OTHER": True})
+
+    def test_build_uri_index(self):
+        uri_rule = oa.rules.uri.URIRule("TEST_URI",
+                                        oa.regex.perl2re("/example/"))
+        unused_rule = oa.rules.uri.URIRule("__TEST_UNUSED",
+                                           oa.regex.perl2re("/example/"))
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_URI": uri_rule, "TEST_BODY": Mock()}
+        ruleset.not_checked = {"__TEST_UNUSED": unused_rule}
+        ruleset.required = {"TEST_URI", "TEST_BODY"}
+
+        ruleset.build_uri_index()
+        self.assertEqual(list(ruleset.uri_index.rules), ["TEST_URI"])
+
+    def test_build_uri_index_disabled(self):
+        uri_rule = oa.rules.uri.URIRule("TEST_URI",
+                                        oa.regex.perl2re("/example/"))
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.use_uri_index = False
+        ruleset.checked = {"TEST_URI": uri_rule}
+
+        ruleset.build_uri_index()
+        self.assertEqual(len(ruleset.uri_index), 0)
+
+    def test_match_rule_stored(self):
+        mock_msg = MagicMock(rule_results={"__TEST_RULE": 2},
+                             saved_evaluations=0, prefilter_skipped=set())
+        mock_rule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": mock_rule}
+
+        result = ruleset.match_rule("__TEST_RULE", mock_msg)
+        mock_rule.match.assert_not_called()
+        self.assertEqual(result, 2)
+        self.assertEqual(mock_msg.saved_evaluations, 1)
+
+    def test_match_rule_error(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock(**{"match.side_effect": ValueError()})
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": mock_rule}
+
+        result = ruleset.match_rule("__TEST_RULE", mock_msg)
+        self.assertEqual(result, False)
+
+    def test_match_rule_stop_processing(self):
+        mock_msg = MagicMock(rule_results={}, saved_evaluations=0,
+                             prefilter_skipped=set())
+        mock_rule = MagicMock(**{"match.side_effect":
+                                 oa.errors.StopProcessing()})
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": mock_rule}
+
+        self.assertRaises(oa.errors.StopProcessing, ruleset.match_rule,
+                          "__TEST_RULE", mock_msg)
+        self.assertEqual(mock_msg.rule_results, {})
+
+    def test_match_shared_subrule(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_subrule = MagicMock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_SUBRULE": mock_subrule}
+
+        def meta_match(msg):
+            return ruleset.match_rule("__TEST_SUBRULE", msg)
+        ruleset.checked = collections.OrderedDict((
+            ("TEST_META_1", MagicMock(score=1, match=meta_match)),
+            ("TEST_META_2", MagicMock(score=1, match=meta_match)),
+        ))
+
+        ruleset.match(mock_msg)
+        mock_subrule.match.assert_called_once_with(mock_msg)
+        self.assertEqual(mock_msg.saved_evaluations, 1)
+
+    def test_build_dependencies(self):
+        meta = oa.rules.meta.MetaRule("TEST_META", "__TEST_SUB")
+        meta.subrules = frozenset(["__TEST_SUB"])
+        subrule = Mock(priority=0)
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = collections.OrderedDict((
+            ("TEST_META", meta), ("TEST_RULE", Mock(priority=0))))
+        ruleset.not_checked = {"__TEST_SUB": subrule,
+                               "__TEST_UNUSED": Mock(priority=0)}
+
+        ruleset.build_dependencies()
+        self.assertEqual(ruleset.dependencies,
+                         {"TEST_META": frozenset(["__TEST_SUB"])})
+        self.assertEqual(ruleset.required,
+                         {"TEST_META", "TEST_RULE", "__TEST_SUB"})
+
+    def test_build_dependencies_order_kept(self):
+        meta = oa.rules.meta.MetaRule("TEST_META", "TEST_RULE")
+        meta.subrules = frozenset(["TEST_RULE"])
+        rule = oa.rules.body.BodyRule("TEST_RULE", pattern=Mock())
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = collections.OrderedDict((
+            ("TEST_META", meta), ("TEST_RULE", rule)))
+
+        ruleset.build_dependencies()
+        # The _TESTS_ and the short circuit order are not changed.
+        self.assertEqual(list(ruleset.checked), ["TEST_META", "TEST_RULE"])
+
+    def test_build_prefilter_not_required(self):
+        mock_add = patch("oa.rules.ruleset.oa.rules.prefilter."
+                         "LiteralPrefilter.add_rule").start()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.not_checked = {"__TEST_RULE": Mock()}
+
+        ruleset.build_prefilter()
+        mock_add.assert_not_called()
+
+    def test_build_prefilter(self):
+        mock_add = patch("oa.rules.ruleset.oa.rules.prefilter."
+                         "LiteralPrefilter.add_rule").start()
+        mock_rule = Mock()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+
+        ruleset.build_prefilter()
+        mock_add.assert_called_with(mock_rule)
+
+    def test_build_prefilter_disabled(self):
+        mock_add = patch("oa.rules.ruleset.oa.rules.prefilter."
+                         "LiteralPrefilter.add_rule").start()
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": Mock()}
+        ruleset.use_prefilter = False
+
+        ruleset.build_prefilter()
+        mock_add.assert_not_called()
+
     def test_get_rule(self):
         mock_rule = Mock()
         ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
@@ -117,14 +385,121 @@ class TestRuleSet(unittest.TestCase):
         ruleset.add_rule(mock_rule)
         mock_rule.postprocess.assert_called_with(ruleset)
 
+    def test_build_score_bounds(self):
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = collections.OrderedDict((
+            ("TEST_1", Mock(score=2.0)),
+            ("TEST_2", Mock(score=-1.0)),
+            ("TEST_3", Mock(score=3.0)),
+        ))
+
+        ruleset.build_score_bounds()
+        self.assertEqual(ruleset.score_bounds,
+                         [(5.0, -1.0), (3.0, -1.0), (3.0, 0.0)])
+
+    def test_build_score_bounds_decisive(self):
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.decisive_verdict = True
+        ruleset.checked = collections.OrderedDict((
+            ("TEST_NET", Mock(score=1.0, priority=0, cost=1e-2)),
+            ("TEST_BODY", Mock(score=1.0, priority=0, cost=2e-5)),
+            ("TEST_LATE", Mock(score=1.0, priority=1, cost=1e-5)),
+        ))
+
+        ruleset.build_score_bounds()
+        self.assertEqual(list(ruleset.checked),
+                         ["TEST_BODY", "TEST_NET", "TEST_LATE"])
+
+    def test_is_verdict_decided_ham(self):
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.score_bounds = [(4.0, -1.0)]
+        mock_msg = Mock(score=0.5)
+
+        self.assertTrue(ruleset.is_verdict_decided(mock_msg, 0))
+        mock_msg.score = 1.0
+        self.assertFalse(ruleset.is_verdict_decided(mock_msg, 0))
+
+    def test_is_verdict_decided_spam(self):
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.score_bounds = [(4.0, -1.0)]
+        mock_msg = Mock(score=6.0)
+
+        self.assertTrue(ruleset.is_verdict_decided(mock_msg, 0))
+        mock_msg.score = 5.5
+        self.assertFalse(ruleset.is_verdict_decided(mock_msg, 0))
+
+    def test_match_decisive_verdict(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_rules = [MagicMock(score=6, priority=0, cost=1e-5),
+                      MagicMock(score=-0.5, priority=0, cost=1e-5),
+                      MagicMock(score=1, priority=0, cost=1e-2)]
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.decisive_verdict = True
+        ruleset.checked = collections.OrderedDict(
+            ("TEST_%d" % i, rule) for i, rule in enumerate(mock_rules))
+        ruleset.build_score_bounds()
+
+        ruleset.match(mock_msg)
+        mock_rules[2].match.assert_not_called()
+        self.assertEqual(list(mock_msg.rules_checked), ["TEST_0"])
+        self.assertEqual(mock_msg.truncated_scan, 2)
+        self.assertEqual(mock_msg.score, 6)
+
+    def test_match_decisive_verdict_full_scan(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_rules = [MagicMock(score=2, priority=0, cost=1e-5),
+                      MagicMock(score=3, priority=0, cost=1e-5)]
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.decisive_verdict = True
+        ruleset.checked = collections.OrderedDict(
+            ("TEST_%d" % i, rule) for i, rule in enumerate(mock_rules))
+        ruleset.build_score_bounds()
+
+        ruleset.match(mock_msg)
+        self.assertEqual(mock_msg.truncated_scan, 0)
+        self.assertEqual(mock_msg.score, 5)
+
+    def test_interpolate_truncated_scan(self):
+        mock_msg = MagicMock(rules_checked={"TEST_RULE": True},
+                             interpolate_data={}, score=6, truncated_scan=3)
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.tags = {"TESTS", "TESTSSCORES"}
+
+        result = ruleset._interpolate("%(TESTS)s %(TESTSSCORES)s", mock_msg)
+        self.assertEqual(result, "TEST_RULE,TRUNCATED_SCAN "
+                                 "TEST_RULE=1,TRUNCATED_SCAN=0")
+
     def test_post_parsing(self):
-        mock_rule = Mock()
+        mock_rule = Mock(score=1.0)
         ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
         ruleset.checked = {"TEST_RULE": mock_rule}
 
         ruleset.post_parsing()
         mock_rule.postparsing.assert_called_with(ruleset)
 
+    def test_post_parsing_message_requires(self):
+        self.mock_ctxt.plugins = {
+            "TestPlugin1": Mock(message_requires=("text",)),
+            "TestPlugin2": Mock(message_requires=("received_headers",)),
+            "TestPlugin3": Mock(message_requires=()),
+        }
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+
+        ruleset.post_parsing()
+        self.assertEqual(ruleset.message_requires,
+                         {"text", "received_headers"})
+        self.assertEqual(self.mock_ctxt.message_requires,
+                         {"text", "received_headers"})
+
+    def test_post_parsing_tlds(self):
+        self.mock_ctxt.conf["util_rb_tld"] = ["com"]
+        self.mock_ctxt.conf["util_rb_2tld"] = ["CO.UK", ""]
+        self.mock_ctxt.conf["util_rb_3tld"] = ["k12.ma.us"]
+        ruleset = oa.rules.ruleset.RuleSet(self.mock_ctxt)
+
+        ruleset.post_parsing()
+        self.assertEqual(self.mock_ctxt.tlds, {"com", "co.uk", "k12.ma.us"})
+
     def test_post_parsing_invalid_rule(self):
         mock_rule = Mock(**{"postparsing.side_effect":
                             oa.errors.InvalidRule("TEST_RULE")})
@@ -0,0 +1,226 @@
+"""Tests for oa.rules.uri_index"""
+
+import re
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import oa.regex
+import oa.rules.uri
+import oa.rules.uri_index
+
+
+class _OldParsed(list):
+    """A parsed pattern without the `state` attribute."""
+
+
+class TestExtractDomainLabel(unittest.TestCase):
+    def check(self, pattern, expected, flags=0):
+        result = oa.rules.uri_index.extract_domain_label(
+            re.compile(pattern, flags))
+        self.assertEqual(result, expected)
+
+    def test_anchored(self):
+        self.check(r"^https?://example\.com", "example")
+
+    def test_optional_www(self):
+        self.check(r"^https?://(?:www\.)?example\.com/", "example")
+
+    def test_any_subdomain(self):
+        self.check(r"://(?:[^/]*\.)?example\.co\.uk\b", "example")
+
+    def test_subdomain_alternatives(self):
+        self.check(r"://(?:www\.|mail\.)?example\.com", "example")
+
+    def test_ignorecase(self):
+        self.check(r"://Example\.COM", "example", re.I)
+
+    def test_no_scheme(self):
+        self.check(r"example\.com", None)
+
+    def test_subdomain_may_include_path(self):
+        self.check(r"://(?:\S+\.)?example\.com", None)
+        self.check(r"://(?:.*\.)?example\.com", None)
+
+    def test_subdomain_without_dot(self):
+        self.check(r"://(?:www)?example\.com", None)
+
+    def test_no_dot(self):
+        self.check(r"://example/", None)
+
+
+    def check_old(self, items, expected, flags=0):
+        """Check with the parsed pattern shape used before Python 3.6,
+        with the flags in `pattern` and groups as (group, items).
+        """
+        parsed = _OldParsed(items)
+        parsed.pattern = Mock(flags=flags)
+        pattern = Mock(pattern=u"", flags=flags)
+        with patch("oa.rules.uri_index.sre_parse.parse",
+                   return_value=parsed):
+            result = oa.rules.uri_index.extract_domain_label(pattern)
+        self.assertEqual(result, expected)
+
+    def literals(self, text):
+        return [(oa.rules.uri_index.sre_constants.LITERAL, ord(char))
+                for char in text]
+
+    def test_old_group_shape(self):
+        group = (oa.rules.uri_index.sre_constants.SUBPATTERN,
+                 (None, self.literals("example.com")))
+        self.check_old(self.literals("://") + [group], "example")
+
+    def test_old_flags(self):
+        self.check_old(self.literals("://Example.com"), "example", re.I)
+
+    def test_unknown_group_shape(self):
+        group = (oa.rules.uri_index.sre_constants.SUBPATTERN,
+                 (None, 0, self.literals("example.com")))
+        self.check_old(self.literals("://") + [group], None)
+
+class TestExtractExactLiteral(unittest.TestCase):
+    def check(self, pattern, expected, flags=0):
+        result = oa.rules.uri_index.extract_exact_literal(
+            re.compile(pattern, flags))
+        self.assertEqual(result, expected)
+
+    def test_exact(self):
+        self.check(r"^Example\.com$", "example.com")
+
+    def test_end_string(self):
+        self.check(r"^example\.com\Z", "example.com")
+
+    def test_not_anchored(self):
+        self.check(r"example\.com$", None)
+        self.check(r"^example\.com", None)
+
+    def test_not_literal(self):
+        self.check(r"^example.com$", None)
+
+    def test_multiline(self):
+        self.check(r"^example\.com$", None, re.M)
+
+
+class TestGetHostLabels(unittest.TestCase):
+    def test_simple(self):
+        result = oa.rules.uri_index.get_host_labels("http://www.example.com/")
+        self.assertEqual(result, {"www", "example", "com"})
+
+    def test_multiple(self):
+        result = oa.rules.uri_index.get_host_labels(
+            "http://a.com/?u=http://b.net")
+        self.assertEqual(result, {"a", "com", "b", "net"})
+
+    def test_no_scheme(self):
+        result = oa.rules.uri_index.get_host_labels("www.example.com")
+        self.assertEqual(result, set())
+
+
+class TestURIIndex(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.index = oa.rules.uri_index.URIIndex()
+        self.mock_msg = Mock(uri_list={
+            "http://www.example.com/path",
+            "https://test.org/cheap-pills",
+        }, uri_detail_links={})
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def get_rule(self, name, pattern):
+        return oa.rules.uri.URIRule(name, oa.regex.perl2re(pattern))
+
+    def test_add_rule(self):
+        rule = self.get_rule("TEST", r"/^https?:\/\/(?:www\.)?example\.com/")
+        self.assertTrue(self.index.add_rule(rule))
+        self.assertIn("TEST", self.index)
+        self.assertEqual(self.index._domains, {"example": {"TEST"}})
+
+    def test_add_rule_literal(self):
+        rule = self.get_rule("TEST", r"/cheap-pills/i")
+        self.assertTrue(self.index.add_rule(rule))
+        self.assertEqual(self.index._literals,
+                         {("cheap-pills", True): {"TEST"}})
+
+    def test_add_rule_unfiltered(self):
+        rule = self.get_rule("TEST", r"/\d+/")
+        self.assertTrue(self.index.add_rule(rule))
+        self.assertEqual(self.index._unfiltered, {"TEST"})
+
+    def test_add_rule_not_uri(self):
+        self.assertFalse(self.index.add_rule(Mock()))
+
+    def test_add_rule_replaced_match(self):
+        rule = self.get_rule("TEST", r"/example/")
+        rule.match = Mock()
+        self.assertFalse(self.index.add_rule(rule))
+
+    def test_add_rule_subclass(self):
+        class CustomRule(oa.rules.uri.URIRule):
+            def match(self, msg):
+                return True
+        rule = CustomRule("TEST", oa.regex.perl2re(r"/example/"))
+        self.assertFalse(self.index.add_rule(rule))
+        self.assertEqual(len(self.index), 0)
+
+    def test_get_candidates(self):
+        self.index.add_rule(self.get_rule("TEST_DOMAIN",
+                                          r"/:\/\/example\.com/"))
+        self.index.add_rule(self.get_rule("TEST_OTHER_DOMAIN",
+                                          r"/:\/\/test\.org/"))
+        self.index.add_rule(self.get_rule("TEST_LITERAL", r"/path/"))
+        self.index.add_rule(self.get_rule("TEST_ANY", r"/\d+/"))
+        result = self.index.get_candidates("http://www.example.com/path")
+        self.assertEqual(result, {"TEST_DOMAIN", "TEST_LITERAL", "TEST_ANY"})
+
+    def test_match(self):
+        rules = [
+            self.get_rule("TEST_1", r"/^https?:\/\/(?:www\.)?example\.com/"),
+            self.get_rule("TEST_2", r"/^https?:\/\/example\.com/"),
+            self.get_rule("TEST_3", r"/CHEAP/i"),
+            self.get_rule("TEST_4", r"/CHEAP/"),
+            self.get_rule("TEST_5", r"/\.org\b/"),
+            self.get_rule("TEST_6", r"/\d+/"),
+        ]
+        for rule in rules:
+            self.index.add_rule(rule)
+        expected = dict((rule.name, rule.match(self.mock_msg))
+                        for rule in rules)
+        result = self.index.match(self.mock_msg)
+        self.assertEqual(result, expected)
+        self.assertEqual(result, {"TEST_1": True, "TEST_2": False,
+                                  "TEST_3": True, "TEST_4": False,
+                                  "TEST_5": True, "TEST_6": False})
+
+    def test_match_detail_checks(self):
+        self.mock_msg.uri_detail_links = {
+            "http://example.com": {"a": {"domain": "example.com"}},
+        }
+        self.index.add_detail_check("TEST_DOMAIN", lambda value: True,
+                                    {"example.com"})
+        self.index.add_detail_check("TEST_OTHER", lambda value: True,
+                                    {"test.org"})
+        self.index.add_detail_check("TEST_ANY", lambda value: False)
+        self.index.rules.update(dict.fromkeys(
+            ("TEST_DOMAIN", "TEST_OTHER", "TEST_ANY")))
+        result = self.index.match(self.mock_msg)
+        self.assertEqual(result, {"TEST_DOMAIN": True, "TEST_OTHER": False,
+                                  "TEST_ANY": False})
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestExtractDomainLabel, "test"))
+    test_suite.addTest(unittest.makeSuite(TestExtractExactLiteral, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGetHostLabels, "test"))
+    test_suite.addTest(unittest.makeSuite(TestURIIndex, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
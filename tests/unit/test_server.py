@@ -31,6 +31,8 @@ class TestServer(unittest.TestCase):
                                  "oa.rules.parser.PADParser").start()
         self.mock_rules = patch("oa.server."
                                 "oa.rules.parser.parse_pad_rules").start()
+        self.mock_close_pools = patch("oa.server."
+                                      "oa.db.pool.close_all").start()
         self.mainset = self.mock_rules.return_value.get_ruleset.return_value
         self.conf = {
             "allow_user_rules": False
@@ -48,6 +50,61 @@ class TestServer(unittest.TestCase):
                          self.mock_rules.return_value.results)
         self.assertEqual(server._ruleset, self.mainset)
 
+    def test_init_warm_up(self):
+        mock_warm_up = patch("oa.server.oa.regex.start_warm_up").start()
+        oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                         "/etc/spamassassin/", warm_up=True)
+        mock_warm_up.assert_called_with()
+
+    def test_init_no_warm_up(self):
+        mock_warm_up = patch("oa.server.oa.regex.start_warm_up").start()
+        oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                         "/etc/spamassassin/")
+        self.assertFalse(mock_warm_up.called)
+
+    def test_init_cache_dir(self):
+        oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                         "/etc/spamassassin/", cache_dir="/tmp/cache")
+        self.mock_rules.assert_called_with(ANY, paranoid=False,
+                                           ignore_unknown=True,
+                                           cache_dir="/tmp/cache")
+
+    def test_reload_incremental(self):
+        server = oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                                  "/etc/spamassassin/")
+        parser = self.mock_rules.return_value
+        server._user_rulesets["alex"] = Mock()
+        server.load_config()
+        parser.reload.assert_called_with(
+            oa.server.oa.config.get_config_files.return_value)
+        self.assertEqual(self.mock_rules.call_count, 1)
+        self.assertEqual(server._parser, parser.reload.return_value)
+        self.assertEqual(server._ruleset,
+                         parser.reload.return_value.get_ruleset.return_value)
+        self.assertEqual(server._user_rulesets, {})
+        self.assertEqual(self.mock_close_pools.call_count, 2)
+
+    def test_reload_unchanged(self):
+        server = oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                                  "/etc/spamassassin/")
+        parser = self.mock_rules.return_value
+        parser.reload.return_value = parser
+        server._user_rulesets["alex"] = Mock()
+        server.load_config()
+        self.assertEqual(parser.get_ruleset.call_count, 1)
+        self.assertEqual(server._ruleset, self.mainset)
+        self.assertEqual(server._user_rulesets, {})
+        # The pools are still used by the same ruleset.
+        self.assertEqual(self.mock_close_pools.call_count, 1)
+
+    def test_reload_full(self):
+        server = oa.server.Server(("0.0.0.0", 783), "/dev/null",
+                                  "/etc/spamassassin/")
+        self.mock_rules.return_value.reload.return_value = None
+        server.load_config()
+        self.assertEqual(self.mock_rules.call_count, 2)
+        self.assertEqual(server._ruleset, self.mainset)
+
     def test_handler(self):
         mock_check = MagicMock()
         mock_rfile = MagicMock()
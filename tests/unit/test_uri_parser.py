@@ -0,0 +1,101 @@
+"""
+Tests for pad.uri_parser
+"""
+
+import unittest
+
+import oa.uri_parser
+
+TLDS = frozenset(("com", "co.uk", "k12.ma.us"))
+
+class TestURI(unittest.TestCase):
+    def test_uri(self):
+        uri = oa.uri_parser.URI("http://user@www.Example.com:8080/a%20b",
+                                TLDS)
+        self.assertEqual(uri.scheme, "http")
+        self.assertEqual(uri.netloc, "user@www.Example.com:8080")
+        self.assertEqual(uri.host, "www.example.com")
+        self.assertEqual(uri.domain, "example.com")
+        self.assertEqual(uri.cleaned, "http://user@www.Example.com:8080/a b")
+        self.assertFalse(uri.is_ip)
+        self.assertEqual(uri.redirects, [])
+
+    def test_uri_no_scheme(self):
+        uri = oa.uri_parser.URI("www.example.co.uk/page", TLDS)
+        self.assertEqual(uri.scheme, "")
+        self.assertEqual(uri.netloc, "")
+        self.assertEqual(uri.host, "www.example.co.uk")
+        self.assertEqual(uri.domain, "example.co.uk")
+
+    def test_uri_3tld(self):
+        uri = oa.uri_parser.URI("http://a.school.k12.ma.us", TLDS)
+        self.assertEqual(uri.domain, "school.k12.ma.us")
+
+    def test_uri_ip(self):
+        uri = oa.uri_parser.URI("http://1.2.3.4:80/login", TLDS)
+        self.assertTrue(uri.is_ip)
+        self.assertEqual(uri.domain, "1.2.3.4")
+        self.assertEqual(uri.get_hosts(), ["1.2.3.4"])
+
+    def test_uri_ipv6_no_brackets(self):
+        uri = oa.uri_parser.URI("https://2001:1af8:4700:a02d:2::1/", TLDS)
+        self.assertTrue(uri.is_ip)
+        self.assertEqual(uri.host, "2001:1af8:4700:a02d:2::1")
+
+    def test_uri_invalid(self):
+        uri = oa.uri_parser.URI("http://[::1/login", TLDS)
+        self.assertEqual(uri.scheme, "")
+        self.assertEqual(uri.netloc, "")
+        self.assertEqual(uri.host, "")
+        self.assertFalse(uri.is_ip)
+
+    def test_get_hosts(self):
+        uri = oa.uri_parser.URI("http://www.example.com/", TLDS)
+        self.assertEqual(uri.get_hosts(),
+                         ["www.example.com", "example.com", "com"])
+
+    def test_is_listed(self):
+        uri = oa.uri_parser.URI("ceva.example.com")
+        self.assertTrue(uri.is_listed(["example.org", "example.com"]))
+        self.assertFalse(uri.is_listed(["example.org"]))
+        self.assertFalse(uri.is_listed(["example.com"], ["ceva.example.com"]))
+
+    def test_is_ip_address(self):
+        self.assertTrue(oa.uri_parser.is_ip_address("1.2.3.4"))
+        self.assertTrue(oa.uri_parser.is_ip_address("2001:db8::1"))
+        self.assertFalse(oa.uri_parser.is_ip_address("@1.2.3.4"))
+        self.assertFalse(oa.uri_parser.is_ip_address("1.example.com"))
+        self.assertFalse(oa.uri_parser.is_ip_address(""))
+
+    def test_redirects(self):
+        uri = oa.uri_parser.URI("http://redirect.example.com/?u="
+                                "http://next.example.net/"
+                                "https://final.example.org/page")
+        self.assertEqual([target.netloc for target in uri.redirects],
+                         ["next.example.net", "final.example.org"])
+        self.assertEqual(uri.redirects[-1].raw,
+                         "https://final.example.org/page")
+
+    def test_get_details(self):
+        uri = oa.uri_parser.URI("http://test%2Ecom")
+        self.assertEqual(uri.get_details(),
+                         {"raw": "http://test%2Ecom", "scheme": "http",
+                          "cleaned": "http://test.com",
+                          "domain": "test%2Ecom"})
+
+    def test_parse_uris(self):
+        uris = oa.uri_parser.parse_uris(["http://example.co.uk"], TLDS)
+        self.assertEqual(uris["http://example.co.uk"].netloc,
+                         "example.co.uk")
+        self.assertEqual(uris["http://example.co.uk"].domain,
+                         "example.co.uk")
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestURI, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
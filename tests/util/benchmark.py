@@ -0,0 +1,470 @@
+"""Utilities for the benchmarks in tests/profiling.
+
+The benchmarks can either use a real rule set (e.g. the stock SpamAssassin
+rules) and a directory of messages, or generate synthetic ones.
+"""
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import base64
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import tempfile
+
+import oa.config
+import oa.message
+import oa.rules.parser
+
+WORDS = (
+    "the", "and", "for", "you", "your", "with", "this", "that", "from",
+    "have", "are", "our", "will", "now", "free", "offer", "click", "here",
+    "money", "cheap", "pills", "viagra", "meeting", "report", "invoice",
+    "account", "password", "winner", "lottery", "million", "dollars",
+    "unsubscribe", "newsletter", "please", "review", "attached", "document",
+    "regards", "thanks", "project", "deadline", "tomorrow", "discount",
+    "limited", "time", "only", "guaranteed", "results", "weight", "loss",
+    "casino", "bonus", "credit", "loan", "mortgage", "approved", "urgent",
+)
+
+# The headers checked by the generated header rules.
+HEADERS = ("Subject", "From", "From:addr", "From:name", "To", "Received",
+           "Subject:raw")
+
+
+def get_argument_parser(description):
+    """Common arguments for all the benchmarks."""
+    parser = argparse.ArgumentParser(
+        description=description,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("-C", "--configpath", default=None,
+                        help="Use the rules from this configuration "
+                             "directory instead of generating them.")
+    parser.add_argument("-S", "--sitepath", default=None,
+                        help="Site configuration directory.")
+    parser.add_argument("-r", "--rules", type=int, default=1000,
+                        help="Number of generated rules.")
+    parser.add_argument("-m", "--messages", type=int, default=200,
+                        help="Number of generated messages.")
+    parser.add_argument("-u", "--uris", type=int, default=10,
+                        help="Number of URIs in each generated message.")
+    parser.add_argument("-M", "--message-dir", default=None,
+                        help="Use the messages from this directory instead "
+                             "of generating them.")
+    parser.add_argument("-s", "--seed", type=int, default=42,
+                        help="Seed for the generated data.")
+    parser.add_argument("-D", "--debug", action="store_true", default=False,
+                        help="Enable debugging output")
+    return parser
+
+
+def generate_rules(count, seed=42):
+    """Generate a configuration with a mix of body, rawbody, full, header,
+    uri and meta rules.
+    """
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        kind = i % 10
+        first, second = rnd.choice(WORDS), rnd.choice(WORDS)
+        name = "BENCH_%s_%d" % (("BODY", "RAW", "FULL", "HEAD", "URI",
+                                 "BODY", "BODY", "NOLIT", "SUB", "META")[kind],
+                                i)
+        if kind in (0, 5, 6):
+            lines.append(r"body %s /\b%s\s+%s\b/i" % (name, first, second))
+        elif kind == 1:
+            lines.append(r"rawbody %s /<b>%s/i" % (name, first))
+        elif kind == 2:
+            lines.append(r"full %s /^X-Bench-%d: %s/m" % (name, i, first))
+        elif kind == 3:
+            header = HEADERS[(i // 10) % len(HEADERS)]
+            lines.append(r"header %s %s =~ /%s %s/i" %
+                         (name, header, first, second))
+        elif kind == 4 and i % 20 < 10:
+            lines.append(r"uri %s /%s\d*\.example\.com/" % (name, first))
+        elif kind == 4:
+            lines.append(r"uri %s /^https?:\/\/%s%d\.example\.com\//" %
+                         (name, first, rnd.randint(0, 99)))
+        elif kind == 7:
+            lines.append(r"body %s /\d{5,}\s\w+/" % name)
+        elif kind == 8:
+            name = "__" + name
+            lines.append(r"body %s /%s/" % (name, first))
+        else:
+            lines.append(r"meta %s (__BENCH_SUB_%d && BENCH_BODY_%d)" %
+                         (name, i - 1, i - 9))
+        lines.append("score %s %0.1f" % (name, rnd.uniform(-0.5, 2.5)))
+    return "\n".join(lines) + "\n"
+
+
+def generate_header_rules(count, seed=42):
+    """Generate header rules only."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        header = HEADERS[i % len(HEADERS)]
+        name = "BENCH_HEAD_%d" % i
+        lines.append(r"header %s %s =~ /%s/i" %
+                     (name, header, rnd.choice(WORDS)))
+        lines.append("score %s %0.1f" % (name, rnd.uniform(-0.5, 2.5)))
+    return "\n".join(lines) + "\n"
+
+
+def generate_message(rnd, words=200, uris=10):
+    """Generate a simple multipart message."""
+    text = " ".join(rnd.choice(WORDS) for dummy in range(words))
+    links = " ".join("http://%s%d.example.com/path?q=%s" %
+                     (rnd.choice(WORDS), rnd.randint(0, 99), rnd.choice(WORDS))
+                     for dummy in range(uris))
+    subject = " ".join(rnd.choice(WORDS) for dummy in range(5))
+    return (
+        "Received: from mx.example.com (mx.example.com [1.2.3.4])\n"
+        "\tby mail.example.net with SMTP id abc123;\n"
+        "\tMon, 1 Jan 2018 10:00:00 +0000\n"
+        "From: Sender <sender@example.com>\n"
+        "To: rcpt@example.net\n"
+        "Subject: %s\n"
+        "MIME-Version: 1.0\n"
+        "Content-Type: multipart/alternative; boundary=\"BOUNDARY\"\n"
+        "\n"
+        "--BOUNDARY\n"
+        "Content-Type: text/plain\n"
+        "\n"
+        "%s\n%s\n"
+        "--BOUNDARY\n"
+        "Content-Type: text/html\n"
+        "\n"
+        "<html><body><p><b>%s</b></p><a href=\"%s\">link</a></body></html>\n"
+        "--BOUNDARY--\n" % (subject, text, links, text[:200],
+                            links.split(" ", 1)[0])
+    )
+
+
+def generate_large_message(size, seed=42):
+    """Generate a message with a text part and an attachment of about
+    `size` MB.
+    """
+    rnd = random.Random(seed)
+    raw = generate_message(rnd)
+    head, rest = raw.split("--BOUNDARY--", 1)
+    data = bytes(bytearray(rnd.getrandbits(8)
+                           for dummy in range(size * 1024 * 768)))
+    attachment = base64.encodebytes(data).decode("ascii")
+    text = " ".join(rnd.choice(WORDS)
+                    for dummy in range(size * 1024 * 16))
+    return (head +
+            "--BOUNDARY\n"
+            "Content-Type: text/plain\n"
+            "\n"
+            "%s\n"
+            "--BOUNDARY\n"
+            "Content-Type: application/octet-stream\n"
+            "Content-Transfer-Encoding: base64\n"
+            "\n"
+            "%s"
+            "--BOUNDARY--" % (text, attachment) + rest)
+
+
+# The relays added by Postfix, Sendmail and Exim.
+RECEIVED_COMMON_RELAYS = (
+    "{host} ({rdns} [{ip}])",
+    "{host} ({rdns}. [{ip}])",
+    "{rdns} ([{ip}] helo={host})",
+    "{rdns} ([{ip}]:{port} helo={host})",
+)
+RECEIVED_RELAYS = RECEIVED_COMMON_RELAYS + (
+    "{rdns} ([{ip}] helo={host} ident={ident})",
+    "{host} ({rdns} [{ip}] (may be forged))",
+    "{host} ([{ip}])",
+    "{host} (HELO {helo}) ({ip})",
+    "{host} (EHLO {helo}) ([{ip}])",
+    "{host} (unknown [{ip}])",
+    "{host} (softdnserr [{ip}])",
+    "{host} ({ident}@{rdns} [{ip}])",
+    "[{ip}] (helo={host})",
+    "{host} [{ip}]",
+    "{host} ({ip})",
+    "{host} (HELO={host}) ([{ip}])",
+    "{ident}@{host}",
+    "({rdns} [{ip}])",
+    "localhost (localhost [127.0.0.1])",
+    "{host} (localhost [127.0.0.1])",
+    "Unknown/Local ([{ip}])",
+)
+RECEIVED_BY = (
+    "by {by}",
+    "by {by} (Postfix)",
+    "by {by} (8.14.4/8.14.4)",
+    "by {by} [{ip}]",
+    "by {by} (Postfix) (Authenticated sender: {ident})",
+)
+RECEIVED_WITH = (
+    "", "with ESMTP", "with esmtps (TLSv1.2:AES256-SHA:256) (Exim 4.85)",
+    "with ESMTPSA", "with esmtpa (Exim 4.89)", "with LMTP", "with SMTP",
+    "with HTTP", "with local", "with BSMTP", "with Microsoft SMTPSVC",
+    "with ESMTPS (version=TLS1_2 cipher=AES128-GCM-SHA256 bits=128/128)",
+)
+RECEIVED_EXTRA = (
+    "", "(envelope-from <{ident}@{rdns}>)", "(envelope-from <>)",
+    "(envelope-sender={ident}@{rdns})", "(return-path: <{ident}@{rdns}>)",
+    "(authenticated as {ident})", "(SquirrelMail authenticated user {ident})",
+    "(authenticated bits=0)",
+)
+RECEIVED_ID = ("", "id {id}", "id <{id}@{by}>", "id {id} (uid {port})")
+RECEIVED_FOR = ("", "for <{ident}@{by}>", "for {ident}@{by}")
+RECEIVED_IPS = ("1.2.3.4", "192.168.1.10", "10.0.0.1", "209.85.220.41",
+                "IPv6:2001:db8::1", "2001:db8::1", "127.0.0.1", "1.2.3")
+
+
+def generate_received_header(rnd, common=0.0):
+    """Generate a Received header from common and unusual forms, with
+    this ratio of relays from the common forms.
+    """
+    word = rnd.choice(WORDS)
+    values = {
+        "host": rnd.choice(("mail.%s.example.com" % word, word,
+                            "mx%d.%s.example.org" % (rnd.randint(0, 9), word),
+                            "[%s]" % rnd.choice(RECEIVED_IPS))),
+        "rdns": rnd.choice(("mail.%s.example.com" % word, "unknown",
+                            "smtp.example.net", "%s.example.org" % word)),
+        "helo": rnd.choice((word, "[1.2.3.4]", "mail.example.com")),
+        "ip": rnd.choice(RECEIVED_IPS),
+        "by": rnd.choice(("mx.example.net", "mx.google.com", "mail.gmx.net",
+                          "%s.example.com" % word)),
+        "ident": rnd.choice((word, "user", "admin")),
+        "id": "%X-%04d" % (rnd.getrandbits(32), rnd.randint(0, 9999)),
+        "port": rnd.randint(1, 65535),
+    }
+    if rnd.random() < common:
+        parts = ["from " + rnd.choice(RECEIVED_COMMON_RELAYS)]
+    else:
+        parts = ["from " + rnd.choice(RECEIVED_RELAYS)]
+    parts.extend(rnd.choice(choices) for choices in (
+        RECEIVED_BY, RECEIVED_WITH, RECEIVED_EXTRA, RECEIVED_ID,
+        RECEIVED_FOR))
+    header = " ".join(part for part in parts if part).format(**values)
+    return header + "; Mon, 1 Jan 2018 10:00:00 +0000"
+
+
+BAYES_SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS bayes_token ("
+    "id INTEGER NOT NULL DEFAULT 0, token BLOB NOT NULL, "
+    "spam_count INTEGER NOT NULL DEFAULT 0, "
+    "ham_count INTEGER NOT NULL DEFAULT 0, "
+    "atime INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (id, token))",
+    # Every lookup is by token only, don't let the benchmarks measure
+    # full table scans.
+    "CREATE INDEX IF NOT EXISTS bayes_token_idx2 ON bayes_token (token)",
+    "CREATE TABLE IF NOT EXISTS bayes_seen ("
+    "id INTEGER NOT NULL DEFAULT 0, msgid TEXT NOT NULL, "
+    "flag TEXT NOT NULL DEFAULT '', PRIMARY KEY (id, msgid))",
+    "CREATE TABLE IF NOT EXISTS bayes_vars ("
+    "id INTEGER PRIMARY KEY, username TEXT NOT NULL DEFAULT '', "
+    "spam_count INTEGER NOT NULL DEFAULT 0, "
+    "ham_count INTEGER NOT NULL DEFAULT 0)",
+)
+
+
+class SQLiteCursor(object):
+    """Cursor of SQLiteConnection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.db.cursor()
+
+    def execute(self, query, args=()):
+        self.connection.round_trip()
+        self.cursor.execute(query.replace("%s", "?"), args)
+
+    def executemany(self, query, args):
+        self.connection.round_trip()
+        self.cursor.executemany(query.replace("%s", "?"), args)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection(object):
+    """Stand-in for a pymysql connection to the Bayes database, backed
+    by a local SQLite database. Every statement and commit counts as a
+    round trip to the server and waits for `latency` seconds.
+    """
+
+    def __init__(self, path=":memory:", latency=0.0):
+        self.db = sqlite3.connect(path)
+        for statement in BAYES_SQLITE_SCHEMA:
+            self.db.execute(statement)
+        self.latency = latency
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.round_trip()
+        self.db.commit()
+
+    def rollback(self):
+        self.round_trip()
+        self.db.rollback()
+
+    def ping(self, reconnect=True):
+        self.round_trip()
+
+    def close(self):
+        pass
+
+
+def count_round_trips(engine, latency=0.0):
+    """Count the statements executed by the SQLAlchemy engine as round
+    trips to the server, waiting for `latency` seconds for each of them.
+    Returns a list that holds the count.
+    """
+    import sqlalchemy.event
+    counter = [0]
+
+    def before_cursor_execute(*args):
+        counter[0] += 1
+        if latency:
+            time.sleep(latency)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute",
+                            before_cursor_execute)
+    return counter
+
+
+class BayesPlugin(dict):
+    """Stand-in for the Bayes plug-in used by the Bayes stores, with the
+    options as items.
+    """
+
+    def __init__(self, engine=None, **options):
+        super(BayesPlugin, self).__init__(options)
+        self.engine = engine
+
+    def get_engine(self):
+        return self.engine
+
+    def get_session(self):
+        import sqlalchemy.orm
+        return sqlalchemy.orm.sessionmaker(bind=self.engine)()
+
+
+def generate_tokens(rnd, count):
+    """Generate Bayes tokens, the first 5 bytes of a SHA1 digest."""
+    return [bytes(bytearray(rnd.getrandbits(8) for dummy in range(5)))
+            for dummy in range(count)]
+
+
+def get_raw_messages(options):
+    """Get the raw messages according to the options."""
+    if options.message_dir:
+        messages = []
+        for name in sorted(os.listdir(options.message_dir)):
+            path = os.path.join(options.message_dir, name)
+            with open(path, "rb") as msgf:
+                messages.append(msgf.read().decode("utf-8", "ignore"))
+        return messages
+    rnd = random.Random(options.seed)
+    return [generate_message(rnd, uris=options.uris)
+            for dummy in range(options.messages)]
+
+
+def get_parser(options, config=None, setup=None):
+    """Parse the rules according to the options and return the
+    PADParser. `setup` is called with the parser before the rules are
+    parsed.
+    """
+    oa.config.LAZY_MODE = False
+    if options.debug:
+        oa.config.setup_logging("oa-logger", debug=True)
+    else:
+        logging.getLogger("oa-logger").setLevel(logging.CRITICAL)
+    tmpdir = None
+    if options.configpath:
+        files = oa.config.get_config_files(
+            options.configpath, options.sitepath or options.configpath)
+    else:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "20_bench.cf")
+        with open(path, "w") as conf:
+            conf.write(config or generate_rules(options.rules, options.seed))
+        files = [path]
+    try:
+        parser = oa.rules.parser.PADParser()
+        if setup is not None:
+            setup(parser)
+        for filename in files:
+            parser.parse_file(filename)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, True)
+    return parser
+
+
+def get_ruleset(options, config=None):
+    """Parse the rules and return the ruleset."""
+    return get_parser(options, config).get_ruleset()
+
+
+def parse_messages(ruleset, raw_messages):
+    return [oa.message.Message(ruleset.ctxt, raw) for raw in raw_messages]
+
+
+def get_hits(msg):
+    """The set of rules that hit for the message."""
+    return frozenset(name for name, result in msg.rules_checked.items()
+                     if result)
+
+
+def run(ruleset, messages, repeat=1):
+    """Match all the messages against the ruleset. Returns the elapsed
+    time and the list of hits for each message.
+    """
+    hits = []
+    start = time.time()
+    for dummy in range(repeat):
+        hits = []
+        for msg in messages:
+            msg.clear_matches()
+            ruleset.match(msg)
+            hits.append(get_hits(msg))
+    elapsed = (time.time() - start) / repeat
+    return elapsed, hits
+
+
+def compare_hits(expected, result, labels=("baseline", "result")):
+    """Print the differences between the hits. Returns True if they
+    are the same.
+    """
+    same = True
+    for i, (first, second) in enumerate(zip(expected, result)):
+        if first != second:
+            same = False
+            print("Message %d differs: only in %s %s, only in %s %s" %
+                  (i, labels[0], sorted(first - second), labels[1],
+                   sorted(second - first)), file=sys.stderr)
+    return same
+
+
+def report(name, elapsed, count):
+    """Print the timing results in a consistent format."""
+    rate = count / elapsed if elapsed else float("inf")
+    print("%-40s %10.4fs %10.1f msgs/sec" % (name, elapsed, rate))